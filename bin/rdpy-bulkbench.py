@@ -0,0 +1,178 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014-2015 Sylvain Peyrefitte
+#
+# This file is part of rdpy.
+#
+# rdpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+bulk compression benchmark over compressed payloads recorded in rss files
+(see rdpy-rdpclient -r)
+"""
+
+import sys, getopt, time
+
+from rdpy.core import log, rss
+from rdpy.protocol.rdp.pdu.data import CompressionOrder, CompressionType
+import bulk
+log._LOG_LEVEL = log.Level.INFO
+
+#fragment must fit in 8K history to be compressed
+_FRAGMENT_SIZE_8K_ = 0x1F80
+
+_TYPE_NAMES_ = {
+    CompressionType.PACKET_COMPR_TYPE_8K : "8K",
+    CompressionType.PACKET_COMPR_TYPE_64K : "64K",
+    CompressionType.PACKET_COMPR_TYPE_RDP6 : "RDP6",
+    CompressionType.PACKET_COMPR_TYPE_RDP61 : "RDP61"
+}
+
+def help():
+    print "Usage: rdpy-bulkbench [-h] [-c] [-l level] [-n iterations] rss_filepath..."
+    print "\t-c: compare with payloads compressed again by MPPC compressor"
+    print "\t-l: MPPC compressor match search effort from 1 (fast) to 9 (best ratio) [default : 1]"
+    print "\t-n: number of replay of payloads [default : 1]"
+
+def readPayloads(rssFile):
+    """
+    @summary: read compressed payloads recorded from server
+    @param rssFile: {rss.FileReader}
+    @return: {list((str, int))} (payload, compression flags) in reception order
+    """
+    payloads = []
+    e = rssFile.nextEvent()
+    while not e is None and e.type.value != rss.EventType.CLOSE:
+        if e.type.value == rss.EventType.BULK:
+            payloads.append((e.event.data.value, e.event.compressionFlags.value))
+        e = rssFile.nextEvent()
+    return payloads
+
+def decompress(payloads):
+    """
+    @summary: decompress payloads as a client, history is kept between payloads
+    @param payloads: {list((str, int))} (payload, compression flags)
+    @return: {tuple} (list(str) decompressed payloads, dict(type, (count, compressed size, decompressed size, time)))
+    """
+    decompressor = None
+    fragments = []
+    stats = {}
+    for payload, flags in payloads:
+        compressionType = flags & CompressionOrder.CompressionTypeMask
+        start = time.time()
+        if decompressor is None or decompressor.type != compressionType:
+            decompressor = bulk.Decompressor(compressionType)
+        fragment = decompressor.decompress(payload, flags)
+        elapsed = time.time() - start
+        count, compressedSize, size, seconds = stats.get(compressionType, (0, 0, 0, 0.0))
+        stats[compressionType] = (count + 1, compressedSize + len(payload), size + len(fragment), seconds + elapsed)
+        fragments.append(fragment)
+    return fragments, stats
+
+def cutFragments(fragments, size):
+    """
+    @summary: cut fragments to fit in compressor history
+    @param fragments: {list(str)}
+    @param size: {integer} max fragment size
+    @return: {list(str)} fragments
+    """
+    result = []
+    for fragment in fragments:
+        result += [fragment[i:i + size] for i in range(0, len(fragment), size)]
+    return result
+
+def recompress(fragments, compressionType, level):
+    """
+    @summary: compress fragments again with MPPC and check round trip
+    @param fragments: {list(str)} decompressed payloads
+    @param compressionType: {CompressionType} 8K or 64K
+    @param level: {integer} compressor level
+    @return: {tuple} (compressed size, compress time, decompress time)
+    """
+    compressor = bulk.Compressor(compressionType, level)
+    start = time.time()
+    payloads = [compressor.compress(fragment) for fragment in fragments]
+    compressTime = time.time() - start
+
+    decompressor = bulk.Decompressor(compressionType)
+    start = time.time()
+    result = [decompressor.decompress(payload, flags | compressionType) for payload, flags in payloads]
+    decompressTime = time.time() - start
+
+    if result != fragments:
+        raise ValueError("invalid round trip")
+    return sum([len(payload) for payload, _ in payloads]), compressTime, decompressTime
+
+def throughput(size, seconds):
+    """
+    @return: {str} MB/s
+    """
+    if seconds == 0:
+        return "-"
+    return "%.1f"%(size / seconds / 1000000)
+
+if __name__ == '__main__':
+    compare = False
+    level = 1
+    iterations = 1
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hcl:n:")
+    except getopt.GetoptError:
+        help()
+        sys.exit(1)
+    for opt, arg in opts:
+        if opt == "-h":
+            help()
+            sys.exit()
+        elif opt == "-c":
+            compare = True
+        elif opt == "-l":
+            level = int(arg)
+        elif opt == "-n":
+            iterations = int(arg)
+
+    if len(args) == 0:
+        help()
+        sys.exit(1)
+
+    print "%-8s %8s %12s %12s %8s %14s %14s"%("type", "payloads", "compressed", "size", "ratio", "compress MB/s", "decompress MB/s")
+    fragments = []
+    for path in args:
+        payloads = readPayloads(rss.createReader(path))
+        if len(payloads) == 0:
+            log.error("no bulk event in %s"%path)
+            continue
+        #each file is a session with its own history
+        total = {}
+        for _ in range(iterations):
+            result, stats = decompress(payloads)
+            for compressionType, (count, compressedSize, size, seconds) in stats.iteritems():
+                total[compressionType] = (count, compressedSize, size, total.get(compressionType, (0, 0, 0, 0.0))[3] + seconds)
+        fragments += [fragment for fragment in result if len(fragment) > 0]
+        for compressionType, (count, compressedSize, size, seconds) in sorted(total.items()):
+            print "%-8s %8d %12d %12d %8.3f %14s %14s"%(_TYPE_NAMES_.get(compressionType, compressionType), count, compressedSize, size, float(compressedSize) / max(size, 1), "-", throughput(size * iterations, seconds))
+
+    if len(fragments) == 0:
+        sys.exit(1)
+
+    if compare:
+        size = sum([len(fragment) for fragment in fragments])
+        for compressionType in [CompressionType.PACKET_COMPR_TYPE_8K, CompressionType.PACKET_COMPR_TYPE_64K]:
+            cut = cutFragments(fragments, _FRAGMENT_SIZE_8K_) if compressionType == CompressionType.PACKET_COMPR_TYPE_8K else fragments
+            compressedSize, compressTime, decompressTime = 0, 0.0, 0.0
+            for _ in range(iterations):
+                compressedSize, c, d = recompress(cut, compressionType, level)
+                compressTime += c
+                decompressTime += d
+            print "%-8s %8d %12d %12d %8.3f %14s %14s"%("MPPC" + _TYPE_NAMES_[compressionType], len(cut), compressedSize, size, float(compressedSize) / size, throughput(size * iterations, compressTime), throughput(size * iterations, decompressTime))
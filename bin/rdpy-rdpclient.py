@@ -27,7 +27,7 @@ from PyQt4 import QtGui, QtCore
 from rdpy.ui.qt4 import RDPClientQt
 from rdpy.protocol.rdp import rdp
 from rdpy.core.error import RDPSecurityNegoFail
-from rdpy.core import rss
+from rdpy.core import rss, framebuffer
 
 import rdpy.core.log as log
 log._LOG_LEVEL = log.Level.INFO
@@ -47,6 +47,8 @@ class RDPClientQtRecorder(RDPClientQt):
         RDPClientQt.__init__(self, controller, width, height)
         self._screensize = width, height
         self._rssRecorder = rssRecorder
+        #compressed payloads can be replayed by rdpy-bulkbench
+        controller.setBulkRecorder(rssRecorder)
         
     def onUpdate(self, destLeft, destTop, destRight, destBottom, width, height, bitsPerPixel, isCompress, data):
         """
@@ -91,7 +93,7 @@ class RDPClientQtFactory(rdp.ClientFactory):
     """
     @summary: Factory create a RDP GUI client
     """
-    def __init__(self, width, height, username, password, domain, fullscreen, keyboardLayout, optimized, security, recodedPath):
+    def __init__(self, width, height, username, password, domain, fullscreen, keyboardLayout, optimized, security, recodedPath, decodeThreads = 0, remoteFX = False, nsCodec = False, graphicsPipeline = False, autoDetect = False):
         """
         @param width: {integer} width of client
         @param heigth: {integer} heigth of client
@@ -103,6 +105,11 @@ class RDPClientQtFactory(rdp.ClientFactory):
         @param optimized: {bool} enable optimized session orders
         @param security: {str} (ssl | rdp | nego)
         @param recodedPath: {str | None} Rss file Path
+        @param decodeThreads: {integer} number of bitmap decoding threads (0 to decode in reactor thread)
+        @param remoteFX: {bool} advertise RemoteFX codec
+        @param nsCodec: {bool} advertise NSCodec
+        @param graphicsPipeline: {bool} accept graphics pipeline in dynamic virtual channel
+        @param autoDetect: {bool} let server measure network and adapt session to link
         """
         self._width = width
         self._height = height
@@ -114,6 +121,15 @@ class RDPClientQtFactory(rdp.ClientFactory):
         self._optimized = optimized
         self._nego = security == "nego"
         self._recodedPath = recodedPath
+        self._remoteFX = remoteFX
+        self._nsCodec = nsCodec
+        self._graphicsPipeline = graphicsPipeline
+        self._autoDetect = autoDetect
+        #last measured (bandwidth, rtt) kept for reconnection
+        self._networkCharacteristics = None
+        self._controller = None
+        #shared by reconnections
+        self._decodePool = framebuffer.DecodePool(decodeThreads) if decodeThreads > 0 else None
         if self._nego:
             #compute start nego nla need credentials
             if username != "" and password != "":
@@ -153,6 +169,19 @@ class RDPClientQtFactory(rdp.ClientFactory):
         if self._optimized:
             controller.setPerformanceSession()
         controller.setSecurityLevel(self._security)
+        controller.setDecodePool(self._decodePool)
+        if self._remoteFX:
+            controller.setRemoteFX()
+        if self._nsCodec:
+            controller.setNSCodec()
+        if self._graphicsPipeline:
+            controller.setGraphicsPipeline()
+        if self._autoDetect:
+            if self._networkCharacteristics is None:
+                controller.setAutoDetect()
+            else:
+                controller.setAutoDetect(*self._networkCharacteristics)
+        self._controller = controller
         
         return self._client
     
@@ -162,6 +191,9 @@ class RDPClientQtFactory(rdp.ClientFactory):
         @param connector: twisted connector use for rdp connection (use reconnect to restart connection)
         @param reason: str use to advertise reason of lost connection
         """
+        if not self._controller is None and not self._controller.getNetworkCharacteristics() is None:
+            self._networkCharacteristics = self._controller.getNetworkCharacteristics()
+            
         #try reconnect with basic RDP security
         if reason.type == RDPSecurityNegoFail and self._nego:
             #stop nego
@@ -222,6 +254,11 @@ def help():
     \t-k: keyboard layout [en|fr] [default : en]
     \t-o: optimized session (disable costly effect) [default : False]
     \t-r: rss_filepath Recorded Session Scenario [default : None]
+    \t-t: number of bitmap decoding threads [default : 0 (decode in reactor thread)]
+    \t-x: enable RemoteFX codec [default : False]
+    \t-n: enable NSCodec [default : False]
+    \t-g: enable graphics pipeline [default : False]
+    \t-a: enable network auto-detect (adapt session to link) [default : False]
     """
         
 if __name__ == '__main__':
@@ -235,10 +272,15 @@ if __name__ == '__main__':
     fullscreen = False
     optimized = False
     recodedPath = None
+    decodeThreads = 0
+    remoteFX = False
+    nsCodec = False
+    graphicsPipeline = False
+    autoDetect = False
     keyboardLayout = autoDetectKeyboardLayout()
     
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "hfou:p:d:w:l:k:r:")
+        opts, args = getopt.getopt(sys.argv[1:], "hfoxngau:p:d:w:l:k:r:t:")
     except getopt.GetoptError:
         help()
     for opt, arg in opts:
@@ -263,6 +305,16 @@ if __name__ == '__main__':
             keyboardLayout = arg
         elif opt == "-r":
             recodedPath = arg
+        elif opt == "-t":
+            decodeThreads = int(arg)
+        elif opt == "-x":
+            remoteFX = True
+        elif opt == "-n":
+            nsCodec = True
+        elif opt == "-g":
+            graphicsPipeline = True
+        elif opt == "-a":
+            autoDetect = True
             
     if ':' in args[0]:
         ip, port = args[0].split(':')
@@ -283,6 +335,6 @@ if __name__ == '__main__':
     log.info("keyboard layout set to %s"%keyboardLayout)
     
     from twisted.internet import reactor
-    reactor.connectTCP(ip, int(port), RDPClientQtFactory(width, height, username, password, domain, fullscreen, keyboardLayout, optimized, "nego", recodedPath))
+    reactor.connectTCP(ip, int(port), RDPClientQtFactory(width, height, username, password, domain, fullscreen, keyboardLayout, optimized, "nego", recodedPath, decodeThreads, remoteFX, nsCodec, graphicsPipeline, autoDetect))
     reactor.runReturn()
     app.exec_()
\ No newline at end of file
@@ -25,8 +25,8 @@ RDP Honey pot use Rss scenario file to simulate RDP server
 import sys, os, getopt, time
 
 from rdpy.core import log, error, rss
+from rdpy.core import worker
 from rdpy.protocol.rdp import rdp
-from twisted.internet import reactor
 
 log._LOG_LEVEL = log.Level.INFO
 
@@ -37,6 +37,8 @@ class HoneyPotServer(rdp.RDPServerObserver):
         @param rssFileSizeList: {Tuple} Tuple(Tuple(width, height), rssFilePath)
         """
         rdp.RDPServerObserver.__init__(self, controller)
+        #updates of a reactor tick are sent together
+        controller.setUpdateBatching()
         self._rssFileSizeList = rssFileSizeList
         self._dx, self._dy = 0, 0
         self._rssFile = None
@@ -85,25 +87,33 @@ class HoneyPotServer(rdp.RDPServerObserver):
     def loopScenario(self, nextEvent):
         """
         @summary: main loop event
+        events without delay are replayed in same reactor tick
+        so their updates are batched by controller
         """
-        if nextEvent.type.value == rss.EventType.UPDATE:
-            self._controller.sendUpdate(nextEvent.event.destLeft.value + self._dx, nextEvent.event.destTop.value + self._dy, nextEvent.event.destRight.value + self._dx, nextEvent.event.destBottom.value + self._dy, nextEvent.event.width.value, nextEvent.event.height.value, nextEvent.event.bpp.value, nextEvent.event.format.value == rss.UpdateFormat.BMP, nextEvent.event.data.value)
+        while True:
+            if nextEvent.type.value == rss.EventType.UPDATE:
+                self._controller.sendUpdate(nextEvent.event.destLeft.value + self._dx, nextEvent.event.destTop.value + self._dy, nextEvent.event.destRight.value + self._dx, nextEvent.event.destBottom.value + self._dy, nextEvent.event.width.value, nextEvent.event.height.value, nextEvent.event.bpp.value, nextEvent.event.format.value == rss.UpdateFormat.BMP, nextEvent.event.data.value)
+                
+            elif nextEvent.type.value == rss.EventType.CLOSE:
+                self._controller.close()
+                return
+                
+            elif nextEvent.type.value == rss.EventType.SCREEN:
+                self._controller.setColorDepth(nextEvent.event.colorDepth.value)
+                #compute centering because we cannot resize client
+                clientSize = nextEvent.event.width.value, nextEvent.event.height.value
+                serverSize = self._controller.getScreen()
+                
+                self._dx, self._dy = (max(0, serverSize[0] - clientSize[0]) / 2), max(0, (serverSize[1] - clientSize[1]) / 2)
+                #restart connection sequence
+                return
             
-        elif nextEvent.type.value == rss.EventType.CLOSE:
-            self._controller.close()
-            return
-            
-        elif nextEvent.type.value == rss.EventType.SCREEN:
-            self._controller.setColorDepth(nextEvent.event.colorDepth.value)
-            #compute centering because we cannot resize client
-            clientSize = nextEvent.event.width.value, nextEvent.event.height.value
-            serverSize = self._controller.getScreen()
-            
-            self._dx, self._dy = (max(0, serverSize[0] - clientSize[0]) / 2), max(0, (serverSize[1] - clientSize[1]) / 2)
-            #restart connection sequence
-            return
+            nextEvent = self._rssFile.nextEvent()
+            if nextEvent.timestamp.value != 0:
+                break
         
-        e = self._rssFile.nextEvent()
+        from twisted.internet import reactor
+        e = nextEvent
         reactor.callLater(float(e.timestamp.value) / 1000.0, lambda:self.loopScenario(e))
         
 class HoneyPotServerFactory(rdp.ServerFactory):
@@ -150,6 +160,7 @@ def help():
             [-l listen_port default 3389] 
             [-k private_key_file_path (mandatory for SSL)] 
             [-c certificate_file_path (mandatory for SSL)] 
+            [-w number of worker processes sharing listening port default 1]
     """
     
 if __name__ == '__main__':
@@ -157,9 +168,10 @@ if __name__ == '__main__':
     privateKeyFilePath = None
     certificateFilePath = None
     rssFileSizeList = []
+    workers = 1
     
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "hl:k:c:")
+        opts, args = getopt.getopt(sys.argv[1:], "hl:k:c:w:")
     except getopt.GetoptError:
         help()
     for opt, arg in opts:
@@ -172,6 +184,8 @@ if __name__ == '__main__':
             privateKeyFilePath = arg
         elif opt == "-c":
             certificateFilePath = arg
+        elif opt == "-w":
+            workers = int(arg)
     
     #build size map
     log.info("Build size map")
@@ -180,5 +194,4 @@ if __name__ == '__main__':
         rssFileSizeList.append((size, arg))
         log.info("(%s, %s) -> %s"%(size[0], size[1], arg))
     
-    reactor.listenTCP(int(listen), HoneyPotServerFactory(rssFileSizeList, privateKeyFilePath, certificateFilePath))
-    reactor.run()
\ No newline at end of file
+    worker.runServer(int(listen), lambda:HoneyPotServerFactory(rssFileSizeList, privateKeyFilePath, certificateFilePath), workers)
\ No newline at end of file
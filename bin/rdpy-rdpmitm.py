@@ -34,9 +34,8 @@ import os
 import argparse
 import time
 
-from rdpy.core import log, error, rss
+from rdpy.core import log, error, rss, worker
 from rdpy.protocol.rdp import rdp
-from twisted.internet import reactor
 
 log._LOG_LEVEL = log.Level.INFO
 
@@ -46,17 +45,21 @@ class ProxyServer(rdp.RDPServerObserver):
     @summary: Server side of proxy
     """
 
-    def __init__(self, controller, target, clientSecurityLevel, rssRecorder):
+    def __init__(self, controller, target, clientSecurityLevel, rssRecorder, screenshotPath = None):
         """
         @param controller: {RDPServerController}
         @param target: {tuple(ip, port)}
         @param rssRecorder: {rss.FileRecorder} use to record session
+        @param screenshotPath: {str} png file of last screen of session (None to disable)
         """
         rdp.RDPServerObserver.__init__(self, controller)
+        #rectangles forwarded in a reactor tick are sent together
+        controller.setUpdateBatching()
         self._target = target
         self._client = None
         self._rss = rssRecorder
         self._clientSecurityLevel = clientSecurityLevel
+        self._screenshotPath = screenshotPath
 
     def setClient(self, client):
         """
@@ -74,6 +77,7 @@ class ProxyServer(rdp.RDPServerObserver):
         @see: rdp.RDPServerObserver.onReady
         """
         if self._client is None:
+            from twisted.internet import reactor
             # try a connection
             domain, username, password = self._controller.getCredentials()
             self._rss.credentials(username, password,
@@ -143,18 +147,20 @@ class ProxyServerFactory(rdp.ServerFactory):
     @summary: Factory on listening events
     """
 
-    def __init__(self, target, ouputDir, privateKeyFilePath, certificateFilePath, clientSecurity):
+    def __init__(self, target, ouputDir, privateKeyFilePath, certificateFilePath, clientSecurity, screenshot = False):
         """
         @param target: {tuple(ip, prt)}
         @param privateKeyFilePath: {str} file contain server private key (if none -> back to standard RDP security)
         @param certificateFilePath: {str} file contain server certificate (if none -> back to standard RDP security)
         @param clientSecurity: {str(ssl|rdp)} security layer use in client connection side
+        @param screenshot: {bool} save last screen of each session next to rss file
         """
         rdp.ServerFactory.__init__(
             self, 16, privateKeyFilePath, certificateFilePath)
         self._target = target
         self._ouputDir = ouputDir
         self._clientSecurity = clientSecurity
+        self._screenshot = screenshot
         # use produce unique file by connection
         self._uniqueId = 0
 
@@ -165,7 +171,8 @@ class ProxyServerFactory(rdp.ServerFactory):
         @see: rdp.ServerFactory.buildObserver
         """
         self._uniqueId += 1
-        return ProxyServer(controller, self._target, self._clientSecurity, rss.createRecorder(os.path.join(self._ouputDir, "%s_%s_%s.rss" % (time.strftime('%Y%m%d%H%M%S'), addr.host, self._uniqueId))))
+        path = os.path.join(self._ouputDir, "%s_%s_%s" % (time.strftime('%Y%m%d%H%M%S'), addr.host, self._uniqueId))
+        return ProxyServer(controller, self._target, self._clientSecurity, rss.createRecorder(path + ".rss"), path + ".png" if self._screenshot else None)
 
 
 class ProxyClient(rdp.RDPClientObserver):
@@ -206,6 +213,10 @@ class ProxyClient(rdp.RDPClientObserver):
         """
         # end scenario
         self._server._rss.close()
+        # last screen is rendered by controller without graphic toolkit
+        frameBuffer = self._controller.getFrameBuffer()
+        if not self._server._screenshotPath is None and not frameBuffer is None:
+            frameBuffer.savePNG(self._server._screenshotPath)
         self._server._controller.close()
 
     def onUpdate(self, destLeft, destTop, destRight, destBottom, width, height, bitsPerPixel, isCompress, data):
@@ -267,6 +278,9 @@ class ProxyClientFactory(rdp.ClientFactory):
         controller.setPassword(self._password)
         controller.setSecurityLevel(self._security)
         controller.setPerformanceSession()
+        # last screen is only rendered if asked
+        if not self._server._screenshotPath is None:
+            controller.setFrameBuffer()
         return ProxyClient(controller, self._server)
 
 
@@ -305,6 +319,10 @@ if __name__ == '__main__':
                    help="output directory", required=True)
     p.add_argument('-s', '--sec', choices=["rdp", "tls", "nla"],
                    default="rdp", help="set protocol security layer")
+    p.add_argument('--screenshot', action='store_true',
+                   help="save last screen of each session in a png file next to rss file")
+    p.add_argument('-w', '--workers', type=int, default=1,
+                   help="number of worker processes sharing listening port")
     ssl = p.add_argument_group()
     ssl.add_argument('-c', '--certificate', help="certificate for TLS connections")
     ssl.add_argument('-k', '--key', help="private key of the given certificate for TLS connections")
@@ -316,8 +334,6 @@ if __name__ == '__main__':
 
     log.info("running server on {addr}, using {sec} security layer, proxying to {target}".format(
              addr=args.listen, sec=args.sec.upper(), target=args.target))
-    reactor.listenTCP(args.listen[1], ProxyServerFactory(
-        args.target, args.output, args.key, args.certificate, mapSecurityLayer(args.sec)),
-        interface=args.listen[0])
-
-    reactor.run()
+    worker.runServer(args.listen[1], lambda: ProxyServerFactory(
+        args.target, args.output, args.key, args.certificate, mapSecurityLayer(args.sec), args.screenshot),
+        args.workers, args.listen[0])
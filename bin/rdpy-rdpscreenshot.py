@@ -19,20 +19,20 @@
 #
 
 """
-example of use rdpy
-take screenshot of login page
+headless RDP screenshot scanner
+take screenshot of login page of a list of hosts
 """
 
 import getopt
+import json
 import os
 import sys
+import time
 
-from PyQt4 import QtCore, QtGui
-from rdpy.protocol.rdp import rdp
-from rdpy.ui.qt4 import RDPBitmapToQtImage
+from rdpy.protocol.rdp import rdp, cache
+from rdpy.core import worker
 import rdpy.core.log as log
 from rdpy.core.error import RDPSecurityNegoFail
-from twisted.internet import task
 
 # set log level
 log._LOG_LEVEL = log.Level.INFO
@@ -40,28 +40,35 @@ log._LOG_LEVEL = log.Level.INFO
 
 class RDPScreenShotFactory(rdp.ClientFactory):
     """
-    @summary: Factory for screenshot exemple
+    @summary: Factory of one host scan
+                security level fall back on standard RDP security if SSL is refused
     """
-    __INSTANCE__ = 0
-    __STATE__ = []
-
-    def __init__(self, reactor, app, width, height, path, timeout):
+    def __init__(self, scanner, ip, port, path):
         """
-        @param reactor: twisted reactor
-        @param width: {integer} width of screen
-        @param height: {integer} height of screen
+        @param scanner: {ScreenShotScanner} scheduler of scan
+        @param ip: {str} address of host
+        @param port: {integer} port of host
         @param path: {str} path of output screenshot
-        @param timeout: {float} close connection after timeout s without any updating
         """
-        RDPScreenShotFactory.__INSTANCE__ += 1
-        self._reactor = reactor
-        self._app = app
-        self._width = width
-        self._height = height
+        self._scanner = scanner
+        self._ip = ip
+        self._port = port
         self._path = path
-        self._timeout = timeout
+        self._startTime = time.time()
         #NLA server can't be screenshooting
         self._security = rdp.SecurityLevel.RDP_LEVEL_SSL
+        #True when screenshot is saved
+        self._isSaved = False
+        #close connection after per host deadline
+        self._deadlineCall = None
+
+    def startedConnecting(self, connector):
+        """
+        @summary: Arm deadline at first connection attempt
+        @param connector: twisted connector
+        """
+        if self._deadlineCall is None:
+            self._deadlineCall = self._scanner._reactor.callLater(self._scanner._deadline, connector.disconnect)
 
     def clientConnectionLost(self, connector, reason):
         """
@@ -69,18 +76,12 @@ class RDPScreenShotFactory(rdp.ClientFactory):
         @param connector: twisted connector use for rdp connection (use reconnect to restart connection)
         @param reason: str use to advertise reason of lost connection
         """
-        if reason.type == RDPSecurityNegoFail and self._security != "rdp":
-            log.info("due to RDPSecurityNegoFail try standard security layer")
+        if reason.type == RDPSecurityNegoFail and self._security != rdp.SecurityLevel.RDP_LEVEL_RDP and self._deadlineCall.active():
+            log.debug("due to RDPSecurityNegoFail try standard security layer on %s"%self._ip)
             self._security = rdp.SecurityLevel.RDP_LEVEL_RDP
             connector.connect()
             return
-
-        log.info("connection lost : %s" % reason)
-        RDPScreenShotFactory.__STATE__.append((connector.host, connector.port, reason))
-        RDPScreenShotFactory.__INSTANCE__ -= 1
-        if(RDPScreenShotFactory.__INSTANCE__ == 0):
-            self._reactor.stop()
-            self._app.exit()
+        self.done(reason)
 
     def clientConnectionFailed(self, connector, reason):
         """
@@ -88,12 +89,24 @@ class RDPScreenShotFactory(rdp.ClientFactory):
         @param connector: twisted connector use for rdp connection (use reconnect to restart connection)
         @param reason: str use to advertise reason of lost connection
         """
-        log.info("connection failed : %s"%reason)
-        RDPScreenShotFactory.__STATE__.append((connector.host, connector.port, reason))
-        RDPScreenShotFactory.__INSTANCE__ -= 1
-        if(RDPScreenShotFactory.__INSTANCE__ == 0):
-            self._reactor.stop()
-            self._app.exit()
+        self.done(reason)
+
+    def done(self, reason):
+        """
+        @summary: End of host scan, report result to scanner
+        @param reason: twisted Failure
+        """
+        if not self._deadlineCall is None and self._deadlineCall.active():
+            self._deadlineCall.cancel()
+        self._scanner.onResult({
+            "host" : self._ip,
+            "port" : self._port,
+            "status" : "ok" if self._isSaved else "failed",
+            "security" : "rdp" if self._security == rdp.SecurityLevel.RDP_LEVEL_RDP else "ssl",
+            "screenshot" : self._path if self._isSaved else None,
+            "reason" : reason.getErrorMessage(),
+            "duration" : round(time.time() - self._startTime, 3)
+        })
 
     def buildObserver(self, controller, addr):
         """
@@ -103,41 +116,31 @@ class RDPScreenShotFactory(rdp.ClientFactory):
         """
         class ScreenShotObserver(rdp.RDPClientObserver):
             """
-            @summary: observer that connect, cache every image received and save at deconnection
+            @summary: observer that connect and save desktop surface of controller at deconnection
             """
-            def __init__(self, controller, width, height, path, timeout, reactor):
+            def __init__(self, controller, factory):
                 """
                 @param controller: {RDPClientController}
-                @param width: {integer} width of screen
-                @param height: {integer} height of screen
-                @param path: {str} path of output screenshot
-                @param timeout: {float} close connection after timeout s without any updating
-                @param reactor: twisted reactor
+                @param factory: {RDPScreenShotFactory}
                 """
                 rdp.RDPClientObserver.__init__(self, controller)
-                self._buffer = QtGui.QImage(width, height, QtGui.QImage.Format_RGB32)
-                self._path = path
-                self._timeout = timeout
+                self._factory = factory
                 self._startTimeout = False
-                self._reactor = reactor
 
             def onUpdate(self, destLeft, destTop, destRight, destBottom, width, height, bitsPerPixel, isCompress, data):
                 """
-                @summary: callback use when bitmap is received 
+                @summary: callback use when bitmap is received
+                            bitmap is already drawn in controller frame buffer
                 """
-                image = RDPBitmapToQtImage(width, height, bitsPerPixel, isCompress, data);
-                with QtGui.QPainter(self._buffer) as qp:
-                # draw image
-                    qp.drawImage(destLeft, destTop, image, 0, 0, destRight - destLeft + 1, destBottom - destTop + 1)
                 if not self._startTimeout:
-                    self._startTimeout = False
-                    self._reactor.callLater(self._timeout, self.checkUpdate)
+                    self._startTimeout = True
+                    self._factory._scanner._reactor.callLater(self._factory._scanner._timeout, self._controller.close)
 
             def onReady(self):
                 """
                 @summary: callback use when RDP stack is connected (just before received bitmap)
                 """
-                log.info("connected %s" % addr)
+                log.debug("connected %s" % addr)
 
             def onSessionReady(self):
                 """
@@ -150,53 +153,199 @@ class RDPScreenShotFactory(rdp.ClientFactory):
                 """
                 @summary: callback use when RDP stack is closed
                 """
-                log.info("save screenshot into %s" % self._path)
-                self._buffer.save(self._path)
+                frameBuffer = self._controller.getFrameBuffer()
+                if frameBuffer is None or not self._startTimeout:
+                    return
+                frameBuffer.savePNG(self._factory._path)
+                self._factory._isSaved = True
 
-            def checkUpdate(self):
-                self._controller.close();
-
-        controller.setScreen(self._width, self._height);
+        controller.setScreen(self._scanner._width, self._scanner._height)
         controller.setSecurityLevel(self._security)
-        return ScreenShotObserver(controller, self._width, self._height, self._path, self._timeout, self._reactor)
+        #desktop is rendered by controller
+        controller.setDrawingOrders()
+        if not self._scanner._persistentBitmapCache is None:
+            controller.setPersistentBitmapCache(self._scanner._persistentBitmapCache)
+        return ScreenShotObserver(controller, self)
 
-def main(width, height, path, timeout, hosts):
+class ScreenShotScanner(object):
     """
-    @summary: main algorithm
-    @param height: {integer} height of screenshot
-    @param width: {integer} width of screenshot
-    @param timeout: {float} in sec
-    @param hosts: {list(str(ip[:port]))}
-    @return: {list(tuple(ip, port, Failure instance)} list of connection state
+    @summary: Bounded connection scheduler
+                at most maxInFlight hosts are scanned at the same time
+                and new connections are started at most rate per second
     """
-    #create application
-    app = QtGui.QApplication(sys.argv)
+    def __init__(self, reactor, width, height, outputDir, timeout, deadline, maxInFlight, rate, resultFile, persistentBitmapCache = None):
+        """
+        @param reactor: twisted reactor
+        @param width: {integer} width of screen
+        @param height: {integer} height of screen
+        @param outputDir: {str} directory of screenshots
+        @param timeout: {float} close connection timeout s after first update
+        @param deadline: {float} max duration of one host scan in s
+        @param maxInFlight: {integer} max number of simultaneous connections
+        @param rate: {float} max number of new connections per second (0 for unlimited)
+        @param resultFile: {file} JSON line of each host result are written in
+        @param persistentBitmapCache: {cache.PersistentBitmapCache} bitmap cache shared by all connections
+        """
+        self._reactor = reactor
+        self._width = width
+        self._height = height
+        self._outputDir = outputDir
+        self._timeout = timeout
+        self._deadline = deadline
+        self._maxInFlight = maxInFlight
+        self._rate = rate
+        self._resultFile = resultFile
+        self._persistentBitmapCache = persistentBitmapCache
+        self._hosts = iter([])
+        self._inFlight = 0
+        self._isExhausted = False
+        #time of next allowed connection
+        self._nextConnectTime = 0.0
+        self._scheduleCall = None
+        
+    def scan(self, hosts):
+        """
+        @summary: Scan hosts and stop reactor at end
+        @param hosts: {iterable(tuple(str, integer))} (ip, port) read lazily
+        """
+        self._hosts = iter(hosts)
+        self._reactor.callWhenRunning(self.scheduleNext)
 
-    #add qt4 reactor
-    import qt4reactor
-    qt4reactor.install()
+    def scheduleNext(self):
+        """
+        @summary: Start connections allowed by concurrency and rate bounds
+        """
+        self._scheduleCall = None
+        while not self._isExhausted and self._inFlight < self._maxInFlight:
+            now = time.time()
+            if now < self._nextConnectTime:
+                self._scheduleCall = self._reactor.callLater(self._nextConnectTime - now, self.scheduleNext)
+                return
+            
+            host = next(self._hosts, None)
+            if host is None:
+                self._isExhausted = True
+                break
+            
+            ip, port = host
+            self._inFlight += 1
+            if self._rate > 0:
+                self._nextConnectTime = now + 1.0 / self._rate
+            self._reactor.connectTCP(ip, port, RDPScreenShotFactory(self, ip, port, os.path.join(self._outputDir, "%s_%s.png" % (ip, port))), timeout = self._deadline)
+            
+        if self._isExhausted and self._inFlight == 0:
+            self._reactor.stop()
 
-    from twisted.internet import reactor
+    def onResult(self, result):
+        """
+        @summary: Write result of a host and start next connections
+        @param result: {dict} JSON serializable result
+        """
+        self._inFlight -= 1
+        log.info("%s:%s %s" % (result["host"], result["port"], result["status"]))
+        self._resultFile.write(json.dumps(result) + "\n")
+        self._resultFile.flush()
+        if self._scheduleCall is None:
+            self.scheduleNext()
 
-    for host in hosts:      
+def readHosts(hosts, hostsFile = None):
+    """
+    @summary: Generate address of host of command line and hosts file
+                file is read lazily to handle large scan
+    @param hosts: {list(str(ip[:port]))}
+    @param hostsFile: {str} path of file with one ip[:port] by line ('-' for stdin)
+    @return: {generator(tuple(str, integer))} (ip, port)
+    """
+    def parse(host):
         if ':' in host:
             ip, port = host.split(':')
-        else:
-            ip, port = host, "3389"
+            return ip, int(port)
+        return host, 3389
 
-        reactor.connectTCP(ip, int(port), RDPScreenShotFactory(reactor, app, width, height, path + "%s.jpg" % ip, timeout))
+    for host in hosts:
+        yield parse(host)
+    if hostsFile is None:
+        return
+    f = sys.stdin if hostsFile == "-" else open(hostsFile)
+    for line in f:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield parse(line)
 
-    reactor.runReturn()
-    app.exec_()
-    return RDPScreenShotFactory.__STATE__
+def scan(width, height, path, timeout, hosts, cachePath, deadline, maxInFlight, rate, resultFile):
+    """
+    @summary: Scan hosts in current process
+    @param hosts: {iterable(tuple(str, integer))} (ip, port)
+    @param resultFile: {file} JSON lines output
+    @see: main
+    """
+    #no graphic toolkit needed, screen is rendered by frame buffer
+    from twisted.internet import reactor
+
+    persistentBitmapCache = None
+    if not cachePath is None:
+        persistentBitmapCache = cache.PersistentBitmapCache(cachePath)
 
+    ScreenShotScanner(reactor, width, height, path, timeout, deadline, maxInFlight, rate, resultFile, persistentBitmapCache).scan(hosts)
+    reactor.run()
+
+    if not persistentBitmapCache is None:
+        persistentBitmapCache.close()
+
+def main(width, height, path, timeout, hosts, cachePath = None, hostsFile = None, deadline = 30.0, maxInFlight = 100, rate = 0.0, resultPath = None, processes = 1):
+    """
+    @summary: main algorithm
+    @param height: {integer} height of screenshot
+    @param width: {integer} width of screenshot
+    @param path: {str} output directory
+    @param timeout: {float} in sec
+    @param hosts: {list(str(ip[:port]))}
+    @param cachePath: {str} path of persistent bitmap cache file
+    @param hostsFile: {str} path of file with one ip[:port] by line
+    @param deadline: {float} max duration of a host scan in sec
+    @param maxInFlight: {integer} max number of simultaneous connections
+    @param rate: {float} max number of new connections per second (0 for unlimited)
+    @param resultPath: {str} path of JSON lines result file (default is results.jsonl in output directory)
+    @param processes: {integer} number of worker processes, hosts are sharded between them
+    """
+    with open(resultPath or os.path.join(path, "results.jsonl"), "a") as resultFile:
+        if processes <= 1:
+            scan(width, height, path, timeout, readHosts(hosts, hostsFile), cachePath, deadline, maxInFlight, rate, resultFile)
+            return
+        
+        #hosts are read once because stdin can't be shared
+        hosts = list(readHosts(hosts, hostsFile))
+        def run(index, output):
+            #each worker has its own persistent cache file
+            scan(width, height, path, timeout, hosts[index::processes], cachePath and "%s.%s"%(cachePath, index), deadline, (maxInFlight + processes - 1) / processes, float(rate) / processes, output)
+        
+        stats = {}
+        def onResult(index, line):
+            resultFile.write(line + "\n")
+            status = json.loads(line)["status"]
+            stats[status] = stats.get(status, 0) + 1
+        
+        supervisor = worker.Supervisor(processes)
+        supervisor.start(run)
+        supervisor.collect(onResult)
+        codes = supervisor.wait()
+        log.info("%s hosts scanned : %s" % (sum(stats.values()), ", ".join(["%s %s" % (status, count) for status, count in sorted(stats.items())])))
+        if any(codes):
+            log.error("workers exit codes : %s" % codes)
 
 def help():
-    print "Usage: rdpy-rdpscreenshot [options] ip[:port]"
+    print "Usage: rdpy-rdpscreenshot [options] ip[:port] ..."
     print "\t-w: width of screen default value is 1024"
     print "\t-l: height of screen default value is 800"
-    print "\t-o: file path of screenshot default(/tmp/rdpy-rdpscreenshot.jpg)"
-    print "\t-t: timeout of connection without any updating order (default is 2s)"
+    print "\t-o: output directory of screenshots <ip>_<port>.png default(/tmp/)"
+    print "\t-t: timeout of connection after first update (default is 5s)"
+    print "\t-c: file path of persistent bitmap cache shared between scans"
+    print "\t-f: file with one ip[:port] by line ('-' for stdin)"
+    print "\t-m: max number of simultaneous connections (default is 100)"
+    print "\t-r: max number of new connections per second (default is unlimited)"
+    print "\t-d: deadline of each host scan (default is 30s)"
+    print "\t-j: JSON lines result file (default is results.jsonl in output directory)"
+    print "\t-p: number of worker processes, hosts are sharded between them (default is 1)"
 
 if __name__ == '__main__':
     # default script argument
@@ -204,9 +353,16 @@ if __name__ == '__main__':
     height = 800
     path = "/tmp/"
     timeout = 5.0
+    cachePath = None
+    hostsFile = None
+    maxInFlight = 100
+    rate = 0.0
+    deadline = 30.0
+    resultPath = None
+    processes = 1
 
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "hw:l:o:t:")
+        opts, args = getopt.getopt(sys.argv[1:], "hw:l:o:t:c:f:m:r:d:j:p:")
     except getopt.GetoptError:
         help()
     for opt, arg in opts:
@@ -221,5 +377,19 @@ if __name__ == '__main__':
             path = arg
         elif opt == "-t":
             timeout = float(arg)
+        elif opt == "-c":
+            cachePath = arg
+        elif opt == "-f":
+            hostsFile = arg
+        elif opt == "-m":
+            maxInFlight = int(arg)
+        elif opt == "-r":
+            rate = float(arg)
+        elif opt == "-d":
+            deadline = float(arg)
+        elif opt == "-j":
+            resultPath = arg
+        elif opt == "-p":
+            processes = int(arg)
 
-    main(width, height, path, timeout, args)
+    main(width, height, path, timeout, args, cachePath, hostsFile, deadline, maxInFlight, rate, resultPath, processes)
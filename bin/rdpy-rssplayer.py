@@ -23,54 +23,84 @@ rss file player
 
 import sys, os, getopt, socket
 
-from PyQt4 import QtGui, QtCore
-
-from rdpy.core import log, rss
-from rdpy.ui.qt4 import QRemoteDesktop, RDPBitmapToQtImage
+from rdpy.core import log, rss, framebuffer
+from rdpy.core.error import InvalidValue
 from rdpy.core.scancode import scancodeToChar
 log._LOG_LEVEL = log.Level.INFO
 
-class RssPlayerWidget(QRemoteDesktop):
+class RssAdaptor(object):
     """
-    @summary: special rss player widget
+    @summary: rss player doesn't send any input
     """
-    def __init__(self, width, height):
-        class RssAdaptor(object):
-            def sendMouseEvent(self, e, isPressed):
-                """ Not Handle """
-            def sendKeyEvent(self, e, isPressed):
-                """ Not Handle """
-            def sendWheelEvent(self, e):
-                """ Not Handle """
-            def closeEvent(self, e):
-                """ Not Handle """
-        QRemoteDesktop.__init__(self, width, height, RssAdaptor())
+    def sendMouseEvent(self, e, isPressed):
+        """ Not Handle """
+    def sendKeyEvent(self, e, isPressed):
+        """ Not Handle """
+    def sendWheelEvent(self, e):
+        """ Not Handle """
+    def closeEvent(self, e):
+        """ Not Handle """
+    def visibilityEvent(self, isVisible):
+        """ Not Handle """
         
-class RssPlayerWindow(QtGui.QWidget):
+def createPlayerWindow():
     """
     @summary: main window of rss player
+                Qt is only imported for graphic replay
+    @return: {QtGui.QWidget} with _viewer and _text widgets
     """
-    def __init__(self):
-        super(RssPlayerWindow, self).__init__()
-        
-        self._viewer = RssPlayerWidget(800, 600)
-        self._text = QtGui.QTextEdit()
-        self._text.setReadOnly(True)
-        self._text.setFixedHeight(150)
+    window = QtGui.QWidget()
+    window._viewer = QRemoteDesktop(800, 600, RssAdaptor())
+    window._text = QtGui.QTextEdit()
+    window._text.setReadOnly(True)
+    window._text.setFixedHeight(150)
 
-        scrollViewer = QtGui.QScrollArea()
-        scrollViewer.setWidget(self._viewer)
-        
-        layout = QtGui.QVBoxLayout()
-        layout.addWidget(scrollViewer, 1)
-        layout.addWidget(self._text, 2)
-        
-        self.setLayout(layout)
-        
-        self.setGeometry(0, 0, 800, 600)
+    scrollViewer = QtGui.QScrollArea()
+    scrollViewer.setWidget(window._viewer)
+    
+    layout = QtGui.QVBoxLayout()
+    layout.addWidget(scrollViewer, 1)
+    layout.addWidget(window._text, 2)
+    
+    window.setLayout(layout)
+    
+    window.setGeometry(0, 0, 800, 600)
+    return window
 
 def help():
-    print "Usage: rdpy-rssplayer [-h] rss_filepath"
+    print "Usage: rdpy-rssplayer [-h] [-o png_filepath] rss_filepath"
+    print "\t-o: replay without graphic interface and save last screen in png file"
+    
+def render(rssFile, path):
+    """
+    @summary: replay rss file in a frame buffer and save last screen
+                no QApplication is needed
+    @param rssFile: {rss.FileReader}
+    @param path: {str} path of output png file
+    """
+    frameBuffer = None
+    width, height = 0, 0
+    e = rssFile.nextEvent()
+    while not e is None and e.type.value != rss.EventType.CLOSE:
+        if e.type.value == rss.EventType.SCREEN:
+            width, height = e.event.width.value, e.event.height.value
+            frameBuffer = framebuffer.FrameBuffer(width, height, e.event.colorDepth.value)
+            
+        elif e.type.value == rss.EventType.UPDATE and not frameBuffer is None:
+            #color depth may change after capabilities exchange
+            if e.event.bpp.value != frameBuffer.getBitsPerPixel():
+                frameBuffer = framebuffer.FrameBuffer(width, height, e.event.bpp.value)
+            try:
+                frameBuffer.updateBitmap(e.event.destLeft.value, e.event.destTop.value, e.event.destRight.value, e.event.destBottom.value, e.event.width.value, e.event.height.value, e.event.bpp.value, e.event.format.value == rss.UpdateFormat.BMP, e.event.data.value)
+            except InvalidValue as error:
+                log.debug("Unable to render update : %s"%error)
+        e = rssFile.nextEvent()
+        
+    if frameBuffer is None:
+        log.error("no screen event in rss file")
+        return
+    log.info("save last screen into %s"%path)
+    frameBuffer.savePNG(path)
 
 def start(widget, rssFile):
     loop(widget, rssFile, rssFile.nextEvent())
@@ -104,20 +134,30 @@ def loop(widget, rssFile, nextEvent):
     QtCore.QTimer.singleShot(e.timestamp.value,lambda:loop(widget, rssFile, e))
 
 if __name__ == '__main__':
+    output = None
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "h")
+        opts, args = getopt.getopt(sys.argv[1:], "ho:")
     except getopt.GetoptError:
         help()
     for opt, arg in opts:
         if opt == "-h":
             help()
             sys.exit()
+        elif opt == "-o":
+            output = arg
             
     filepath = args[0]
+    if not output is None:
+        render(rss.createReader(filepath), output)
+        sys.exit()
+        
+    from PyQt4 import QtGui, QtCore
+    from rdpy.ui.qt4 import QRemoteDesktop, RDPBitmapToQtImage
+    
     #create application
     app = QtGui.QApplication(sys.argv)
     
-    mainWindow = RssPlayerWindow()
+    mainWindow = createPlayerWindow()
     mainWindow.show()
     
     rssFile = rss.createReader(filepath)
@@ -26,6 +26,7 @@ take screenshot of login page
 import sys, os, getopt
 from PyQt4 import QtCore, QtGui
 from rdpy.protocol.rfb import rfb
+from rdpy.core import worker
 import rdpy.core.log as log
 from rdpy.ui.qt4 import qtImageFormatFromRFBPixelFormat
 from twisted.internet import task
@@ -131,18 +132,45 @@ class RFBScreenShotFactory(rfb.ClientFactory):
         controller.setPassword(self._password)
         return ScreenShotObserver(controller, self._path)
         
+def scan(hosts, path, password):
+    """
+    @summary: Take screenshot of hosts in current process
+    @param hosts: {list(tuple(str, str))} (ip, port)
+    @param path: {str} output directory
+    @param password: {str} password for VNC authentication
+    """
+    global app, reactor
+    if len(hosts) == 0:
+        return
+    
+    #create application
+    app = QtGui.QApplication(sys.argv)
+    
+    #add qt4 reactor
+    import qt4reactor
+    qt4reactor.install()
+    from twisted.internet import reactor
+    
+    for ip, port in hosts:
+        reactor.connectTCP(ip, int(port), RFBScreenShotFactory(password, path + "%s.jpg"%ip))
+    
+    reactor.runReturn()
+    app.exec_()
+        
 def help():
     print "Usage: rdpy-vncscreenshot [options] ip[:port]"
     print "\t-o: file path of screenshot default(/tmp/rdpy-vncscreenshot.jpg)"
     print "\t-p: password for VNC Session"
+    print "\t-w: number of worker processes, hosts are sharded between them (default is 1)"
         
 if __name__ == '__main__':
     #default script argument
     path = "/tmp/"
     password = ""
+    workers = 1
     
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "hp:o:")
+        opts, args = getopt.getopt(sys.argv[1:], "hp:o:w:")
     except getopt.GetoptError:
         help()
     for opt, arg in opts:
@@ -153,24 +181,20 @@ if __name__ == '__main__':
             path = arg
         elif opt == "-p":
             password = arg
-        
-    #create application
-    app = QtGui.QApplication(sys.argv)
-    
-    #add qt4 reactor
-    import qt4reactor
-    qt4reactor.install()
-    from twisted.internet import reactor
-
+        elif opt == "-w":
+            workers = int(arg)
     
+    hosts = []
     for arg in args:      
         if ':' in arg:
-            ip, port = arg.split(':')
+            hosts.append(tuple(arg.split(':')))
         else:
-            ip, port = arg, "5900"
-        
-        reactor.connectTCP(ip, int(port), RFBScreenShotFactory(password, path + "%s.jpg"%ip))
-        
+            hosts.append((arg, "5900"))
     
-    reactor.runReturn()
-    app.exec_()
\ No newline at end of file
+    if workers <= 1:
+        scan(hosts, path, password)
+    else:
+        supervisor = worker.Supervisor(workers)
+        supervisor.start(lambda index, output:scan(hosts[index::workers], path, password))
+        supervisor.collect(lambda index, line:log.info("worker %s : %s"%(index, line)))
+        supervisor.wait()
@@ -0,0 +1,1474 @@
+/* -*- c-basic-offset: 8 -*-
+   rdpy: Remote Desktop Protocol in Python
+   Bulk compression routines (MPPC RDP 4.0/5.0 and RDP 6.1)
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+*/
+
+/* MPPC bit stream is described in RFC 2118 and [MS-RDPBCGR] 3.1.8
+   RDP 6.1 (XCRUSH) is described in [MS-RDPEGDI] 3.1.8.2
+   RDP 8.0 (segmented data of graphics pipeline) is described in [MS-RDPEGFX] 2.2.5 */
+
+#include <Python.h>
+#include <string.h>
+
+#define uint8	unsigned char
+#define uint16	unsigned short
+#define uint32	unsigned int
+
+#define	 RD_BOOL	int
+#define False	0
+#define True	1
+
+/* compression type, low nibble of compression flags */
+#define PACKET_COMPR_TYPE_8K	0x00
+#define PACKET_COMPR_TYPE_64K	0x01
+#define PACKET_COMPR_TYPE_RDP6	0x02
+#define PACKET_COMPR_TYPE_RDP61	0x03
+#define PACKET_COMPR_TYPE_RDP8	0x04
+#define COMPRESSION_TYPE_MASK	0x0F
+
+/* compression flags */
+#define PACKET_COMPRESSED	0x20
+#define PACKET_AT_FRONT		0x40
+#define PACKET_FLUSHED		0x80
+
+/* RDP 6.1 level 1 compression flags */
+#define L1_COMPRESSED		0x01
+#define L1_NO_COMPRESSION	0x02
+#define L1_PACKET_AT_FRONT	0x04
+#define L1_INNER_COMPRESSION	0x10
+
+#define MPPC_8K_HISTORY_SIZE	8192
+#define MPPC_64K_HISTORY_SIZE	65536
+#define XCRUSH_HISTORY_SIZE	2000000
+#define RDP8_HISTORY_SIZE	2500000
+
+/* RDP 8.0 segmented data descriptor */
+#define RDP8_SEGMENTED_SINGLE	0xE0
+#define RDP8_SEGMENTED_MULTIPART	0xE1
+
+/* size of one RDP61_MATCH_DETAILS structure */
+#define XCRUSH_MATCH_SIZE	8
+
+#define GETUINT16(p)	((uint16)((p)[0] | ((p)[1] << 8)))
+#define GETUINT32(p)	((uint32)((p)[0] | ((p)[1] << 8) | ((p)[2] << 16) | ((uint32)(p)[3] << 24)))
+
+/* bit stream reader (msb first) */
+typedef struct
+{
+	const uint8 * data;
+	int size;
+	int position;
+	int length;
+} bitstream;
+
+static void
+bitstream_init(bitstream * bs, const uint8 * data, int size)
+{
+	bs->data = data;
+	bs->size = size;
+	bs->position = 0;
+	bs->length = size * 8;
+}
+
+/* peek next 32 bits, padded with zero after end of stream */
+static uint32
+bitstream_peek(bitstream * bs)
+{
+	int index = bs->position >> 3;
+	int shift = bs->position & 7;
+	unsigned long long accumulator = 0;
+	int i;
+
+	for (i = 0; i < 5; i++)
+	{
+		accumulator <<= 8;
+		if (index + i < bs->size)
+			accumulator |= bs->data[index + i];
+	}
+	return (uint32) ((accumulator >> (8 - shift)) & 0xFFFFFFFF);
+}
+
+static void
+bitstream_shift(bitstream * bs, int nbits)
+{
+	bs->position += nbits;
+}
+
+static int
+bitstream_remaining(bitstream * bs)
+{
+	return bs->length - bs->position;
+}
+
+/* MPPC context (RDP 4.0 8K or RDP 5.0 64K history) */
+typedef struct
+{
+	int type;
+	uint8 * history;
+	int size;
+	int offset;
+} mppc_context;
+
+static RD_BOOL
+mppc_init(mppc_context * mppc, int type)
+{
+	mppc->type = type;
+	mppc->size = (type == PACKET_COMPR_TYPE_8K) ? MPPC_8K_HISTORY_SIZE : MPPC_64K_HISTORY_SIZE;
+	mppc->offset = 0;
+	mppc->history = (uint8 *) calloc(mppc->size, 1);
+	return mppc->history != NULL;
+}
+
+static void
+mppc_free(mppc_context * mppc)
+{
+	free(mppc->history);
+	mppc->history = NULL;
+}
+
+static void
+mppc_reset(mppc_context * mppc)
+{
+	memset(mppc->history, 0, mppc->size);
+	mppc->offset = 0;
+}
+
+/* decompress data into history buffer
+   output point into history buffer and is valid until next call */
+static RD_BOOL
+mppc_decompress(mppc_context * mppc, const uint8 * input, int size, uint8 ** output, int * outsize, int flags)
+{
+	bitstream bs;
+	uint8 * history = mppc->history;
+	uint8 * end = mppc->history + mppc->size;
+	uint8 * ptr;
+	uint8 * src;
+	uint32 accumulator;
+	uint32 offset;
+	uint32 length;
+	int k;
+
+	if (flags & PACKET_FLUSHED)
+		mppc_reset(mppc);
+
+	if (flags & PACKET_AT_FRONT)
+		mppc->offset = 0;
+
+	if (!(flags & PACKET_COMPRESSED))
+	{
+		*output = (uint8 *) input;
+		*outsize = size;
+		return True;
+	}
+
+	ptr = history + mppc->offset;
+	bitstream_init(&bs, input, size);
+
+	/* less than 8 bits is padding */
+	while (bitstream_remaining(&bs) >= 8)
+	{
+		accumulator = bitstream_peek(&bs);
+
+		/* literal */
+		if ((accumulator & 0x80000000) == 0x00000000)
+		{
+			if (ptr >= end)
+				return False;
+			*ptr++ = (uint8) (accumulator >> 24);
+			bitstream_shift(&bs, 8);
+			continue;
+		}
+		if ((accumulator & 0xC0000000) == 0x80000000)
+		{
+			if (ptr >= end)
+				return False;
+			*ptr++ = (uint8) (((accumulator >> 23) & 0x7F) | 0x80);
+			bitstream_shift(&bs, 9);
+			continue;
+		}
+
+		/* copy offset */
+		if (mppc->type == PACKET_COMPR_TYPE_8K)
+		{
+			if ((accumulator & 0xF0000000) == 0xF0000000)
+			{
+				offset = (accumulator >> 22) & 0x3F;
+				bitstream_shift(&bs, 10);
+			}
+			else if ((accumulator & 0xF0000000) == 0xE0000000)
+			{
+				offset = ((accumulator >> 20) & 0xFF) + 64;
+				bitstream_shift(&bs, 12);
+			}
+			else
+			{
+				offset = ((accumulator >> 16) & 0x1FFF) + 320;
+				bitstream_shift(&bs, 16);
+			}
+		}
+		else
+		{
+			if ((accumulator & 0xF8000000) == 0xF8000000)
+			{
+				offset = (accumulator >> 21) & 0x3F;
+				bitstream_shift(&bs, 11);
+			}
+			else if ((accumulator & 0xF8000000) == 0xF0000000)
+			{
+				offset = ((accumulator >> 19) & 0xFF) + 64;
+				bitstream_shift(&bs, 13);
+			}
+			else if ((accumulator & 0xF0000000) == 0xE0000000)
+			{
+				offset = ((accumulator >> 17) & 0x7FF) + 320;
+				bitstream_shift(&bs, 15);
+			}
+			else
+			{
+				offset = ((accumulator >> 13) & 0xFFFF) + 2368;
+				bitstream_shift(&bs, 19);
+			}
+		}
+
+		/* length of match : k ones, a zero and k + 1 bits */
+		accumulator = bitstream_peek(&bs);
+		if ((accumulator & 0x80000000) == 0)
+		{
+			length = 3;
+			bitstream_shift(&bs, 1);
+		}
+		else
+		{
+			k = 0;
+			while (k < 15 && (accumulator & (0x80000000 >> k)))
+				k++;
+			if (k == 15 || (mppc->type == PACKET_COMPR_TYPE_8K && k > 11))
+				return False;
+			bitstream_shift(&bs, k + 1);
+			accumulator = bitstream_peek(&bs);
+			length = (1 << (k + 1)) + (accumulator >> (31 - k));
+			bitstream_shift(&bs, k + 1);
+		}
+
+		if (bitstream_remaining(&bs) < 0)
+			return False;
+
+		src = ptr - offset;
+		if (offset == 0 || src < history || ptr + length > end)
+			return False;
+
+		/* byte per byte because source and destination may overlap */
+		while (length-- > 0)
+			*ptr++ = *src++;
+	}
+
+	*output = history + mppc->offset;
+	*outsize = (int) (ptr - *output);
+	mppc->offset = (int) (ptr - history);
+	return True;
+}
+
+/* RDP 6.1 context, level 2 compressor is MPPC 64K */
+typedef struct
+{
+	uint8 * history;
+	int size;
+	int offset;
+	mppc_context mppc;
+} xcrush_context;
+
+static RD_BOOL
+xcrush_init(xcrush_context * xcrush)
+{
+	xcrush->size = XCRUSH_HISTORY_SIZE;
+	xcrush->offset = 0;
+	xcrush->history = (uint8 *) calloc(xcrush->size, 1);
+	if (xcrush->history == NULL)
+		return False;
+	if (!mppc_init(&xcrush->mppc, PACKET_COMPR_TYPE_64K))
+	{
+		free(xcrush->history);
+		xcrush->history = NULL;
+		return False;
+	}
+	return True;
+}
+
+static void
+xcrush_free(xcrush_context * xcrush)
+{
+	free(xcrush->history);
+	xcrush->history = NULL;
+	mppc_free(&xcrush->mppc);
+}
+
+static void
+xcrush_reset(xcrush_context * xcrush)
+{
+	memset(xcrush->history, 0, xcrush->size);
+	xcrush->offset = 0;
+	mppc_reset(&xcrush->mppc);
+}
+
+/* level 1 decompression : literals and matches into history */
+static RD_BOOL
+xcrush_decompress_l1(xcrush_context * xcrush, const uint8 * input, int size, uint8 ** output, int * outsize, int flags)
+{
+	const uint8 * end = input + size;
+	const uint8 * literals;
+	const uint8 * match;
+	uint8 * dst;
+	uint8 * src;
+	int count, i, outoff, literalsize;
+	uint32 matchlength, matchoutoff, matchhistoff;
+
+	if (flags & L1_PACKET_AT_FRONT)
+		xcrush->offset = 0;
+
+	dst = xcrush->history + xcrush->offset;
+	outoff = 0;
+
+	if (flags & L1_COMPRESSED)
+	{
+		if (size < 2)
+			return False;
+		count = GETUINT16(input);
+		match = input + 2;
+		literals = match + count * XCRUSH_MATCH_SIZE;
+		if (literals > end)
+			return False;
+
+		for (i = 0; i < count; i++, match += XCRUSH_MATCH_SIZE)
+		{
+			matchlength = GETUINT16(match);
+			matchoutoff = GETUINT16(match + 2);
+			matchhistoff = GETUINT32(match + 4);
+
+			if ((int) matchoutoff < outoff)
+				return False;
+
+			/* literals before match */
+			literalsize = matchoutoff - outoff;
+			if (literals + literalsize > end || xcrush->offset + outoff + literalsize > xcrush->size)
+				return False;
+			memcpy(dst + outoff, literals, literalsize);
+			literals += literalsize;
+			outoff += literalsize;
+
+			if (matchhistoff + matchlength > (uint32) xcrush->size || xcrush->offset + outoff + matchlength > (uint32) xcrush->size)
+				return False;
+
+			src = xcrush->history + matchhistoff;
+			for (; matchlength > 0; matchlength--)
+				dst[outoff++] = *src++;
+		}
+
+		/* tail literals */
+		literalsize = (int) (end - literals);
+		if (xcrush->offset + outoff + literalsize > xcrush->size)
+			return False;
+		memcpy(dst + outoff, literals, literalsize);
+		outoff += literalsize;
+	}
+	else
+	{
+		if (xcrush->offset + size > xcrush->size)
+			return False;
+		memcpy(dst, input, size);
+		outoff = size;
+	}
+
+	xcrush->offset += outoff;
+	*output = dst;
+	*outsize = outoff;
+	return True;
+}
+
+static RD_BOOL
+xcrush_decompress(xcrush_context * xcrush, const uint8 * input, int size, uint8 ** output, int * outsize, int flags)
+{
+	int level1, level2;
+	uint8 * inner;
+	int innersize;
+
+	if (flags & PACKET_FLUSHED)
+		xcrush_reset(xcrush);
+
+	if (!(flags & PACKET_COMPRESSED))
+	{
+		*output = (uint8 *) input;
+		*outsize = size;
+		return True;
+	}
+
+	if (size < 2)
+		return False;
+
+	level1 = input[0];
+	level2 = input[1];
+	input += 2;
+	size -= 2;
+
+	if (level2 & PACKET_COMPRESSED)
+	{
+		if (!mppc_decompress(&xcrush->mppc, input, size, &inner, &innersize, level2))
+			return False;
+		input = inner;
+		size = innersize;
+	}
+	else if (level2 & PACKET_FLUSHED)
+	{
+		mppc_reset(&xcrush->mppc);
+	}
+
+	return xcrush_decompress_l1(xcrush, input, size, output, outsize, level1);
+}
+
+/* MPPC compressor (server side)
+   history is a ring restarted at front when full */
+
+#define MPPC_HASH_BITS		15
+#define MPPC_HASH_SIZE		(1 << MPPC_HASH_BITS)
+#define MPPC_HASH(p)		((((uint32) (p)[0] << 16 | (uint32) (p)[1] << 8 | (p)[2]) * 2654435761U) >> (32 - MPPC_HASH_BITS))
+#define MPPC_MAX_LEVEL		9
+
+/* bit stream writer (msb first) */
+typedef struct
+{
+	uint8 * data;
+	int size;
+	int length;
+	uint32 accumulator;
+	int count;
+	RD_BOOL overflow;
+} bitwriter;
+
+static void
+bitwriter_init(bitwriter * bw, uint8 * data, int size)
+{
+	bw->data = data;
+	bw->size = size;
+	bw->length = 0;
+	bw->accumulator = 0;
+	bw->count = 0;
+	bw->overflow = False;
+}
+
+/* write at most 24 bits */
+static void
+bitwriter_write(bitwriter * bw, uint32 value, int nbits)
+{
+	bw->accumulator = (bw->accumulator << nbits) | (value & ((1 << nbits) - 1));
+	bw->count += nbits;
+	while (bw->count >= 8)
+	{
+		bw->count -= 8;
+		if (bw->length >= bw->size)
+		{
+			bw->overflow = True;
+			continue;
+		}
+		bw->data[bw->length++] = (uint8) (bw->accumulator >> bw->count);
+	}
+}
+
+/* pad last byte with zero */
+static void
+bitwriter_flush(bitwriter * bw)
+{
+	if (bw->count > 0)
+		bitwriter_write(bw, 0, 8 - bw->count);
+}
+
+typedef struct
+{
+	int type;
+	uint8 * history;
+	int size;
+	int offset;
+	int depth;
+	RD_BOOL flush;
+	int * head;
+	int * chain;
+} mppc_compressor;
+
+static void
+mppc_compressor_reset(mppc_compressor * mppc)
+{
+	memset(mppc->head, 0xFF, MPPC_HASH_SIZE * sizeof(int));
+	mppc->offset = 0;
+	mppc->flush = True;
+}
+
+static RD_BOOL
+mppc_compressor_init(mppc_compressor * mppc, int type, int level)
+{
+	mppc->type = type;
+	mppc->size = (type == PACKET_COMPR_TYPE_8K) ? MPPC_8K_HISTORY_SIZE : MPPC_64K_HISTORY_SIZE;
+	/* level is the cost of match search */
+	mppc->depth = 1 << (level - 1);
+	mppc->history = (uint8 *) calloc(mppc->size, 1);
+	mppc->head = (int *) malloc(MPPC_HASH_SIZE * sizeof(int));
+	mppc->chain = (int *) malloc(mppc->size * sizeof(int));
+	if (mppc->history == NULL || mppc->head == NULL || mppc->chain == NULL)
+		return False;
+	mppc_compressor_reset(mppc);
+	return True;
+}
+
+static void
+mppc_compressor_free(mppc_compressor * mppc)
+{
+	free(mppc->history);
+	free(mppc->head);
+	free(mppc->chain);
+	mppc->history = NULL;
+	mppc->head = NULL;
+	mppc->chain = NULL;
+}
+
+static void
+mppc_write_literal(bitwriter * bw, uint8 value)
+{
+	if (value < 0x80)
+		bitwriter_write(bw, value, 8);
+	else
+		bitwriter_write(bw, 0x100 | (value & 0x7F), 9);
+}
+
+static void
+mppc_write_match(mppc_compressor * mppc, bitwriter * bw, uint32 offset, uint32 length)
+{
+	int n;
+
+	if (mppc->type == PACKET_COMPR_TYPE_8K)
+	{
+		if (offset < 64)
+			bitwriter_write(bw, (0xF << 6) | offset, 10);
+		else if (offset < 320)
+			bitwriter_write(bw, (0xE << 8) | (offset - 64), 12);
+		else
+			bitwriter_write(bw, (0x6 << 13) | (offset - 320), 16);
+	}
+	else
+	{
+		if (offset < 64)
+			bitwriter_write(bw, (0x1F << 6) | offset, 11);
+		else if (offset < 320)
+			bitwriter_write(bw, (0x1E << 8) | (offset - 64), 13);
+		else if (offset < 2368)
+			bitwriter_write(bw, (0xE << 11) | (offset - 320), 15);
+		else
+			bitwriter_write(bw, (0x6 << 16) | (offset - 2368), 19);
+	}
+
+	if (length == 3)
+	{
+		bitwriter_write(bw, 0, 1);
+		return;
+	}
+
+	/* n - 1 ones, a zero and n bits */
+	n = 0;
+	while ((length >> (n + 1)) != 0)
+		n++;
+	bitwriter_write(bw, ((1 << (n - 1)) - 1) << 1, n);
+	bitwriter_write(bw, length - (1 << n), n);
+}
+
+static void
+mppc_insert(mppc_compressor * mppc, int position)
+{
+	uint32 hash = MPPC_HASH(mppc->history + position);
+	mppc->chain[position] = mppc->head[hash];
+	mppc->head[hash] = position;
+}
+
+/* compress input into output (at most size - 1 bytes)
+   return compression flags, when data can't be compressed
+   output is unused and history is flushed */
+static int
+mppc_compress(mppc_compressor * mppc, const uint8 * input, int size, uint8 * output, int * outsize)
+{
+	bitwriter bw;
+	uint8 * history = mppc->history;
+	int flags = mppc->type | PACKET_COMPRESSED;
+	int maxlength = mppc->size - 1;
+	int position, end, candidate, depth, length, bestlength, bestoffset, i;
+
+	if (size == 0 || size > mppc->size)
+		goto uncompressed;
+
+	if (mppc->flush)
+	{
+		flags |= PACKET_FLUSHED;
+		mppc->flush = False;
+	}
+
+	if (mppc->offset + size > mppc->size)
+	{
+		memset(mppc->head, 0xFF, MPPC_HASH_SIZE * sizeof(int));
+		mppc->offset = 0;
+		flags |= PACKET_AT_FRONT;
+	}
+
+	memcpy(history + mppc->offset, input, size);
+	/* never expand payload */
+	bitwriter_init(&bw, output, size - 1);
+
+	position = mppc->offset;
+	end = mppc->offset + size;
+	while (position < end && !bw.overflow)
+	{
+		bestlength = 0;
+		bestoffset = 0;
+		if (end - position >= 3)
+		{
+			candidate = mppc->head[MPPC_HASH(history + position)];
+			depth = mppc->depth;
+			while (candidate >= 0 && candidate < position && depth-- > 0)
+			{
+				if (history[candidate] == history[position] && history[candidate + 1] == history[position + 1] && history[candidate + 2] == history[position + 2])
+				{
+					length = 3;
+					while (position + length < end && length < maxlength && history[candidate + length] == history[position + length])
+						length++;
+					if (length > bestlength)
+					{
+						bestlength = length;
+						bestoffset = position - candidate;
+					}
+				}
+				candidate = mppc->chain[candidate];
+			}
+			mppc_insert(mppc, position);
+		}
+
+		if (bestlength >= 3)
+		{
+			mppc_write_match(mppc, &bw, bestoffset, bestlength);
+			for (i = 1; i < bestlength; i++)
+			{
+				if (end - (position + i) >= 3)
+					mppc_insert(mppc, position + i);
+			}
+			position += bestlength;
+		}
+		else
+		{
+			mppc_write_literal(&bw, history[position]);
+			position++;
+		}
+	}
+	bitwriter_flush(&bw);
+
+	if (bw.overflow)
+		goto uncompressed;
+
+	mppc->offset = end;
+	*outsize = bw.length;
+	return flags;
+
+uncompressed:
+	mppc_compressor_reset(mppc);
+	mppc->flush = False;
+	*outsize = 0;
+	return PACKET_FLUSHED;
+}
+
+/* RDP 8.0 context (history of 2.5 MB for graphics pipeline, 8 KB for RDP 8.0 lite) */
+typedef struct
+{
+	uint8 * history;
+	int size;
+	int offset;
+} rdp8_context;
+
+/* prefix code token, literal (type 0) or match distance (type 1) */
+typedef struct
+{
+	int prefixLength;
+	uint32 prefixCode;
+	int valueBits;
+	int tokenType;
+	uint32 valueBase;
+} rdp8_token;
+
+static const rdp8_token rdp8_tokens[] =
+{
+	{ 1, 0, 8, 0, 0 },
+	{ 5, 17, 5, 1, 0 },
+	{ 5, 18, 7, 1, 32 },
+	{ 5, 19, 9, 1, 160 },
+	{ 5, 20, 10, 1, 672 },
+	{ 5, 21, 12, 1, 1696 },
+	{ 5, 24, 0, 0, 0x00 },
+	{ 5, 25, 0, 0, 0x01 },
+	{ 6, 44, 14, 1, 5792 },
+	{ 6, 45, 15, 1, 22176 },
+	{ 6, 52, 0, 0, 0x02 },
+	{ 6, 53, 0, 0, 0x03 },
+	{ 6, 54, 0, 0, 0xFF },
+	{ 7, 92, 18, 1, 54944 },
+	{ 7, 93, 20, 1, 317088 },
+	{ 7, 110, 0, 0, 0x04 },
+	{ 7, 111, 0, 0, 0x05 },
+	{ 7, 112, 0, 0, 0x06 },
+	{ 7, 113, 0, 0, 0x07 },
+	{ 7, 114, 0, 0, 0x08 },
+	{ 7, 115, 0, 0, 0x09 },
+	{ 7, 116, 0, 0, 0x0A },
+	{ 7, 117, 0, 0, 0x0B },
+	{ 7, 118, 0, 0, 0x3A },
+	{ 7, 119, 0, 0, 0x3B },
+	{ 7, 120, 0, 0, 0x3C },
+	{ 7, 121, 0, 0, 0x3D },
+	{ 7, 122, 0, 0, 0x3E },
+	{ 7, 123, 0, 0, 0x3F },
+	{ 7, 124, 0, 0, 0x40 },
+	{ 7, 125, 0, 0, 0x80 },
+	{ 8, 188, 20, 1, 1365664 },
+	{ 8, 189, 21, 1, 2414240 },
+	{ 8, 252, 0, 0, 0x0C },
+	{ 8, 253, 0, 0, 0x38 },
+	{ 8, 254, 0, 0, 0x39 },
+	{ 8, 255, 0, 0, 0x66 },
+	{ 9, 380, 22, 1, 4511392 },
+	{ 9, 381, 23, 1, 8705696 },
+	{ 9, 382, 24, 1, 17094304 },
+};
+
+#define RDP8_TOKEN_COUNT	((int) (sizeof(rdp8_tokens) / sizeof(rdp8_token)))
+#define RDP8_MAX_PREFIX_LENGTH	9
+
+/* token of each 9 bits prefix, -1 if prefix is invalid */
+static signed char rdp8_prefix_table[1 << RDP8_MAX_PREFIX_LENGTH];
+static RD_BOOL rdp8_prefix_table_ready = False;
+
+static void
+rdp8_init_prefix_table(void)
+{
+	int i, j, shift;
+
+	if (rdp8_prefix_table_ready)
+		return;
+	memset(rdp8_prefix_table, -1, sizeof(rdp8_prefix_table));
+	/* tokens are sorted by prefix length so shorter prefixes come first */
+	for (i = RDP8_TOKEN_COUNT - 1; i >= 0; i--)
+	{
+		shift = RDP8_MAX_PREFIX_LENGTH - rdp8_tokens[i].prefixLength;
+		for (j = 0; j < (1 << shift); j++)
+			rdp8_prefix_table[(rdp8_tokens[i].prefixCode << shift) | j] = i;
+	}
+	rdp8_prefix_table_ready = True;
+}
+
+static RD_BOOL
+rdp8_init(rdp8_context * rdp8, int size)
+{
+	rdp8_init_prefix_table();
+	rdp8->size = size;
+	rdp8->offset = 0;
+	rdp8->history = (uint8 *) calloc(size, 1);
+	return rdp8->history != NULL;
+}
+
+static void
+rdp8_free(rdp8_context * rdp8)
+{
+	free(rdp8->history);
+	rdp8->history = NULL;
+}
+
+static void
+rdp8_reset(rdp8_context * rdp8)
+{
+	memset(rdp8->history, 0, rdp8->size);
+	rdp8->offset = 0;
+}
+
+/* growable output buffer */
+typedef struct
+{
+	uint8 * data;
+	int size;
+	int capacity;
+} rdp8_output;
+
+static RD_BOOL
+rdp8_output_reserve(rdp8_output * out, int count)
+{
+	uint8 * data;
+	int capacity = out->capacity;
+
+	if (out->size + count <= capacity)
+		return True;
+	if (count > 0x7fffffff - out->size)
+		return False;
+	while (capacity < out->size + count)
+		capacity = capacity < 0x40000000 ? capacity * 2 : 0x7fffffff;
+	data = (uint8 *) realloc(out->data, capacity);
+	if (data == NULL)
+		return False;
+	out->data = data;
+	out->capacity = capacity;
+	return True;
+}
+
+/* append bytes to output and history */
+static RD_BOOL
+rdp8_write(rdp8_context * rdp8, rdp8_output * out, const uint8 * data, int count)
+{
+	int i, n;
+
+	if (!rdp8_output_reserve(out, count))
+		return False;
+	memcpy(out->data + out->size, data, count);
+	out->size += count;
+	/* only last bytes are kept in history */
+	if (count > rdp8->size)
+	{
+		data += count - rdp8->size;
+		count = rdp8->size;
+	}
+	for (i = 0; i < count; i += n)
+	{
+		n = rdp8->size - rdp8->offset;
+		if (n > count - i)
+			n = count - i;
+		memcpy(rdp8->history + rdp8->offset, data + i, n);
+		rdp8->offset = (rdp8->offset + n) % rdp8->size;
+	}
+	return True;
+}
+
+/* copy count bytes from distance in history (may overlap) */
+static RD_BOOL
+rdp8_copy(rdp8_context * rdp8, rdp8_output * out, uint32 distance, uint32 count)
+{
+	uint8 * history = rdp8->history;
+	int src, offset = rdp8->offset, size = rdp8->size;
+	uint8 * dst;
+	uint32 i;
+
+	if (distance > (uint32) size || !rdp8_output_reserve(out, count))
+		return False;
+	src = (offset + size - distance) % size;
+	dst = out->data + out->size;
+	for (i = 0; i < count; i++)
+	{
+		dst[i] = history[offset] = history[src];
+		if (++src == size)
+			src = 0;
+		if (++offset == size)
+			offset = 0;
+	}
+	rdp8->offset = offset;
+	out->size += count;
+	return True;
+}
+
+/* read nbits (at most 25) of bit stream, False if stream is too short */
+static RD_BOOL
+rdp8_get_bits(bitstream * bs, int nbits, uint32 * value)
+{
+	if (bitstream_remaining(bs) < nbits)
+		return False;
+	*value = nbits == 0 ? 0 : bitstream_peek(bs) >> (32 - nbits);
+	bitstream_shift(bs, nbits);
+	return True;
+}
+
+/* decompress one RDP8_BULK_ENCODED_DATA */
+static RD_BOOL
+rdp8_decompress_segment(rdp8_context * rdp8, const uint8 * input, int size, rdp8_output * out)
+{
+	const rdp8_token * token;
+	bitstream bs;
+	uint32 value, distance, count, extra, bit;
+	int index;
+	uint8 literal;
+
+	if (size < 1 || (input[0] & COMPRESSION_TYPE_MASK) != PACKET_COMPR_TYPE_RDP8)
+		return False;
+
+	if (!(input[0] & PACKET_COMPRESSED))
+		return rdp8_write(rdp8, out, input + 1, size - 1);
+
+	/* last byte is number of unused bits of previous one */
+	if (size < 2 || input[size - 1] > 7)
+		return False;
+	bitstream_init(&bs, input + 1, size - 2);
+	bs.length -= input[size - 1];
+
+	while (bitstream_remaining(&bs) > 0)
+	{
+		index = rdp8_prefix_table[bitstream_peek(&bs) >> (32 - RDP8_MAX_PREFIX_LENGTH)];
+		if (index < 0 || bitstream_remaining(&bs) < rdp8_tokens[index].prefixLength)
+			return False;
+		token = &rdp8_tokens[index];
+		bitstream_shift(&bs, token->prefixLength);
+
+		if (!rdp8_get_bits(&bs, token->valueBits, &value))
+			return False;
+
+		if (token->tokenType == 0)
+		{
+			literal = (uint8) (token->valueBase + value);
+			if (!rdp8_write(rdp8, out, &literal, 1))
+				return False;
+			continue;
+		}
+
+		distance = token->valueBase + value;
+		if (distance == 0)
+		{
+			/* unencoded bytes are aligned on next byte */
+			if (!rdp8_get_bits(&bs, 15, &count))
+				return False;
+			bs.position = (bs.position + 7) & ~7;
+			if (bitstream_remaining(&bs) < (int) count * 8)
+				return False;
+			if (!rdp8_write(rdp8, out, bs.data + (bs.position >> 3), count))
+				return False;
+			bitstream_shift(&bs, count * 8);
+			continue;
+		}
+
+		if (!rdp8_get_bits(&bs, 1, &bit))
+			return False;
+		if (bit == 0)
+			count = 3;
+		else
+		{
+			count = 4;
+			extra = 2;
+			for (;;)
+			{
+				if (!rdp8_get_bits(&bs, 1, &bit))
+					return False;
+				if (bit == 0)
+					break;
+				count *= 2;
+				if (++extra > 24)
+					return False;
+			}
+			if (!rdp8_get_bits(&bs, extra, &value))
+				return False;
+			count += value;
+		}
+		if (!rdp8_copy(rdp8, out, distance, count))
+			return False;
+	}
+	return True;
+}
+
+/* decompress RDP_SEGMENTED_DATA, output must be freed */
+static RD_BOOL
+rdp8_decompress(rdp8_context * rdp8, const uint8 * input, int size, uint8 ** output, int * outsize)
+{
+	rdp8_output out;
+	uint32 segmentCount, uncompressedSize, segmentSize, i;
+	int offset;
+	RD_BOOL rv = True;
+
+	out.size = 0;
+	out.capacity = 1024;
+	out.data = (uint8 *) malloc(out.capacity);
+	if (out.data == NULL || size < 1)
+	{
+		free(out.data);
+		return False;
+	}
+
+	if (input[0] == RDP8_SEGMENTED_SINGLE)
+		rv = rdp8_decompress_segment(rdp8, input + 1, size - 1, &out);
+	else if (input[0] == RDP8_SEGMENTED_MULTIPART && size >= 7)
+	{
+		segmentCount = GETUINT16(input + 1);
+		uncompressedSize = GETUINT32(input + 3);
+		offset = 7;
+		for (i = 0; i < segmentCount && rv; i++)
+		{
+			if (size - offset < 4)
+			{
+				rv = False;
+				break;
+			}
+			segmentSize = GETUINT32(input + offset);
+			offset += 4;
+			if (segmentSize > (uint32) (size - offset))
+			{
+				rv = False;
+				break;
+			}
+			rv = rdp8_decompress_segment(rdp8, input + offset, segmentSize, &out);
+			offset += segmentSize;
+		}
+		if (rv && (uint32) out.size != uncompressedSize)
+			rv = False;
+	}
+	else
+		rv = False;
+
+	if (!rv)
+	{
+		free(out.data);
+		return False;
+	}
+	*output = out.data;
+	*outsize = out.size;
+	return True;
+}
+
+/* Python binding */
+
+typedef struct
+{
+	PyObject_HEAD
+	int type;
+	mppc_context mppc;
+	xcrush_context xcrush;
+} Decompressor;
+
+static int
+Decompressor_init(Decompressor * self, PyObject * args, PyObject * kwds)
+{
+	int type = 0;
+
+	if (!PyArg_ParseTuple(args, "i", &type))
+		return -1;
+
+	self->type = type;
+	switch (type)
+	{
+		case PACKET_COMPR_TYPE_8K:
+		case PACKET_COMPR_TYPE_64K:
+			if (!mppc_init(&self->mppc, type))
+			{
+				PyErr_NoMemory();
+				return -1;
+			}
+			break;
+		case PACKET_COMPR_TYPE_RDP61:
+			if (!xcrush_init(&self->xcrush))
+			{
+				PyErr_NoMemory();
+				return -1;
+			}
+			break;
+		default:
+			PyErr_Format(PyExc_ValueError, "unsupported bulk compression type %d", type);
+			return -1;
+	}
+	return 0;
+}
+
+static void
+Decompressor_dealloc(Decompressor * self)
+{
+	if (self->type == PACKET_COMPR_TYPE_RDP61)
+		xcrush_free(&self->xcrush);
+	else
+		mppc_free(&self->mppc);
+	self->ob_type->tp_free((PyObject *) self);
+}
+
+static PyObject *
+Decompressor_decompress(Decompressor * self, PyObject * args)
+{
+	const char * input;
+	int size = 0, flags = 0, outsize = 0;
+	uint8 * output = NULL;
+	RD_BOOL rv;
+
+	if (!PyArg_ParseTuple(args, "s#i", &input, &size, &flags))
+		return NULL;
+
+	if (self->type == PACKET_COMPR_TYPE_RDP61)
+		rv = xcrush_decompress(&self->xcrush, (const uint8 *) input, size, &output, &outsize, flags);
+	else
+		rv = mppc_decompress(&self->mppc, (const uint8 *) input, size, &output, &outsize, flags);
+
+	if (!rv)
+	{
+		PyErr_SetString(PyExc_ValueError, "invalid bulk compressed data");
+		return NULL;
+	}
+
+	return PyString_FromStringAndSize((const char *) output, outsize);
+}
+
+static PyObject *
+Decompressor_reset(Decompressor * self, PyObject * args)
+{
+	if (self->type == PACKET_COMPR_TYPE_RDP61)
+		xcrush_reset(&self->xcrush);
+	else
+		mppc_reset(&self->mppc);
+	Py_RETURN_NONE;
+}
+
+static PyObject *
+Decompressor_gettype(Decompressor * self, void * closure)
+{
+	return PyInt_FromLong(self->type);
+}
+
+static PyMethodDef Decompressor_methods[] =
+{
+	{"decompress", (PyCFunction) Decompressor_decompress, METH_VARARGS, "decompress(data, flags) decompress bulk data in accordance with compression flags."},
+	{"reset", (PyCFunction) Decompressor_reset, METH_NOARGS, "reset history buffer."},
+	{NULL, NULL, 0, NULL}
+};
+
+static PyGetSetDef Decompressor_getset[] =
+{
+	{"type", (getter) Decompressor_gettype, NULL, "compression type", NULL},
+	{NULL, NULL, NULL, NULL, NULL}
+};
+
+static PyTypeObject DecompressorType =
+{
+	PyObject_HEAD_INIT(NULL)
+	0,						/* ob_size */
+	"bulk.Decompressor",				/* tp_name */
+	sizeof(Decompressor),				/* tp_basicsize */
+	0,						/* tp_itemsize */
+	(destructor) Decompressor_dealloc,		/* tp_dealloc */
+	0,						/* tp_print */
+	0,						/* tp_getattr */
+	0,						/* tp_setattr */
+	0,						/* tp_compare */
+	0,						/* tp_repr */
+	0,						/* tp_as_number */
+	0,						/* tp_as_sequence */
+	0,						/* tp_as_mapping */
+	0,						/* tp_hash */
+	0,						/* tp_call */
+	0,						/* tp_str */
+	0,						/* tp_getattro */
+	0,						/* tp_setattro */
+	0,						/* tp_as_buffer */
+	Py_TPFLAGS_DEFAULT,				/* tp_flags */
+	"Decompressor(type) bulk decompressor with its own history buffer.",	/* tp_doc */
+	0,						/* tp_traverse */
+	0,						/* tp_clear */
+	0,						/* tp_richcompare */
+	0,						/* tp_weaklistoffset */
+	0,						/* tp_iter */
+	0,						/* tp_iternext */
+	Decompressor_methods,				/* tp_methods */
+	0,						/* tp_members */
+	Decompressor_getset,				/* tp_getset */
+	0,						/* tp_base */
+	0,						/* tp_dict */
+	0,						/* tp_descr_get */
+	0,						/* tp_descr_set */
+	0,						/* tp_dictoffset */
+	(initproc) Decompressor_init,			/* tp_init */
+	0,						/* tp_alloc */
+	0,						/* tp_new */
+};
+
+typedef struct
+{
+	PyObject_HEAD
+	mppc_compressor mppc;
+} Compressor;
+
+static int
+Compressor_init(Compressor * self, PyObject * args, PyObject * kwds)
+{
+	static char * kwlist[] = {"type", "level", NULL};
+	int type = 0, level = 1;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "i|i", kwlist, &type, &level))
+		return -1;
+
+	if (type != PACKET_COMPR_TYPE_8K && type != PACKET_COMPR_TYPE_64K)
+	{
+		PyErr_Format(PyExc_ValueError, "unsupported bulk compression type %d", type);
+		return -1;
+	}
+
+	if (level < 1 || level > MPPC_MAX_LEVEL)
+	{
+		PyErr_Format(PyExc_ValueError, "invalid compression level %d", level);
+		return -1;
+	}
+
+	if (!mppc_compressor_init(&self->mppc, type, level))
+	{
+		mppc_compressor_free(&self->mppc);
+		PyErr_NoMemory();
+		return -1;
+	}
+	return 0;
+}
+
+static void
+Compressor_dealloc(Compressor * self)
+{
+	mppc_compressor_free(&self->mppc);
+	self->ob_type->tp_free((PyObject *) self);
+}
+
+static PyObject *
+Compressor_compress(Compressor * self, PyObject * args)
+{
+	const char * input;
+	int size = 0, flags, outsize = 0;
+	uint8 * output;
+	PyObject * result;
+
+	if (!PyArg_ParseTuple(args, "s#", &input, &size))
+		return NULL;
+
+	output = (uint8 *) malloc(size > 0 ? size : 1);
+	if (output == NULL)
+		return PyErr_NoMemory();
+
+	flags = mppc_compress(&self->mppc, (const uint8 *) input, size, output, &outsize);
+	if (flags & PACKET_COMPRESSED)
+		result = Py_BuildValue("(s#i)", (const char *) output, outsize, flags);
+	else
+		result = Py_BuildValue("(s#i)", input, size, flags);
+
+	free(output);
+	return result;
+}
+
+static PyObject *
+Compressor_reset(Compressor * self, PyObject * args)
+{
+	mppc_compressor_reset(&self->mppc);
+	Py_RETURN_NONE;
+}
+
+static PyObject *
+Compressor_gettype(Compressor * self, void * closure)
+{
+	return PyInt_FromLong(self->mppc.type);
+}
+
+static PyMethodDef Compressor_methods[] =
+{
+	{"compress", (PyCFunction) Compressor_compress, METH_VARARGS, "compress(data) -> (payload, flags) payload is data itself when compression doesn't reduce size."},
+	{"reset", (PyCFunction) Compressor_reset, METH_NOARGS, "reset history buffer, next packet is flagged as flushed."},
+	{NULL, NULL, 0, NULL}
+};
+
+static PyGetSetDef Compressor_getset[] =
+{
+	{"type", (getter) Compressor_gettype, NULL, "compression type", NULL},
+	{NULL, NULL, NULL, NULL, NULL}
+};
+
+static PyTypeObject CompressorType =
+{
+	PyObject_HEAD_INIT(NULL)
+	0,						/* ob_size */
+	"bulk.Compressor",				/* tp_name */
+	sizeof(Compressor),				/* tp_basicsize */
+	0,						/* tp_itemsize */
+	(destructor) Compressor_dealloc,		/* tp_dealloc */
+	0,						/* tp_print */
+	0,						/* tp_getattr */
+	0,						/* tp_setattr */
+	0,						/* tp_compare */
+	0,						/* tp_repr */
+	0,						/* tp_as_number */
+	0,						/* tp_as_sequence */
+	0,						/* tp_as_mapping */
+	0,						/* tp_hash */
+	0,						/* tp_call */
+	0,						/* tp_str */
+	0,						/* tp_getattro */
+	0,						/* tp_setattro */
+	0,						/* tp_as_buffer */
+	Py_TPFLAGS_DEFAULT,				/* tp_flags */
+	"Compressor(type, level = 1) MPPC compressor, level (1-9) trade CPU for bandwidth.",	/* tp_doc */
+	0,						/* tp_traverse */
+	0,						/* tp_clear */
+	0,						/* tp_richcompare */
+	0,						/* tp_weaklistoffset */
+	0,						/* tp_iter */
+	0,						/* tp_iternext */
+	Compressor_methods,				/* tp_methods */
+	0,						/* tp_members */
+	Compressor_getset,				/* tp_getset */
+	0,						/* tp_base */
+	0,						/* tp_dict */
+	0,						/* tp_descr_get */
+	0,						/* tp_descr_set */
+	0,						/* tp_dictoffset */
+	(initproc) Compressor_init,			/* tp_init */
+	0,						/* tp_alloc */
+	0,						/* tp_new */
+};
+
+typedef struct
+{
+	PyObject_HEAD
+	rdp8_context rdp8;
+} RDP8Decompressor;
+
+static int
+RDP8Decompressor_init(RDP8Decompressor * self, PyObject * args, PyObject * kwds)
+{
+	static char * kwlist[] = {"historySize", NULL};
+	int historySize = RDP8_HISTORY_SIZE;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "|i", kwlist, &historySize))
+		return -1;
+
+	if (historySize <= 0)
+	{
+		PyErr_Format(PyExc_ValueError, "invalid history size %d", historySize);
+		return -1;
+	}
+
+	rdp8_free(&self->rdp8);
+	if (!rdp8_init(&self->rdp8, historySize))
+	{
+		PyErr_NoMemory();
+		return -1;
+	}
+	return 0;
+}
+
+static void
+RDP8Decompressor_dealloc(RDP8Decompressor * self)
+{
+	rdp8_free(&self->rdp8);
+	self->ob_type->tp_free((PyObject *) self);
+}
+
+static PyObject *
+RDP8Decompressor_decompress(RDP8Decompressor * self, PyObject * args)
+{
+	const char * input;
+	int size = 0, outsize = 0;
+	uint8 * output = NULL;
+	PyObject * result;
+
+	if (!PyArg_ParseTuple(args, "s#", &input, &size))
+		return NULL;
+
+	if (!rdp8_decompress(&self->rdp8, (const uint8 *) input, size, &output, &outsize))
+	{
+		PyErr_SetString(PyExc_ValueError, "invalid RDP 8.0 segmented data");
+		return NULL;
+	}
+
+	result = PyString_FromStringAndSize((const char *) output, outsize);
+	free(output);
+	return result;
+}
+
+static PyObject *
+RDP8Decompressor_reset(RDP8Decompressor * self, PyObject * args)
+{
+	rdp8_reset(&self->rdp8);
+	Py_RETURN_NONE;
+}
+
+static PyMethodDef RDP8Decompressor_methods[] =
+{
+	{"decompress", (PyCFunction) RDP8Decompressor_decompress, METH_VARARGS, "decompress(data) decompress RDP 8.0 segmented data (single or multipart)."},
+	{"reset", (PyCFunction) RDP8Decompressor_reset, METH_NOARGS, "reset history buffer."},
+	{NULL, NULL, 0, NULL}
+};
+
+static PyTypeObject RDP8DecompressorType =
+{
+	PyObject_HEAD_INIT(NULL)
+	0,						/* ob_size */
+	"bulk.RDP8Decompressor",			/* tp_name */
+	sizeof(RDP8Decompressor),			/* tp_basicsize */
+	0,						/* tp_itemsize */
+	(destructor) RDP8Decompressor_dealloc,		/* tp_dealloc */
+	0,						/* tp_print */
+	0,						/* tp_getattr */
+	0,						/* tp_setattr */
+	0,						/* tp_compare */
+	0,						/* tp_repr */
+	0,						/* tp_as_number */
+	0,						/* tp_as_sequence */
+	0,						/* tp_as_mapping */
+	0,						/* tp_hash */
+	0,						/* tp_call */
+	0,						/* tp_str */
+	0,						/* tp_getattro */
+	0,						/* tp_setattro */
+	0,						/* tp_as_buffer */
+	Py_TPFLAGS_DEFAULT,				/* tp_flags */
+	"RDP8Decompressor(historySize = 2500000) RDP 8.0 decompressor of graphics pipeline (8192 history for RDP 8.0 lite).",	/* tp_doc */
+	0,						/* tp_traverse */
+	0,						/* tp_clear */
+	0,						/* tp_richcompare */
+	0,						/* tp_weaklistoffset */
+	0,						/* tp_iter */
+	0,						/* tp_iternext */
+	RDP8Decompressor_methods,			/* tp_methods */
+	0,						/* tp_members */
+	0,						/* tp_getset */
+	0,						/* tp_base */
+	0,						/* tp_dict */
+	0,						/* tp_descr_get */
+	0,						/* tp_descr_set */
+	0,						/* tp_dictoffset */
+	(initproc) RDP8Decompressor_init,		/* tp_init */
+	0,						/* tp_alloc */
+	0,						/* tp_new */
+};
+
+static PyMethodDef bulk_methods[] =
+{
+	{NULL, NULL, 0, NULL}
+};
+
+PyMODINIT_FUNC
+initbulk(void)
+{
+	PyObject * m;
+
+	DecompressorType.tp_new = PyType_GenericNew;
+	if (PyType_Ready(&DecompressorType) < 0)
+		return;
+
+	CompressorType.tp_new = PyType_GenericNew;
+	if (PyType_Ready(&CompressorType) < 0)
+		return;
+
+	RDP8DecompressorType.tp_new = PyType_GenericNew;
+	if (PyType_Ready(&RDP8DecompressorType) < 0)
+		return;
+
+	m = Py_InitModule("bulk", bulk_methods);
+	if (m == NULL)
+		return;
+
+	Py_INCREF(&DecompressorType);
+	PyModule_AddObject(m, "Decompressor", (PyObject *) &DecompressorType);
+
+	Py_INCREF(&CompressorType);
+	PyModule_AddObject(m, "Compressor", (PyObject *) &CompressorType);
+
+	Py_INCREF(&RDP8DecompressorType);
+	PyModule_AddObject(m, "RDP8Decompressor", (PyObject *) &RDP8DecompressorType);
+}
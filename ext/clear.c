@@ -0,0 +1,433 @@
+/* -*- c-basic-offset: 8 -*-
+   rdpy: Remote Desktop Protocol in Python
+   ClearCodec decoder
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+*/
+
+/* ClearCodec is described in [MS-RDPEGFX] 2.2.4.1
+   bitmap is composed of residual layer (RLE of BGR pixels), bands layer
+   (columns of pixels cached in vertical bar storages) and subcodec layer
+   (raw, NSCodec or RLEX palette pixels), each layer is drawn over previous one.
+   Small bitmaps may be kept in glyph cache */
+
+#include <stdlib.h>
+#include <string.h>
+#include "clear.h"
+#include "nsc.h"
+
+#define uint8	unsigned char
+#define uint16	unsigned short
+#define uint32	unsigned int
+
+#define CLEARCODEC_FLAG_GLYPH_INDEX	0x01
+#define CLEARCODEC_FLAG_GLYPH_HIT	0x02
+#define CLEARCODEC_FLAG_CACHE_RESET	0x04
+
+#define CLEARCODEC_SUBCODEC_UNCOMPRESSED	0x00
+#define CLEARCODEC_SUBCODEC_NSCODEC	0x01
+#define CLEARCODEC_SUBCODEC_RLEX	0x02
+
+#define CLEAR_VBAR_STORAGE_SIZE	32768
+#define CLEAR_SHORT_VBAR_STORAGE_SIZE	16384
+#define CLEAR_GLYPH_CACHE_SIZE	4000
+#define CLEAR_VBAR_MAX_HEIGHT	52
+#define CLEAR_GLYPH_MAX_PIXELS	1024
+
+/* column of 32 bits BGRA pixels */
+typedef struct
+{
+	int count;
+	uint8 pixels[CLEAR_VBAR_MAX_HEIGHT * 4];
+} clear_vbar;
+
+typedef struct
+{
+	int count;
+	uint8 * pixels;
+} clear_glyph;
+
+struct clear_context
+{
+	clear_vbar * vBars;
+	int vBarCursor;
+	clear_vbar * shortVBars;
+	int shortVBarCursor;
+	clear_glyph glyphs[CLEAR_GLYPH_CACHE_SIZE];
+};
+
+/* bounded little endian reader */
+typedef struct
+{
+	const uint8 * data;
+	int size;
+	int position;
+} clear_stream;
+
+static int
+read_uint8(clear_stream * s, uint32 * value)
+{
+	if (s->size - s->position < 1)
+		return 0;
+	*value = s->data[s->position];
+	s->position += 1;
+	return 1;
+}
+
+static int
+read_uint16(clear_stream * s, uint32 * value)
+{
+	if (s->size - s->position < 2)
+		return 0;
+	*value = s->data[s->position] | (s->data[s->position + 1] << 8);
+	s->position += 2;
+	return 1;
+}
+
+static int
+read_uint32(clear_stream * s, uint32 * value)
+{
+	if (s->size - s->position < 4)
+		return 0;
+	*value = s->data[s->position] | (s->data[s->position + 1] << 8) | (s->data[s->position + 2] << 16) | ((uint32)s->data[s->position + 3] << 24);
+	s->position += 4;
+	return 1;
+}
+
+/* run length factor is extended on 16 then 32 bits */
+static int
+read_run_length(clear_stream * s, uint32 * value)
+{
+	if (!read_uint8(s, value))
+		return 0;
+	if (*value == 0xff && !read_uint16(s, value))
+		return 0;
+	if (*value == 0xffff && !read_uint32(s, value))
+		return 0;
+	return 1;
+}
+
+/* read BGR pixel in BGRA */
+static int
+read_pixel(clear_stream * s, uint8 * pixel)
+{
+	if (s->size - s->position < 3)
+		return 0;
+	pixel[0] = s->data[s->position];
+	pixel[1] = s->data[s->position + 1];
+	pixel[2] = s->data[s->position + 2];
+	pixel[3] = 0xff;
+	s->position += 3;
+	return 1;
+}
+
+clear_context *
+clear_new(void)
+{
+	clear_context * clear = (clear_context *)calloc(1, sizeof(clear_context));
+	if (clear == NULL)
+		return NULL;
+	clear->vBars = (clear_vbar *)calloc(CLEAR_VBAR_STORAGE_SIZE, sizeof(clear_vbar));
+	clear->shortVBars = (clear_vbar *)calloc(CLEAR_SHORT_VBAR_STORAGE_SIZE, sizeof(clear_vbar));
+	if (clear->vBars == NULL || clear->shortVBars == NULL)
+	{
+		clear_free(clear);
+		return NULL;
+	}
+	return clear;
+}
+
+void
+clear_free(clear_context * clear)
+{
+	int i;
+	if (clear == NULL)
+		return;
+	for (i = 0; i < CLEAR_GLYPH_CACHE_SIZE; i++)
+		free(clear->glyphs[i].pixels);
+	free(clear->vBars);
+	free(clear->shortVBars);
+	free(clear);
+}
+
+/* RLE of BGR pixels must cover whole bitmap */
+static int
+clear_decode_residual(uint8 * output, int width, int height, clear_stream * s)
+{
+	uint32 count, pixelIndex = 0, pixelCount = width * height, i;
+	uint8 pixel[4];
+
+	while (s->position < s->size)
+	{
+		if (!read_pixel(s, pixel) || !read_run_length(s, &count))
+			return 0;
+		if (count > pixelCount - pixelIndex)
+			return 0;
+		for (i = 0; i < count; i++)
+			memcpy(output + (pixelIndex + i) * 4, pixel, 4);
+		pixelIndex += count;
+	}
+	return pixelIndex == pixelCount;
+}
+
+static int
+clear_decode_bands(clear_context * clear, uint8 * output, int width, int height, clear_stream * s)
+{
+	uint32 xStart, xEnd, yStart, yEnd, header, yOn, yOff, index, x, y, vBarHeight;
+	uint8 background[4];
+	clear_vbar * vBar, * shortVBar;
+
+	while (s->position < s->size)
+	{
+		if (!read_uint16(s, &xStart) || !read_uint16(s, &xEnd) || !read_uint16(s, &yStart) || !read_uint16(s, &yEnd) || !read_pixel(s, background))
+			return 0;
+		if (xEnd < xStart || yEnd < yStart || xEnd >= (uint32)width || yEnd >= (uint32)height)
+			return 0;
+		vBarHeight = yEnd - yStart + 1;
+		if (vBarHeight > CLEAR_VBAR_MAX_HEIGHT)
+			return 0;
+
+		for (x = xStart; x <= xEnd; x++)
+		{
+			if (!read_uint16(s, &header))
+				return 0;
+
+			if ((header & 0x8000) == 0x8000)
+			{
+				/* full vertical bar cache hit */
+				vBar = &clear->vBars[header & 0x7fff];
+			}
+			else
+			{
+				if ((header & 0xc000) == 0x4000)
+				{
+					/* short vertical bar cache hit */
+					shortVBar = &clear->shortVBars[header & 0x3fff];
+					if (!read_uint8(s, &yOn))
+						return 0;
+				}
+				else
+				{
+					/* short vertical bar cache miss, pixels from yOn to yOff */
+					yOn = header & 0xff;
+					yOff = (header >> 8) & 0x3f;
+					if (yOff < yOn || yOff - yOn > CLEAR_VBAR_MAX_HEIGHT)
+						return 0;
+					shortVBar = &clear->shortVBars[clear->shortVBarCursor];
+					clear->shortVBarCursor = (clear->shortVBarCursor + 1) % CLEAR_SHORT_VBAR_STORAGE_SIZE;
+					shortVBar->count = yOff - yOn;
+					for (y = 0; y < yOff - yOn; y++)
+						if (!read_pixel(s, shortVBar->pixels + y * 4))
+							return 0;
+				}
+				if (yOn + shortVBar->count > vBarHeight)
+					return 0;
+
+				/* full vertical bar is background around short one */
+				vBar = &clear->vBars[clear->vBarCursor];
+				clear->vBarCursor = (clear->vBarCursor + 1) % CLEAR_VBAR_STORAGE_SIZE;
+				vBar->count = vBarHeight;
+				for (y = 0; y < yOn; y++)
+					memcpy(vBar->pixels + y * 4, background, 4);
+				memcpy(vBar->pixels + yOn * 4, shortVBar->pixels, shortVBar->count * 4);
+				for (y = yOn + shortVBar->count; y < vBarHeight; y++)
+					memcpy(vBar->pixels + y * 4, background, 4);
+			}
+
+			/* cached bar may be shorter than band */
+			for (y = 0; y < vBarHeight; y++)
+			{
+				index = ((yStart + y) * width + x) * 4;
+				memcpy(output + index, (int)y < vBar->count ? vBar->pixels + y * 4 : background, 4);
+			}
+		}
+	}
+	return 1;
+}
+
+/* palette indexes runs, each run is followed by a suite of increasing indexes */
+static int
+clear_decode_rlex(uint8 * output, int stride, int width, int height, clear_stream * s)
+{
+	uint32 paletteCount, value, stopIndex, suiteDepth, startIndex, count, i, pixelIndex = 0, pixelCount = width * height;
+	uint8 palette[128 * 4];
+	int numBits;
+
+	if (!read_uint8(s, &paletteCount) || paletteCount == 0 || paletteCount > 127)
+		return 0;
+	for (i = 0; i < paletteCount; i++)
+		if (!read_pixel(s, palette + i * 4))
+			return 0;
+	for (numBits = 1; numBits < 7 && (1U << numBits) < paletteCount; numBits++);
+
+	while (s->position < s->size)
+	{
+		if (!read_uint8(s, &value) || !read_run_length(s, &count))
+			return 0;
+		stopIndex = value & ((1 << numBits) - 1);
+		suiteDepth = value >> numBits;
+		if (stopIndex >= paletteCount || suiteDepth > stopIndex)
+			return 0;
+		startIndex = stopIndex - suiteDepth;
+		if (count > pixelCount - pixelIndex || suiteDepth + 1 > pixelCount - pixelIndex - count)
+			return 0;
+		for (i = 0; i < count; i++, pixelIndex++)
+			memcpy(output + (pixelIndex / width) * stride + (pixelIndex % width) * 4, palette + startIndex * 4, 4);
+		for (i = startIndex; i <= stopIndex; i++, pixelIndex++)
+			memcpy(output + (pixelIndex / width) * stride + (pixelIndex % width) * 4, palette + i * 4, 4);
+	}
+	return pixelIndex == pixelCount;
+}
+
+static int
+clear_decode_subcodecs(uint8 * output, int width, int height, clear_stream * s)
+{
+	uint32 xStart, yStart, w, h, byteCount, codecId, x, y;
+	clear_stream bitmap;
+	uint8 * buf, * dst;
+	int rv;
+
+	while (s->position < s->size)
+	{
+		if (!read_uint16(s, &xStart) || !read_uint16(s, &yStart) || !read_uint16(s, &w) || !read_uint16(s, &h) || !read_uint32(s, &byteCount) || !read_uint8(s, &codecId))
+			return 0;
+		if (byteCount > (uint32)(s->size - s->position) || xStart + w > (uint32)width || yStart + h > (uint32)height)
+			return 0;
+		bitmap.data = s->data + s->position;
+		bitmap.size = byteCount;
+		bitmap.position = 0;
+		s->position += byteCount;
+		dst = output + (yStart * width + xStart) * 4;
+		if (w == 0 || h == 0)
+			continue;
+
+		switch (codecId)
+		{
+			case CLEARCODEC_SUBCODEC_UNCOMPRESSED:
+				if (byteCount != w * h * 3)
+					return 0;
+				for (y = 0; y < h; y++)
+					for (x = 0; x < w; x++)
+						read_pixel(&bitmap, dst + y * width * 4 + x * 4);
+				break;
+			case CLEARCODEC_SUBCODEC_NSCODEC:
+				buf = (uint8 *)malloc(w * h * 4);
+				if (buf == NULL)
+					return -1;
+				rv = nsc_decompress(buf, w, h, bitmap.data, bitmap.size);
+				if (rv == 1)
+					for (y = 0; y < h; y++)
+						for (x = 0; x < w; x++)
+						{
+							memcpy(dst + y * width * 4 + x * 4, buf + (y * w + x) * 4, 3);
+							dst[y * width * 4 + x * 4 + 3] = 0xff;
+						}
+				free(buf);
+				if (rv != 1)
+					return rv;
+				break;
+			case CLEARCODEC_SUBCODEC_RLEX:
+				if (!clear_decode_rlex(dst, width * 4, w, h, &bitmap))
+					return 0;
+				break;
+			default:
+				return 0;
+		}
+	}
+	return 1;
+}
+
+int
+clear_decompress(clear_context * clear, uint8 * output, int width, int height, const uint8 * input, int size)
+{
+	clear_stream s, layer;
+	uint32 glyphFlags, seqNumber, glyphIndex = 0, residualByteCount, bandsByteCount, subcodecByteCount;
+	uint32 pixelCount = width * height;
+	clear_glyph * glyph = NULL;
+	int rv = 1;
+
+	s.data = input;
+	s.size = size;
+	s.position = 0;
+	if (width <= 0 || height <= 0 || !read_uint8(&s, &glyphFlags) || !read_uint8(&s, &seqNumber))
+		return 0;
+
+	if (glyphFlags & CLEARCODEC_FLAG_CACHE_RESET)
+	{
+		clear->vBarCursor = 0;
+		clear->shortVBarCursor = 0;
+	}
+
+	if (glyphFlags & CLEARCODEC_FLAG_GLYPH_INDEX)
+	{
+		if (!read_uint16(&s, &glyphIndex) || glyphIndex >= CLEAR_GLYPH_CACHE_SIZE || pixelCount > CLEAR_GLYPH_MAX_PIXELS)
+			return 0;
+		glyph = &clear->glyphs[glyphIndex];
+		if (glyphFlags & CLEARCODEC_FLAG_GLYPH_HIT)
+		{
+			if (glyph->pixels == NULL || glyph->count != (int)pixelCount)
+				return 0;
+			memcpy(output, glyph->pixels, pixelCount * 4);
+			return 1;
+		}
+	}
+	else if (glyphFlags & CLEARCODEC_FLAG_GLYPH_HIT)
+		return 0;
+
+	if (!read_uint32(&s, &residualByteCount) || !read_uint32(&s, &bandsByteCount) || !read_uint32(&s, &subcodecByteCount))
+		return 0;
+
+	/* each layer is bounded by its byte count */
+	if (residualByteCount > (uint32)(s.size - s.position))
+		return 0;
+	layer.data = s.data + s.position;
+	layer.size = residualByteCount;
+	layer.position = 0;
+	s.position += residualByteCount;
+	if (residualByteCount > 0 && !clear_decode_residual(output, width, height, &layer))
+		return 0;
+
+	if (bandsByteCount > (uint32)(s.size - s.position))
+		return 0;
+	layer.data = s.data + s.position;
+	layer.size = bandsByteCount;
+	layer.position = 0;
+	s.position += bandsByteCount;
+	if (!clear_decode_bands(clear, output, width, height, &layer))
+		return 0;
+
+	if (subcodecByteCount > (uint32)(s.size - s.position))
+		return 0;
+	layer.data = s.data + s.position;
+	layer.size = subcodecByteCount;
+	layer.position = 0;
+	rv = clear_decode_subcodecs(output, width, height, &layer);
+	if (rv != 1)
+		return rv;
+
+	if (glyph != NULL)
+	{
+		if (glyph->count != (int)pixelCount)
+		{
+			free(glyph->pixels);
+			glyph->count = 0;
+			glyph->pixels = (uint8 *)malloc(pixelCount * 4);
+			if (glyph->pixels == NULL)
+				return -1;
+			glyph->count = pixelCount;
+		}
+		memcpy(glyph->pixels, output, pixelCount * 4);
+	}
+	return 1;
+}
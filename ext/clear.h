@@ -0,0 +1,35 @@
+/* -*- c-basic-offset: 8 -*-
+   rdpy: Remote Desktop Protocol in Python
+   ClearCodec decoder
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+*/
+
+#ifndef RDPY_CLEAR_H
+#define RDPY_CLEAR_H
+
+/* vertical bar caches and glyph cache kept between bitmaps */
+typedef struct clear_context clear_context;
+
+/* return NULL if out of memory */
+clear_context * clear_new(void);
+
+void clear_free(clear_context * clear);
+
+/* draw ClearCodec bitmap stream over top-down 32 bits BGRA pixels of destination
+   (pixels not covered by any layer are kept)
+   return 1 on success, 0 if stream is invalid, -1 if out of memory */
+int clear_decompress(clear_context * clear, unsigned char * output, int width, int height, const unsigned char * input, int size);
+
+#endif
@@ -0,0 +1,300 @@
+/* -*- c-basic-offset: 8 -*-
+   rdpy: Remote Desktop Protocol in Python
+   NSCodec bitmap codec
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+*/
+
+/* NSCodec is described in [MS-RDPNSC]
+   stream start with byte count of luma, orange chroma, green chroma and alpha planes,
+   color loss level and chroma subsampling flag, then planes in same order.
+   A plane is raw if its byte count is its original size, rle encoded if lower
+   and filled with 0xff if empty. With chroma subsampling luma lines are padded
+   to a multiple of 8 and chroma planes are half size in both directions.
+   Planes are top-down (unlike planar codec) */
+
+#include <stdlib.h>
+#include <string.h>
+#include "nsc.h"
+
+#define uint8	unsigned char
+
+#define CLAMP(v) ((v) < 0 ? 0 : ((v) > 255 ? 255 : (v)))
+#define ROUND_UP(v, n) (((v) + (n) - 1) / (n) * (n))
+
+#define NSC_HEADER_SIZE	20
+
+/* original size of each plane */
+static void
+nsc_plane_sizes(int width, int height, int chromaSubsampling, int * sizes)
+{
+	if (chromaSubsampling)
+	{
+		sizes[0] = ROUND_UP(width, 8) * height;
+		sizes[1] = sizes[2] = (ROUND_UP(width, 8) / 2) * (ROUND_UP(height, 2) / 2);
+	}
+	else
+		sizes[0] = sizes[1] = sizes[2] = width * height;
+	sizes[3] = width * height;
+}
+
+/* a pair of equal values start a run, followed by run length - 2
+   or 0xff and 32 bits run length. Last 4 values are always raw
+   return 1 on success, 0 if stream is invalid */
+static int
+nsc_rle_decode(uint8 * out, int originalSize, const uint8 * in, int size)
+{
+	const uint8 *end = in + size;
+	int left = originalSize;
+	unsigned int len;
+	uint8 value;
+
+	while (left > 4)
+	{
+		if (in >= end)
+			return 0;
+		value = *in++;
+		if (left == 5 || in >= end || *in != value)
+		{
+			*out++ = value;
+			left--;
+			continue;
+		}
+		if (++in >= end)
+			return 0;
+		if (*in < 0xff)
+			len = *in++ + 2;
+		else
+		{
+			if (end - in < 5)
+				return 0;
+			len = in[1] | (in[2] << 8) | (in[3] << 16) | ((unsigned int)in[4] << 24);
+			in += 5;
+		}
+		if (len > (unsigned int)left)
+			return 0;
+		memset(out, value, len);
+		out += len;
+		left -= len;
+	}
+	if (end - in < left)
+		return 0;
+	memcpy(out, in, left);
+	return 1;
+}
+
+/* return size of encoded plane or -1 if not smaller than original */
+static int
+nsc_rle_encode(uint8 * out, const uint8 * in, int originalSize)
+{
+	int left = originalSize, size = 0, run;
+
+	while (left > 4)
+	{
+		/* worst case of one step, output never exceed original size */
+		if (size + 7 + 4 >= originalSize)
+			return -1;
+		run = 1;
+		while (run < left - 4 && in[run] == in[0])
+			run++;
+		out[size++] = in[0];
+		if (run > 1)
+		{
+			out[size++] = in[0];
+			if (run <= 256)
+				out[size++] = run - 2;
+			else
+			{
+				out[size++] = 0xff;
+				out[size++] = run & 0xff;
+				out[size++] = (run >> 8) & 0xff;
+				out[size++] = (run >> 16) & 0xff;
+				out[size++] = (run >> 24) & 0xff;
+			}
+		}
+		in += run;
+		left -= run;
+	}
+	memcpy(out + size, in, left);
+	size += left;
+	return size < originalSize ? size : -1;
+}
+
+int
+nsc_decompress(uint8 * output, int width, int height, const uint8 * input, int size)
+{
+	const uint8 *in = input + NSC_HEADER_SIZE, *end = input + size;
+	uint8 *buf, *planes[4];
+	unsigned int planeSize;
+	int sizes[4], cll, cs, shift, lumaWidth, chromaWidth, plane, x, y, rv = 1;
+
+	if (width <= 0 || height <= 0 || size < NSC_HEADER_SIZE)
+		return 0;
+	cll = input[16];
+	cs = input[17];
+	if (cll < 1 || cll > 7)
+		return 0;
+	shift = cll - 1;
+	nsc_plane_sizes(width, height, cs, sizes);
+	lumaWidth = cs ? ROUND_UP(width, 8) : width;
+	chromaWidth = cs ? lumaWidth / 2 : width;
+
+	buf = (uint8 *)malloc(sizes[0] + sizes[1] + sizes[2] + sizes[3]);
+	if (buf == NULL)
+		return -1;
+	planes[0] = buf;
+	for (plane = 1; plane < 4; plane++)
+		planes[plane] = planes[plane - 1] + sizes[plane - 1];
+
+	for (plane = 0; plane < 4 && rv; plane++)
+	{
+		planeSize = input[4 * plane] | (input[4 * plane + 1] << 8) | (input[4 * plane + 2] << 16) | ((unsigned int)input[4 * plane + 3] << 24);
+		if (planeSize > (unsigned int)(end - in))
+			rv = 0;
+		else if (planeSize == 0)
+			memset(planes[plane], 0xff, sizes[plane]);
+		else if (planeSize < (unsigned int)sizes[plane])
+			rv = nsc_rle_decode(planes[plane], sizes[plane], in, planeSize);
+		else
+			memcpy(planes[plane], in, sizes[plane]);
+		in += planeSize;
+	}
+
+	if (rv)
+	{
+		for (y = 0; y < height; y++)
+		{
+			uint8 *out = output + y * width * 4;
+			const uint8 *luma = planes[0] + y * lumaWidth;
+			const uint8 *co = planes[1] + (cs ? y >> 1 : y) * chromaWidth;
+			const uint8 *cg = planes[2] + (cs ? y >> 1 : y) * chromaWidth;
+			const uint8 *alpha = planes[3] + y * width;
+			for (x = 0; x < width; x++)
+			{
+				/* subsampled chroma is shared by 2x2 pixels */
+				int c = cs ? x >> 1 : x;
+				int o = (signed char)(uint8)(co[c] << shift);
+				int g = (signed char)(uint8)(cg[c] << shift);
+				int t = luma[x] - g;
+				out[x * 4] = CLAMP(t - o);
+				out[x * 4 + 1] = CLAMP(luma[x] + g);
+				out[x * 4 + 2] = CLAMP(t + o);
+				out[x * 4 + 3] = alpha[x];
+			}
+		}
+	}
+
+	free(buf);
+	return rv;
+}
+
+int
+nsc_max_size(int width, int height)
+{
+	int sizes[4];
+	nsc_plane_sizes(width, height, 1, sizes);
+	/* subsampled luma plane is the biggest one */
+	return NSC_HEADER_SIZE + 4 * sizes[0];
+}
+
+int
+nsc_compress(uint8 * output, const uint8 * input, int width, int height, int colorLossLevel, int chromaSubsampling)
+{
+	uint8 *buf, *planes[4], *out = output + NSC_HEADER_SIZE;
+	int sizes[4], cll = colorLossLevel, cs = chromaSubsampling ? 1 : 0;
+	int lumaWidth, chromaWidth, chromaHeight, plane, x, y, n;
+
+	if (cll < 1)
+		cll = 1;
+	if (cll > 7)
+		cll = 7;
+	nsc_plane_sizes(width, height, cs, sizes);
+	lumaWidth = cs ? ROUND_UP(width, 8) : width;
+	chromaWidth = cs ? lumaWidth / 2 : width;
+	chromaHeight = cs ? ROUND_UP(height, 2) / 2 : height;
+
+	buf = (uint8 *)malloc(sizes[0] + sizes[1] + sizes[2] + sizes[3]);
+	if (buf == NULL)
+		return -1;
+	planes[0] = buf;
+	for (plane = 1; plane < 4; plane++)
+		planes[plane] = planes[plane - 1] + sizes[plane - 1];
+
+	/* luma and alpha, padding repeat last column */
+	for (y = 0; y < height; y++)
+	{
+		const uint8 *src = input + y * width * 4;
+		uint8 *luma = planes[0] + y * lumaWidth, *alpha = planes[3] + y * width;
+		for (x = 0; x < width; x++)
+		{
+			luma[x] = (uint8)((src[x * 4 + 2] + 2 * src[x * 4 + 1] + src[x * 4]) >> 2);
+			alpha[x] = src[x * 4 + 3];
+		}
+		for (; x < lumaWidth; x++)
+			luma[x] = luma[width - 1];
+	}
+
+	/* chroma is averaged on 2x2 blocks, borders are repeated */
+	for (y = 0; y < chromaHeight; y++)
+	{
+		uint8 *co = planes[1] + y * chromaWidth, *cg = planes[2] + y * chromaWidth;
+		if (!cs)
+		{
+			const uint8 *src = input + y * width * 4;
+			for (x = 0; x < width; x++)
+			{
+				int r = src[x * 4 + 2], g = src[x * 4 + 1], b = src[x * 4];
+				co[x] = (uint8)((r - b) >> cll);
+				cg[x] = (uint8)((2 * g - r - b) >> (cll + 1));
+			}
+			continue;
+		}
+		for (x = 0; x < chromaWidth; x++)
+		{
+			int dx, dy, sumCo = 0, sumCg = 0;
+			for (dy = 0; dy < 2; dy++)
+				for (dx = 0; dx < 2; dx++)
+				{
+					int px = 2 * x + dx < width ? 2 * x + dx : width - 1;
+					int py = 2 * y + dy < height ? 2 * y + dy : height - 1;
+					const uint8 *src = input + (py * width + px) * 4;
+					sumCo += src[2] - src[0];
+					sumCg += 2 * src[1] - src[2] - src[0];
+				}
+			co[x] = (uint8)(sumCo >> (cll + 2));
+			cg[x] = (uint8)(sumCg >> (cll + 3));
+		}
+	}
+
+	for (plane = 0; plane < 4; plane++)
+	{
+		n = nsc_rle_encode(out, planes[plane], sizes[plane]);
+		if (n < 0)
+		{
+			memcpy(out, planes[plane], sizes[plane]);
+			n = sizes[plane];
+		}
+		output[4 * plane] = n & 0xff;
+		output[4 * plane + 1] = (n >> 8) & 0xff;
+		output[4 * plane + 2] = (n >> 16) & 0xff;
+		output[4 * plane + 3] = (n >> 24) & 0xff;
+		out += n;
+	}
+	output[16] = cll;
+	output[17] = cs;
+	output[18] = output[19] = 0;
+
+	free(buf);
+	return (int)(out - output);
+}
@@ -0,0 +1,34 @@
+/* -*- c-basic-offset: 8 -*-
+   rdpy: Remote Desktop Protocol in Python
+   NSCodec bitmap codec
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+*/
+
+#ifndef RDPY_NSC_H
+#define RDPY_NSC_H
+
+/* decode NSCodec bitmap stream in top-down 32 bits BGRA pixels
+   return 1 on success, 0 if stream is invalid, -1 if out of memory */
+int nsc_decompress(unsigned char * output, int width, int height, const unsigned char * input, int size);
+
+/* max size of nsc_compress output */
+int nsc_max_size(int width, int height);
+
+/* encode top-down 32 bits BGRA pixels, color loss level from 1 to 7
+   chroma planes are subsampled by 2x2 blocks if chromaSubsampling is set
+   return size of output or -1 if out of memory */
+int nsc_compress(unsigned char * output, const unsigned char * input, int width, int height, int colorLossLevel, int chromaSubsampling);
+
+#endif
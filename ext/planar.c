@@ -0,0 +1,350 @@
+/* -*- c-basic-offset: 8 -*-
+   rdpy: Remote Desktop Protocol in Python
+   RDP 6.0 planar bitmap codec
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+*/
+
+/* Planar codec is described in [MS-RDPEGDI] 2.2.2.5.1 and 3.1.9
+   planes are stored bottom-up (first line of stream is last line of image)
+   in order alpha (unless NA), then red green blue or luma orange-chroma green-chroma
+   when color loss level is set. RGB planes are decoded straight into output,
+   YCoCg planes are decoded in contiguous buffers and converted in one branchless pass */
+
+#include <stdlib.h>
+#include <string.h>
+#include "planar.h"
+
+#define uint8	unsigned char
+
+#define CLAMP(v) ((v) < 0 ? 0 : ((v) > 255 ? 255 : (v)))
+
+/* decode one plane, rle or raw, in a buffer where consecutive values are step bytes apart
+   and consecutive stream lines are lineStep bytes apart
+   rle plane first line is raw, next ones are signed deltas with previous line
+   a repeat count of 1 or 2 is the high nibble of a long run
+   return number of bytes read or -1 if stream is invalid */
+static int
+planar_plane_decode(uint8 * plane, int step, int lineStep, int width, int height, int rle, const uint8 * input, int size)
+{
+	const uint8 *in = input, *end = input + size;
+	int x, y, collen, replen, colour;
+
+	if (!rle)
+	{
+		if (size < width * height)
+			return -1;
+		for (y = 0; y < height; y++)
+		{
+			uint8 *line = plane + y * lineStep;
+			for (x = 0; x < width; x++)
+				line[x * step] = in[x];
+			in += width;
+		}
+		return width * height;
+	}
+
+	for (y = 0; y < height; y++)
+	{
+		uint8 *line = plane + y * lineStep;
+		const uint8 *prev = y ? line - lineStep : NULL;
+		colour = 0;
+		x = 0;
+		while (x < width)
+		{
+			if (in >= end)
+				return -1;
+			replen = *in & 0xf;
+			collen = *in >> 4;
+			in++;
+			if (replen == 1 || replen == 2)
+			{
+				replen = (replen << 4) | collen;
+				collen = 0;
+			}
+			if (x + collen + replen > width || in + collen > end)
+				return -1;
+
+			if (prev == NULL)
+			{
+				for (; collen > 0; collen--, x++)
+					colour = line[x * step] = *in++;
+				for (; replen > 0; replen--, x++)
+					line[x * step] = colour;
+			}
+			else
+			{
+				for (; collen > 0; collen--, x++)
+				{
+					/* sign is in lowest bit */
+					colour = (*in >> 1) ^ -(*in & 1);
+					in++;
+					line[x * step] = (uint8)(prev[x * step] + colour);
+				}
+				for (; replen > 0; replen--, x++)
+					line[x * step] = (uint8)(prev[x * step] + colour);
+			}
+		}
+	}
+	return (int)(in - input);
+}
+
+/* encode one line of rle plane (raw values or delta codes)
+   repeat count is 0 or 3 to 15, longer runs use the long form */
+static uint8 *
+planar_rle_line(uint8 * out, const uint8 * values, int width)
+{
+	int i = 0, collen, replen;
+	uint8 colour = 0;
+
+	while (i < width)
+	{
+		replen = 0;
+		while (i + replen < width && replen < 47 && values[i + replen] == colour)
+			replen++;
+		if (replen >= 16)
+		{
+			*out++ = ((replen & 0xf) << 4) | (replen >> 4);
+			i += replen;
+			continue;
+		}
+		if (replen >= 3)
+		{
+			*out++ = replen;
+			i += replen;
+			continue;
+		}
+
+		collen = 1;
+		while (collen < 15 && i + collen < width)
+		{
+			int k = i + collen;
+			if (k + 2 < width && values[k] == values[k - 1] && values[k + 1] == values[k - 1] && values[k + 2] == values[k - 1])
+				break;
+			collen++;
+		}
+		colour = values[i + collen - 1];
+		replen = 0;
+		while (i + collen + replen < width && replen < 15 && values[i + collen + replen] == colour)
+			replen++;
+		if (replen < 3)
+			replen = 0;
+		*out++ = (collen << 4) | replen;
+		memcpy(out, values + i, collen);
+		out += collen;
+		i += collen + replen;
+	}
+	return out;
+}
+
+/* encode a whole plane, values is a scratch line */
+static uint8 *
+planar_rle_encode(uint8 * out, const uint8 * plane, int width, int height, uint8 * values)
+{
+	int x, y;
+
+	for (y = 0; y < height; y++)
+	{
+		const uint8 *line = plane + y * width;
+		if (y == 0)
+			memcpy(values, line, width);
+		else
+		{
+			for (x = 0; x < width; x++)
+			{
+				int delta = (signed char)(uint8)(line[x] - line[x - width]);
+				values[x] = (uint8)((delta << 1) ^ -(delta < 0));
+			}
+		}
+		out = planar_rle_line(out, values, width);
+	}
+	return out;
+}
+
+int
+planar_decompress(uint8 * output, int width, int height, const uint8 * input, int size)
+{
+	const uint8 *in = input + 1, *end = input + size;
+	uint8 *buf = NULL, *planes[4];
+	int header, cll, cs, rle, na, sw, sh, plane, x, y, rv = 1;
+	int total = width * height;
+
+	if (size < 1)
+		return 0;
+	header = input[0];
+	cll = header & PLANAR_CLL_MASK;
+	cs = header & PLANAR_CS;
+	rle = header & PLANAR_RLE;
+	na = header & PLANAR_NA;
+	/* chroma subsampling only apply on YCoCg */
+	if (cs && !cll)
+		return 0;
+	sw = cs ? (width + 1) / 2 : width;
+	sh = cs ? (height + 1) / 2 : height;
+
+	if (cll)
+	{
+		/* YCoCg planes are decoded apart then converted */
+		buf = (uint8 *)malloc(2 * total + 2 * sw * sh + 1);
+		if (buf == NULL)
+			return -1;
+		planes[1] = buf;
+		planes[2] = buf + total;
+		planes[3] = planes[2] + sw * sh;
+	}
+
+	for (plane = na ? 1 : 0; plane < 4 && rv; plane++)
+	{
+		int pw = plane < 2 ? width : sw, ph = plane < 2 ? height : sh, n;
+		if (cll && plane != 0)
+			n = planar_plane_decode(planes[plane], 1, pw, pw, ph, rle, in, (int)(end - in));
+		else
+			/* alpha, red, green, blue directly in bottom-up output */
+			n = planar_plane_decode(output + (height - 1) * width * 4 + 3 - plane, 4, -width * 4, width, height, rle, in, (int)(end - in));
+		if (n < 0)
+			rv = 0;
+		else
+			in += n;
+	}
+	/* raw planes are followed by a pad byte */
+	if (rv && (rle ? in != end : end - in > 1))
+		rv = 0;
+
+	if (rv && cll)
+	{
+		int shift = cll - 1;
+		for (y = 0; y < height; y++)
+		{
+			uint8 *out = output + (height - 1 - y) * width * 4;
+			const uint8 *luma = planes[1] + y * width;
+			const uint8 *co = planes[2] + (y >> (cs ? 1 : 0)) * sw;
+			const uint8 *cg = planes[3] + (y >> (cs ? 1 : 0)) * sw;
+			for (x = 0; x < width; x++)
+			{
+				/* subsampled chroma is shared by 2x2 pixels */
+				int c = cs ? x >> 1 : x;
+				int o = (signed char)(uint8)(co[c] << shift);
+				int g = (signed char)(uint8)(cg[c] << shift);
+				int t = luma[x] - g;
+				out[x * 4] = CLAMP(t - o);
+				out[x * 4 + 1] = CLAMP(luma[x] + g);
+				out[x * 4 + 2] = CLAMP(t + o);
+			}
+		}
+	}
+	if (rv && na)
+	{
+		for (x = 0; x < total; x++)
+			output[x * 4 + 3] = 0xff;
+	}
+
+	free(buf);
+	return rv;
+}
+
+int
+planar_max_size(int width, int height)
+{
+	/* header, four planes where each line may grow by one control byte every 15 values, pad */
+	return 2 + 4 * height * (width + width / 15 + 1);
+}
+
+int
+planar_compress(uint8 * output, const uint8 * input, int width, int height, int flags)
+{
+	uint8 *out = output, *buf, *alpha, *p1, *p2, *p3, *sub2, *sub3, *values;
+	int cll = flags & PLANAR_CLL_MASK, cs, rle = flags & PLANAR_RLE, na = flags & PLANAR_NA;
+	int sw, sh, plane, x, y, total = width * height;
+
+	cs = cll ? flags & PLANAR_CS : 0;
+	sw = cs ? (width + 1) / 2 : width;
+	sh = cs ? (height + 1) / 2 : height;
+
+	buf = (uint8 *)malloc(4 * total + 2 * sw * sh + width + 1);
+	if (buf == NULL)
+		return -1;
+	alpha = buf;
+	p1 = alpha + total;
+	p2 = p1 + total;
+	p3 = p2 + total;
+	sub2 = cs ? p3 + total : p2;
+	sub3 = cs ? sub2 + sw * sh : p3;
+	values = (cs ? sub3 + sw * sh : p3 + total);
+
+	/* split in planes, stream is bottom-up */
+	for (y = 0; y < height; y++)
+	{
+		const uint8 *src = input + (height - 1 - y) * width * 4;
+		int i = y * width;
+		if (cll)
+		{
+			for (x = 0; x < width; x++, i++)
+			{
+				int b = src[x * 4], g = src[x * 4 + 1], r = src[x * 4 + 2];
+				p1[i] = (uint8)((r + 2 * g + b) >> 2);
+				p2[i] = (uint8)((r - b) >> cll);
+				p3[i] = (uint8)((2 * g - r - b) >> (cll + 1));
+				alpha[i] = src[x * 4 + 3];
+			}
+		}
+		else
+		{
+			for (x = 0; x < width; x++, i++)
+			{
+				p3[i] = src[x * 4];
+				p2[i] = src[x * 4 + 1];
+				p1[i] = src[x * 4 + 2];
+				alpha[i] = src[x * 4 + 3];
+			}
+		}
+	}
+
+	/* chroma is averaged on 2x2 blocks */
+	if (cs)
+	{
+		for (y = 0; y < sh; y++)
+			for (x = 0; x < sw; x++)
+			{
+				int dx, dy, count = 0, co = 0, cg = 0;
+				for (dy = 0; dy < 2 && 2 * y + dy < height; dy++)
+					for (dx = 0; dx < 2 && 2 * x + dx < width; dx++)
+					{
+						co += (signed char)p2[(2 * y + dy) * width + 2 * x + dx];
+						cg += (signed char)p3[(2 * y + dy) * width + 2 * x + dx];
+						count++;
+					}
+				sub2[y * sw + x] = (uint8)(co / count);
+				sub3[y * sw + x] = (uint8)(cg / count);
+			}
+	}
+
+	*out++ = cll | cs | rle | na;
+	for (plane = na ? 1 : 0; plane < 4; plane++)
+	{
+		const uint8 *src = plane == 0 ? alpha : (plane == 1 ? p1 : (plane == 2 ? sub2 : sub3));
+		int pw = plane < 2 ? width : sw, ph = plane < 2 ? height : sh;
+		if (rle)
+			out = planar_rle_encode(out, src, pw, ph, values);
+		else
+		{
+			memcpy(out, src, pw * ph);
+			out += pw * ph;
+		}
+	}
+	if (!rle)
+		*out++ = 0;
+
+	free(buf);
+	return (int)(out - output);
+}
@@ -0,0 +1,39 @@
+/* -*- c-basic-offset: 8 -*-
+   rdpy: Remote Desktop Protocol in Python
+   RDP 6.0 planar bitmap codec
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+*/
+
+#ifndef RDPY_PLANAR_H
+#define RDPY_PLANAR_H
+
+/* format header, [MS-RDPEGDI] 2.2.2.5.1 */
+#define PLANAR_CLL_MASK	0x07
+#define PLANAR_CS	0x08
+#define PLANAR_RLE	0x10
+#define PLANAR_NA	0x20
+
+/* decode planar bitmap in top-down 32 bits BGRA pixels
+   return 1 on success, 0 if stream is invalid, -1 if out of memory */
+int planar_decompress(unsigned char * output, int width, int height, const unsigned char * input, int size);
+
+/* max size of planar_compress output */
+int planar_max_size(int width, int height);
+
+/* encode top-down 32 bits BGRA pixels with format header flags
+   return size of output or -1 if out of memory */
+int planar_compress(unsigned char * output, const unsigned char * input, int width, int height, int flags);
+
+#endif
@@ -0,0 +1,367 @@
+/* -*- c-basic-offset: 8 -*-
+   rdpy: Remote Desktop Protocol in Python
+   RemoteFX tile decoder
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+*/
+
+/* RemoteFX codec is described in [MS-RDPRFX] 3.1.8
+   each component of tile is RLGR entropy decoded, LL3 band is differential decoded,
+   bands are dequantized and a 3 levels inverse DWT (5/3 lifting) is applied.
+   Components are then converted from YCbCr (11.5 fixed point) to RGB.
+   Each tile use only its own stack buffers so tiles can be decoded in parallel */
+
+#include <string.h>
+#include "rfx.h"
+
+#define uint8	unsigned char
+
+/* RLGR constants, [MS-RDPRFX] 3.1.8.1.7.1 */
+#define KPMAX	80
+#define LSGR	3
+#define UP_GR	4
+#define DN_GR	6
+#define UQ_GR	3
+#define DQ_GR	3
+
+#define UPDATE_PARAM(param, delta, k) \
+{ \
+	param += delta; \
+	if (param > KPMAX) \
+		param = KPMAX; \
+	if (param < 0) \
+		param = 0; \
+	k = param >> LSGR; \
+}
+
+#define TILE_PIXELS	(RFX_TILE_SIZE * RFX_TILE_SIZE)
+
+/* bit stream, most significant bit first */
+typedef struct
+{
+	const uint8 *data;
+	int size;
+	int bits;
+	int pos;
+} bit_stream;
+
+/* number of leading zero bits of non zero 32 bits value */
+#ifdef __GNUC__
+#define CLZ(v) __builtin_clz(v)
+#else
+static int
+CLZ(unsigned int v)
+{
+	int n = 0;
+	while (!(v & 0x80000000))
+	{
+		v <<= 1;
+		n++;
+	}
+	return n;
+}
+#endif
+
+/* next 32 bits of stream, missing bits are read as zero */
+static unsigned int
+peek_bits(bit_stream * bs)
+{
+	int byte = bs->pos >> 3, i;
+	unsigned long long window = 0;
+
+	if (byte + 5 <= bs->size)
+		window = ((unsigned long long)bs->data[byte] << 32) | ((unsigned long long)bs->data[byte + 1] << 24)
+			| ((unsigned long long)bs->data[byte + 2] << 16) | ((unsigned long long)bs->data[byte + 3] << 8) | bs->data[byte + 4];
+	else
+		for (i = 0; i < 5; i++)
+			window = (window << 8) | (byte + i < bs->size ? bs->data[byte + i] : 0);
+	return (unsigned int)(window >> (8 - (bs->pos & 7)));
+}
+
+/* read count bits (at most 32) */
+static unsigned int
+get_bits(bit_stream * bs, int count)
+{
+	unsigned int value;
+	if (!count)
+		return 0;
+	value = peek_bits(bs) >> (32 - count);
+	bs->pos += count;
+	return value;
+}
+
+/* count and skip consecutive 1 bits, following 0 bit is consumed */
+static unsigned int
+count_ones(bit_stream * bs)
+{
+	unsigned int run = 0, window;
+	int n;
+	while (bs->pos < bs->bits)
+	{
+		window = ~peek_bits(bs);
+		if (window)
+		{
+			n = CLZ(window);
+			bs->pos += n + 1;
+			return run + n;
+		}
+		run += 32;
+		bs->pos += 32;
+	}
+	return run;
+}
+
+/* Golomb-Rice code with adaptive parameter kr */
+static unsigned int
+get_gr_code(bit_stream * bs, int * krp, int * kr)
+{
+	unsigned int vk, mag;
+
+	/* unary prefix of 1 bits */
+	vk = count_ones(bs);
+	mag = get_bits(bs, *kr) | (vk << *kr);
+
+	if (!vk)
+	{
+		*krp -= 2;
+		if (*krp < 0)
+			*krp = 0;
+	}
+	else if (vk != 1)
+	{
+		*krp += vk;
+		if (*krp > KPMAX)
+			*krp = KPMAX;
+	}
+	*kr = *krp >> LSGR;
+	return mag;
+}
+
+/* magnitude with sign in lowest bit */
+static short
+from_2mag_sign(unsigned int value)
+{
+	return (short)((value & 1) ? -(int)((value + 1) >> 1) : (int)(value >> 1));
+}
+
+static void
+rlgr_decode(const uint8 * data, int size, short * out, int count, int rlgr3)
+{
+	bit_stream bs = {data, size, size * 8, 0};
+	int k = 1, kp = 1 << LSGR, kr = 1, krp = 1 << LSGR, i = 0;
+	unsigned int mag;
+
+	memset(out, 0, count * sizeof(short));
+	while (bs.pos < bs.bits && i < count)
+	{
+		if (k)
+		{
+			/* run length mode, each 0 bit is a run of 1 << k zeros */
+			unsigned int window = peek_bits(&bs);
+			int zeros = window ? CLZ(window) : 32;
+			if (bs.pos + zeros > bs.bits)
+				zeros = bs.bits - bs.pos;
+			bs.pos += zeros;
+			for (; zeros > 0 && i < count; zeros--)
+			{
+				i += 1 << k;
+				UPDATE_PARAM(kp, UP_GR, k);
+			}
+			if (bs.pos >= bs.bits || i >= count)
+				break;
+			/* run continue in next window */
+			if (!window)
+				continue;
+			/* terminating 1 bit */
+			bs.pos++;
+			i += get_bits(&bs, k);
+			/* sign then magnitude - 1 of non zero value */
+			mag = get_bits(&bs, 1);
+			if (i < count)
+				out[i++] = mag ? -(short)(get_gr_code(&bs, &krp, &kr) + 1) : (short)(get_gr_code(&bs, &krp, &kr) + 1);
+			UPDATE_PARAM(kp, -DN_GR, k);
+		}
+		else if (rlgr3)
+		{
+			/* two values coded in one code */
+			unsigned int val1, val2, bits = 0;
+			mag = get_gr_code(&bs, &krp, &kr);
+			for (val1 = mag; val1; val1 >>= 1)
+				bits++;
+			val1 = get_bits(&bs, bits);
+			val2 = mag - val1;
+			if (val1 && val2)
+				UPDATE_PARAM(kp, -2 * DQ_GR, k)
+			else if (!val1 && !val2)
+				UPDATE_PARAM(kp, 2 * UQ_GR, k)
+			out[i++] = from_2mag_sign(val1);
+			if (i < count)
+				out[i++] = from_2mag_sign(val2);
+		}
+		else
+		{
+			mag = get_gr_code(&bs, &krp, &kr);
+			if (!mag)
+			{
+				out[i++] = 0;
+				UPDATE_PARAM(kp, UQ_GR, k);
+			}
+			else
+			{
+				out[i++] = from_2mag_sign(mag);
+				UPDATE_PARAM(kp, -DQ_GR, k);
+			}
+		}
+	}
+}
+
+static void
+dequantize_band(short * band, int count, int quant)
+{
+	int i, shift = quant - 1;
+	if (shift <= 0)
+		return;
+	for (i = 0; i < count; i++)
+		band[i] = (short)(band[i] << shift);
+}
+
+/* bands are stored HL1 LH1 HH1 HL2 LH2 HH2 HL3 LH3 HH3 LL3
+   quant values are LL3 LH3 HL3 HH3 LH2 HL2 HH2 LH1 HL1 HH1 (4 bits each, low nibble first) */
+static void
+dequantize(short * buffer, const uint8 * quant)
+{
+	int q[10], i;
+	for (i = 0; i < 5; i++)
+	{
+		q[2 * i] = quant[i] & 0xf;
+		q[2 * i + 1] = quant[i] >> 4;
+	}
+	dequantize_band(buffer, 1024, q[8]);
+	dequantize_band(buffer + 1024, 1024, q[7]);
+	dequantize_band(buffer + 2048, 1024, q[9]);
+	dequantize_band(buffer + 3072, 256, q[5]);
+	dequantize_band(buffer + 3328, 256, q[4]);
+	dequantize_band(buffer + 3584, 256, q[6]);
+	dequantize_band(buffer + 3840, 64, q[2]);
+	dequantize_band(buffer + 3904, 64, q[1]);
+	dequantize_band(buffer + 3968, 64, q[3]);
+	dequantize_band(buffer + 4032, 64, q[0]);
+}
+
+/* one level of inverse DWT, sub-bands HL LH HH LL of width w are replaced by 2w x 2w block */
+static void
+idwt_block(short * buffer, short * idwt, int w)
+{
+	int x, y, n, total = w << 1;
+	const short *ll, *hl, *lh, *hh;
+	short *l, *h, *dst;
+
+	/* horizontal pass, L uses LL and HL, H uses LH and HH */
+	for (y = 0; y < w; y++)
+	{
+		hl = buffer + y * w;
+		lh = buffer + w * w + y * w;
+		hh = buffer + 2 * w * w + y * w;
+		ll = buffer + 3 * w * w + y * w;
+		l = idwt + y * total;
+		h = idwt + w * total + y * total;
+
+		/* even coefficients */
+		l[0] = ll[0] - ((hl[0] + hl[0] + 1) >> 1);
+		h[0] = lh[0] - ((hh[0] + hh[0] + 1) >> 1);
+		for (n = 1; n < w; n++)
+		{
+			l[2 * n] = ll[n] - ((hl[n - 1] + hl[n] + 1) >> 1);
+			h[2 * n] = lh[n] - ((hh[n - 1] + hh[n] + 1) >> 1);
+		}
+		/* odd coefficients */
+		for (n = 0; n < w - 1; n++)
+		{
+			l[2 * n + 1] = (hl[n] << 1) + ((l[2 * n] + l[2 * n + 2]) >> 1);
+			h[2 * n + 1] = (hh[n] << 1) + ((h[2 * n] + h[2 * n + 2]) >> 1);
+		}
+		l[2 * n + 1] = (hl[n] << 1) + l[2 * n];
+		h[2 * n + 1] = (hh[n] << 1) + h[2 * n];
+	}
+
+	/* vertical pass, result in original buffer */
+	for (x = 0; x < total; x++)
+	{
+		l = idwt + x;
+		h = idwt + w * total + x;
+		dst = buffer + x;
+
+		dst[0] = l[0] - ((h[0] * 2 + 1) >> 1);
+		for (n = 1; n < w; n++)
+		{
+			l += total;
+			h += total;
+			/* even then odd coefficients */
+			dst[2 * total] = l[0] - ((h[-total] + h[0] + 1) >> 1);
+			dst[total] = (h[-total] << 1) + ((dst[0] + dst[2 * total]) >> 1);
+			dst += 2 * total;
+		}
+		dst[total] = (h[0] << 1) + dst[0];
+	}
+}
+
+static void
+decode_component(const uint8 * data, int size, const uint8 * quant, short * buffer, int rlgr3)
+{
+	short idwt[TILE_PIXELS];
+	int i;
+
+	rlgr_decode(data, size, buffer, TILE_PIXELS, rlgr3);
+	/* LL3 band is differential coded */
+	for (i = 4033; i < TILE_PIXELS; i++)
+		buffer[i] += buffer[i - 1];
+	dequantize(buffer, quant);
+	idwt_block(buffer + 3840, idwt, 8);
+	idwt_block(buffer + 3072, idwt, 16);
+	idwt_block(buffer, idwt, 32);
+}
+
+#define CLAMP(v) ((v) < 0 ? 0 : ((v) > 255 ? 255 : (v)))
+
+int
+rfx_decode_tile(uint8 * output, int stride,
+		const uint8 * yData, int yLen, const uint8 * cbData, int cbLen, const uint8 * crData, int crLen,
+		const uint8 * quantY, const uint8 * quantCb, const uint8 * quantCr, int rlgr3)
+{
+	short y[TILE_PIXELS], cb[TILE_PIXELS], cr[TILE_PIXELS];
+	int row, x;
+
+	decode_component(yData, yLen, quantY, y, rlgr3);
+	decode_component(cbData, cbLen, quantCb, cb, rlgr3);
+	decode_component(crData, crLen, quantCr, cr, rlgr3);
+
+	/* ICT color conversion on 11.5 fixed point values, 16 bits of precision for factors */
+	for (row = 0; row < RFX_TILE_SIZE; row++)
+	{
+		uint8 *out = output + row * stride;
+		const short *py = y + row * RFX_TILE_SIZE, *pcb = cb + row * RFX_TILE_SIZE, *pcr = cr + row * RFX_TILE_SIZE;
+		for (x = 0; x < RFX_TILE_SIZE; x++)
+		{
+			int luma = (py[x] + 4096) << 16;
+			int r = ((luma + pcr[x] * 91915) >> 16) >> 5;
+			int g = ((luma - pcb[x] * 22526 - pcr[x] * 46818) >> 16) >> 5;
+			int b = ((luma + pcb[x] * 115992) >> 16) >> 5;
+			out[x * 4] = CLAMP(b);
+			out[x * 4 + 1] = CLAMP(g);
+			out[x * 4 + 2] = CLAMP(r);
+			out[x * 4 + 3] = 0xff;
+		}
+	}
+	return 1;
+}
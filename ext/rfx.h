@@ -0,0 +1,32 @@
+/* -*- c-basic-offset: 8 -*-
+   rdpy: Remote Desktop Protocol in Python
+   RemoteFX tile decoder
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+*/
+
+#ifndef RDPY_RFX_H
+#define RDPY_RFX_H
+
+#define RFX_TILE_SIZE	64
+
+/* decode one 64x64 tile in top-down 32 bits BGRX pixels (stride bytes per line)
+   quant are the 5 bytes of TS_RFX_CODEC_QUANT of each component
+   rlgr3 select RLGR3 entropy instead of RLGR1
+   only stack buffers are used so tiles can be decoded in parallel, return 1 */
+int rfx_decode_tile(unsigned char * output, int stride,
+		const unsigned char * yData, int yLen, const unsigned char * cbData, int cbLen, const unsigned char * crData, int crLen,
+		const unsigned char * quantY, const unsigned char * quantCb, const unsigned char * quantCr, int rlgr3);
+
+#endif
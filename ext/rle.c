@@ -25,6 +25,10 @@
 /* *INDENT-OFF* */
 
 #include <Python.h>
+#include "planar.h"
+#include "rfx.h"
+#include "nsc.h"
+#include "clear.h"
 
 /* Specific rename for RDPY integration */
 #define uint8	unsigned char
@@ -755,138 +759,11 @@ bitmap_decompress3(uint8 * output, int width, int height, uint8 * input, int siz
 	return True;
 }
 
-/* decompress a colour plane */
-static int
-process_plane(uint8 * in, int width, int height, uint8 * out, int size)
-{
-	int indexw;
-	int indexh;
-	int code;
-	int collen;
-	int replen;
-	int color;
-	int x;
-	int revcode;
-	uint8 * last_line;
-	uint8 * this_line;
-	uint8 * org_in;
-	uint8 * org_out;
-
-	org_in = in;
-	org_out = out;
-	last_line = 0;
-	indexh = 0;
-	while (indexh < height)
-	{
-		out = (org_out + width * height * 4) - ((indexh + 1) * width * 4);
-		color = 0;
-		this_line = out;
-		indexw = 0;
-		if (last_line == 0)
-		{
-			while (indexw < width)
-			{
-				code = CVAL(in);
-				replen = code & 0xf;
-				collen = (code >> 4) & 0xf;
-				revcode = (replen << 4) | collen;
-				if ((revcode <= 47) && (revcode >= 16))
-				{
-					replen = revcode;
-					collen = 0;
-				}
-				while (collen > 0)
-				{
-					color = CVAL(in);
-					*out = color;
-					out += 4;
-					indexw++;
-					collen--;
-				}
-				while (replen > 0)
-				{
-					*out = color;
-					out += 4;
-					indexw++;
-					replen--;
-				}
-			}
-		}
-		else
-		{
-			while (indexw < width)
-			{
-				code = CVAL(in);
-				replen = code & 0xf;
-				collen = (code >> 4) & 0xf;
-				revcode = (replen << 4) | collen;
-				if ((revcode <= 47) && (revcode >= 16))
-				{
-					replen = revcode;
-					collen = 0;
-				}
-				while (collen > 0)
-				{
-					x = CVAL(in);
-					if (x & 1)
-					{
-						x = x >> 1;
-						x = x + 1;
-						color = -x;
-					}
-					else
-					{
-						x = x >> 1;
-						color = x;
-					}
-					x = last_line[indexw * 4] + color;
-					*out = x;
-					out += 4;
-					indexw++;
-					collen--;
-				}
-				while (replen > 0)
-				{
-					x = last_line[indexw * 4] + color;
-					*out = x;
-					out += 4;
-					indexw++;
-					replen--;
-				}
-			}
-		}
-		indexh++;
-		last_line = this_line;
-	}
-	return (int) (in - org_in);
-}
-
-/* 4 byte bitmap decompress */
+/* 4 byte bitmap use RDP 6.0 planar codec */
 static RD_BOOL
 bitmap_decompress4(uint8 * output, int width, int height, uint8 * input, int size)
 {
-	int code;
-	int bytes_pro;
-	int total_pro;
-
-	code = CVAL(input);
-	if (code != 0x10)
-	{
-		return False;
-	}
-	total_pro = 1;
-	bytes_pro = process_plane(input, width, height, output + 3, size - total_pro);
-	total_pro += bytes_pro;
-	input += bytes_pro;
-	bytes_pro = process_plane(input, width, height, output + 2, size - total_pro);
-	total_pro += bytes_pro;
-	input += bytes_pro;
-	bytes_pro = process_plane(input, width, height, output + 1, size - total_pro);
-	total_pro += bytes_pro;
-	input += bytes_pro;
-	bytes_pro = process_plane(input, width, height, output + 0, size - total_pro);
-	total_pro += bytes_pro;
-	return size == total_pro;
+	return planar_decompress(output, width, height, input, size) == 1;
 }
 
 /* main decompress function */
@@ -923,25 +800,774 @@ bitmap_decompress_wrapper(PyObject* self, PyObject* args)
 {
 	Py_buffer output, input;
 	int width = 0, height = 0, bpp = 0;
+	RD_BOOL rv;
 
-	if (!PyArg_ParseTuple(args, "s*iis*i", &output, &width, &height, &input, &bpp))
+	if (!PyArg_ParseTuple(args, "w*iis*i", &output, &width, &height, &input, &bpp))
 		return NULL;
 
-	if(bitmap_decompress((uint8*)output.buf, width, height, (uint8*)input.buf, input.len, bpp) == False)
+	/* decoder doesn't check output bounds */
+	if (width < 0 || height < 0 || bpp < 1 || bpp > 4 || output.len < (Py_ssize_t)width * height * bpp)
+	{
+		PyBuffer_Release(&output);
+		PyBuffer_Release(&input);
+		PyErr_SetString(PyExc_ValueError, "output buffer too small for bitmap");
 		return NULL;
+	}
+
+	/* buffers are locked by Py_buffer, other threads can run during decompression */
+	Py_BEGIN_ALLOW_THREADS
+	rv = bitmap_decompress((uint8*)output.buf, width, height, (uint8*)input.buf, input.len, bpp);
+	Py_END_ALLOW_THREADS
+
+	PyBuffer_Release(&output);
+	PyBuffer_Release(&input);
+
+	if (rv == False)
+	{
+		PyErr_SetString(PyExc_ValueError, "invalid rle bitmap");
+		return NULL;
+	}
 
 	Py_RETURN_NONE;
 }
  
+/* tile of bitmap update, data is owned by rects tuple */
+typedef struct
+{
+	int left, top, right, bottom;
+	int width, height;
+	int compressed;
+	const char* data;
+	/* filled by "s#" which writes an int without PY_SSIZE_T_CLEAN */
+	int size;
+	/* clipped area, result of decoding */
+	int x, y, w, h;
+	int valid;
+} bitmap_rect;
+
+/* decode one tile into its position in surface (top-down, stride bytes per row) */
+static RD_BOOL
+bitmap_write_rect(uint8* surface, int stride, int surfaceHeight, int Bpp, bitmap_rect* rect, uint8* scratch)
+{
+	const uint8* src;
+	int row, srcStride = rect->width * Bpp;
+
+	rect->x = rect->left < 0 ? 0 : rect->left;
+	rect->y = rect->top < 0 ? 0 : rect->top;
+	rect->w = rect->right + 1;
+	if (rect->w > rect->left + rect->width)
+		rect->w = rect->left + rect->width;
+	if (rect->w > stride / Bpp)
+		rect->w = stride / Bpp;
+	rect->w -= rect->x;
+	rect->h = rect->bottom + 1;
+	if (rect->h > rect->top + rect->height)
+		rect->h = rect->top + rect->height;
+	if (rect->h > surfaceHeight)
+		rect->h = surfaceHeight;
+	rect->h -= rect->y;
+
+	if (rect->compressed)
+	{
+		if (!bitmap_decompress(scratch, rect->width, rect->height, (uint8*)rect->data, rect->size, Bpp))
+			return False;
+		src = scratch;
+	}
+	else if (rect->size < (Py_ssize_t)srcStride * rect->height)
+		return False;
+	else
+		src = (const uint8*)rect->data;
+
+	if (rect->w <= 0 || rect->h <= 0)
+		return True;
+
+	for (row = 0; row < rect->h; row++)
+	{
+		int srcRow = rect->y - rect->top + row;
+		/* raw bitmap is bottom-up */
+		if (!rect->compressed)
+			srcRow = rect->height - 1 - srcRow;
+		memcpy(surface + (rect->y + row) * stride + rect->x * Bpp, src + srcRow * srcStride + (rect->x - rect->left) * Bpp, rect->w * Bpp);
+	}
+	return True;
+}
+
+static PyObject*
+bitmap_decompress_many_wrapper(PyObject* self, PyObject* args)
+{
+	Py_buffer surface;
+	PyObject *rects = NULL, *items = NULL, *result = NULL;
+	bitmap_rect* decoded = NULL;
+	uint8* scratch = NULL;
+	Py_ssize_t count = 0, i, scratchSize = 0;
+	int stride = 0, Bpp = 0;
+
+	if (!PyArg_ParseTuple(args, "w*iOi", &surface, &stride, &rects, &Bpp))
+		return NULL;
+
+	if (Bpp < 1 || Bpp > 4 || stride < Bpp || stride % Bpp != 0)
+	{
+		PyErr_SetString(PyExc_ValueError, "invalid surface stride");
+		goto end;
+	}
+
+	/* tuple keeps a reference on each bitmap while threads run */
+	items = PySequence_Tuple(rects);
+	if (items == NULL)
+		goto end;
+	count = PyTuple_GET_SIZE(items);
+
+	decoded = (bitmap_rect*)PyMem_Malloc((count ? count : 1) * sizeof(bitmap_rect));
+	if (decoded == NULL)
+	{
+		PyErr_NoMemory();
+		goto end;
+	}
+
+	for (i = 0; i < count; i++)
+	{
+		bitmap_rect* rect = decoded + i;
+		if (!PyArg_ParseTuple(PyTuple_GET_ITEM(items, i), "iiiiiiis#;rect must be (destLeft, destTop, destRight, destBottom, width, height, isCompress, data)",
+				&rect->left, &rect->top, &rect->right, &rect->bottom, &rect->width, &rect->height, &rect->compressed, &rect->data, &rect->size))
+			goto end;
+		if (rect->width < 0 || rect->height < 0)
+		{
+			PyErr_SetString(PyExc_ValueError, "invalid bitmap size");
+			goto end;
+		}
+		if (rect->compressed && (Py_ssize_t)rect->width * rect->height * Bpp > scratchSize)
+			scratchSize = (Py_ssize_t)rect->width * rect->height * Bpp;
+	}
+
+	/* one scratch buffer for all compressed tiles */
+	scratch = (uint8*)PyMem_Malloc(scratchSize ? scratchSize : 1);
+	if (scratch == NULL)
+	{
+		PyErr_NoMemory();
+		goto end;
+	}
+
+	Py_BEGIN_ALLOW_THREADS
+	for (i = 0; i < count; i++)
+		decoded[i].valid = bitmap_write_rect((uint8*)surface.buf, stride, (int)(surface.len / stride), Bpp, decoded + i, scratch);
+	Py_END_ALLOW_THREADS
+
+	result = PyList_New(count);
+	if (result == NULL)
+		goto end;
+	for (i = 0; i < count; i++)
+	{
+		PyObject* area;
+		if (!decoded[i].valid)
+		{
+			Py_INCREF(Py_False);
+			area = Py_False;
+		}
+		else if (decoded[i].w <= 0 || decoded[i].h <= 0)
+		{
+			Py_INCREF(Py_None);
+			area = Py_None;
+		}
+		else if ((area = Py_BuildValue("(iiii)", decoded[i].x, decoded[i].y, decoded[i].w, decoded[i].h)) == NULL)
+		{
+			Py_CLEAR(result);
+			goto end;
+		}
+		PyList_SET_ITEM(result, i, area);
+	}
+
+end:
+	PyMem_Free(scratch);
+	PyMem_Free(decoded);
+	Py_XDECREF(items);
+	PyBuffer_Release(&surface);
+	return result;
+}
+
+/* convert pixels in RDP color depth to native 32 bits 0xffRRGGBB, rows are flipped if input is bottom-up */
+static void
+pixels_to_xrgb(unsigned int* output, const uint8* input, int width, int height, int bpp, const uint8* palette, int flip)
+{
+	int x, y, Bpp = (bpp + 7) / 8;
+	unsigned int v, r, g, b;
+
+	for (y = 0; y < height; y++)
+	{
+		const uint8* src = input + (flip ? height - 1 - y : y) * width * Bpp;
+		unsigned int* dst = output + y * width;
+		switch (bpp)
+		{
+			case 8:
+				for (x = 0; x < width; x++, src++)
+					dst[x] = 0xff000000 | (palette[*src * 3] << 16) | (palette[*src * 3 + 1] << 8) | palette[*src * 3 + 2];
+				break;
+			case 15:
+				for (x = 0; x < width; x++, src += 2)
+				{
+					v = src[0] | (src[1] << 8);
+					r = (v >> 10) & 0x1f; g = (v >> 5) & 0x1f; b = v & 0x1f;
+					dst[x] = 0xff000000 | (((r << 3) | (r >> 2)) << 16) | (((g << 3) | (g >> 2)) << 8) | (b << 3) | (b >> 2);
+				}
+				break;
+			case 16:
+				for (x = 0; x < width; x++, src += 2)
+				{
+					v = src[0] | (src[1] << 8);
+					r = (v >> 11) & 0x1f; g = (v >> 5) & 0x3f; b = v & 0x1f;
+					dst[x] = 0xff000000 | (((r << 3) | (r >> 2)) << 16) | (((g << 2) | (g >> 4)) << 8) | (b << 3) | (b >> 2);
+				}
+				break;
+			default:
+				/* 24 and 32 bpp are BGR(X) */
+				for (x = 0; x < width; x++, src += Bpp)
+					dst[x] = 0xff000000 | (src[2] << 16) | (src[1] << 8) | src[0];
+				break;
+		}
+	}
+}
+
+/* check parameters shared by xrgb functions, palette is mandatory for 8 bpp */
+static int
+check_xrgb(Py_buffer* output, int width, int height, int bpp, const char* palette, int paletteSize)
+{
+	if (width < 0 || height < 0 || (bpp != 8 && bpp != 15 && bpp != 16 && bpp != 24 && bpp != 32))
+	{
+		PyErr_SetString(PyExc_ValueError, "invalid bitmap format");
+		return False;
+	}
+	if (bpp == 8 && (palette == NULL || paletteSize < 768))
+	{
+		PyErr_SetString(PyExc_ValueError, "8 bpp pixels need a 256 colors RGB palette");
+		return False;
+	}
+	if (output->len < (Py_ssize_t)width * height * 4)
+	{
+		PyErr_SetString(PyExc_ValueError, "output buffer too small for bitmap");
+		return False;
+	}
+	return True;
+}
+
+static PyObject*
+pixels_to_xrgb_wrapper(PyObject* self, PyObject* args)
+{
+	Py_buffer output, input;
+	int width = 0, height = 0, bpp = 0, flip = 0, paletteSize = 0;
+	const char* palette = NULL;
+	RD_BOOL rv;
+
+	if (!PyArg_ParseTuple(args, "w*iis*ii|z#", &output, &width, &height, &input, &bpp, &flip, &palette, &paletteSize))
+		return NULL;
+
+	rv = check_xrgb(&output, width, height, bpp, palette, paletteSize);
+	if (rv && input.len < (Py_ssize_t)width * height * ((bpp + 7) / 8))
+	{
+		PyErr_SetString(PyExc_ValueError, "input buffer too small for bitmap");
+		rv = False;
+	}
+
+	if (rv)
+	{
+		Py_BEGIN_ALLOW_THREADS
+		pixels_to_xrgb((unsigned int*)output.buf, (uint8*)input.buf, width, height, bpp, (const uint8*)palette, flip);
+		Py_END_ALLOW_THREADS
+	}
+
+	PyBuffer_Release(&output);
+	PyBuffer_Release(&input);
+	if (!rv)
+		return NULL;
+	Py_RETURN_NONE;
+}
+
+static PyObject*
+bitmap_to_xrgb_wrapper(PyObject* self, PyObject* args)
+{
+	Py_buffer output, input;
+	int width = 0, height = 0, bpp = 0, compressed = 0, paletteSize = 0;
+	const char* palette = NULL;
+	uint8* scratch = NULL;
+	RD_BOOL rv;
+
+	if (!PyArg_ParseTuple(args, "w*iis*ii|z#", &output, &width, &height, &input, &bpp, &compressed, &palette, &paletteSize))
+		return NULL;
+
+	rv = check_xrgb(&output, width, height, bpp, palette, paletteSize);
+	if (rv && compressed && (scratch = (uint8*)PyMem_Malloc((Py_ssize_t)width * height * ((bpp + 7) / 8) + 1)) == NULL)
+	{
+		PyErr_NoMemory();
+		rv = False;
+	}
+	else if (rv && !compressed && input.len < (Py_ssize_t)width * height * ((bpp + 7) / 8))
+	{
+		PyErr_SetString(PyExc_ValueError, "input buffer too small for bitmap");
+		rv = False;
+	}
+
+	if (rv)
+	{
+		Py_BEGIN_ALLOW_THREADS
+		if (compressed)
+		{
+			/* decompressed bitmap is already top-down */
+			rv = bitmap_decompress(scratch, width, height, (uint8*)input.buf, input.len, (bpp + 7) / 8);
+			if (rv)
+				pixels_to_xrgb((unsigned int*)output.buf, scratch, width, height, bpp, (const uint8*)palette, 0);
+		}
+		else
+			pixels_to_xrgb((unsigned int*)output.buf, (uint8*)input.buf, width, height, bpp, (const uint8*)palette, 1);
+		Py_END_ALLOW_THREADS
+		if (!rv)
+			PyErr_SetString(PyExc_ValueError, "invalid rle bitmap");
+	}
+
+	PyMem_Free(scratch);
+	PyBuffer_Release(&output);
+	PyBuffer_Release(&input);
+	if (!rv)
+		return NULL;
+	Py_RETURN_NONE;
+}
+
+/* write order header of interleaved rle (regular, lite or mega mega form) */
+static uint8*
+interleaved_order(uint8* out, int opcode, int count)
+{
+	if (count < 32)
+		*out++ = (opcode << 5) | count;
+	else if (count < 32 + 256)
+	{
+		*out++ = opcode << 5;
+		*out++ = count - 32;
+	}
+	else
+	{
+		*out++ = 0xf0 | opcode;
+		*out++ = count & 0xff;
+		*out++ = count >> 8;
+	}
+	return out;
+}
+
+/* pixel i of stream match fill order (copy of previous line, black on first line) */
+static int
+interleaved_fill(const uint8* pixels, int i, int width, int Bpp)
+{
+	static const uint8 black[4] = {0, 0, 0, 0};
+	return memcmp(pixels + i * Bpp, i < width ? black : pixels + (i - width) * Bpp, Bpp) == 0;
+}
+
+/* compress top-down pixels with interleaved rle, only fill, colour and copy orders are used
+   return size of output (at most width * height * (Bpp + 1) + 3) */
+static int
+bitmap_compress_interleaved(uint8* output, const uint8* input, int width, int height, int Bpp)
+{
+	uint8* out = output;
+	uint8* stream;
+	int i, j, total = width * height, lastfill = False;
+
+	/* stream is bottom-up */
+	stream = (uint8*)malloc(total * Bpp + 1);
+	if (stream == NULL)
+		return -1;
+	for (i = 0; i < height; i++)
+		memcpy(stream + i * width * Bpp, input + (height - 1 - i) * width * Bpp, width * Bpp);
+
+	i = 0;
+	while (i < total)
+	{
+		int fill = 0, colour = 1;
+		while (i + fill < total && fill < 0xffff && interleaved_fill(stream, i + fill, width, Bpp))
+			fill++;
+		while (i + colour < total && colour < 0xffff && memcmp(stream + (i + colour) * Bpp, stream + i * Bpp, Bpp) == 0)
+			colour++;
+
+		/* two consecutive fill orders would insert a mix pixel */
+		if (fill > 0 && fill >= colour && !lastfill)
+		{
+			out = interleaved_order(out, 0, fill);
+			i += fill;
+			lastfill = True;
+			continue;
+		}
+		lastfill = False;
+		if (colour >= 3)
+		{
+			out = interleaved_order(out, 3, colour);
+			memcpy(out, stream + i * Bpp, Bpp);
+			out += Bpp;
+			i += colour;
+			continue;
+		}
+
+		/* copy pixels until a run worth an order */
+		j = i + 1;
+		while (j < total && j - i < 0xffff)
+		{
+			if (interleaved_fill(stream, j, width, Bpp) && j + 1 < total && interleaved_fill(stream, j + 1, width, Bpp))
+				break;
+			if (j + 2 < total && memcmp(stream + j * Bpp, stream + (j + 1) * Bpp, Bpp) == 0 && memcmp(stream + j * Bpp, stream + (j + 2) * Bpp, Bpp) == 0)
+				break;
+			j++;
+		}
+		out = interleaved_order(out, 4, j - i);
+		memcpy(out, stream + i * Bpp, (j - i) * Bpp);
+		out += (j - i) * Bpp;
+		i = j;
+	}
+
+	free(stream);
+	return (int)(out - output);
+}
+
+static PyObject*
+bitmap_compress_wrapper(PyObject* self, PyObject* args)
+{
+	Py_buffer input;
+	PyObject* result = NULL;
+	uint8* output = NULL;
+	int width = 0, height = 0, Bpp = 0, size = -1;
+	Py_ssize_t maxSize;
+
+	if (!PyArg_ParseTuple(args, "s*iii", &input, &width, &height, &Bpp))
+		return NULL;
+
+	if (width <= 0 || height <= 0 || Bpp < 1 || Bpp > 4 || input.len < (Py_ssize_t)width * height * Bpp)
+	{
+		PyBuffer_Release(&input);
+		PyErr_SetString(PyExc_ValueError, "input buffer too small for bitmap");
+		return NULL;
+	}
+
+	if (Bpp == 4)
+		maxSize = planar_max_size(width, height);
+	else
+		maxSize = (Py_ssize_t)width * height * (Bpp + 1) + 3;
+	output = (uint8*)PyMem_Malloc(maxSize);
+	if (output == NULL)
+	{
+		PyBuffer_Release(&input);
+		return PyErr_NoMemory();
+	}
+
+	Py_BEGIN_ALLOW_THREADS
+	if (Bpp == 4)
+		size = planar_compress(output, (uint8*)input.buf, width, height, PLANAR_RLE);
+	else
+		size = bitmap_compress_interleaved(output, (uint8*)input.buf, width, height, Bpp);
+	Py_END_ALLOW_THREADS
+
+	if (size < 0)
+		PyErr_NoMemory();
+	else
+		result = PyString_FromStringAndSize((char*)output, size);
+
+	PyMem_Free(output);
+	PyBuffer_Release(&input);
+	return result;
+}
+
+static PyObject*
+planar_compress_wrapper(PyObject* self, PyObject* args)
+{
+	Py_buffer input;
+	PyObject* result = NULL;
+	uint8* output = NULL;
+	int width = 0, height = 0, flags = PLANAR_RLE, size;
+
+	if (!PyArg_ParseTuple(args, "s*ii|i", &input, &width, &height, &flags))
+		return NULL;
+
+	if (width <= 0 || height <= 0 || input.len < (Py_ssize_t)width * height * 4)
+	{
+		PyBuffer_Release(&input);
+		PyErr_SetString(PyExc_ValueError, "input buffer too small for bitmap");
+		return NULL;
+	}
+
+	output = (uint8*)PyMem_Malloc(planar_max_size(width, height));
+	if (output == NULL)
+	{
+		PyBuffer_Release(&input);
+		return PyErr_NoMemory();
+	}
+
+	Py_BEGIN_ALLOW_THREADS
+	size = planar_compress(output, (uint8*)input.buf, width, height, flags & (PLANAR_CLL_MASK | PLANAR_CS | PLANAR_RLE | PLANAR_NA));
+	Py_END_ALLOW_THREADS
+
+	if (size < 0)
+		PyErr_NoMemory();
+	else
+		result = PyString_FromStringAndSize((char*)output, size);
+
+	PyMem_Free(output);
+	PyBuffer_Release(&input);
+	return result;
+}
+
+static PyObject*
+rfx_decode_tile_wrapper(PyObject* self, PyObject* args)
+{
+	Py_buffer y, cb, cr, qy, qcb, qcr;
+	PyObject* result = NULL;
+	int rlgr3 = 0;
+
+	if (!PyArg_ParseTuple(args, "s*s*s*s*s*s*|i", &y, &cb, &cr, &qy, &qcb, &qcr, &rlgr3))
+		return NULL;
+
+	if (qy.len < 5 || qcb.len < 5 || qcr.len < 5)
+		PyErr_SetString(PyExc_ValueError, "quantization values must be 5 bytes");
+	else
+	{
+		result = PyString_FromStringAndSize(NULL, RFX_TILE_SIZE * RFX_TILE_SIZE * 4);
+		if (result != NULL)
+		{
+			uint8* output = (uint8*)PyString_AS_STRING(result);
+			Py_BEGIN_ALLOW_THREADS
+			rfx_decode_tile(output, RFX_TILE_SIZE * 4, (uint8*)y.buf, (int)y.len, (uint8*)cb.buf, (int)cb.len, (uint8*)cr.buf, (int)cr.len,
+					(uint8*)qy.buf, (uint8*)qcb.buf, (uint8*)qcr.buf, rlgr3);
+			Py_END_ALLOW_THREADS
+		}
+	}
+
+	PyBuffer_Release(&y);
+	PyBuffer_Release(&cb);
+	PyBuffer_Release(&cr);
+	PyBuffer_Release(&qy);
+	PyBuffer_Release(&qcb);
+	PyBuffer_Release(&qcr);
+	return result;
+}
+
+static PyObject*
+nsc_decompress_wrapper(PyObject* self, PyObject* args)
+{
+	Py_buffer input;
+	PyObject* result = NULL;
+	int width = 0, height = 0, rv;
+
+	if (!PyArg_ParseTuple(args, "iis*", &width, &height, &input))
+		return NULL;
+
+	if (width <= 0 || height <= 0)
+		PyErr_SetString(PyExc_ValueError, "invalid bitmap size");
+	else
+	{
+		result = PyString_FromStringAndSize(NULL, width * height * 4);
+		if (result != NULL)
+		{
+			uint8* output = (uint8*)PyString_AS_STRING(result);
+			Py_BEGIN_ALLOW_THREADS
+			rv = nsc_decompress(output, width, height, (uint8*)input.buf, (int)input.len);
+			Py_END_ALLOW_THREADS
+			if (rv <= 0)
+			{
+				Py_DECREF(result);
+				result = NULL;
+				if (rv < 0)
+					PyErr_NoMemory();
+				else
+					PyErr_SetString(PyExc_ValueError, "invalid NSCodec stream");
+			}
+		}
+	}
+
+	PyBuffer_Release(&input);
+	return result;
+}
+
+static PyObject*
+nsc_compress_wrapper(PyObject* self, PyObject* args)
+{
+	Py_buffer input;
+	PyObject* result = NULL;
+	uint8* output = NULL;
+	int width = 0, height = 0, colorLossLevel = 3, chromaSubsampling = 1, size;
+
+	if (!PyArg_ParseTuple(args, "s*ii|ii", &input, &width, &height, &colorLossLevel, &chromaSubsampling))
+		return NULL;
+
+	if (width <= 0 || height <= 0 || input.len < (Py_ssize_t)width * height * 4)
+	{
+		PyBuffer_Release(&input);
+		PyErr_SetString(PyExc_ValueError, "input buffer too small for bitmap");
+		return NULL;
+	}
+
+	output = (uint8*)PyMem_Malloc(nsc_max_size(width, height));
+	if (output == NULL)
+	{
+		PyBuffer_Release(&input);
+		return PyErr_NoMemory();
+	}
+
+	Py_BEGIN_ALLOW_THREADS
+	size = nsc_compress(output, (uint8*)input.buf, width, height, colorLossLevel, chromaSubsampling);
+	Py_END_ALLOW_THREADS
+
+	if (size < 0)
+		PyErr_NoMemory();
+	else
+		result = PyString_FromStringAndSize((char*)output, size);
+
+	PyMem_Free(output);
+	PyBuffer_Release(&input);
+	return result;
+}
+
+/* ClearCodec decoder keep caches between bitmaps */
+typedef struct
+{
+	PyObject_HEAD
+	clear_context* clear;
+} ClearDecoder;
+
+static int
+ClearDecoder_init(ClearDecoder* self, PyObject* args, PyObject* kwds)
+{
+	if (!PyArg_ParseTuple(args, ""))
+		return -1;
+	clear_free(self->clear);
+	self->clear = clear_new();
+	if (self->clear == NULL)
+	{
+		PyErr_NoMemory();
+		return -1;
+	}
+	return 0;
+}
+
+static void
+ClearDecoder_dealloc(ClearDecoder* self)
+{
+	clear_free(self->clear);
+	self->ob_type->tp_free((PyObject*)self);
+}
+
+static PyObject*
+ClearDecoder_decompress(ClearDecoder* self, PyObject* args)
+{
+	Py_buffer input, pixels;
+	PyObject* result = NULL;
+	int width = 0, height = 0, rv;
+
+	if (!PyArg_ParseTuple(args, "iis*s*", &width, &height, &input, &pixels))
+		return NULL;
+
+	if (self->clear == NULL)
+		PyErr_SetString(PyExc_ValueError, "decoder is not initialized");
+	else if (width <= 0 || height <= 0 || pixels.len < (Py_ssize_t)width * height * 4)
+		PyErr_SetString(PyExc_ValueError, "destination pixels too small for bitmap");
+	else
+	{
+		result = PyString_FromStringAndSize((char*)pixels.buf, width * height * 4);
+		if (result != NULL)
+		{
+			uint8* output = (uint8*)PyString_AS_STRING(result);
+			/* caches are not shared between threads */
+			Py_BEGIN_ALLOW_THREADS
+			rv = clear_decompress(self->clear, output, width, height, (uint8*)input.buf, (int)input.len);
+			Py_END_ALLOW_THREADS
+			if (rv <= 0)
+			{
+				Py_DECREF(result);
+				result = NULL;
+				if (rv < 0)
+					PyErr_NoMemory();
+				else
+					PyErr_SetString(PyExc_ValueError, "invalid ClearCodec stream");
+			}
+		}
+	}
+
+	PyBuffer_Release(&input);
+	PyBuffer_Release(&pixels);
+	return result;
+}
+
+static PyMethodDef ClearDecoder_methods[] =
+{
+	{"decompress", (PyCFunction)ClearDecoder_decompress, METH_VARARGS, "decompress(width, height, data, pixels) draw ClearCodec bitmap over top-down 32 bits pixels of destination, return new pixels."},
+	{NULL, NULL, 0, NULL}
+};
+
+static PyTypeObject ClearDecoderType =
+{
+	PyObject_HEAD_INIT(NULL)
+	0,						/* ob_size */
+	"rle.ClearDecoder",				/* tp_name */
+	sizeof(ClearDecoder),				/* tp_basicsize */
+	0,						/* tp_itemsize */
+	(destructor)ClearDecoder_dealloc,		/* tp_dealloc */
+	0,						/* tp_print */
+	0,						/* tp_getattr */
+	0,						/* tp_setattr */
+	0,						/* tp_compare */
+	0,						/* tp_repr */
+	0,						/* tp_as_number */
+	0,						/* tp_as_sequence */
+	0,						/* tp_as_mapping */
+	0,						/* tp_hash */
+	0,						/* tp_call */
+	0,						/* tp_str */
+	0,						/* tp_getattro */
+	0,						/* tp_setattro */
+	0,						/* tp_as_buffer */
+	Py_TPFLAGS_DEFAULT,				/* tp_flags */
+	"ClearDecoder() ClearCodec decoder with its own vertical bar and glyph caches.",	/* tp_doc */
+	0,						/* tp_traverse */
+	0,						/* tp_clear */
+	0,						/* tp_richcompare */
+	0,						/* tp_weaklistoffset */
+	0,						/* tp_iter */
+	0,						/* tp_iternext */
+	ClearDecoder_methods,				/* tp_methods */
+	0,						/* tp_members */
+	0,						/* tp_getset */
+	0,						/* tp_base */
+	0,						/* tp_dict */
+	0,						/* tp_descr_get */
+	0,						/* tp_descr_set */
+	0,						/* tp_dictoffset */
+	(initproc)ClearDecoder_init,			/* tp_init */
+	0,						/* tp_alloc */
+	0,						/* tp_new */
+};
+
 static PyMethodDef rle_methods[] =
 {
-     {"bitmap_decompress", bitmap_decompress_wrapper, METH_VARARGS, "decompress bitmap from microsoft rle algorithm."},
+     {"bitmap_decompress", bitmap_decompress_wrapper, METH_VARARGS, "decompress bitmap from microsoft rle algorithm (RDP 6.0 planar codec for 4 bytes per pixel)."},
+     {"bitmap_decompress_many", bitmap_decompress_many_wrapper, METH_VARARGS, "decode list of bitmaps (destLeft, destTop, destRight, destBottom, width, height, isCompress, data) into their position in surface, return list of modified areas (None if clipped, False if invalid)."},
+     {"pixels_to_xrgb", pixels_to_xrgb_wrapper, METH_VARARGS, "convert pixels (8, 15, 16, 24, 32 bpp) to native 32 bits 0xffRRGGBB, flip bottom-up rows if asked, 8 bpp need RGB palette."},
+     {"bitmap_to_xrgb", bitmap_to_xrgb_wrapper, METH_VARARGS, "decode RDP bitmap (raw bottom-up or rle compressed) to top-down native 32 bits 0xffRRGGBB."},
+     {"bitmap_compress", bitmap_compress_wrapper, METH_VARARGS, "compress top-down pixels, interleaved rle for 1 to 3 bytes per pixel, RDP 6.0 planar for 4 bytes per pixel."},
+     {"planar_compress", planar_compress_wrapper, METH_VARARGS, "compress top-down 32 bits pixels with RDP 6.0 planar codec, flags is format header (PLANAR_RLE by default)."},
+     {"rfx_decode_tile", rfx_decode_tile_wrapper, METH_VARARGS, "decode RemoteFX 64x64 tile from Y Cb Cr component data and their 5 bytes quantization values, return top-down 32 bits BGRX pixels (RLGR1 entropy unless rlgr3 is set)."},
+     {"nsc_decompress", nsc_decompress_wrapper, METH_VARARGS, "decode NSCodec bitmap stream of width x height, return top-down 32 bits BGRA pixels."},
+     {"nsc_compress", nsc_compress_wrapper, METH_VARARGS, "compress top-down 32 bits pixels with NSCodec, color loss level from 1 to 7 (3 by default), chroma subsampling enabled by default."},
      {NULL, NULL, 0, NULL}
 };
  
 PyMODINIT_FUNC
 initrle(void)
 {
-     (void) Py_InitModule("rle", rle_methods);
+     PyObject* m;
+
+     ClearDecoderType.tp_new = PyType_GenericNew;
+     if (PyType_Ready(&ClearDecoderType) < 0)
+          return;
+
+     m = Py_InitModule("rle", rle_methods);
+     if (m == NULL)
+          return;
+     /* planar format header flags */
+     PyModule_AddIntConstant(m, "PLANAR_CS", PLANAR_CS);
+     PyModule_AddIntConstant(m, "PLANAR_RLE", PLANAR_RLE);
+     PyModule_AddIntConstant(m, "PLANAR_NA", PLANAR_NA);
+     PyModule_AddIntConstant(m, "RFX_TILE_SIZE", RFX_TILE_SIZE);
+
+     Py_INCREF(&ClearDecoderType);
+     PyModule_AddObject(m, "ClearDecoder", (PyObject*)&ClearDecoderType);
 }
 
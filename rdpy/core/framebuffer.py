@@ -0,0 +1,800 @@
+#
+# Copyright (c) 2014-2015 Sylvain Peyrefitte
+#
+# This file is part of rdpy.
+#
+# rdpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Desktop surface without any graphic toolkit
+
+Pixels are stored top-down in session color depth
+"""
+
+import struct, sys, zlib, threading, Queue
+from array import array
+from binascii import hexlify, unhexlify
+from rdpy.core.error import InvalidValue
+from rdpy.core import log
+import rle
+
+try:
+    import numpy
+except ImportError:
+    #color conversion fall back on lookup tables
+    numpy = None
+
+class Rop3(object):
+    """
+    @summary: Common ternary raster operations
+    @see: http://msdn.microsoft.com/en-us/library/cc241583.aspx
+    """
+    BLACKNESS = 0x00
+    DSTINVERT = 0x55
+    PATINVERT = 0x5A
+    SRCINVERT = 0x66
+    SRCAND = 0x88
+    DSTCOPY = 0xAA
+    SRCCOPY = 0xCC
+    SRCPAINT = 0xEE
+    PATCOPY = 0xF0
+    WHITENESS = 0xFF
+
+def rop3(rop, dst, src = None, pat = None):
+    """
+    @summary: Apply ternary raster operation on raw pixels
+                bit n of rop is the result for (pattern, source, destination) = n
+    @param rop: {integer} ternary raster operation code
+    @param dst: {str} destination pixels
+    @param src: {str} source pixels (same length than dst)
+    @param pat: {str} pattern pixels (same length than dst)
+    @return: {str} result pixels
+    """
+    if rop == Rop3.SRCCOPY:
+        return src
+    if rop == Rop3.PATCOPY:
+        return pat
+    if rop == Rop3.DSTCOPY:
+        return dst
+    if rop == Rop3.BLACKNESS:
+        return "\x00" * len(dst)
+    if rop == Rop3.WHITENESS:
+        return "\xff" * len(dst)
+
+    size = len(dst)
+    if size == 0:
+        return dst
+    mask = (1 << (size * 8)) - 1
+    d = long(hexlify(dst), 16)
+    s = 0 if src is None else long(hexlify(src), 16)
+    p = 0 if pat is None else long(hexlify(pat), 16)
+
+    result = 0
+    for i in range(0, 8):
+        if rop & (1 << i):
+            result |= (p if i & 4 else ~p) & (s if i & 2 else ~s) & (d if i & 1 else ~d)
+
+    return unhexlify("%0*x"%(size * 2, result & mask))
+
+def rop2ToRop3(rop2):
+    """
+    @summary: Convert binary raster operation (R2_XXX) into ternary raster operation
+                pen is used as pattern
+    @param rop2: {integer} binary raster operation (1 to 16)
+    @return: {integer} ternary raster operation
+    @see: http://msdn.microsoft.com/en-us/library/cc241582.aspx
+    """
+    if rop2 < 1 or rop2 > 16:
+        raise InvalidValue("invalid binary raster operation %s"%rop2)
+    rop = 0
+    for i in range(0, 8):
+        #(pen, destination) index in rop2 truth table
+        if (rop2 - 1) & (1 << (((i >> 1) & 2) | (i & 1))):
+            rop |= 1 << i
+    return rop
+
+def maskRuns(mask):
+    """
+    @summary: Runs of set bits of a mask byte, most significant bit first
+    @param mask: {integer} mask byte
+    @return: {list(tuple)} (offset, length) of each run
+    """
+    runs = []
+    offset = 0
+    while offset < 8:
+        if not mask & (0x80 >> offset):
+            offset += 1
+            continue
+        start = offset
+        while offset < 8 and mask & (0x80 >> offset):
+            offset += 1
+        runs.append((start, offset - start))
+    return runs
+
+def union(areas):
+    """
+    @summary: Bounding area of modified areas
+    @param areas: {list(tuple)} (left, top, width, height) or None
+    @return: {tuple} (left, top, width, height) or None if all areas are None
+    """
+    areas = [area for area in areas if not area is None]
+    if len(areas) == 0:
+        return None
+    left = min([area[0] for area in areas])
+    top = min([area[1] for area in areas])
+    right = max([area[0] + area[2] for area in areas])
+    bottom = max([area[1] + area[3] for area in areas])
+    return (left, top, right - left, bottom - top)
+
+#precomputed runs of each mask byte
+_MASK_RUNS_ = [maskRuns(i) for i in range(0, 256)]
+
+#lazily computed RGB pixel of each 15 and 16 bpp value
+_RGB_TABLES_ = {}
+
+def rgbTable(bitsPerPixel):
+    """
+    @summary: Lookup table of 15 or 16 bpp pixels, low bits are replicated
+                to map full intensity on 0xff
+    @param bitsPerPixel: {integer} 15 or 16
+    @return: {list(str)} RGB pixel of each pixel value
+    """
+    if not _RGB_TABLES_.has_key(bitsPerPixel):
+        table = []
+        for value in range(0, 0x10000):
+            if bitsPerPixel == 15:
+                r, g, b = (value >> 10) & 0x1f, (value >> 5) & 0x1f, value & 0x1f
+                r, g, b = (r << 3) | (r >> 2), (g << 3) | (g >> 2), (b << 3) | (b >> 2)
+            else:
+                r, g, b = (value >> 11) & 0x1f, (value >> 5) & 0x3f, value & 0x1f
+                r, g, b = (r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)
+            table.append(chr(r) + chr(g) + chr(b))
+        _RGB_TABLES_[bitsPerPixel] = table
+    return _RGB_TABLES_[bitsPerPixel]
+
+def pixelsToRGB(pixels, bitsPerPixel, palette = None):
+    """
+    @summary: Convert raw pixels in RGB 24 bits (vectorized with NumPy if available)
+    @param pixels: {str} pixels in RDP color depth (little endian, BGR order)
+    @param bitsPerPixel: {integer} 8, 15, 16, 24 or 32
+    @param palette: {list(tuple)} (red, green, blue) of 256 colors for 8 bpp
+    @return: {str} RGB pixels
+    """
+    if bitsPerPixel == 8:
+        if palette is None:
+            raise InvalidValue("8 bpp pixels need a palette")
+        if not numpy is None:
+            return numpy.array(palette, dtype = numpy.uint8)[numpy.frombuffer(pixels, dtype = numpy.uint8)].tostring()
+        table = [chr(r) + chr(g) + chr(b) for r, g, b in palette]
+        return "".join([table[ord(c)] for c in pixels])
+
+    if bitsPerPixel in [15, 16]:
+        if not numpy is None:
+            value = numpy.frombuffer(pixels, dtype = "<u2").astype(numpy.uint32)
+            rgb = numpy.empty((len(value), 3), dtype = numpy.uint8)
+            if bitsPerPixel == 15:
+                r, g, b = (value >> 10) & 0x1f, (value >> 5) & 0x1f, value & 0x1f
+                rgb[:, 0], rgb[:, 1], rgb[:, 2] = (r << 3) | (r >> 2), (g << 3) | (g >> 2), (b << 3) | (b >> 2)
+            else:
+                r, g, b = (value >> 11) & 0x1f, (value >> 5) & 0x3f, value & 0x1f
+                rgb[:, 0], rgb[:, 1], rgb[:, 2] = (r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)
+            return rgb.tostring()
+        values = array("H", pixels)
+        if sys.byteorder == "big":
+            values.byteswap()
+        table = rgbTable(bitsPerPixel)
+        return "".join([table[v] for v in values])
+
+    if bitsPerPixel in [24, 32]:
+        bytesPerPixel = bitsPerPixel / 8
+        if not numpy is None:
+            return numpy.frombuffer(pixels, dtype = numpy.uint8).reshape(-1, bytesPerPixel)[:, 2::-1].tostring()
+        #extended slices are copied without python loop
+        src = bytearray(pixels)
+        rgb = bytearray(len(src) / bytesPerPixel * 3)
+        rgb[0::3] = src[2::bytesPerPixel]
+        rgb[1::3] = src[1::bytesPerPixel]
+        rgb[2::3] = src[0::bytesPerPixel]
+        return str(rgb)
+
+    raise InvalidValue("invalid color depth %s"%bitsPerPixel)
+
+def encodePNG(width, height, rgb, level = 6):
+    """
+    @summary: Encode RGB 24 bits image in PNG format
+    @param rgb: {str} top-down RGB pixels
+    @param level: {integer} zlib compression level
+    @return: {str} PNG file content
+    @see: http://www.w3.org/TR/PNG/
+    """
+    def chunk(chunkType, data):
+        return struct.pack(">I", len(data)) + chunkType + data + struct.pack(">I", zlib.crc32(chunkType + data) & 0xffffffff)
+
+    rowSize = width * 3
+    #each row start with filter type none
+    raw = "".join(["\x00" + rgb[i * rowSize:(i + 1) * rowSize] for i in range(0, height)])
+    return "\x89PNG\r\n\x1a\n" + chunk("IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)) + chunk("IDAT", zlib.compress(raw, level)) + chunk("IEND", "")
+
+def compressBitmap(left, top, width, height, bitsPerPixel, pixels, tileSize = 64):
+    """
+    @summary: Split raw pixels in compressed bitmap tiles
+                interleaved RLE is used until 24 bpp, RDP 6.0 planar codec for 32 bpp
+                tile width is padded to a multiple of 4 by repeating last column
+    @param pixels: {str} top-down pixels in bitsPerPixel color depth
+    @param tileSize: {integer} max width and height of tile
+    @return: {list(tuple)} sendUpdate parameters
+                (destLeft, destTop, destRight, destBottom, width, height, bitsPerPixel, isCompress, data)
+    """
+    bytesPerPixel = (bitsPerPixel + 7) / 8
+    rowSize = width * bytesPerPixel
+    tiles = []
+    for tileTop in range(0, height, tileSize):
+        tileHeight = min(tileSize, height - tileTop)
+        for tileLeft in range(0, width, tileSize):
+            tileWidth = min(tileSize, width - tileLeft)
+            paddedWidth = (tileWidth + 3) & ~3
+            rows = []
+            for i in range(tileTop, tileTop + tileHeight):
+                row = pixels[i * rowSize + tileLeft * bytesPerPixel:i * rowSize + (tileLeft + tileWidth) * bytesPerPixel]
+                rows.append(row + row[-bytesPerPixel:] * (paddedWidth - tileWidth))
+            tiles.append((left + tileLeft, top + tileTop, left + tileLeft + tileWidth - 1, top + tileTop + tileHeight - 1, paddedWidth, tileHeight, bitsPerPixel, True, rle.bitmap_compress("".join(rows), paddedWidth, tileHeight, bytesPerPixel)))
+    return tiles
+
+class FrameBuffer(object):
+    """
+    @summary: Surface of remote desktop
+                each drawing function return the modified area (left, top, width, height)
+                or None if nothing was drawn
+    """
+    def __init__(self, width, height, bitsPerPixel):
+        """
+        @param width: {integer} width of desktop
+        @param height: {integer} height of desktop
+        @param bitsPerPixel: {integer} color depth of session (8, 15, 16, 24, 32)
+        """
+        self._width = width
+        self._height = height
+        self._bitsPerPixel = bitsPerPixel
+        self._bytesPerPixel = (bitsPerPixel + 7) / 8
+        self._stride = width * self._bytesPerPixel
+        self._data = bytearray(self._stride * height)
+        #bounding area modified since last popDirtyArea
+        self._dirtyArea = None
+        #palette use to export 8 bpp surface
+        self._palette = None
+
+    def getWidth(self):
+        """
+        @return: {integer} width of surface
+        """
+        return self._width
+
+    def getHeight(self):
+        """
+        @return: {integer} height of surface
+        """
+        return self._height
+
+    def getBitsPerPixel(self):
+        """
+        @return: {integer} color depth of surface
+        """
+        return self._bitsPerPixel
+
+    def setPalette(self, palette):
+        """
+        @summary: Palette of 8 bpp session, needed for export
+        @param palette: {list(tuple)} (red, green, blue) of 256 colors
+        """
+        self._palette = palette
+
+    def markDirty(self, left, top, width, height):
+        """
+        @summary: Add area to dirty area
+        """
+        self._dirtyArea = union([self._dirtyArea, (left, top, width, height)])
+
+    def popDirtyArea(self):
+        """
+        @summary: Bounding area of all modifications since last call
+        @return: {tuple} (left, top, width, height) or None if nothing was drawn
+        """
+        area = self._dirtyArea
+        self._dirtyArea = None
+        return area
+
+    def toRGB(self, left = 0, top = 0, width = None, height = None):
+        """
+        @summary: Export an area (whole surface by default) in RGB 24 bits
+        @return: {str} top-down RGB pixels
+        """
+        if width is None:
+            width = self._width - left
+        if height is None:
+            height = self._height - top
+        return pixelsToRGB(self.readRect(left, top, width, height), self._bitsPerPixel, self._palette)
+
+    def toXRGB(self, left = 0, top = 0, width = None, height = None):
+        """
+        @summary: Export an area (whole surface by default) in display ready 32 bits
+        @return: {bytearray} top-down native 0xffRRGGBB pixels
+        """
+        if width is None:
+            width = self._width - left
+        if height is None:
+            height = self._height - top
+        palette = None
+        if self._bitsPerPixel == 8:
+            if self._palette is None:
+                raise InvalidValue("8 bpp pixels need a palette")
+            palette = "".join([chr(r) + chr(g) + chr(b) for r, g, b in self._palette])
+        buf = bytearray(width * height * 4)
+        rle.pixels_to_xrgb(buf, width, height, self.readRect(left, top, width, height), self._bitsPerPixel, 0, palette)
+        return buf
+
+    def toPNG(self, left = 0, top = 0, width = None, height = None):
+        """
+        @summary: Export an area (whole surface by default) in PNG format
+        @return: {str} PNG file content
+        """
+        if width is None:
+            width = self._width - left
+        if height is None:
+            height = self._height - top
+        return encodePNG(width, height, self.toRGB(left, top, width, height))
+
+    def savePNG(self, path):
+        """
+        @summary: Save whole surface in a PNG file
+        @param path: {str} file path
+        """
+        with open(path, "wb") as f:
+            f.write(self.toPNG())
+
+    def colorToPixel(self, color):
+        """
+        @param color: {integer} color in session color depth
+        @return: {str} raw pixel
+        """
+        return struct.pack("<I", color & 0xffffffff)[:self._bytesPerPixel]
+
+    def clip(self, left, top, width, height, bounds = None):
+        """
+        @summary: Intersect rectangle with surface and bounds
+        @param bounds: {tuple} inclusive clipping rectangle (left, top, right, bottom)
+        @return: {tuple} (left, top, width, height) or None if empty
+        """
+        right = min(left + width, self._width)
+        bottom = min(top + height, self._height)
+        left = max(left, 0)
+        top = max(top, 0)
+        if not bounds is None:
+            left = max(left, bounds[0])
+            top = max(top, bounds[1])
+            right = min(right, bounds[2] + 1)
+            bottom = min(bottom, bounds[3] + 1)
+        if right <= left or bottom <= top:
+            return None
+        return (left, top, right - left, bottom - top)
+
+    def readRect(self, left, top, width, height):
+        """
+        @summary: Read pixels of an area inside surface
+        @return: {str} top-down pixels rows without padding
+        """
+        rowSize = width * self._bytesPerPixel
+        offset = top * self._stride + left * self._bytesPerPixel
+        return "".join([str(self._data[offset + i * self._stride:offset + i * self._stride + rowSize]) for i in range(0, height)])
+
+    def writeRect(self, left, top, width, height, pixels):
+        """
+        @summary: Write pixels of an area inside surface
+        @param pixels: {str} top-down pixels rows without padding
+        """
+        rowSize = width * self._bytesPerPixel
+        offset = top * self._stride + left * self._bytesPerPixel
+        if rowSize == self._stride:
+            #full rows are contiguous
+            self._data[offset:offset + rowSize * height] = pixels[:rowSize * height]
+        else:
+            for i in range(0, height):
+                self._data[offset + i * self._stride:offset + i * self._stride + rowSize] = pixels[i * rowSize:(i + 1) * rowSize]
+        self.markDirty(left, top, width, height)
+
+    def writeRop(self, left, top, width, height, rop, src = None, pat = None):
+        """
+        @summary: Apply raster operation on an area inside surface
+        """
+        if rop in [Rop3.SRCCOPY, Rop3.PATCOPY, Rop3.BLACKNESS, Rop3.WHITENESS]:
+            dst = "\x00" * (width * height * self._bytesPerPixel)
+        else:
+            dst = self.readRect(left, top, width, height)
+        self.writeRect(left, top, width, height, rop3(rop, dst, src, pat))
+
+    def decodeBitmap(self, width, height, isCompress, data):
+        """
+        @summary: Decode RDP bitmap in surface color depth
+        @param isCompress: {bool} RLE compressed bitmap
+        @param data: {str} bitmap data
+        @return: {str} top-down pixels
+        """
+        rowSize = width * self._bytesPerPixel
+        if isCompress:
+            buf = bytearray(rowSize * height)
+            try:
+                rle.bitmap_decompress(buf, width, height, data, self._bytesPerPixel)
+            except ValueError as e:
+                raise InvalidValue("unable to decompress bitmap : %s"%e)
+            return str(buf)
+        #raw bitmap is bottom-up
+        return "".join([data[i * rowSize:(i + 1) * rowSize] for i in range(height - 1, -1, -1)])
+
+    def updateBitmap(self, destLeft, destTop, destRight, destBottom, width, height, bitsPerPixel, isCompress, data):
+        """
+        @summary: Apply bitmap update (same parameters as RDPClientObserver.onUpdate)
+        @return: {tuple} modified area
+        """
+        if bitsPerPixel != self._bitsPerPixel:
+            raise InvalidValue("bitmap color depth %s doesn't match surface color depth %s"%(bitsPerPixel, self._bitsPerPixel))
+        return self.writeBitmap(destLeft, destTop, destRight, destBottom, width, self.decodeBitmap(width, height, isCompress, data))
+
+    def updateBitmaps(self, bitmaps):
+        """
+        @summary: Apply all bitmaps of an update in one native call
+                    bitmaps are decoded directly in surface without intermediate buffers
+        @param bitmaps: {list(tuple)} same parameters as updateBitmap
+        @return: {list} modified area of each bitmap, None if nothing was drawn
+        @raise InvalidValue: if one bitmap is not in surface color depth, or can't be decoded (others are applied)
+        """
+        #bitmap in another color depth is not decoded (empty raw bitmap is invalid)
+        areas = rle.bitmap_decompress_many(self._data, self._stride, [(destLeft, destTop, destRight, destBottom, width, height, int(bool(isCompress)), data) if bitsPerPixel == self._bitsPerPixel else (0, 0, -1, -1, 1, 1, 0, "")
+                                                                      for destLeft, destTop, destRight, destBottom, width, height, bitsPerPixel, isCompress, data in bitmaps], self._bytesPerPixel)
+        invalid = 0
+        for i, area in enumerate(areas):
+            if area is False:
+                invalid += 1
+                areas[i] = None
+            elif not area is None:
+                self.markDirty(*area)
+        if invalid > 0:
+            raise InvalidValue("unable to decode %d bitmaps of update"%invalid)
+        return areas
+
+    def writeBitmap(self, destLeft, destTop, destRight, destBottom, width, buf):
+        """
+        @summary: Write decoded bitmap clipped by destination rectangle
+        @param width: {integer} width of bitmap
+        @param buf: {str} top-down pixels returned by decodeBitmap
+        @return: {tuple} modified area
+        """
+        rowSize = width * self._bytesPerPixel
+        area = self.clip(destLeft, destTop, destRight - destLeft + 1, destBottom - destTop + 1)
+        if area is None:
+            return None
+        left, top, w, h = area
+        if (left, top, w) == (destLeft, destTop, width):
+            #no horizontal clipping, rows can be written as is
+            self.writeRect(left, top, w, h, buf)
+            return area
+        srcOffset = (left - destLeft) * self._bytesPerPixel
+        pixels = "".join([buf[(top - destTop + i) * rowSize + srcOffset:(top - destTop + i) * rowSize + srcOffset + w * self._bytesPerPixel] for i in range(0, h)])
+        self.writeRect(left, top, w, h, pixels)
+        return area
+
+    def getBitmap(self, left, top, width, height):
+        """
+        @summary: Export an area as raw RDP bitmap (bottom-up, width padded on 4 pixels)
+        @return: {tuple} (padded width, data)
+        """
+        paddedWidth = (width + 3) & ~3
+        padding = "\x00" * ((paddedWidth - width) * self._bytesPerPixel)
+        rowSize = width * self._bytesPerPixel
+        pixels = self.readRect(left, top, width, height)
+        return (paddedWidth, "".join([pixels[i * rowSize:(i + 1) * rowSize] + padding for i in range(height - 1, -1, -1)]))
+
+    def fillRect(self, left, top, width, height, color, rop = Rop3.PATCOPY, bounds = None):
+        """
+        @summary: Apply raster operation with a solid color as pattern
+        @param color: {integer} color in session color depth
+        @param rop: {integer} ternary raster operation
+        @param bounds: {tuple} inclusive clipping rectangle
+        @return: {tuple} modified area
+        """
+        area = self.clip(left, top, width, height, bounds)
+        if area is None:
+            return None
+        left, top, width, height = area
+        self.writeRop(left, top, width, height, rop, pat = self.colorToPixel(color) * (width * height))
+        return area
+
+    def patternRect(self, left, top, width, height, pattern, originX = 0, originY = 0, rop = Rop3.PATCOPY, bounds = None):
+        """
+        @summary: Apply raster operation with a 8x8 pattern
+        @param pattern: {list(str)} 8 rows of 8 raw pixels
+        @param originX: {integer} x origin of pattern
+        @param originY: {integer} y origin of pattern
+        @return: {tuple} modified area
+        """
+        area = self.clip(left, top, width, height, bounds)
+        if area is None:
+            return None
+        left, top, width, height = area
+
+        rows = []
+        for row in pattern:
+            #pattern row aligned on left coordinate
+            start = ((left - originX) & 7) * self._bytesPerPixel
+            line = row * ((width + 15) / 8)
+            rows.append(line[start:start + width * self._bytesPerPixel])
+        pat = "".join([rows[(top + i - originY) & 7] for i in range(0, height)])
+        self.writeRop(left, top, width, height, rop, pat = pat)
+        return area
+
+    def copyRect(self, left, top, width, height, srcLeft, srcTop, rop = Rop3.SRCCOPY, bounds = None):
+        """
+        @summary: Copy an area of surface to another one (may overlap)
+        @param srcLeft: {integer} x coordinate of source
+        @param srcTop: {integer} y coordinate of source
+        @return: {tuple} modified area
+        """
+        area = self.clip(left, top, width, height, bounds)
+        if area is None:
+            return None
+        srcLeft += area[0] - left
+        srcTop += area[1] - top
+        left, top, width, height = area
+        #source must be inside surface
+        srcArea = self.clip(srcLeft, srcTop, width, height)
+        if srcArea is None or srcArea[2:] != (width, height):
+            return None
+        self.writeRop(left, top, width, height, rop, src = self.readRect(srcLeft, srcTop, width, height))
+        return area
+
+    def blitRect(self, left, top, width, height, pixels, srcWidth, srcLeft, srcTop, rop = Rop3.SRCCOPY, bounds = None):
+        """
+        @summary: Copy an area of a top-down bitmap into surface
+        @param pixels: {str} top-down pixels of source bitmap
+        @param srcWidth: {integer} width of source bitmap
+        @param srcLeft: {integer} x coordinate in source bitmap
+        @param srcTop: {integer} y coordinate in source bitmap
+        @return: {tuple} modified area
+        """
+        area = self.clip(left, top, width, height, bounds)
+        if area is None:
+            return None
+        srcLeft += area[0] - left
+        srcTop += area[1] - top
+        left, top, width, height = area
+        srcRowSize = srcWidth * self._bytesPerPixel
+        rowSize = width * self._bytesPerPixel
+        src = "".join([pixels[(srcTop + i) * srcRowSize + srcLeft * self._bytesPerPixel:(srcTop + i) * srcRowSize + srcLeft * self._bytesPerPixel + rowSize] for i in range(0, height)])
+        if len(src) != rowSize * height:
+            return None
+        self.writeRop(left, top, width, height, rop, src = src)
+        return area
+
+    def fillMask(self, left, top, width, height, mask, color, bounds = None):
+        """
+        @summary: Fill pixels of a monochrome mask (glyph) with a color
+                    each run of set bits is written with one slice assignment
+        @param mask: {str} top-down rows of mask, each row is padded on a byte
+        @param color: {integer} color in session color depth
+        @return: {tuple} modified area
+        """
+        area = self.clip(left, top, width, height, bounds)
+        if area is None:
+            return None
+        pixel = self.colorToPixel(color)
+        maskStride = (width + 7) / 8
+        areaLeft, areaTop, areaWidth, areaHeight = area
+        areaRight = areaLeft + areaWidth
+        for y in range(areaTop, areaTop + areaHeight):
+            maskOffset = (y - top) * maskStride
+            rowOffset = y * self._stride
+            for i in range(0, maskStride):
+                for offset, length in _MASK_RUNS_[ord(mask[maskOffset + i])]:
+                    start = max(left + i * 8 + offset, areaLeft)
+                    end = min(left + i * 8 + offset + length, areaRight)
+                    if start < end:
+                        self._data[rowOffset + start * self._bytesPerPixel:rowOffset + end * self._bytesPerPixel] = pixel * (end - start)
+        self.markDirty(*area)
+        return area
+
+    def drawLine(self, xStart, yStart, xEnd, yEnd, color, rop2 = 13, bounds = None):
+        """
+        @summary: Draw a line of one pixel width, last point is not drawn
+        @param color: {integer} pen color in session color depth
+        @param rop2: {integer} binary raster operation (default R2_COPYPEN)
+        @return: {tuple} modified area
+        """
+        rop = rop2ToRop3(rop2)
+        #Bresenham
+        dx = abs(xEnd - xStart)
+        dy = abs(yEnd - yStart)
+        sx = 1 if xStart < xEnd else -1
+        sy = 1 if yStart < yEnd else -1
+        err = dx - dy
+        x, y = xStart, yStart
+        points = []
+        while (x, y) != (xEnd, yEnd):
+            points.append((x, y))
+            e2 = 2 * err
+            if e2 > -dy:
+                err -= dy
+                x += sx
+            if e2 < dx:
+                err += dx
+                y += sy
+
+        pixel = self.colorToPixel(color)
+        drawn = [p for p in points if not self.clip(p[0], p[1], 1, 1, bounds) is None]
+        if len(drawn) == 0:
+            return None
+        for px, py in drawn:
+            self.writeRop(px, py, 1, 1, rop, pat = pixel)
+
+        left = min([p[0] for p in drawn])
+        top = min([p[1] for p in drawn])
+        return (left, top, max([p[0] for p in drawn]) - left + 1, max([p[1] for p in drawn]) - top + 1)
+
+class DecodePool(object):
+    """
+    @summary: Threads use to decode bitmaps on several cores
+                rle extension release the GIL during decompression
+    """
+    def __init__(self, threads):
+        """
+        @param threads: {integer} number of decoding threads
+        """
+        self._tasks = Queue.Queue()
+        self._threads = [threading.Thread(target = self.work) for i in range(0, threads)]
+        for thread in self._threads:
+            #don't prevent process exit
+            thread.daemon = True
+            thread.start()
+        #results of submit are delivered in submission order
+        self._nextSubmit = 0
+        self._nextDelivery = 0
+        #results not yet delivered, filled by decoding threads
+        self._results = {}
+        self._resultsCondition = threading.Condition()
+
+    def work(self):
+        """
+        @summary: Body of decoding threads
+        """
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            task()
+
+    def map(self, function, items):
+        """
+        @summary: Call function on each item in parallel and wait all results
+        @param function: {callable(item)}
+        @param items: {list}
+        @return: {list} results in items order
+        @raise: first exception raised by function
+        """
+        if len(items) < 2:
+            return [function(item) for item in items]
+        done = Queue.Queue()
+        def task(index, item):
+            try:
+                done.put((index, function(item), None))
+            except Exception as e:
+                done.put((index, None, e))
+        for index, item in enumerate(items):
+            self._tasks.put(lambda index = index, item = item:task(index, item))
+        results = [None] * len(items)
+        errors = []
+        for i in range(0, len(items)):
+            index, result, error = done.get()
+            results[index] = result
+            if not error is None:
+                errors.append((index, error))
+        if len(errors) > 0:
+            raise min(errors)[1]
+        return results
+
+    def submit(self, function, callback):
+        """
+        @summary: Call function in a decoding thread then callback with its result in reactor thread
+                    callbacks are called in submission order
+        @param function: {callable()} decoding function
+        @param callback: {callable(result)} call in reactor thread
+        """
+        from twisted.internet import reactor
+        index = self._nextSubmit
+        self._nextSubmit += 1
+        def task():
+            try:
+                result = (function(), None)
+            except Exception as e:
+                result = (None, e)
+            self.complete(index, callback, result)
+            reactor.callFromThread(self.deliverReady)
+        self._tasks.put(task)
+
+    def schedule(self, callback):
+        """
+        @summary: Call callback in reactor thread after callbacks of previous submissions
+                    callback is called at once if nothing is pending
+        @param callback: {callable()}
+        """
+        index = self._nextSubmit
+        self._nextSubmit += 1
+        self.deliver(index, lambda result:callback(), (None, None))
+
+    def complete(self, index, callback, result):
+        """
+        @summary: Keep result until previous ones are delivered
+                    may be called from decoding threads
+        @param index: {integer} submission index of result
+        @param callback: {callable(result)}
+        @param result: {tuple} (result, exception)
+        """
+        with self._resultsCondition:
+            self._results[index] = (callback, result)
+            self._resultsCondition.notify()
+
+    def deliver(self, index, callback, result):
+        """
+        @summary: Complete a result and call callbacks of all consecutive available results
+                    must be called from reactor thread
+        @param index: {integer} submission index of result
+        @param callback: {callable(result)}
+        @param result: {tuple} (result, exception)
+        """
+        self.complete(index, callback, result)
+        self.deliverReady()
+
+    def deliverReady(self):
+        """
+        @summary: Call callbacks of all consecutive available results
+                    must be called from reactor thread
+        """
+        while True:
+            with self._resultsCondition:
+                if not self._results.has_key(self._nextDelivery):
+                    return
+                callback, (value, error) = self._results.pop(self._nextDelivery)
+                self._nextDelivery += 1
+            if error is None:
+                callback(value)
+            else:
+                log.error("decoding failed : %s"%error)
+
+    def flush(self):
+        """
+        @summary: Wait pending submissions and call their callbacks
+                    must be called from reactor thread
+                    use when next callbacks can't be delayed
+        """
+        while self._nextDelivery < self._nextSubmit:
+            with self._resultsCondition:
+                while not self._results.has_key(self._nextDelivery):
+                    self._resultsCondition.wait()
+            self.deliverReady()
+
+    def close(self):
+        """
+        @summary: Stop threads after pending tasks
+        """
+        for thread in self._threads:
+            self._tasks.put(None)
+        for thread in self._threads:
+            thread.join()
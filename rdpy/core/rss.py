@@ -36,6 +36,7 @@ class EventType(object):
     CLOSE = 0x0004
     KEY_UNICODE = 0x0005
     KEY_SCANCODE = 0x0006
+    BULK = 0x0007
     
 class UpdateFormat(object):
     """
@@ -58,7 +59,7 @@ class Event(CompositeType):
             """
             @summary: Closure for event factory
             """
-            for c in [UpdateEvent, ScreenEvent, InfoEvent, CloseEvent, KeyEventScancode, KeyEventUnicode]:
+            for c in [UpdateEvent, ScreenEvent, InfoEvent, CloseEvent, KeyEventScancode, KeyEventUnicode, BulkEvent]:
                 if self.type.value == c._TYPE_:
                     return c(readLen = self.length)
             log.debug("unknown event type : %s"%hex(self.type.value))
@@ -145,6 +146,17 @@ class KeyEventScancode(CompositeType):
         self.code = UInt32Le()
         self.isPressed = UInt8()
         
+class BulkEvent(CompositeType):
+    """
+    @summary: bulk compressed payload as received from server (use by rdpy-bulkbench)
+    """
+    _TYPE_ = EventType.BULK
+    def __init__(self, readLen = None):
+        CompositeType.__init__(self, readLen = readLen)
+        self.compressionFlags = UInt8()
+        self.length = UInt32Le(lambda:sizeof(self.data))
+        self.data = String(readLen = self.length)
+        
 def timeMs():
     """
     @return: {int} time stamp in milliseconds
@@ -256,6 +268,17 @@ class FileRecorder(object):
         keyEvent.isPressed.value = 0 if isPressed else 1
         self.rec(keyEvent)
     
+    def bulk(self, compressionFlags, data):
+        """
+        @summary: record bulk compressed payload
+        @param compressionFlags: {int} CompressionOrder | CompressionType
+        @param data: {str} compressed payload
+        """
+        bulkEvent = BulkEvent()
+        bulkEvent.compressionFlags.value = compressionFlags
+        bulkEvent.data.value = data
+        self.rec(bulkEvent)
+    
     def close(self):
         """
         @summary: end of scenario
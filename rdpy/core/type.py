@@ -856,6 +856,27 @@ class Stream(StringIO):
     """
     @summary:  Stream use to read all types
     """
+    def __init__(self, buf = ""):
+        """
+        @param buf: {str | buffer} initial content
+                    a buffer is read in place without copy, stream is read-only
+        """
+        if isinstance(buf, buffer):
+            StringIO.__init__(self)
+            #StringIO only slices its buffer on read
+            self.buf = buf
+            self.len = len(buf)
+        else:
+            StringIO.__init__(self, buf)
+        
+    def getvalue(self):
+        """
+        @return: {str} whole content of stream
+        """
+        if isinstance(self.buf, buffer):
+            return str(self.buf)
+        return StringIO.getvalue(self)
+    
     def dataLen(self):
         """
         @return: not yet read length
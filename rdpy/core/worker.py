@@ -0,0 +1,198 @@
+#
+# Copyright (c) 2014-2015 Sylvain Peyrefitte
+#
+# This file is part of rdpy.
+#
+# rdpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""
+Multi process helpers for servers and scanners
+Twisted reactor must be imported by workers only (after fork)
+else its poller is shared between processes
+"""
+
+import os, sys, errno, signal, select, socket, traceback
+from rdpy.core import log
+
+def createListeningSocket(port, interface = "", backlog = 50):
+    """
+    @summary: Create a listening TCP socket inherited by workers
+    @param port: {integer} listening port
+    @param interface: {str} listening interface (all by default)
+    @param backlog: {integer} size of pending connections queue
+    @return: {socket.socket}
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((interface, port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+def adoptListeningSocket(reactor, sock, factory):
+    """
+    @summary: Accept connections of an inherited socket in worker reactor
+                each connection is accepted by only one worker
+    @param reactor: twisted reactor of worker
+    @param sock: {socket.socket} created by createListeningSocket
+    @param factory: twisted server factory
+    @return: twisted listening port
+    """
+    return reactor.adoptStreamPort(sock.fileno(), sock.family, factory)
+
+class Supervisor(object):
+    """
+    @summary: Fork worker processes, collect lines they write
+                and wait for their end
+                SIGINT and SIGTERM received by supervisor are forwarded to workers
+                which stop their reactor gracefully
+    """
+    def __init__(self, count):
+        """
+        @param count: {integer} number of workers
+        """
+        self._count = count
+        self._pids = []
+        #read end of worker pipe -> worker index
+        self._pipes = {}
+        
+    def start(self, target):
+        """
+        @summary: Fork workers
+        @param target: {callable(index, output)} run in each worker
+                        index is the worker number, output is a file read by supervisor
+        """
+        for index in range(0, self._count):
+            r, w = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                #worker don't read pipes of previous workers
+                os.close(r)
+                for fd in self._pipes.keys():
+                    os.close(fd)
+                os._exit(self.runWorker(target, index, os.fdopen(w, "w")))
+            os.close(w)
+            self._pids.append(pid)
+            self._pipes[r] = index
+            
+        signal.signal(signal.SIGINT, lambda signum, frame:self.stop())
+        signal.signal(signal.SIGTERM, lambda signum, frame:self.stop())
+        
+    def runWorker(self, target, index, output):
+        """
+        @summary: Body of worker process
+        @return: {integer} exit code of worker
+        """
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        try:
+            target(index, output)
+            return 0
+        except:
+            log.error("worker %s : %s"%(index, traceback.format_exc()))
+            return 1
+        finally:
+            try:
+                output.close()
+                sys.stdout.flush()
+            except IOError:
+                pass
+        
+    def stop(self, signum = signal.SIGTERM):
+        """
+        @summary: Ask workers to stop
+        @param signum: {integer} signal sent to workers
+        """
+        for pid in self._pids:
+            try:
+                os.kill(pid, signum)
+            except OSError:
+                pass
+        
+    def collect(self, callback):
+        """
+        @summary: Read lines written by workers until all workers close their output
+        @param callback: {callable(index, line)} call for each line without end of line
+        """
+        buffers = dict([(fd, "") for fd in self._pipes.keys()])
+        while len(self._pipes) > 0:
+            try:
+                readable = select.select(self._pipes.keys(), [], [])[0]
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            
+            for fd in readable:
+                data = os.read(fd, 65536)
+                lines = (buffers[fd] + data).split("\n")
+                #last element is not a complete line
+                buffers[fd] = lines.pop()
+                for line in lines:
+                    callback(self._pipes[fd], line)
+                if data == "":
+                    if buffers[fd] != "":
+                        callback(self._pipes[fd], buffers[fd])
+                    os.close(fd)
+                    del self._pipes[fd]
+        
+    def wait(self):
+        """
+        @summary: Wait end of all workers
+        @return: {list(integer)} exit code of each worker (negative signal number if killed)
+        """
+        codes = []
+        for pid in self._pids:
+            while True:
+                try:
+                    status = os.waitpid(pid, 0)[1]
+                    break
+                except OSError as e:
+                    if e.errno != errno.EINTR:
+                        raise
+            codes.append(os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status))
+        self._pids = []
+        return codes
+
+def runServer(port, buildFactory, workers = 1, interface = ""):
+    """
+    @summary: Run a twisted server in current process
+                or in workers that share the listening socket
+    @param port: {integer} listening port
+    @param buildFactory: {callable()} build server factory, call in each worker
+    @param workers: {integer} number of worker processes
+    @param interface: {str} listening interface (all by default)
+    """
+    if workers <= 1:
+        from twisted.internet import reactor
+        reactor.listenTCP(port, buildFactory(), interface = interface)
+        reactor.run()
+        return
+    
+    sock = createListeningSocket(port, interface)
+    def serve(index, output):
+        from twisted.internet import reactor
+        #reactor use its own copy of socket
+        adoptListeningSocket(reactor, sock, buildFactory())
+        sock.close()
+        reactor.run()
+        
+    supervisor = Supervisor(workers)
+    supervisor.start(serve)
+    sock.close()
+    supervisor.collect(lambda index, line:log.info("worker %s : %s"%(index, line)))
+    for index, code in enumerate(supervisor.wait()):
+        log.info("worker %s exit with code %s"%(index, code))
@@ -0,0 +1,311 @@
+#
+# Copyright (c) 2014-2015 Sylvain Peyrefitte
+#
+# This file is part of rdpy.
+#
+# rdpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Network characteristics auto-detection
+Server measure round trip time and bandwidth with PDUs sent on MCS message channel
+Client answer them, measure bandwidth on its side and choose session settings
+from link quality
+@see: http://msdn.microsoft.com/en-us/library/dn366771.aspx
+"""
+
+import time
+from rdpy.core.type import UInt8, UInt16Le, UInt32Le, String, sizeof
+from rdpy.core.layer import LayerAutomata
+from rdpy.core.error import CallPureVirtualFuntion, InvalidExpectedDataException
+from rdpy.core import log
+from t125.gcc import ConnectionType, HighColor
+from pdu.data import CompressionType
+from sec import SecurityFlag, PerfFlag
+
+class HeaderType(object):
+    """
+    @summary: Direction of auto-detect PDU
+    """
+    TYPE_ID_AUTODETECT_REQUEST = 0x00
+    TYPE_ID_AUTODETECT_RESPONSE = 0x01
+
+class RequestType(object):
+    """
+    @summary: Type of auto-detect request sent by server
+    @see: http://msdn.microsoft.com/en-us/library/dn366772.aspx
+    """
+    RDP_RTT_REQUEST_TYPE_CONTINUOUS = 0x0001
+    RDP_RTT_REQUEST_TYPE_CONNECTTIME = 0x1001
+    RDP_BW_START_REQUEST_TYPE_CONTINUOUS = 0x0014
+    RDP_BW_START_REQUEST_TYPE_TUNNEL = 0x0114
+    RDP_BW_START_REQUEST_TYPE_CONNECTTIME = 0x1014
+    RDP_BW_PAYLOAD_REQUEST_TYPE = 0x0002
+    RDP_BW_STOP_REQUEST_TYPE_CONNECTTIME = 0x002B
+    RDP_BW_STOP_REQUEST_TYPE_CONTINUOUS = 0x0429
+    RDP_BW_STOP_REQUEST_TYPE_TUNNEL = 0x0629
+    RDP_NETCHAR_RESULTS_BASERTT_AVERAGERTT = 0x0840
+    RDP_NETCHAR_RESULTS_BANDWIDTH_AVERAGERTT = 0x0880
+    RDP_NETCHAR_RESULTS_BASERTT_BANDWIDTH_AVERAGERTT = 0x08C0
+
+class ResponseType(object):
+    """
+    @summary: Type of auto-detect response sent by client
+    @see: http://msdn.microsoft.com/en-us/library/dn366800.aspx
+    """
+    RDP_RTT_RESPONSE_TYPE = 0x0000
+    RDP_BW_RESULTS_RESPONSE_TYPE_CONNECTTIME = 0x0003
+    RDP_BW_RESULTS_RESPONSE_TYPE_CONTINUOUS = 0x000B
+    RDP_NETCHAR_SYNC_RESPONSE_TYPE = 0x0018
+
+class NetworkProfile(object):
+    """
+    @summary: Session settings adapted to a kind of link
+    """
+    def __init__(self, connectionType, performanceFlags, compressionType, colorDepth, inputBatchDelay):
+        """
+        @param connectionType: {gcc.ConnectionType} advertised connection type
+        @param performanceFlags: {sec.PerfFlag} desktop features disabled or enabled
+        @param compressionType: {pdu.data.CompressionType} max bulk compression, None to disable compression
+        @param colorDepth: {gcc.HighColor} max color depth, None to keep color depth of client settings
+        @param inputBatchDelay: {float} max delay in second before pending input events are sent
+        """
+        self.connectionType = connectionType
+        self.performanceFlags = performanceFlags
+        self.compressionType = compressionType
+        self.colorDepth = colorDepth
+        self.inputBatchDelay = inputBatchDelay
+
+#desktop features disabled on slow links
+PERF_LOW = PerfFlag.PERF_DISABLE_WALLPAPER | PerfFlag.PERF_DISABLE_FULLWINDOWDRAG | PerfFlag.PERF_DISABLE_MENUANIMATIONS | PerfFlag.PERF_DISABLE_THEMING | PerfFlag.PERF_DISABLE_CURSOR_SHADOW | PerfFlag.PERF_DISABLE_CURSORSETTINGS
+PERF_MEDIUM = PerfFlag.PERF_DISABLE_WALLPAPER | PerfFlag.PERF_DISABLE_FULLWINDOWDRAG | PerfFlag.PERF_DISABLE_MENUANIMATIONS | PerfFlag.PERF_DISABLE_CURSOR_SHADOW
+PERF_HIGH = PerfFlag.PERF_DISABLE_WALLPAPER | PerfFlag.PERF_ENABLE_FONT_SMOOTHING
+PERF_FULL = PerfFlag.PERF_ENABLE_FONT_SMOOTHING | PerfFlag.PERF_ENABLE_DESKTOP_COMPOSITION
+
+_PROFILES_ = {
+    ConnectionType.CONNECTION_TYPE_MODEM : NetworkProfile(ConnectionType.CONNECTION_TYPE_MODEM, PERF_LOW, CompressionType.PACKET_COMPR_TYPE_RDP61, HighColor.HIGH_COLOR_16BPP, 1.0 / 10),
+    ConnectionType.CONNECTION_TYPE_BROADBAND_LOW : NetworkProfile(ConnectionType.CONNECTION_TYPE_BROADBAND_LOW, PERF_MEDIUM, CompressionType.PACKET_COMPR_TYPE_RDP61, HighColor.HIGH_COLOR_16BPP, 1.0 / 20),
+    ConnectionType.CONNECTION_TYPE_SATELLITE : NetworkProfile(ConnectionType.CONNECTION_TYPE_SATELLITE, PERF_MEDIUM, CompressionType.PACKET_COMPR_TYPE_RDP61, HighColor.HIGH_COLOR_16BPP, 1.0 / 20),
+    ConnectionType.CONNECTION_TYPE_BROADBAND_HIGH : NetworkProfile(ConnectionType.CONNECTION_TYPE_BROADBAND_HIGH, PERF_HIGH, CompressionType.PACKET_COMPR_TYPE_RDP61, None, 1.0 / 30),
+    ConnectionType.CONNECTION_TYPE_WAN : NetworkProfile(ConnectionType.CONNECTION_TYPE_WAN, PERF_FULL, CompressionType.PACKET_COMPR_TYPE_RDP61, None, 1.0 / 60),
+    ConnectionType.CONNECTION_TYPE_LAN : NetworkProfile(ConnectionType.CONNECTION_TYPE_LAN, PERF_FULL, None, None, 1.0 / 60),
+}
+
+def getConnectionType(bandwidth, rtt):
+    """
+    @summary: Classify link from its characteristics
+    @param bandwidth: {integer} bandwidth in kilobits per second
+    @param rtt: {integer} round trip time in milliseconds, None if unknown
+    @return: {gcc.ConnectionType}
+    """
+    if bandwidth < 256:
+        return ConnectionType.CONNECTION_TYPE_MODEM
+    if bandwidth < 2000:
+        return ConnectionType.CONNECTION_TYPE_BROADBAND_LOW
+    if bandwidth < 10000:
+        if not rtt is None and rtt >= 300:
+            return ConnectionType.CONNECTION_TYPE_SATELLITE
+        return ConnectionType.CONNECTION_TYPE_BROADBAND_HIGH
+    if not rtt is None and rtt >= 20:
+        return ConnectionType.CONNECTION_TYPE_WAN
+    return ConnectionType.CONNECTION_TYPE_LAN
+
+def getProfile(bandwidth, rtt):
+    """
+    @param bandwidth: {integer} bandwidth in kilobits per second
+    @param rtt: {integer} round trip time in milliseconds, None if unknown
+    @return: {NetworkProfile} settings adapted to link
+    """
+    return _PROFILES_[getConnectionType(bandwidth, rtt)]
+
+class NetworkCharacteristicsListener(object):
+    """
+    @summary: Notified when network characteristics are measured
+    """
+    def onNetworkCharacteristics(self, bandwidth, rtt):
+        """
+        @summary: New link measure
+        @param bandwidth: {integer} bandwidth in kilobits per second
+        @param rtt: {integer} round trip time in milliseconds, None if unknown
+        """
+        raise CallPureVirtualFuntion("%s:%s defined by interface %s"%(self.__class__, "onNetworkCharacteristics", "NetworkCharacteristicsListener"))
+
+class Client(LayerAutomata):
+    """
+    @summary: Client side of auto-detect
+                presentation layer of MCS message channel
+    """
+    def __init__(self, listener, secLayer, clock = time.time):
+        """
+        @param listener: {NetworkCharacteristicsListener} notified of measures
+        @param secLayer: {sec.SecLayer} security layer of global channel (share encryption state)
+        @param clock: {callable} return current time in second
+        """
+        LayerAutomata.__init__(self, None)
+        self._listener = listener
+        self._secLayer = secLayer
+        self._clock = clock
+        #start time of bandwidth measure, None if no measure is in progress
+        self._bandwidthStart = None
+        #bytes received during bandwidth measure
+        self._bandwidthByteCount = 0
+        #last measures
+        self._bandwidth = None
+        self._rtt = None
+
+    def connect(self):
+        """
+        @summary: Message channel is joined
+        """
+        self._bandwidthStart = None
+        self._bandwidthByteCount = 0
+
+    def getBandwidth(self):
+        """
+        @return: {integer} last measured bandwidth in kilobits per second or None
+        """
+        return self._bandwidth
+
+    def getRTT(self):
+        """
+        @return: {integer} last round trip time in milliseconds or None
+        """
+        return self._rtt
+
+    def recv(self, s):
+        """
+        @summary: Read security header and dispatch auto-detect request
+        @param s: {Stream}
+        """
+        securityFlag = UInt16Le()
+        securityFlagHi = UInt16Le()
+        s.readType((securityFlag, securityFlagHi))
+
+        if not securityFlag.value & SecurityFlag.SEC_AUTODETECT_REQ:
+            log.debug("ignore message channel PDU with security flag %s"%hex(securityFlag.value))
+            return
+
+        if securityFlag.value & SecurityFlag.SEC_ENCRYPT:
+            s = self._secLayer.readEncryptedPayload(s, securityFlag.value & SecurityFlag.SEC_SECURE_CHECKSUM)
+
+        self.recvRequest(s)
+
+    def recvRequest(self, s):
+        """
+        @summary: Answer an auto-detect request
+        @param s: {Stream}
+        """
+        headerLength = UInt8()
+        headerTypeId = UInt8()
+        sequenceNumber = UInt16Le()
+        requestType = UInt16Le()
+        s.readType((headerLength, headerTypeId, sequenceNumber, requestType))
+
+        if headerTypeId.value != HeaderType.TYPE_ID_AUTODETECT_REQUEST:
+            raise InvalidExpectedDataException("invalid auto-detect request header")
+
+        if requestType.value in [RequestType.RDP_RTT_REQUEST_TYPE_CONNECTTIME, RequestType.RDP_RTT_REQUEST_TYPE_CONTINUOUS]:
+            self.sendResponse(sequenceNumber.value, ResponseType.RDP_RTT_RESPONSE_TYPE)
+
+        elif requestType.value in [RequestType.RDP_BW_START_REQUEST_TYPE_CONNECTTIME, RequestType.RDP_BW_START_REQUEST_TYPE_CONTINUOUS, RequestType.RDP_BW_START_REQUEST_TYPE_TUNNEL]:
+            self._bandwidthStart = self._clock()
+            self._bandwidthByteCount = 0
+
+        elif requestType.value == RequestType.RDP_BW_PAYLOAD_REQUEST_TYPE:
+            self._bandwidthByteCount += self.readPayload(s)
+
+        elif requestType.value in [RequestType.RDP_BW_STOP_REQUEST_TYPE_CONNECTTIME, RequestType.RDP_BW_STOP_REQUEST_TYPE_CONTINUOUS, RequestType.RDP_BW_STOP_REQUEST_TYPE_TUNNEL]:
+            if requestType.value == RequestType.RDP_BW_STOP_REQUEST_TYPE_CONNECTTIME:
+                self._bandwidthByteCount += self.readPayload(s)
+                responseType = ResponseType.RDP_BW_RESULTS_RESPONSE_TYPE_CONNECTTIME
+            else:
+                responseType = ResponseType.RDP_BW_RESULTS_RESPONSE_TYPE_CONTINUOUS
+            self.recvBandwidthStop(sequenceNumber.value, responseType)
+
+        elif requestType.value in [RequestType.RDP_NETCHAR_RESULTS_BASERTT_AVERAGERTT, RequestType.RDP_NETCHAR_RESULTS_BANDWIDTH_AVERAGERTT, RequestType.RDP_NETCHAR_RESULTS_BASERTT_BANDWIDTH_AVERAGERTT]:
+            self.recvNetworkCharacteristicsResult(requestType.value, s)
+
+        else:
+            log.debug("unknown auto-detect request type %s"%hex(requestType.value))
+
+    def readPayload(self, s):
+        """
+        @summary: Read payload of bandwidth measure
+        @param s: {Stream}
+        @return: {integer} size of payload
+        """
+        payloadLength = UInt16Le()
+        s.readType(payloadLength)
+        s.readType(String(readLen = payloadLength))
+        return payloadLength.value
+
+    def recvBandwidthStop(self, sequenceNumber, responseType):
+        """
+        @summary: End of bandwidth measure, send results and notify client side measure
+        @param sequenceNumber: {integer} sequence number of stop request
+        @param responseType: {ResponseType} connect time or continuous results
+        """
+        if self._bandwidthStart is None:
+            log.warning("bandwidth measure stop without start")
+            return
+
+        #in milliseconds
+        timeDelta = int((self._clock() - self._bandwidthStart) * 1000)
+        byteCount = self._bandwidthByteCount
+        self._bandwidthStart = None
+        self._bandwidthByteCount = 0
+        self.sendResponse(sequenceNumber, responseType, (UInt32Le(timeDelta), UInt32Le(byteCount)))
+
+        #measure is too short to be meaningful
+        if timeDelta == 0 or byteCount == 0:
+            return
+
+        self._bandwidth = byteCount * 8 / timeDelta
+        self._listener.onNetworkCharacteristics(self._bandwidth, self._rtt)
+
+    def recvNetworkCharacteristicsResult(self, requestType, s):
+        """
+        @summary: Server send its measures
+        @param requestType: {RequestType} fields present in result
+        @param s: {Stream}
+        """
+        baseRTT = UInt32Le(conditional = lambda:requestType != RequestType.RDP_NETCHAR_RESULTS_BANDWIDTH_AVERAGERTT)
+        bandwidth = UInt32Le(conditional = lambda:requestType != RequestType.RDP_NETCHAR_RESULTS_BASERTT_AVERAGERTT)
+        averageRTT = UInt32Le()
+        s.readType((baseRTT, bandwidth, averageRTT))
+
+        self._rtt = averageRTT.value
+        if requestType != RequestType.RDP_NETCHAR_RESULTS_BASERTT_AVERAGERTT:
+            self._bandwidth = bandwidth.value
+
+        if not self._bandwidth is None:
+            self._listener.onNetworkCharacteristics(self._bandwidth, self._rtt)
+
+    def sendResponse(self, sequenceNumber, responseType, data = ()):
+        """
+        @summary: Send an auto-detect response
+        @param sequenceNumber: {integer} sequence number of request
+        @param responseType: {ResponseType}
+        @param data: {Type | Tuple} response fields
+        """
+        body = (UInt8(6 + sizeof(data)), UInt8(HeaderType.TYPE_ID_AUTODETECT_RESPONSE), UInt16Le(sequenceNumber), UInt16Le(responseType), data)
+
+        if not self._secLayer._enableEncryption:
+            self._transport.send((UInt16Le(SecurityFlag.SEC_AUTODETECT_RSP), UInt16Le(), body))
+            return
+
+        flag = SecurityFlag.SEC_AUTODETECT_RSP | SecurityFlag.SEC_ENCRYPT
+        if self._secLayer._enableSecureCheckSum:
+            flag |= SecurityFlag.SEC_SECURE_CHECKSUM
+        self._transport.send((UInt16Le(flag), UInt16Le(), self._secLayer.writeEncryptedPayload(body, flag & SecurityFlag.SEC_SECURE_CHECKSUM)))
@@ -0,0 +1,544 @@
+#
+# Copyright (c) 2014-2015 Sylvain Peyrefitte
+#
+# This file is part of rdpy.
+#
+# rdpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Client side caches filled by secondary drawing orders
+"""
+
+import mmap, os, struct
+from collections import OrderedDict
+from rdpy.core.error import InvalidValue
+from pdu.order import BitmapFormat
+
+class BitmapCacheCell(object):
+    """
+    @summary: One cell of bitmap cache
+                Entries are kept in least recently used order
+    """
+    def __init__(self, entries):
+        """
+        @param entries: {integer} number of entries negotiated for this cell
+        """
+        self._entries = entries
+        self._bitmaps = OrderedDict()
+
+    def getEntries(self):
+        """
+        @return: {integer} max number of entries
+        """
+        return self._entries
+
+    def put(self, cacheIndex, bitmap):
+        """
+        @summary: Store bitmap in cell
+        @param cacheIndex: {integer} index of entry or BitmapCache.WAITING_LIST_INDEX
+                            to use first free entry or least recently used one
+        @param bitmap: {tuple} (width, height, top-down pixels)
+        @return: {integer} index of entry
+        @raise InvalidValue: if index is out of cell
+        """
+        if cacheIndex == BitmapCache.WAITING_LIST_INDEX:
+            if len(self._bitmaps) < self._entries:
+                cacheIndex = (i for i in xrange(0, self._entries) if not i in self._bitmaps).next()
+            else:
+                cacheIndex = iter(self._bitmaps).next()
+        elif cacheIndex >= self._entries:
+            raise InvalidValue("bitmap cache index %s out of cell (%s entries)"%(cacheIndex, self._entries))
+
+        self._bitmaps.pop(cacheIndex, None)
+        self._bitmaps[cacheIndex] = bitmap
+        return cacheIndex
+
+    def get(self, cacheIndex):
+        """
+        @summary: Retrieve bitmap and mark it as recently used
+        @param cacheIndex: {integer} index of entry
+        @return: {tuple} (width, height, top-down pixels) or None
+        """
+        bitmap = self._bitmaps.pop(cacheIndex, None)
+        if not bitmap is None:
+            self._bitmaps[cacheIndex] = bitmap
+        return bitmap
+
+class BitmapCache(object):
+    """
+    @summary: Bitmap cache (revision 2 and 3) with negotiated cells
+    @see: http://msdn.microsoft.com/en-us/library/cc240560.aspx
+    """
+    WAITING_LIST_INDEX = 32767
+
+    def __init__(self, cellEntries):
+        """
+        @param cellEntries: {list(integer)} number of entries of each cell
+        """
+        self._cells = [BitmapCacheCell(entries) for entries in cellEntries]
+
+    def getCell(self, cacheId):
+        """
+        @param cacheId: {integer} id of cell
+        @return: {BitmapCacheCell}
+        @raise InvalidValue: if cell is not negotiated
+        """
+        if cacheId >= len(self._cells):
+            raise InvalidValue("unknown bitmap cache cell %s"%cacheId)
+        return self._cells[cacheId]
+
+    def put(self, cacheId, cacheIndex, bitmap):
+        """
+        @see: BitmapCacheCell.put
+        """
+        return self.getCell(cacheId).put(cacheIndex, bitmap)
+
+    def get(self, cacheId, cacheIndex):
+        """
+        @see: BitmapCacheCell.get
+        """
+        return self.getCell(cacheId).get(cacheIndex)
+
+class PersistentBitmapCache(object):
+    """
+    @summary: Bitmap cache kept on disk across sessions
+                Memory mapped file of fixed size entries indexed by 64 bits key
+                When file is full least recently used entry is replaced
+    @see: http://msdn.microsoft.com/en-us/library/cc240494.aspx
+    """
+    _MAGIC_ = "RDPYPBC1"
+    #magic, max entries
+    _HEADER_ = struct.Struct("<8sI")
+    #key1, key2, stamp, used, cacheId, bitsPerPixel, width, height, length
+    _ENTRY_HEADER_ = struct.Struct("<IIIBBBxHHI")
+    #largest bitmap of cache (64x64 pixels in 32 bpp)
+    _MAX_BITMAP_SIZE_ = 64 * 64 * 4
+    
+    def __init__(self, path, maxEntries = 2048):
+        """
+        @param path: {str} path of cache file, created if not exist
+        @param maxEntries: {integer} max number of bitmaps in file
+                            file is reset if it was created with another size
+        """
+        self._maxEntries = maxEntries
+        self._entrySize = self._ENTRY_HEADER_.size + self._MAX_BITMAP_SIZE_
+        size = self._HEADER_.size + maxEntries * self._entrySize
+        header = self._HEADER_.pack(self._MAGIC_, maxEntries)
+        
+        self._file = open(path, "r+b" if os.path.exists(path) else "w+b")
+        isValid = self._file.read(self._HEADER_.size) == header
+        if not isValid:
+            self._file.truncate(0)
+        #unused entries are sparse
+        self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+        if not isValid:
+            self._map[0:self._HEADER_.size] = header
+        
+        #in memory index
+        self._index = {}
+        self._keys = [None] * maxEntries
+        self._stamps = [0] * maxEntries
+        self._free = []
+        self._stamp = 0
+        for entry in range(maxEntries - 1, -1, -1):
+            key1, key2, stamp, used = self.readEntryHeader(entry)[:4]
+            if not used:
+                self._free.append(entry)
+                continue
+            self._index[(key1, key2)] = entry
+            self._keys[entry] = (key1, key2)
+            self._stamps[entry] = stamp
+            self._stamp = max(self._stamp, stamp)
+            
+    def getMaxEntries(self):
+        """
+        @return: {integer} max number of bitmaps in file
+        """
+        return self._maxEntries
+    
+    def getOffset(self, entry):
+        """
+        @param entry: {integer} index of entry in file
+        @return: {integer} offset of entry in file
+        """
+        return self._HEADER_.size + entry * self._entrySize
+    
+    def readEntryHeader(self, entry):
+        """
+        @param entry: {integer} index of entry in file
+        @return: {tuple} (key1, key2, stamp, used, cacheId, bitsPerPixel, width, height, length)
+        """
+        offset = self.getOffset(entry)
+        return self._ENTRY_HEADER_.unpack(self._map[offset:offset + self._ENTRY_HEADER_.size])
+    
+    def touch(self, entry):
+        """
+        @summary: Mark entry as most recently used
+        @param entry: {integer} index of entry in file
+        """
+        self._stamp += 1
+        self._stamps[entry] = self._stamp
+        offset = self.getOffset(entry) + 8
+        self._map[offset:offset + 4] = struct.pack("<I", self._stamp)
+        
+    def put(self, key1, key2, cacheId, bitsPerPixel, width, height, pixels):
+        """
+        @summary: Store bitmap in file
+        @param key1: {integer} low 32 bits of persistent key
+        @param key2: {integer} high 32 bits of persistent key
+        @param cacheId: {integer} bitmap cache cell of bitmap
+        @param bitsPerPixel: {integer} color depth of bitmap
+        @param pixels: {str} top-down pixels
+        @return: True if bitmap is stored
+        """
+        if len(pixels) > self._MAX_BITMAP_SIZE_ or self._maxEntries == 0:
+            return False
+        
+        key = (key1, key2)
+        entry = self._index.get(key)
+        if entry is None:
+            if len(self._free) > 0:
+                entry = self._free.pop()
+            else:
+                #evict least recently used entry
+                entry = min(xrange(0, self._maxEntries), key = self._stamps.__getitem__)
+                del self._index[self._keys[entry]]
+            self._index[key] = entry
+            self._keys[entry] = key
+            
+        self._stamp += 1
+        self._stamps[entry] = self._stamp
+        offset = self.getOffset(entry)
+        self._map[offset:offset + self._ENTRY_HEADER_.size] = self._ENTRY_HEADER_.pack(key1, key2, self._stamp, 1, cacheId, bitsPerPixel, width, height, len(pixels))
+        offset += self._ENTRY_HEADER_.size
+        self._map[offset:offset + len(pixels)] = pixels
+        return True
+    
+    def get(self, key1, key2):
+        """
+        @summary: Retrieve bitmap and mark it as recently used
+        @param key1: {integer} low 32 bits of persistent key
+        @param key2: {integer} high 32 bits of persistent key
+        @return: {tuple} (cacheId, bitsPerPixel, width, height, top-down pixels) or None
+        """
+        entry = self._index.get((key1, key2))
+        if entry is None:
+            return None
+        cacheId, bitsPerPixel, width, height, length = self.readEntryHeader(entry)[4:]
+        self.touch(entry)
+        offset = self.getOffset(entry) + self._ENTRY_HEADER_.size
+        return (cacheId, bitsPerPixel, width, height, self._map[offset:offset + length])
+    
+    def getKeys(self, cacheId, bitsPerPixel, maxKeys):
+        """
+        @summary: Keys of bitmaps of a cell, most recently used first
+        @param cacheId: {integer} bitmap cache cell
+        @param bitsPerPixel: {integer} color depth of session
+        @param maxKeys: {integer} number of entries of cell
+        @return: {list(tuple(key1, key2))}
+        """
+        entries = []
+        for entry in self._index.itervalues():
+            if self.readEntryHeader(entry)[4:6] == (cacheId, bitsPerPixel):
+                entries.append(entry)
+        entries.sort(key = self._stamps.__getitem__, reverse = True)
+        return [self._keys[entry] for entry in entries[:maxKeys]]
+    
+    def flush(self):
+        """
+        @summary: Write pending changes on disk
+        """
+        self._map.flush()
+        
+    def close(self):
+        """
+        @summary: Flush and close cache file
+        """
+        self._map.flush()
+        self._map.close()
+        self._file.close()
+
+class Glyph(object):
+    """
+    @summary: Glyph of glyph cache, kept as monochrome mask
+    """
+    def __init__(self, x, y, width, height, mask):
+        """
+        @param x: {integer} x offset from glyph origin
+        @param y: {integer} y offset from glyph origin
+        @param width: {integer} width of glyph
+        @param height: {integer} height of glyph
+        @param mask: {str} top-down rows padded on a byte
+        """
+        self._x = x
+        self._y = y
+        self._width = width
+        self._height = height
+        self._mask = mask[:(width + 7) / 8 * height]
+        
+    def getRect(self, x, y):
+        """
+        @param x: {integer} x coordinate of glyph origin
+        @param y: {integer} y coordinate of glyph origin
+        @return: {tuple} (left, top, width, height) of glyph
+        """
+        return (x + self._x, y + self._y, self._width, self._height)
+    
+    def getWidth(self):
+        """
+        @return: {integer} width of glyph
+        """
+        return self._width
+    
+    def getMask(self):
+        """
+        @return: {str} top-down rows padded on a byte
+        """
+        return self._mask
+    
+class GlyphCache(object):
+    """
+    @summary: Glyph cache with negotiated cells and glyph fragment cache
+    @see: http://msdn.microsoft.com/en-us/library/cc240565.aspx
+    """
+    def __init__(self, cellEntries, fragmentEntries):
+        """
+        @param cellEntries: {list(integer)} number of entries of each cell
+        @param fragmentEntries: {integer} number of entries of fragment cache
+        """
+        self._cells = [[None] * entries for entries in cellEntries]
+        self._fragments = [None] * fragmentEntries
+        
+    def putGlyph(self, cacheId, cacheIndex, glyph):
+        """
+        @param cacheId: {integer} id of cell
+        @param cacheIndex: {integer} index in cell
+        @param glyph: {Glyph}
+        @raise InvalidValue: if index is out of cache
+        """
+        if cacheId >= len(self._cells) or cacheIndex >= len(self._cells[cacheId]):
+            raise InvalidValue("glyph %s of cell %s out of glyph cache"%(cacheIndex, cacheId))
+        self._cells[cacheId][cacheIndex] = glyph
+        
+    def getGlyph(self, cacheId, cacheIndex):
+        """
+        @param cacheId: {integer} id of cell
+        @param cacheIndex: {integer} index in cell
+        @return: {Glyph}
+        @raise InvalidValue: if glyph is not cached
+        """
+        if cacheId >= len(self._cells) or cacheIndex >= len(self._cells[cacheId]) or self._cells[cacheId][cacheIndex] is None:
+            raise InvalidValue("glyph %s of cell %s not cached"%(cacheIndex, cacheId))
+        return self._cells[cacheId][cacheIndex]
+    
+    def putFragment(self, fragmentIndex, fragment):
+        """
+        @param fragmentIndex: {integer} index in fragment cache
+        @param fragment: {str} glyph fragment bytes
+        @raise InvalidValue: if index is out of cache
+        """
+        if fragmentIndex >= len(self._fragments):
+            raise InvalidValue("glyph fragment %s out of fragment cache"%fragmentIndex)
+        self._fragments[fragmentIndex] = fragment
+        
+    def getFragment(self, fragmentIndex):
+        """
+        @param fragmentIndex: {integer} index in fragment cache
+        @return: {str} glyph fragment bytes
+        @raise InvalidValue: if fragment is not cached
+        """
+        if fragmentIndex >= len(self._fragments) or self._fragments[fragmentIndex] is None:
+            raise InvalidValue("glyph fragment %s not cached"%fragmentIndex)
+        return self._fragments[fragmentIndex]
+
+class Brush(object):
+    """
+    @summary: 8x8 brush of brush cache
+    """
+    def __init__(self, bitsPerPixel, rows):
+        """
+        @param bitsPerPixel: {integer} 1 for monochrome brush
+        @param rows: {list} 8 top-down rows, integer for monochrome brush
+                            else str of 8 raw pixels
+        """
+        self._bitsPerPixel = bitsPerPixel
+        self._rows = rows
+
+    def isMonochrome(self):
+        """
+        @return: True if brush is a 1 bpp bitmap
+        """
+        return self._bitsPerPixel == 1
+
+    def getRows(self):
+        """
+        @return: {list} top-down rows
+        """
+        return self._rows
+
+def decodeBrush(iBitmapFormat, brushData):
+    """
+    @summary: Decode brush of cache brush order
+                rows are sent bottom-up, color brush may be compressed
+                with 2 bits index in a 4 colors palette
+    @param iBitmapFormat: {pdu.order.BitmapFormat}
+    @param brushData: {str} brush data
+    @return: {Brush}
+    @see: http://msdn.microsoft.com/en-us/library/cc241616.aspx
+    """
+    if iBitmapFormat == BitmapFormat.BMF_1BPP:
+        return Brush(1, [ord(c) for c in brushData[7::-1]])
+
+    bitsPerPixel = {BitmapFormat.BMF_8BPP : 8, BitmapFormat.BMF_16BPP : 16, BitmapFormat.BMF_24BPP : 24, BitmapFormat.BMF_32BPP : 32}.get(iBitmapFormat)
+    if bitsPerPixel is None:
+        raise InvalidValue("invalid brush format %s"%iBitmapFormat)
+    bytesPerPixel = bitsPerPixel / 8
+
+    #compressed brush
+    if len(brushData) == 16 + 4 * bytesPerPixel:
+        palette = [brushData[16 + i * bytesPerPixel:16 + (i + 1) * bytesPerPixel] for i in range(0, 4)]
+        rows = []
+        for y in range(7, -1, -1):
+            indexes = ord(brushData[y * 2]) << 8 | ord(brushData[y * 2 + 1])
+            rows.append("".join([palette[(indexes >> (14 - 2 * x)) & 0x3] for x in range(0, 8)]))
+        return Brush(bitsPerPixel, rows)
+
+    rowSize = 8 * bytesPerPixel
+    if len(brushData) < 8 * rowSize:
+        raise InvalidValue("invalid brush length %s"%len(brushData))
+    return Brush(bitsPerPixel, [brushData[y * rowSize:(y + 1) * rowSize] for y in range(7, -1, -1)])
+
+class Pointer(object):
+    """
+    @summary: Decoded pointer shape of pointer cache
+    """
+    def __init__(self, hotSpotX, hotSpotY, width, height, data):
+        """
+        @param hotSpotX: {integer} x coordinate of hot spot
+        @param hotSpotY: {integer} y coordinate of hot spot
+        @param width: {integer} width of pointer
+        @param height: {integer} height of pointer
+        @param data: {str} top-down BGRA pixels
+        """
+        self._hotSpotX = hotSpotX
+        self._hotSpotY = hotSpotY
+        self._width = width
+        self._height = height
+        self._data = data
+        
+    def getHotSpot(self):
+        """
+        @return: {tuple} (x, y) of hot spot
+        """
+        return (self._hotSpotX, self._hotSpotY)
+    
+    def getSize(self):
+        """
+        @return: {tuple} (width, height)
+        """
+        return (self._width, self._height)
+    
+    def getData(self):
+        """
+        @return: {str} top-down BGRA pixels
+        """
+        return self._data
+
+class PointerCache(object):
+    """
+    @summary: Pointer cache with negotiated size
+    @see: http://msdn.microsoft.com/en-us/library/cc240562.aspx
+    """
+    def __init__(self, entries):
+        """
+        @param entries: {integer} number of entries
+        """
+        self._entries = [None] * entries
+        
+    def put(self, cacheIndex, pointer):
+        """
+        @param cacheIndex: {integer} index in cache
+        @param pointer: {Pointer}
+        @raise InvalidValue: if index is out of cache
+        """
+        if cacheIndex >= len(self._entries):
+            raise InvalidValue("pointer %s out of pointer cache"%cacheIndex)
+        self._entries[cacheIndex] = pointer
+        
+    def get(self, cacheIndex):
+        """
+        @param cacheIndex: {integer} index in cache
+        @return: {Pointer}
+        @raise InvalidValue: if pointer is not cached
+        """
+        if cacheIndex >= len(self._entries) or self._entries[cacheIndex] is None:
+            raise InvalidValue("pointer %s not cached"%cacheIndex)
+        return self._entries[cacheIndex]
+
+def decodePointer(xorBpp, width, height, xorMask, andMask):
+    """
+    @summary: Decode masks of pointer update
+                rows are sent bottom-up and padded on 2 bytes
+                pixel with and bit set is transparent for a black xor pixel
+                else it should invert screen, it is drawn in black
+    @param xorBpp: {integer} color depth of xor mask (1, 15, 16, 24 or 32)
+    @param width: {integer} width of pointer
+    @param height: {integer} height of pointer
+    @param xorMask: {str} xor mask
+    @param andMask: {str} 1 bpp and mask (may be empty for 32 bpp)
+    @return: {str} top-down BGRA pixels
+    @see: http://msdn.microsoft.com/en-us/library/cc240618.aspx
+    """
+    if not xorBpp in [1, 15, 16, 24, 32]:
+        raise InvalidValue("unsupported pointer color depth %s"%xorBpp)
+    xorStride = ((width * (16 if xorBpp == 15 else xorBpp) + 15) / 16) * 2
+    andStride = ((width + 15) / 16) * 2
+    if len(xorMask) < xorStride * height:
+        raise InvalidValue("invalid pointer xor mask length %s"%len(xorMask))
+    hasAndMask = len(andMask) >= andStride * height
+    if not hasAndMask and xorBpp != 32:
+        raise InvalidValue("invalid pointer and mask length %s"%len(andMask))
+    
+    result = bytearray(width * height * 4)
+    for y in range(0, height):
+        xorRow = (height - 1 - y) * xorStride
+        andRow = (height - 1 - y) * andStride
+        for x in range(0, width):
+            if xorBpp == 1:
+                b = g = r = 0xff if ord(xorMask[xorRow + x / 8]) & (0x80 >> (x % 8)) else 0
+                a = 0xff
+            elif xorBpp == 15 or xorBpp == 16:
+                value = struct.unpack_from("<H", xorMask, xorRow + x * 2)[0]
+                if xorBpp == 15:
+                    r, g, b = (value >> 7) & 0xf8, (value >> 2) & 0xf8, (value << 3) & 0xf8
+                else:
+                    r, g, b = (value >> 8) & 0xf8, (value >> 3) & 0xfc, (value << 3) & 0xf8
+                a = 0xff
+            elif xorBpp == 24:
+                b, g, r = [ord(c) for c in xorMask[xorRow + x * 3:xorRow + x * 3 + 3]]
+                a = 0xff
+            else:
+                b, g, r, a = [ord(c) for c in xorMask[xorRow + x * 4:xorRow + x * 4 + 4]]
+            
+            if xorBpp != 32 and hasAndMask and ord(andMask[andRow + x / 8]) & (0x80 >> (x % 8)):
+                if r == g == b == 0:
+                    a = 0
+                else:
+                    b = g = r = 0
+            
+            offset = (y * width + x) * 4
+            result[offset:offset + 4] = chr(b) + chr(g) + chr(r) + chr(a)
+    return str(result)
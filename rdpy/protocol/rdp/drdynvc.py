@@ -0,0 +1,425 @@
+#
+# Copyright (c) 2014-2015 Sylvain Peyrefitte
+#
+# This file is part of rdpy.
+#
+# rdpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Dynamic virtual channels
+All dynamic channels are multiplexed in drdynvc static virtual channel
+Server open channels by name, client accept them if a listener is registered
+@see: http://msdn.microsoft.com/en-us/library/cc241215.aspx
+"""
+
+import struct
+from rdpy.core.type import String, Stream
+from rdpy.core.layer import LayerAutomata, IStreamSender
+from rdpy.core.error import CallPureVirtualFuntion, InvalidExpectedDataException
+from rdpy.core import log
+import bulk
+
+#name of static virtual channel
+CHANNEL_NAME = "drdynvc"
+
+#max size of a static channel chunk, dynamic channel PDU must fit in
+CHANNEL_CHUNK_LENGTH = 1600
+
+#history of RDP 8.0 lite bulk compression
+HISTORY_SIZE_LITE = 8192
+
+class ChannelFlag(object):
+    """
+    @summary: Flags of static virtual channel PDU header
+    @see: http://msdn.microsoft.com/en-us/library/cc240553.aspx
+    """
+    CHANNEL_FLAG_FIRST = 0x00000001
+    CHANNEL_FLAG_LAST = 0x00000002
+    CHANNEL_FLAG_SHOW_PROTOCOL = 0x00000010
+    CHANNEL_FLAG_SUSPEND = 0x00000020
+    CHANNEL_FLAG_RESUME = 0x00000040
+    CHANNEL_PACKET_COMPRESSED = 0x00200000
+    CHANNEL_PACKET_AT_FRONT = 0x00400000
+    CHANNEL_PACKET_FLUSHED = 0x00800000
+
+class Cmd(object):
+    """
+    @summary: Dynamic virtual channel PDU type
+    @see: http://msdn.microsoft.com/en-us/library/cc241267.aspx
+    """
+    CREATE = 0x01
+    DATA_FIRST = 0x02
+    DATA = 0x03
+    CLOSE = 0x04
+    CAPABILITY = 0x05
+    DATA_FIRST_COMPRESSED = 0x06
+    DATA_COMPRESSED = 0x07
+    SOFT_SYNC_REQUEST = 0x08
+    SOFT_SYNC_RESPONSE = 0x09
+
+class CreationStatus(object):
+    """
+    @summary: Status of create response (HRESULT)
+    @see: http://msdn.microsoft.com/en-us/library/cc241272.aspx
+    """
+    OK = 0x00000000
+    NO_LISTENER = 0xC0000001
+
+class VirtualChannel(LayerAutomata, IStreamSender):
+    """
+    @summary: Static virtual channel layer
+                Reassemble chunks for presentation layer and split sent messages
+    @see: http://msdn.microsoft.com/en-us/library/cc240548.aspx
+    """
+    def __init__(self, presentation, chunkLength = CHANNEL_CHUNK_LENGTH):
+        """
+        @param presentation: {Layer} channel protocol layer
+        @param chunkLength: {integer} max size of sent chunk
+        """
+        LayerAutomata.__init__(self, presentation)
+        self._chunkLength = chunkLength
+        #received chunks of current message
+        self._chunks = []
+
+    def recv(self, s):
+        """
+        @summary: Reassemble chunks of channel PDU
+        @param s: {Stream}
+        """
+        length, flags = struct.unpack("<II", s.read(8))
+        if flags & ChannelFlag.CHANNEL_PACKET_COMPRESSED:
+            #compression is never advertised in channel options
+            log.error("Unsupported compressed static channel data")
+            return
+
+        if flags & ChannelFlag.CHANNEL_FLAG_FIRST:
+            self._chunks = []
+        self._chunks.append(s.read())
+
+        if not flags & ChannelFlag.CHANNEL_FLAG_LAST:
+            return
+
+        data = "".join(self._chunks)
+        self._chunks = []
+        if len(data) != length:
+            raise InvalidExpectedDataException("invalid length of static channel data")
+        self._presentation.recv(Stream(data))
+
+    def send(self, data):
+        """
+        @summary: Send message in chunks
+        @param data: {Type | Tuple}
+        """
+        s = Stream()
+        s.writeType(data)
+        data = s.getvalue()
+        for i in range(0, max(len(data), 1), self._chunkLength):
+            flags = 0
+            if i == 0:
+                flags |= ChannelFlag.CHANNEL_FLAG_FIRST
+            if i + self._chunkLength >= len(data):
+                flags |= ChannelFlag.CHANNEL_FLAG_LAST
+            self._transport.send(String(struct.pack("<II", len(data), flags) + data[i:i + self._chunkLength]))
+
+class DynamicChannelListener(object):
+    """
+    @summary: Protocol of a dynamic virtual channel
+    """
+    def onOpen(self, channel):
+        """
+        @summary: Channel is created by server
+        @param channel: {DynamicChannel} use to send data
+        """
+        raise CallPureVirtualFuntion("%s:%s defined by interface %s"%(self.__class__, "onOpen", "DynamicChannelListener"))
+
+    def recv(self, data):
+        """
+        @summary: Complete message received on channel
+        @param data: {str}
+        """
+        raise CallPureVirtualFuntion("%s:%s defined by interface %s"%(self.__class__, "recv", "DynamicChannelListener"))
+
+    def onClose(self):
+        """
+        @summary: Channel is closed
+        """
+        raise CallPureVirtualFuntion("%s:%s defined by interface %s"%(self.__class__, "onClose", "DynamicChannelListener"))
+
+class DynamicChannel(object):
+    """
+    @summary: Opened dynamic virtual channel
+    """
+    def __init__(self, manager, channelId, name):
+        """
+        @param manager: {Client} dynamic channel manager
+        @param channelId: {integer} id chosen by server
+        @param name: {str} name of channel
+        """
+        self._manager = manager
+        self._channelId = channelId
+        self._name = name
+
+    def getChannelId(self):
+        """
+        @return: {integer} id of channel
+        """
+        return self._channelId
+
+    def getName(self):
+        """
+        @return: {str} name of channel
+        """
+        return self._name
+
+    def send(self, data):
+        """
+        @summary: Send message on channel
+        @param data: {str}
+        """
+        self._manager.sendData(self._channelId, data)
+
+    def close(self):
+        """
+        @summary: Ask server to close channel
+        """
+        self._manager.sendClose(self._channelId)
+
+def variableSize(value):
+    """
+    @summary: Smallest field size of a dynamic channel PDU header
+    @param value: {integer} channel id or length
+    @return: {integer} cbChId or Sp code
+    """
+    if value <= 0xff:
+        return 0
+    if value <= 0xffff:
+        return 1
+    return 2
+
+_VARIABLE_FORMAT_ = ["<B", "<H", "<I", None]
+
+def readVariable(data, offset, code):
+    """
+    @param data: {str} PDU
+    @param offset: {integer} offset of field
+    @param code: {integer} cbChId or Sp code
+    @return: {tuple} (value, offset after field)
+    @raise InvalidExpectedDataException: if field is invalid
+    """
+    if _VARIABLE_FORMAT_[code] is None:
+        raise InvalidExpectedDataException("invalid field size of dynamic channel PDU")
+    size = struct.calcsize(_VARIABLE_FORMAT_[code])
+    if len(data) < offset + size:
+        raise InvalidExpectedDataException("truncated dynamic channel PDU")
+    return struct.unpack_from(_VARIABLE_FORMAT_[code], data, offset)[0], offset + size
+
+def writeVariable(value, code):
+    """
+    @param value: {integer} channel id or length
+    @param code: {integer} cbChId or Sp code
+    @return: {str} encoded field
+    """
+    return struct.pack(_VARIABLE_FORMAT_[code], value)
+
+class Client(LayerAutomata):
+    """
+    @summary: Client side of dynamic virtual channel manager
+                presentation layer of drdynvc static channel
+    """
+    def __init__(self):
+        LayerAutomata.__init__(self, None)
+        #factory of listener by channel name
+        self._listenerFactories = {}
+        #opened channel id => (channel, listener)
+        self._channels = {}
+        #channel id => (total length, received fragments)
+        self._fragments = {}
+        #negotiated protocol version
+        self._version = None
+        #compressed data use RDP 8.0 lite bulk compression
+        self._decompressor = bulk.RDP8Decompressor(HISTORY_SIZE_LITE)
+
+    def addListener(self, name, listenerFactory):
+        """
+        @summary: Accept channel opened by server with this name
+        @param name: {str} name of dynamic channel
+        @param listenerFactory: {callable()} build a DynamicChannelListener for each opened channel
+        """
+        self._listenerFactories[name] = listenerFactory
+
+    def getVersion(self):
+        """
+        @return: {integer} negotiated version or None before capabilities exchange
+        """
+        return self._version
+
+    def connect(self):
+        """
+        @summary: Static channel is joined, server will send capabilities
+        """
+        self._version = None
+        self._channels = {}
+        self._fragments = {}
+        self._decompressor.reset()
+
+    def closeChannels(self):
+        """
+        @summary: Connection is closed, notify listeners of opened channels
+        """
+        for _, listener in self._channels.values():
+            listener.onClose()
+        self._channels = {}
+
+    def recv(self, s):
+        """
+        @summary: Dispatch dynamic channel PDU
+        @param s: {Stream}
+        """
+        data = s.read()
+        if len(data) == 0:
+            raise InvalidExpectedDataException("empty dynamic channel PDU")
+        header = ord(data[0])
+        cmd, sp, cbChId = header >> 4, (header >> 2) & 3, header & 3
+
+        if cmd == Cmd.CAPABILITY:
+            self.recvCapabilityRequest(data)
+            return
+        if cmd == Cmd.SOFT_SYNC_REQUEST:
+            log.debug("ignore multitransport soft sync request")
+            return
+
+        channelId, offset = readVariable(data, 1, cbChId)
+        if cmd == Cmd.CREATE:
+            self.recvCreateRequest(channelId, cbChId, data[offset:].split("\x00")[0])
+        elif cmd == Cmd.CLOSE:
+            self.recvClose(channelId)
+        elif cmd in [Cmd.DATA_FIRST, Cmd.DATA_FIRST_COMPRESSED]:
+            length, offset = readVariable(data, offset, sp)
+            self._fragments[channelId] = (length, [])
+            self.recvData(channelId, self.readPayload(cmd == Cmd.DATA_FIRST_COMPRESSED, data[offset:]))
+        elif cmd in [Cmd.DATA, Cmd.DATA_COMPRESSED]:
+            self.recvData(channelId, self.readPayload(cmd == Cmd.DATA_COMPRESSED, data[offset:]))
+        else:
+            log.debug("ignore dynamic channel PDU %s"%cmd)
+
+    def readPayload(self, isCompressed, payload):
+        """
+        @param isCompressed: {bool} payload is RDP 8.0 lite segmented data
+        @param payload: {str}
+        @return: {str} decompressed payload
+        @raise InvalidExpectedDataException: if payload can't be decompressed
+        """
+        if not isCompressed:
+            return payload
+        try:
+            return self._decompressor.decompress(payload)
+        except ValueError as e:
+            raise InvalidExpectedDataException("unable to decompress dynamic channel data : %s"%e)
+
+    def recvCapabilityRequest(self, data):
+        """
+        @summary: Answer with highest version supported by both sides
+        @param data: {str} DYNVC_CAPS_VERSION1/2/3 PDU
+        """
+        if len(data) < 4:
+            raise InvalidExpectedDataException("invalid dynamic channel capabilities")
+        self._version = min(struct.unpack_from("<H", data, 2)[0], 3)
+        self._transport.send(String(struct.pack("<BBH", Cmd.CAPABILITY << 4, 0, self._version)))
+
+    def recvCreateRequest(self, channelId, cbChId, name):
+        """
+        @summary: Open channel if a listener is registered for its name
+        @param channelId: {integer}
+        @param cbChId: {integer} size code of channel id
+        @param name: {str} name of channel
+        """
+        if not name in self._listenerFactories:
+            log.debug("refuse dynamic channel %s"%name)
+            self._transport.send(String(chr(Cmd.CREATE << 4 | cbChId) + writeVariable(channelId, cbChId) + struct.pack("<I", CreationStatus.NO_LISTENER)))
+            return
+
+        channel = DynamicChannel(self, channelId, name)
+        listener = self._listenerFactories[name]()
+        self._channels[channelId] = (channel, listener)
+        self._transport.send(String(chr(Cmd.CREATE << 4 | cbChId) + writeVariable(channelId, cbChId) + struct.pack("<I", CreationStatus.OK)))
+        listener.onOpen(channel)
+
+    def recvData(self, channelId, data):
+        """
+        @summary: Reassemble fragments and give complete message to listener
+        @param channelId: {integer}
+        @param data: {str} fragment
+        """
+        if not channelId in self._channels:
+            log.debug("data on unknown dynamic channel %s"%channelId)
+            return
+
+        if channelId in self._fragments:
+            length, fragments = self._fragments[channelId]
+            fragments.append(data)
+            received = sum([len(fragment) for fragment in fragments])
+            if received < length:
+                return
+            del self._fragments[channelId]
+            if received != length:
+                raise InvalidExpectedDataException("invalid length of dynamic channel data")
+            data = "".join(fragments)
+
+        self._channels[channelId][1].recv(data)
+
+    def recvClose(self, channelId):
+        """
+        @summary: Server close channel, client must answer
+        @param channelId: {integer}
+        """
+        self._fragments.pop(channelId, None)
+        if not channelId in self._channels:
+            return
+        _, listener = self._channels.pop(channelId)
+        cbChId = variableSize(channelId)
+        self._transport.send(String(chr(Cmd.CLOSE << 4 | cbChId) + writeVariable(channelId, cbChId)))
+        listener.onClose()
+
+    def sendData(self, channelId, data):
+        """
+        @summary: Send message on dynamic channel, fragmented if it doesn't fit in a chunk
+        @param channelId: {integer}
+        @param data: {str}
+        """
+        cbChId = variableSize(channelId)
+        header = chr(Cmd.DATA << 4 | cbChId) + writeVariable(channelId, cbChId)
+        if len(header) + len(data) <= CHANNEL_CHUNK_LENGTH:
+            self._transport.send(String(header + data))
+            return
+
+        sp = variableSize(len(data))
+        firstHeader = chr(Cmd.DATA_FIRST << 4 | sp << 2 | cbChId) + writeVariable(channelId, cbChId) + writeVariable(len(data), sp)
+        offset = CHANNEL_CHUNK_LENGTH - len(firstHeader)
+        self._transport.send(String(firstHeader + data[:offset]))
+        while offset < len(data):
+            self._transport.send(String(header + data[offset:offset + CHANNEL_CHUNK_LENGTH - len(header)]))
+            offset += CHANNEL_CHUNK_LENGTH - len(header)
+
+    def sendClose(self, channelId):
+        """
+        @summary: Close channel from client side
+        @param channelId: {integer}
+        """
+        if not channelId in self._channels:
+            return
+        _, listener = self._channels.pop(channelId)
+        cbChId = variableSize(channelId)
+        self._transport.send(String(chr(Cmd.CLOSE << 4 | cbChId) + writeVariable(channelId, cbChId)))
+        listener.onClose()
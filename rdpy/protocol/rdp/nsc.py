@@ -0,0 +1,88 @@
+#
+# Copyright (c) 2014-2015 Sylvain Peyrefitte
+#
+# This file is part of rdpy.
+#
+# rdpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+NSCodec use in surface bits commands
+Bitmaps are encoded and decoded by rle extension (color conversion,
+chroma subsampling and RLE of planes in C)
+@see: http://msdn.microsoft.com/en-us/library/ff635245.aspx
+"""
+
+import struct
+from rdpy.core.error import InvalidValue
+import rle
+
+#codec id of surface bits command chosen by client in bitmap codecs capability
+CODEC_ID_NSCODEC = 1
+
+#default color loss level, 1 is lossless for luma and chroma
+COLOR_LOSS_LEVEL = 3
+
+def capabilitySet(allowDynamicFidelity = True, allowSubsampling = True, colorLossLevel = COLOR_LOSS_LEVEL):
+    """
+    @summary: Properties of NSCodec in bitmap codecs capability
+    @param allowDynamicFidelity: {bool} server can lower color loss level
+    @param allowSubsampling: {bool} server can subsample chroma planes
+    @param colorLossLevel: {integer} max color loss level (1 to 7)
+    @return: {str} TS_NSCODEC_CAPABILITYSET
+    @see: http://msdn.microsoft.com/en-us/library/ff635384.aspx
+    """
+    return struct.pack("<BBB", int(allowDynamicFidelity), int(allowSubsampling), colorLossLevel)
+
+def readCapabilitySet(properties):
+    """
+    @summary: Read NSCodec properties advertised by client
+    @param properties: {str} TS_NSCODEC_CAPABILITYSET
+    @return: {tuple} (allowSubsampling, colorLossLevel)
+    @raise InvalidValue: if properties are invalid
+    """
+    if len(properties) < 3:
+        raise InvalidValue("invalid NSCodec capability set")
+    _, allowSubsampling, colorLossLevel = struct.unpack_from("<BBB", properties)
+    return bool(allowSubsampling), min(max(colorLossLevel, 1), 7)
+
+def decode(width, height, data):
+    """
+    @summary: Decode NSCodec bitmap, GIL is released during decoding
+    @param width: {integer} width of bitmap
+    @param height: {integer} height of bitmap
+    @param data: {str} NSCodec bitmap stream
+    @return: {str} top-down 32 bits pixels
+    @raise InvalidValue: if stream is invalid
+    """
+    try:
+        return rle.nsc_decompress(width, height, data)
+    except ValueError as e:
+        raise InvalidValue("invalid NSCodec bitmap : %s"%e)
+
+def encode(width, height, pixels, colorLossLevel = COLOR_LOSS_LEVEL, chromaSubsampling = True):
+    """
+    @summary: Encode bitmap with NSCodec, GIL is released during encoding
+    @param width: {integer} width of bitmap
+    @param height: {integer} height of bitmap
+    @param pixels: {str} top-down 32 bits pixels
+    @param colorLossLevel: {integer} from 1 to 7
+    @param chromaSubsampling: {bool} subsample chroma planes by 2x2 blocks
+    @return: {str} NSCodec bitmap stream
+    @raise InvalidValue: if pixels don't match bitmap size
+    """
+    try:
+        return rle.nsc_compress(pixels, width, height, colorLossLevel, int(chromaSubsampling))
+    except ValueError as e:
+        raise InvalidValue("unable to encode NSCodec bitmap : %s"%e)
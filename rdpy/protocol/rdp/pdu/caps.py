@@ -175,6 +175,22 @@ class BrushSupport(object):
     BRUSH_COLOR_8x8 = 0x00000001
     BRUSH_COLOR_FULL = 0x00000002
 
+class BitmapCacheRev2Flag(object):
+    """
+    @summary: Use in revision 2 bitmap cache capability
+    @see: http://msdn.microsoft.com/en-us/library/cc240560.aspx
+    """
+    PERSISTENT_KEYS_EXPECTED_FLAG = 0x0001
+    ALLOW_CACHE_WAITING_LIST_FLAG = 0x0002
+    
+class BitmapCacheRev2CellInfo(object):
+    """
+    @summary: Use in cell info of revision 2 bitmap cache capability
+    @see: http://msdn.microsoft.com/en-us/library/cc240561.aspx
+    """
+    NUM_ENTRIES_MASK = 0x7FFFFFFF
+    PERSISTENT = 0x80000000
+
 class GlyphSupport(object):
     """
     @summary: Use by glyph order
@@ -210,6 +226,24 @@ class SoundFlag(object):
     NONE = 0x0000
     SOUND_BEEPS_FLAG = 0x0001
 
+class SurfaceCommandsFlag(object):
+    """
+    @summary: Surface commands supported by client
+    @see: http://msdn.microsoft.com/en-us/library/dd871563.aspx
+    """
+    SURFCMDS_SETSURFACEBITS = 0x00000002
+    SURFCMDS_FRAMEMARKER = 0x00000010
+    SURFCMDS_STREAMSURFACEBITS = 0x00000040
+    
+class CodecGUID(object):
+    """
+    @summary: Bitmap codecs identifier (little endian GUID)
+    @see: http://msdn.microsoft.com/en-us/library/dd891377.aspx
+    """
+    CODEC_GUID_REMOTEFX = "\x12\x2f\x77\x76\x72\xbd\x63\x44\xaf\xb3\xb7\x3c\x9c\x6f\x78\x86"
+    CODEC_GUID_IMAGE_REMOTEFX = "\xd4\xcc\x44\x27\x8a\x9d\x74\x4e\x80\x3c\x0e\xcb\xee\xa1\x9c\x54"
+    CODEC_GUID_NSCODEC = "\xb9\x1b\x8d\xca\x0f\x00\x4f\x15\x58\x9f\xae\x2d\x1a\x87\xe2\xd6"
+
 class CacheEntry(CompositeType):
     """
     @summary: Use in capability cache exchange
@@ -235,7 +269,7 @@ class Capability(CompositeType):
             """
             Closure for capability factory
             """
-            for c in [GeneralCapability, BitmapCapability, OrderCapability, BitmapCacheCapability, PointerCapability, InputCapability, BrushCapability, GlyphCapability, OffscreenBitmapCacheCapability, VirtualChannelCapability, SoundCapability, ControlCapability, WindowActivationCapability, FontCapability, ColorCacheCapability, ShareCapability, MultiFragmentUpdate]:
+            for c in [GeneralCapability, BitmapCapability, OrderCapability, BitmapCacheCapability, BitmapCacheRev2Capability, PointerCapability, InputCapability, BrushCapability, GlyphCapability, OffscreenBitmapCacheCapability, VirtualChannelCapability, SoundCapability, ControlCapability, WindowActivationCapability, FontCapability, ColorCacheCapability, ShareCapability, MultiFragmentUpdate, SurfaceCommandsCapability, BitmapCodecsCapability]:
                 if self.capabilitySetType.value == c._TYPE_ and (self.lengthCapability.value - 4) > 0:
                     return c(readLen = self.lengthCapability - 4)
             log.debug("unknown Capability type : %s"%hex(self.capabilitySetType.value))
@@ -349,6 +383,29 @@ class BitmapCacheCapability(CompositeType):
         self.cache2Entries = UInt16Le()
         self.cache2MaximumCellSize = UInt16Le()
         
+class BitmapCacheRev2Capability(CompositeType):
+    """
+    @summary: Revision 2 of bitmap cache, cell caches are managed by server
+    client -> server
+    @see: http://msdn.microsoft.com/en-us/library/cc240560.aspx
+    """
+    _TYPE_ = CapsType.CAPSTYPE_BITMAPCACHE_REV2
+    
+    def __init__(self, readLen = None):
+        CompositeType.__init__(self, readLen = readLen)
+        self.cacheFlags = UInt16Le()
+        self.pad2 = UInt8()
+        self.numCellCaches = UInt8()
+        #number of entries of each cell (BitmapCacheRev2CellInfo)
+        self.bitmapCacheCellInfo = ArrayType(UInt32Le, init = [UInt32Le(0) for _ in range(0, 5)], readLen = CallableValue(5))
+        self.pad3 = String("\x00" * 12, readLen = CallableValue(12))
+        
+    def getCellEntries(self):
+        """
+        @return: {list(integer)} number of entries of each used cell
+        """
+        return [cell.value & BitmapCacheRev2CellInfo.NUM_ENTRIES_MASK for cell in self.bitmapCacheCellInfo._array[:self.numCellCaches.value]]
+        
 class PointerCapability(CompositeType):
     """
     @summary: Use to indicate pointer handle of client
@@ -539,4 +596,70 @@ class MultiFragmentUpdate(CompositeType):
     
     def __init__(self, readLen = None):
         CompositeType.__init__(self, readLen = readLen)
-        self.MaxRequestSize = UInt32Le(0)
\ No newline at end of file
+        self.MaxRequestSize = UInt32Le(0)
+        
+class SurfaceCommandsCapability(CompositeType):
+    """
+    @summary: Use to advertise surface commands supported by client
+    client -> server
+    server -> client
+    @see: http://msdn.microsoft.com/en-us/library/dd871563.aspx
+    """
+    _TYPE_ = CapsType.CAPSETTYPE_SURFACE_COMMANDS
+    
+    def __init__(self, readLen = None):
+        CompositeType.__init__(self, readLen = readLen)
+        self.cmdFlags = UInt32Le()
+        self.reserved = UInt32Le()
+        
+class BitmapCodec(CompositeType):
+    """
+    @summary: One codec of bitmap codecs capability
+                codecID is chosen by client and reused in surface commands
+    @see: http://msdn.microsoft.com/en-us/library/dd891377.aspx
+    """
+    def __init__(self, codecGUID = "\x00" * 16, codecID = 0, codecProperties = ""):
+        """
+        @param codecGUID: {CodecGUID}
+        @param codecID: {integer} identifier of codec in session
+        @param codecProperties: {str} codec specific properties
+        """
+        CompositeType.__init__(self)
+        self.codecGUID = String(codecGUID, readLen = CallableValue(16))
+        self.codecID = UInt8(codecID)
+        self.codecPropertiesLength = UInt16Le(lambda:sizeof(self.codecProperties))
+        self.codecProperties = String(codecProperties, readLen = self.codecPropertiesLength)
+        
+class BitmapCodecsCapability(CompositeType):
+    """
+    @summary: Use to negotiate bitmap codecs (NSCodec, RemoteFX)
+    client -> server
+    server -> client
+    @see: http://msdn.microsoft.com/en-us/library/dd891377.aspx
+    """
+    _TYPE_ = CapsType.CAPSETTYPE_BITMAP_CODECS
+    
+    def __init__(self, readLen = None):
+        CompositeType.__init__(self, readLen = readLen)
+        self.bitmapCodecCount = UInt8(lambda:len(self.bitmapCodecArray._array))
+        self.bitmapCodecArray = ArrayType(BitmapCodec, readLen = self.bitmapCodecCount)
+        
+    def getCodecID(self, codecGUID):
+        """
+        @param codecGUID: {CodecGUID}
+        @return: {integer} id of codec or None if codec is not negotiated
+        """
+        codec = self.getCodec(codecGUID)
+        if codec is None:
+            return None
+        return codec.codecID.value
+    
+    def getCodec(self, codecGUID):
+        """
+        @param codecGUID: {CodecGUID}
+        @return: {BitmapCodec} codec or None if codec is not negotiated
+        """
+        for codec in self.bitmapCodecArray._array:
+            if codec.codecGUID.value == codecGUID:
+                return codec
+        return None
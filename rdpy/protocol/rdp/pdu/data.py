@@ -25,7 +25,7 @@ In this layer are managed all mains bitmap update orders end user inputs
 from rdpy.core.type import CompositeType, CallableValue, String, UInt8, UInt16Le, UInt32Le, sizeof, ArrayType, FactoryType
 from rdpy.core.error import InvalidExpectedDataException
 import rdpy.core.log as log
-import caps, order
+import caps
  
 class PDUType(object):
     """
@@ -176,9 +176,54 @@ class KeyboardFlag(object):
     @see: http://msdn.microsoft.com/en-us/library/cc240584.aspx
     """
     KBDFLAGS_EXTENDED = 0x0100
+    KBDFLAGS_EXTENDED1 = 0x0200
     KBDFLAGS_DOWN = 0x4000
     KBDFLAGS_RELEASE = 0x8000
     
+class FastPathInputEventCode(object):
+    """
+    @summary: Use in fast path input event header
+    @see: http://msdn.microsoft.com/en-us/library/cc240592.aspx
+    """
+    FASTPATH_INPUT_EVENT_SCANCODE = 0x0
+    FASTPATH_INPUT_EVENT_MOUSE = 0x1
+    FASTPATH_INPUT_EVENT_MOUSEX = 0x2
+    FASTPATH_INPUT_EVENT_SYNC = 0x3
+    FASTPATH_INPUT_EVENT_UNICODE = 0x4
+    
+class FastPathKeyboardFlag(object):
+    """
+    @summary: Use in fast path scan code and unicode event header
+    @see: http://msdn.microsoft.com/en-us/library/cc240594.aspx
+    """
+    FASTPATH_INPUT_KBDFLAGS_RELEASE = 0x01
+    FASTPATH_INPUT_KBDFLAGS_EXTENDED = 0x02
+    FASTPATH_INPUT_KBDFLAGS_EXTENDED1 = 0x04
+    
+class BitmapDataExFlag(object):
+    """
+    @summary: Use in bitmap data ex
+    @see: http://msdn.microsoft.com/en-us/library/dd302200.aspx
+    """
+    EX_COMPRESSED_BITMAP_HEADER_PRESENT = 0x01
+    
+class SurfaceCommandType(object):
+    """
+    @summary: Type of surface command
+    @see: http://msdn.microsoft.com/en-us/library/dd302197.aspx
+    """
+    CMDTYPE_SET_SURFACE_BITS = 0x0001
+    CMDTYPE_FRAME_MARKER = 0x0004
+    CMDTYPE_STREAM_SURFACE_BITS = 0x0006
+    
+class FrameAction(object):
+    """
+    @summary: Use in frame marker command
+    @see: http://msdn.microsoft.com/en-us/library/dd302199.aspx
+    """
+    SURFACECMD_FRAMEACTION_BEGIN = 0x0000
+    SURFACECMD_FRAMEACTION_END = 0x0001
+    
 class FastPathUpdateType(object):
     """
     @summary: Use in Fast Path update packet
@@ -196,6 +241,35 @@ class FastPathUpdateType(object):
     FASTPATH_UPDATETYPE_CACHED = 0xA
     FASTPATH_UPDATETYPE_POINTER = 0xB
     
+class PointerMessageType(object):
+    """
+    @summary: Type of slow path pointer update
+    @see: http://msdn.microsoft.com/en-us/library/cc240614.aspx
+    """
+    TS_PTRMSGTYPE_SYSTEM = 0x0001
+    TS_PTRMSGTYPE_POSITION = 0x0003
+    TS_PTRMSGTYPE_COLOR = 0x0006
+    TS_PTRMSGTYPE_CACHED = 0x0007
+    TS_PTRMSGTYPE_POINTER = 0x0008
+    
+class SystemPointerType(object):
+    """
+    @summary: Use in system pointer update
+    @see: http://msdn.microsoft.com/en-us/library/cc240616.aspx
+    """
+    SYSPTR_NULL = 0x00000000
+    SYSPTR_DEFAULT = 0x00007F00
+    
+class FastPathFragmentation(object):
+    """
+    @summary: Fragmentation of fast path update
+    @see: http://msdn.microsoft.com/en-us/library/cc240622.aspx
+    """
+    FASTPATH_FRAGMENT_SINGLE = 0x0
+    FASTPATH_FRAGMENT_LAST = 0x1
+    FASTPATH_FRAGMENT_FIRST = 0x2
+    FASTPATH_FRAGMENT_NEXT = 0x3
+    
 class FastPathOutputCompression(object):
     """
     @summary: Flag for compression
@@ -544,6 +618,19 @@ class DeactiveAllPDU(CompositeType):
         self.lengthSourceDescriptor = UInt16Le(lambda:sizeof(self.sourceDescriptor))
         self.sourceDescriptor = String("rdpy", readLen = self.lengthSourceDescriptor)
 
+def createPDUData(pduType2, readLen):
+    """
+    @summary: Create data PDU object in accordance with pduType2
+    @param pduType2: {PDUType2} type of data PDU
+    @param readLen: {CallableValue} max length to read
+    @return: data PDU object or String if type is unknown
+    """
+    for c in [UpdateDataPDU, SynchronizeDataPDU, ControlDataPDU, ErrorInfoDataPDU, FontListDataPDU, FontMapDataPDU, PersistentListPDU, ClientInputEventPDU, ShutdownDeniedPDU, ShutdownRequestPDU, SupressOutputDataPDU, SaveSessionInfoPDU, PointerDataPDU]:
+        if pduType2 == c._PDUTYPE2_:
+            return c(readLen = readLen)
+    log.debug("unknown PDU data type : %s"%hex(pduType2))
+    return String(readLen = readLen)
+
 class DataPDU(CompositeType):
     """
     @summary: Generic PDU packet use after connection sequence
@@ -559,11 +646,10 @@ class DataPDU(CompositeType):
             """
             @summary: Create object in accordance self.shareDataHeader.pduType2 value
             """
-            for c in [UpdateDataPDU, SynchronizeDataPDU, ControlDataPDU, ErrorInfoDataPDU, FontListDataPDU, FontMapDataPDU, PersistentListPDU, ClientInputEventPDU, ShutdownDeniedPDU, ShutdownRequestPDU, SupressOutputDataPDU, SaveSessionInfoPDU]:
-                if self.shareDataHeader.pduType2.value == c._PDUTYPE2_:
-                    return c(readLen = CallableValue(readLen.value - sizeof(self.shareDataHeader)))
-            log.debug("unknown PDU data type : %s"%hex(self.shareDataHeader.pduType2.value))
-            return String(readLen = CallableValue(readLen.value - sizeof(self.shareDataHeader)))
+            #compressed payload are parsed by PDU layer after bulk decompression
+            if self.shareDataHeader.compressedType.value & CompressionOrder.PACKET_COMPRESSED:
+                return String(readLen = CallableValue(readLen.value - sizeof(self.shareDataHeader)))
+            return createPDUData(self.shareDataHeader.pduType2.value, CallableValue(readLen.value - sizeof(self.shareDataHeader)))
             
         if pduData is None:
             pduData = FactoryType(PDUDataFactory)
@@ -659,10 +745,10 @@ class PersistentListEntry(CompositeType):
     @summary: Use to record persistent key in PersistentListPDU
     @see: http://msdn.microsoft.com/en-us/library/cc240496.aspx
     """  
-    def __init__(self):
+    def __init__(self, key1 = 0, key2 = 0):
         CompositeType.__init__(self)
-        self.key1 = UInt32Le()
-        self.key2 = UInt32Le()
+        self.key1 = UInt32Le(key1)
+        self.key2 = UInt32Le(key2)
     
 class PersistentListPDU(CompositeType):
     """
@@ -671,6 +757,8 @@ class PersistentListPDU(CompositeType):
     @see: http://msdn.microsoft.com/en-us/library/cc240495.aspx
     """
     _PDUTYPE2_ = PDUType2.PDUTYPE2_BITMAPCACHE_PERSISTENT_LIST
+    #max number of entries in one PDU
+    _MAX_ENTRIES_ = 169
     
     def __init__(self, userId = 0, shareId = 0, readLen = None):
         CompositeType.__init__(self, readLen = readLen)
@@ -687,7 +775,7 @@ class PersistentListPDU(CompositeType):
         self.bitMask = UInt8()
         self.pad2 = UInt8()
         self.pad3 = UInt16Le()
-        self.entries = ArrayType(PersistentListEntry, readLen = CallableValue(lambda:(self.numEntriesCache0 + self.numEntriesCache1 + self.numEntriesCache2 + self.numEntriesCache3 + self.numEntriesCache4)))
+        self.entries = ArrayType(PersistentListEntry, readLen = CallableValue(lambda:(self.numEntriesCache0.value + self.numEntriesCache1.value + self.numEntriesCache2.value + self.numEntriesCache3.value + self.numEntriesCache4.value)))
 
 class ClientInputEventPDU(CompositeType):
     """
@@ -776,7 +864,7 @@ class UpdateDataPDU(CompositeType):
             """
             @summary: Create object in accordance self.updateType value
             """
-            for c in [BitmapUpdateDataPDU]:
+            for c in [BitmapUpdateDataPDU, OrderUpdateDataPDU]:
                 if self.updateType.value == c._UPDATE_TYPE_:
                     return c(readLen = CallableValue(readLen.value - 2))
             log.debug("unknown PDU update data type : %s"%hex(self.updateType.value))
@@ -801,33 +889,100 @@ class SaveSessionInfoPDU(CompositeType):
         #TODO parse info data
         self.infoData = String()
         
+class PointerDataPDU(CompositeType):
+    """
+    @summary: Slow path pointer update
+    @see: http://msdn.microsoft.com/en-us/library/cc240614.aspx
+    """
+    _PDUTYPE2_ = PDUType2.PDUTYPE2_POINTER
+    
+    def __init__(self, pointerData = None, readLen = None):
+        """
+        @param pointerData: {SystemPointerUpdate | PointerPositionUpdate | ColorPointerUpdate | CachedPointerUpdate | NewPointerUpdate}
+        @param readLen: Max length to read
+        """
+        CompositeType.__init__(self, readLen = readLen)
+        self.messageType = UInt16Le(lambda:pointerData.__class__._MESSAGE_TYPE_)
+        self.pad2Octets = UInt16Le()
+        
+        def PointerDataFactory():
+            """
+            @summary: Create object in accordance self.messageType value
+            """
+            for c in [SystemPointerUpdate, PointerPositionUpdate, ColorPointerUpdate, CachedPointerUpdate, NewPointerUpdate]:
+                if self.messageType.value == c._MESSAGE_TYPE_:
+                    return c(readLen = CallableValue(readLen.value - 4))
+            log.debug("unknown pointer update type : %s"%hex(self.messageType.value))
+            return String(readLen = CallableValue(readLen.value - 4))
+        
+        if pointerData is None:
+            pointerData = FactoryType(PointerDataFactory)
+        elif not "_MESSAGE_TYPE_" in pointerData.__class__.__dict__:
+            raise InvalidExpectedDataException("Try to send an invalid pointer update PDU")
+        
+        self.pointerData = pointerData
+        
+def createFastPathUpdateData(updateCode, readLen):
+    """
+    @summary: Create fast path update object in accordance with update code
+    @param updateCode: {FastPathUpdateType} update code (4 lower bits of update header)
+    @param readLen: {CallableValue} max length to read
+    @return: fast path update object or String if type is unknown
+    """
+    for c in [FastPathBitmapUpdateDataPDU, FastPathOrderUpdateDataPDU, FastPathSurfaceCommandsUpdate, FastPathPointerHiddenUpdate, FastPathPointerDefaultUpdate, PointerPositionUpdate, ColorPointerUpdate, CachedPointerUpdate, NewPointerUpdate]:
+        if updateCode == c._FASTPATH_UPDATE_TYPE_:
+            return c(readLen = readLen)
+    log.debug("unknown Fast Path PDU update data type : %s"%hex(updateCode))
+    return String(readLen = readLen)
+
 class FastPathUpdatePDU(CompositeType):
     """
     @summary: Fast path update PDU packet
     @see: http://msdn.microsoft.com/en-us/library/cc240622.aspx
     """
-    def __init__(self, updateData = None):
+    def __init__(self, updateData = None, updateCode = None, fragmentation = FastPathFragmentation.FASTPATH_FRAGMENT_SINGLE, compressionFlags = None):
+        """
+        @param updateData: {FastPathXXXUpdateDataPDU | String} update object or raw payload (fragment or compressed)
+        @param updateCode: {FastPathUpdateType} mandatory if updateData is a raw payload
+        @param fragmentation: {FastPathFragmentation}
+        @param compressionFlags: {integer} bulk compression flags of raw payload, None if not compressed
+        """
         CompositeType.__init__(self)
-        self.updateHeader = UInt8(lambda:updateData.__class__._FASTPATH_UPDATE_TYPE_)
-        self.compressionFlags = UInt8(conditional = lambda:((self.updateHeader.value >> 4) & FastPathOutputCompression.FASTPATH_OUTPUT_COMPRESSION_USED))
+        if updateCode is None and not updateData is None:
+            if not "_FASTPATH_UPDATE_TYPE_" in  updateData.__class__.__dict__:
+                raise InvalidExpectedDataException("Try to send an invalid fast path data update PDU")
+            updateCode = updateData.__class__._FASTPATH_UPDATE_TYPE_
+        compression = 0 if compressionFlags is None else FastPathOutputCompression.FASTPATH_OUTPUT_COMPRESSION_USED
+        
+        self.updateHeader = UInt8(lambda:(updateCode | (fragmentation << 4) | (compression << 6)))
+        self.compressionFlags = UInt8(compressionFlags or 0, conditional = lambda:((self.updateHeader.value >> 6) & FastPathOutputCompression.FASTPATH_OUTPUT_COMPRESSION_USED))
         self.size = UInt16Le(lambda:sizeof(self.updateData))
         
         def UpdateDataFactory():
             """
             @summary: Create correct object in accordance to self.updateHeader field
             """
-            for c in [FastPathBitmapUpdateDataPDU]:
-                if (self.updateHeader.value & 0xf) == c._FASTPATH_UPDATE_TYPE_:
-                    return c(readLen = self.size)
-            log.debug("unknown Fast Path PDU update data type : %s"%hex(self.updateHeader.value & 0xf))
-            return String(readLen = self.size)
+            #compressed payload and fragments are parsed by PDU layer
+            if self.compressionFlags.value & CompressionOrder.PACKET_COMPRESSED or self.getFragmentation() != FastPathFragmentation.FASTPATH_FRAGMENT_SINGLE:
+                return String(readLen = self.size)
+            return createFastPathUpdateData(self.getUpdateCode(), self.size)
             
         if updateData is None:
             updateData = FactoryType(UpdateDataFactory)
-        elif not "_FASTPATH_UPDATE_TYPE_" in  updateData.__class__.__dict__:
-            raise InvalidExpectedDataException("Try to send an invalid fast path data update PDU")
             
         self.updateData = updateData
+        
+    def getUpdateCode(self):
+        """
+        @return: {FastPathUpdateType} update code of update header
+        """
+        return self.updateHeader.value & 0xf
+    
+    def getFragmentation(self):
+        """
+        @return: {FastPathFragmentation} fragmentation of update header
+        """
+        return (self.updateHeader.value >> 4) & 0x3
   
 class BitmapUpdateDataPDU(CompositeType):
     """
@@ -847,15 +1002,17 @@ class BitmapUpdateDataPDU(CompositeType):
 class OrderUpdateDataPDU(CompositeType):
     """
     @summary: PDU type use to communicate Accelerated order (GDI)
+                orders are decoded by order.OrderDecoder because they depend on previous orders
     @see: http://msdn.microsoft.com/en-us/library/cc241571.aspx
-    @todo: not implemented yet but need it
     """
+    _UPDATE_TYPE_ = UpdateType.UPDATETYPE_ORDERS
+    
     def __init__(self, readLen = None):
         CompositeType.__init__(self, readLen = readLen)
         self.pad2OctetsA = UInt16Le()
-        self.numberOrders = UInt16Le(lambda:len(self.orderData._array))
+        self.numberOrders = UInt16Le()
         self.pad2OctetsB = UInt16Le()
-        self.orderData = ArrayType(order.PrimaryDrawingOrder, readLen = self.numberOrders)
+        self.orderData = String(readLen = CallableValue(lambda:readLen.value - 6))
 
 class BitmapCompressedDataHeader(CompositeType):
     """
@@ -903,6 +1060,31 @@ class BitmapData(CompositeType):
         self.bitmapLength = UInt16Le(lambda:(sizeof(self.bitmapComprHdr) + sizeof(self.bitmapDataStream)))
         self.bitmapComprHdr = BitmapCompressedDataHeader(bodySize = lambda:sizeof(self.bitmapDataStream), scanWidth = lambda:self.width.value, uncompressedSize = lambda:(self.width.value * self.height.value * self.bitsPerPixel.value), conditional = lambda:((self.flags.value & BitmapFlag.BITMAP_COMPRESSION) and not (self.flags.value & BitmapFlag.NO_BITMAP_COMPRESSION_HDR)))
         self.bitmapDataStream = String(bitmapDataStream, readLen = CallableValue(lambda:(self.bitmapLength.value if (not self.flags.value & BitmapFlag.BITMAP_COMPRESSION or self.flags.value & BitmapFlag.NO_BITMAP_COMPRESSION_HDR) else self.bitmapComprHdr.cbCompMainBodySize.value)))
+        
+class BitmapDataEx(CompositeType):
+    """
+    @summary: Bitmap encoded with a codec (use by cache bitmap revision 3 and surface commands)
+    @see: http://msdn.microsoft.com/en-us/library/dd302200.aspx
+    """
+    def __init__(self, bitsPerPixel = 0, codecID = 0, width = 0, height = 0, bitmapData = ""):
+        """
+        @param bitsPerPixel: color depth
+        @param codecID: codec id negotiated in bitmap codecs capability (0 for raw)
+        @param width: width of image
+        @param height: height of image
+        @param bitmapData: encoded bitmap
+        """
+        CompositeType.__init__(self)
+        self.bpp = UInt8(bitsPerPixel)
+        self.flags = UInt8()
+        self.reserved = UInt8()
+        self.codecID = UInt8(codecID)
+        self.width = UInt16Le(width)
+        self.height = UInt16Le(height)
+        self.bitmapDataLength = UInt32Le(lambda:sizeof(self.bitmapData))
+        #TS_COMPRESSED_BITMAP_HEADER_EX (unique id and timestamp) is not used
+        self.exBitmapDataHeader = String("\x00" * 24, readLen = CallableValue(24), conditional = lambda:(self.flags.value & BitmapDataExFlag.EX_COMPRESSED_BITMAP_HEADER_PRESENT))
+        self.bitmapData = String(bitmapData, readLen = self.bitmapDataLength)
 
 class FastPathBitmapUpdateDataPDU(CompositeType):
     """
@@ -916,6 +1098,206 @@ class FastPathBitmapUpdateDataPDU(CompositeType):
         self.header = UInt16Le(FastPathUpdateType.FASTPATH_UPDATETYPE_BITMAP, constant = True)
         self.numberRectangles = UInt16Le(lambda:len(self.rectangles._array))
         self.rectangles = ArrayType(BitmapData, readLen = self.numberRectangles)
+        
+class FastPathOrderUpdateDataPDU(CompositeType):
+    """
+    @summary: Fast path version of order update PDU
+    @see: http://msdn.microsoft.com/en-us/library/cc240622.aspx
+    """
+    _FASTPATH_UPDATE_TYPE_ = FastPathUpdateType.FASTPATH_UPDATETYPE_ORDERS
+    
+    def __init__(self, readLen = None):
+        CompositeType.__init__(self, readLen = readLen)
+        self.numberOrders = UInt16Le()
+        self.orderData = String(readLen = CallableValue(lambda:readLen.value - 2))
+    
+class FastPathSurfaceCommandsUpdate(CompositeType):
+    """
+    @summary: Fast path update which contain surface commands
+                commands are decoded by PDU layer
+    @see: http://msdn.microsoft.com/en-us/library/cc240622.aspx
+    """
+    _FASTPATH_UPDATE_TYPE_ = FastPathUpdateType.FASTPATH_UPDATETYPE_SURFCMDS
+    
+    def __init__(self, surfaceCommands = "", readLen = None):
+        """
+        @param surfaceCommands: {str} encoded SurfaceCommand sequence
+        """
+        CompositeType.__init__(self, readLen = readLen)
+        self.surfaceCommands = String(surfaceCommands, readLen = readLen)
+        
+class SurfaceBitsCommand(CompositeType):
+    """
+    @summary: Bitmap encoded with codec to draw at destination
+                stream surface bits command has same layout
+    @see: http://msdn.microsoft.com/en-us/library/dd302198.aspx
+    """
+    _CMD_TYPE_ = SurfaceCommandType.CMDTYPE_SET_SURFACE_BITS
+    
+    def __init__(self, destLeft = 0, destTop = 0, destRight = 0, destBottom = 0, bitmapData = None):
+        """
+        @param destLeft: destination left coordinate
+        @param destTop: destination top coordinate
+        @param destRight: destination right coordinate (exclusive)
+        @param destBottom: destination bottom coordinate (exclusive)
+        @param bitmapData: {BitmapDataEx}
+        """
+        CompositeType.__init__(self)
+        self.destLeft = UInt16Le(destLeft)
+        self.destTop = UInt16Le(destTop)
+        self.destRight = UInt16Le(destRight)
+        self.destBottom = UInt16Le(destBottom)
+        self.bitmapData = bitmapData or BitmapDataEx()
+        
+class FrameMarkerCommand(CompositeType):
+    """
+    @summary: Begin or end of a frame of surface commands
+    @see: http://msdn.microsoft.com/en-us/library/dd302199.aspx
+    """
+    _CMD_TYPE_ = SurfaceCommandType.CMDTYPE_FRAME_MARKER
+    
+    def __init__(self, frameAction = FrameAction.SURFACECMD_FRAMEACTION_BEGIN, frameId = 0):
+        """
+        @param frameAction: {FrameAction}
+        @param frameId: {integer} identifier of frame
+        """
+        CompositeType.__init__(self)
+        self.frameAction = UInt16Le(frameAction)
+        self.frameId = UInt32Le(frameId)
+        
+class SurfaceCommand(CompositeType):
+    """
+    @summary: Surface command header
+    @see: http://msdn.microsoft.com/en-us/library/dd302197.aspx
+    """
+    def __init__(self, command = None, cmdType = None):
+        """
+        @param command: {SurfaceBitsCommand | FrameMarkerCommand}
+        @param cmdType: {SurfaceCommandType} override type of command (stream surface bits)
+        """
+        CompositeType.__init__(self)
+        self.cmdType = UInt16Le(lambda:(cmdType or command.__class__._CMD_TYPE_))
+        
+        def CommandFactory():
+            """
+            @summary: Create command in accordance to self.cmdType field
+            """
+            if self.cmdType.value in [SurfaceCommandType.CMDTYPE_SET_SURFACE_BITS, SurfaceCommandType.CMDTYPE_STREAM_SURFACE_BITS]:
+                return SurfaceBitsCommand()
+            elif self.cmdType.value == SurfaceCommandType.CMDTYPE_FRAME_MARKER:
+                return FrameMarkerCommand()
+            #commands don't have length field
+            raise InvalidExpectedDataException("Unknown surface command type %s"%hex(self.cmdType.value))
+        
+        if command is None:
+            command = FactoryType(CommandFactory)
+        elif not "_CMD_TYPE_" in command.__class__.__dict__:
+            raise InvalidExpectedDataException("Try to send an invalid surface command")
+        
+        self.command = command
+    
+class FastPathPointerHiddenUpdate(CompositeType):
+    """
+    @summary: Fast path update use to hide pointer
+    @see: http://msdn.microsoft.com/en-us/library/cc240622.aspx
+    """
+    _FASTPATH_UPDATE_TYPE_ = FastPathUpdateType.FASTPATH_UPDATETYPE_PTR_NULL
+    
+    def __init__(self, readLen = None):
+        CompositeType.__init__(self, readLen = readLen)
+        
+class FastPathPointerDefaultUpdate(CompositeType):
+    """
+    @summary: Fast path update use to set default system pointer
+    @see: http://msdn.microsoft.com/en-us/library/cc240622.aspx
+    """
+    _FASTPATH_UPDATE_TYPE_ = FastPathUpdateType.FASTPATH_UPDATETYPE_PTR_DEFAULT
+    
+    def __init__(self, readLen = None):
+        CompositeType.__init__(self, readLen = readLen)
+        
+class SystemPointerUpdate(CompositeType):
+    """
+    @summary: Hide pointer or set default system pointer
+    @see: http://msdn.microsoft.com/en-us/library/cc240616.aspx
+    """
+    _MESSAGE_TYPE_ = PointerMessageType.TS_PTRMSGTYPE_SYSTEM
+    
+    def __init__(self, systemPointerType = SystemPointerType.SYSPTR_DEFAULT, readLen = None):
+        CompositeType.__init__(self, readLen = readLen)
+        self.systemPointerType = UInt32Le(systemPointerType)
+        
+class PointerPositionUpdate(CompositeType):
+    """
+    @summary: Move pointer on client side
+    @see: http://msdn.microsoft.com/en-us/library/cc240617.aspx
+    """
+    _MESSAGE_TYPE_ = PointerMessageType.TS_PTRMSGTYPE_POSITION
+    _FASTPATH_UPDATE_TYPE_ = FastPathUpdateType.FASTPATH_UPDATETYPE_PTR_POSITION
+    
+    def __init__(self, readLen = None):
+        CompositeType.__init__(self, readLen = readLen)
+        self.xPos = UInt16Le()
+        self.yPos = UInt16Le()
+        
+class ColorPointerUpdate(CompositeType):
+    """
+    @summary: Pointer shape with a 24 bpp xor mask and a 1 bpp and mask
+                masks rows are bottom-up and padded on 2 bytes
+                pointer is stored in pointer cache
+    @see: http://msdn.microsoft.com/en-us/library/cc240618.aspx
+    """
+    _MESSAGE_TYPE_ = PointerMessageType.TS_PTRMSGTYPE_COLOR
+    _FASTPATH_UPDATE_TYPE_ = FastPathUpdateType.FASTPATH_UPDATETYPE_COLOR
+    
+    def __init__(self, readLen = None):
+        CompositeType.__init__(self, readLen = readLen)
+        self.cacheIndex = UInt16Le()
+        self.hotSpotX = UInt16Le()
+        self.hotSpotY = UInt16Le()
+        self.width = UInt16Le()
+        self.height = UInt16Le()
+        self.lengthAndMask = UInt16Le(lambda:sizeof(self.andMaskData))
+        self.lengthXorMask = UInt16Le(lambda:sizeof(self.xorMaskData))
+        self.xorMaskData = String(readLen = self.lengthXorMask)
+        self.andMaskData = String(readLen = self.lengthAndMask)
+        
+    def getXorBpp(self):
+        """
+        @return: {integer} color depth of xor mask
+        """
+        return 24
+        
+class CachedPointerUpdate(CompositeType):
+    """
+    @summary: Use a pointer of pointer cache
+    @see: http://msdn.microsoft.com/en-us/library/cc240620.aspx
+    """
+    _MESSAGE_TYPE_ = PointerMessageType.TS_PTRMSGTYPE_CACHED
+    _FASTPATH_UPDATE_TYPE_ = FastPathUpdateType.FASTPATH_UPDATETYPE_CACHED
+    
+    def __init__(self, readLen = None):
+        CompositeType.__init__(self, readLen = readLen)
+        self.cacheIndex = UInt16Le()
+        
+class NewPointerUpdate(CompositeType):
+    """
+    @summary: Pointer shape with xor mask of any color depth
+    @see: http://msdn.microsoft.com/en-us/library/cc240619.aspx
+    """
+    _MESSAGE_TYPE_ = PointerMessageType.TS_PTRMSGTYPE_POINTER
+    _FASTPATH_UPDATE_TYPE_ = FastPathUpdateType.FASTPATH_UPDATETYPE_POINTER
+    
+    def __init__(self, readLen = None):
+        CompositeType.__init__(self, readLen = readLen)
+        self.xorBpp = UInt16Le()
+        self.colorPtrAttr = ColorPointerUpdate()
+        
+    def getXorBpp(self):
+        """
+        @return: {integer} color depth of xor mask
+        """
+        return self.xorBpp.value
     
 class SlowPathInputEvent(CompositeType):
     """
@@ -958,6 +1340,8 @@ class PointerEvent(CompositeType):
     @see: http://msdn.microsoft.com/en-us/library/cc240586.aspx
     """
     _INPUT_MESSAGE_TYPE_ = InputMessageType.INPUT_EVENT_MOUSE
+    #same layout in fast path
+    _FASTPATH_INPUT_EVENT_CODE_ = FastPathInputEventCode.FASTPATH_INPUT_EVENT_MOUSE
     
     def __init__(self):
         CompositeType.__init__(self)
@@ -971,6 +1355,8 @@ class PointerExEvent(CompositeType):
     @see: http://msdn.microsoft.com/en-us/library/cc240587.aspx
     """
     _INPUT_MESSAGE_TYPE_ = InputMessageType.INPUT_EVENT_MOUSEX
+    #same layout in fast path
+    _FASTPATH_INPUT_EVENT_CODE_ = FastPathInputEventCode.FASTPATH_INPUT_EVENT_MOUSEX
     
     def __init__(self):
         CompositeType.__init__(self)
@@ -1002,4 +1388,107 @@ class UnicodeKeyEvent(CompositeType):
         CompositeType.__init__(self)
         self.keyboardFlags = UInt16Le()
         self.unicode = UInt16Le()
-        self.pad2Octets = UInt16Le()
\ No newline at end of file
+        self.pad2Octets = UInt16Le()
+        
+class FastPathInputEvent(CompositeType):
+    """
+    @summary: Fast path input event, flags are encoded in event header
+    @see: http://msdn.microsoft.com/en-us/library/cc240591.aspx
+    """
+    def __init__(self, eventData = None, eventFlags = 0):
+        """
+        @param eventData: {FastPathXXXEvent | PointerEvent | PointerExEvent}
+        @param eventFlags: {integer} 5 bits flags of event (FastPathKeyboardFlag or ToogleFlag)
+        """
+        CompositeType.__init__(self)
+        self.eventHeader = UInt8(lambda:((self.eventData.__class__._FASTPATH_INPUT_EVENT_CODE_ << 5) | (eventFlags & 0x1f)))
+        
+        def FastPathInputEventFactory():
+            """
+            @summary: Create object in accordance with event code
+            """
+            for c in [FastPathScancodeKeyEvent, PointerEvent, PointerExEvent, FastPathSynchronizeEvent, FastPathUnicodeKeyEvent]:
+                if self.getEventCode() == c._FASTPATH_INPUT_EVENT_CODE_:
+                    return c()
+            raise InvalidExpectedDataException("unknown fast path input : %s"%hex(self.getEventCode()))
+        
+        if eventData is None:
+            eventData = FactoryType(FastPathInputEventFactory)
+        elif not "_FASTPATH_INPUT_EVENT_CODE_" in eventData.__class__.__dict__:
+            raise InvalidExpectedDataException("try to send an invalid Fast Path Input Event")
+        
+        self.eventData = eventData
+        
+    def getEventCode(self):
+        """
+        @return: {FastPathInputEventCode} code of event header
+        """
+        return self.eventHeader.value >> 5
+    
+    def getEventFlags(self):
+        """
+        @return: {integer} flags of event header
+        """
+        return self.eventHeader.value & 0x1f
+        
+class FastPathScancodeKeyEvent(CompositeType):
+    """
+    @summary: Fast path version of scan code event
+    @see: http://msdn.microsoft.com/en-us/library/cc240594.aspx
+    """
+    _FASTPATH_INPUT_EVENT_CODE_ = FastPathInputEventCode.FASTPATH_INPUT_EVENT_SCANCODE
+    
+    def __init__(self):
+        CompositeType.__init__(self)
+        self.keyCode = UInt8()
+        
+class FastPathUnicodeKeyEvent(CompositeType):
+    """
+    @summary: Fast path version of unicode event
+    @see: http://msdn.microsoft.com/en-us/library/cc240595.aspx
+    """
+    _FASTPATH_INPUT_EVENT_CODE_ = FastPathInputEventCode.FASTPATH_INPUT_EVENT_UNICODE
+    
+    def __init__(self):
+        CompositeType.__init__(self)
+        self.unicode = UInt16Le()
+        
+class FastPathSynchronizeEvent(CompositeType):
+    """
+    @summary: Fast path version of synchronize event
+    toggle flags are encoded in event header
+    @see: http://msdn.microsoft.com/en-us/library/cc240597.aspx
+    """
+    _FASTPATH_INPUT_EVENT_CODE_ = FastPathInputEventCode.FASTPATH_INPUT_EVENT_SYNC
+    
+def createFastPathInputEvent(slowPathInputData):
+    """
+    @summary: Convert slow path input event data into fast path input event
+    @param slowPathInputData: {PointerEvent | PointerExEvent | ScancodeKeyEvent | UnicodeKeyEvent | SynchronizeEvent}
+    @return: {FastPathInputEvent}
+    """
+    if isinstance(slowPathInputData, PointerEvent) or isinstance(slowPathInputData, PointerExEvent):
+        return FastPathInputEvent(slowPathInputData)
+    
+    if isinstance(slowPathInputData, SynchronizeEvent):
+        return FastPathInputEvent(FastPathSynchronizeEvent(), slowPathInputData.toggleFlags.value)
+    
+    eventFlags = 0
+    if slowPathInputData.keyboardFlags.value & KeyboardFlag.KBDFLAGS_RELEASE:
+        eventFlags |= FastPathKeyboardFlag.FASTPATH_INPUT_KBDFLAGS_RELEASE
+        
+    if isinstance(slowPathInputData, UnicodeKeyEvent):
+        event = FastPathUnicodeKeyEvent()
+        event.unicode.value = slowPathInputData.unicode.value
+        return FastPathInputEvent(event, eventFlags)
+    
+    if isinstance(slowPathInputData, ScancodeKeyEvent):
+        if slowPathInputData.keyboardFlags.value & KeyboardFlag.KBDFLAGS_EXTENDED:
+            eventFlags |= FastPathKeyboardFlag.FASTPATH_INPUT_KBDFLAGS_EXTENDED
+        if slowPathInputData.keyboardFlags.value & KeyboardFlag.KBDFLAGS_EXTENDED1:
+            eventFlags |= FastPathKeyboardFlag.FASTPATH_INPUT_KBDFLAGS_EXTENDED1
+        event = FastPathScancodeKeyEvent()
+        event.keyCode.value = slowPathInputData.keyCode.value & 0xff
+        return FastPathInputEvent(event, eventFlags)
+    
+    raise InvalidExpectedDataException("no fast path version of input event %s"%slowPathInputData.__class__)
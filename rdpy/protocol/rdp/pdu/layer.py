@@ -24,11 +24,12 @@ In this layer are managed all mains bitmap update orders end user inputs
 """
 
 from rdpy.core.layer import LayerAutomata
-from rdpy.core.error import CallPureVirtualFuntion
-from rdpy.core.type import ArrayType
+from rdpy.core.error import CallPureVirtualFuntion, InvalidExpectedDataException
+from rdpy.core.type import ArrayType, CallableValue, Stream, String, UInt8, sizeof
 import rdpy.core.log as log
 import rdpy.protocol.rdp.tpkt as tpkt
-import data, caps
+import data, caps, order
+import bulk
 
 class PDUClientListener(object):
     """
@@ -54,11 +55,34 @@ class PDUClientListener(object):
         """
         raise CallPureVirtualFuntion("%s:%s defined by interface %s"%(self.__class__, "onUpdate", "PDUClientListener"))
     
-    def recvDstBltOrder(self, order):
+    def onPrimaryOrder(self, primaryOrder):
         """
-        @param order: rectangle order
+        @summary: call for each primary drawing order of order update
+                    order object is reused by next order of same type
+        @param primaryOrder: {order.PrimaryDrawingOrder}
         """
-        pass
+        raise CallPureVirtualFuntion("%s:%s defined by interface %s"%(self.__class__, "onPrimaryOrder", "PDUClientListener"))
+    
+    def onSecondaryOrder(self, secondaryOrder):
+        """
+        @summary: call for each secondary drawing order (cache orders) of order update
+        @param secondaryOrder: {order.SecondaryDrawingOrder}
+        """
+        raise CallPureVirtualFuntion("%s:%s defined by interface %s"%(self.__class__, "onSecondaryOrder", "PDUClientListener"))
+    
+    def onPointerUpdate(self, pointerUpdate):
+        """
+        @summary: call for each pointer update (slow path or fast path)
+        @param pointerUpdate: {data.SystemPointerUpdate | data.PointerPositionUpdate | data.ColorPointerUpdate | data.CachedPointerUpdate | data.NewPointerUpdate}
+        """
+        raise CallPureVirtualFuntion("%s:%s defined by interface %s"%(self.__class__, "onPointerUpdate", "PDUClientListener"))
+    
+    def onSurfaceCommand(self, surfaceCommand):
+        """
+        @summary: call for each surface command of fast path surface commands update
+        @param surfaceCommand: {data.SurfaceCommand}
+        """
+        raise CallPureVirtualFuntion("%s:%s defined by interface %s"%(self.__class__, "onSurfaceCommand", "PDUClientListener"))
 
 class PDUServerListener(object):
     """
@@ -77,6 +101,13 @@ class PDUServerListener(object):
         """
         raise CallPureVirtualFuntion("%s:%s defined by interface %s"%(self.__class__, "onSlowPathInput", "PDUServerListener"))
     
+    def onFastPathInput(self, fastPathInputEvents):
+        """
+        @summary: Event call when fast path input are available
+        @param fastPathInputEvents: [data.FastPathInputEvent]
+        """
+        raise CallPureVirtualFuntion("%s:%s defined by interface %s"%(self.__class__, "onFastPathInput", "PDUServerListener"))
+    
 class PDULayer(LayerAutomata, tpkt.IFastPathListener):
     """
     @summary: Global channel for MCS that handle session
@@ -115,6 +146,10 @@ class PDULayer(LayerAutomata, tpkt.IFastPathListener):
         self._shareId = 0x103EA
         #enable or not fast path
         self._fastPathSender = None
+        #bulk decompressor (history is shared by slow path and fast path)
+        self._bulkDecompressor = None
+        #record compressed payloads (rss.FileRecorder)
+        self._bulkRecorder = None
         
     def setFastPathSender(self, fastPathSender):
         """
@@ -123,6 +158,39 @@ class PDULayer(LayerAutomata, tpkt.IFastPathListener):
         """
         self._fastPathSender = fastPathSender
     
+    def decompress(self, compressionFlags, payload):
+        """
+        @summary: Bulk decompress payload in accordance with compression flags
+        @param compressionFlags: {int} CompressionOrder | CompressionType
+        @param payload: {str} compressed payload
+        @return: {Stream} decompressed payload
+        @see: http://msdn.microsoft.com/en-us/library/cc240837.aspx
+        """
+        if not self._bulkRecorder is None:
+            self._bulkRecorder.bulk(compressionFlags, payload)
+        compressionType = compressionFlags & data.CompressionOrder.CompressionTypeMask
+        try:
+            if self._bulkDecompressor is None or self._bulkDecompressor.type != compressionType:
+                self._bulkDecompressor = bulk.Decompressor(compressionType)
+            return Stream(self._bulkDecompressor.decompress(payload, compressionFlags))
+        except ValueError as e:
+            raise InvalidExpectedDataException("Bulk decompression failed : %s"%e)
+        
+    def decompressDataPDU(self, dataPDU):
+        """
+        @summary: Replace compressed payload of data PDU by its parsed content
+        Must be called on each data PDU to keep history synchronized
+        @param dataPDU: {DataPDU}
+        """
+        compressedType = dataPDU.shareDataHeader.compressedType.value
+        if compressedType & data.CompressionOrder.PACKET_COMPRESSED:
+            s = self.decompress(compressedType, dataPDU.pduData.value)
+            pduData = data.createPDUData(dataPDU.shareDataHeader.pduType2.value, CallableValue(s.dataLen()))
+            s.readType(pduData)
+            dataPDU.pduData = pduData
+        elif compressedType & data.CompressionOrder.PACKET_FLUSHED:
+            self.decompress(compressedType, "")
+        
     def sendPDU(self, pduMessage):
         """
         @summary: Send a PDU data to transport layer
@@ -141,12 +209,60 @@ class Client(PDULayer):
     """
     @summary: Client automata of PDU layer
     """
+    #max size of reassembled fast path update advertised to server
+    _FASTPATH_MAX_REQUEST_SIZE_ = 0x200000
+    #initial size of fast path reassembly buffer
+    _FASTPATH_FRAGMENT_BUFFER_SIZE_ = 0x10000
+    #number of entries of each bitmap cache cell
+    _BITMAP_CACHE_CELLS_ = [600, 600, 2048]
+    #(number of entries, max size of glyph) of each glyph cache cell
+    _GLYPH_CACHE_CELLS_ = [(254, 4), (254, 4), (254, 8), (254, 8), (254, 16), (254, 32), (254, 64), (254, 128), (254, 256), (64, 2048)]
+    #256 fragments of 256 bytes max
+    _GLYPH_FRAGMENT_CACHE_ = 0x01000100
+    
     def __init__(self, listener):
         """
         @param listener: PDUClientListener
         """
         PDULayer.__init__(self)
         self._listener = listener
+        #fast path fragment reassembly
+        self._fragmentBuffer = bytearray(self._FASTPATH_FRAGMENT_BUFFER_SIZE_)
+        self._fragmentLength = 0
+        self._fragmentUpdateCode = None
+        #drawing orders state
+        self._orderDecoder = order.OrderDecoder()
+        #drawing orders are advertised only if client render them
+        self._drawingOrders = False
+        
+        #bitmap cache revision 2 replace revision 1
+        del self._clientCapabilities[caps.CapsType.CAPSTYPE_BITMAPCACHE]
+        bitmapCacheCapability = caps.BitmapCacheRev2Capability()
+        bitmapCacheCapability.numCellCaches.value = len(self._BITMAP_CACHE_CELLS_)
+        for i in range(0, len(self._BITMAP_CACHE_CELLS_)):
+            bitmapCacheCapability.bitmapCacheCellInfo[i].value = self._BITMAP_CACHE_CELLS_[i]
+        self._clientCapabilities[caps.CapsType.CAPSTYPE_BITMAPCACHE_REV2] = caps.Capability(bitmapCacheCapability)
+        self._clientCapabilities[caps.CapsType.CAPSTYPE_BRUSH].capability.brushSupportLevel.value = caps.BrushSupport.BRUSH_COLOR_FULL
+        
+        #glyph cache
+        glyphCapability = self._clientCapabilities[caps.CapsType.CAPSTYPE_GLYPHCACHE].capability
+        for i in range(0, len(self._GLYPH_CACHE_CELLS_)):
+            glyphCapability.glyphCache[i].cacheEntries.value, glyphCapability.glyphCache[i].cacheMaximumCellSize.value = self._GLYPH_CACHE_CELLS_[i]
+        glyphCapability.fragCache.value = self._GLYPH_FRAGMENT_CACHE_
+        glyphCapability.glyphSupportLevel.value = caps.GlyphSupport.GLYPH_SUPPORT_FULL
+        
+        #pointer cache size field is needed to receive new pointer update
+        pointerCapability = caps.PointerCapability(isServer = True)
+        pointerCapability.colorPointerFlag.value = 1
+        pointerCapability.pointerCacheSize.value = pointerCapability.colorPointerCacheSize.value
+        self._clientCapabilities[caps.CapsType.CAPSTYPE_POINTER] = caps.Capability(pointerCapability)
+        
+        #persistent bitmap cache (cache.PersistentBitmapCache)
+        self._persistentBitmapCache = None
+        #keys sent at first activation by cell, None if not sent
+        self._persistentKeys = None
+        #bitmaps of sent keys by cell (width, height, pixels), until they are loaded in bitmap cache
+        self._persistentBitmaps = None
         
     def connect(self):
         """
@@ -204,6 +320,8 @@ class Client(PDULayer):
         """
         pdu = data.PDU()
         s.readType(pdu)
+        if pdu.shareControlHeader.pduType.value == data.PDUType.PDUTYPE_DATAPDU:
+            self.decompressDataPDU(pdu.pduMessage)
         if pdu.shareControlHeader.pduType.value != data.PDUType.PDUTYPE_DATAPDU or pdu.pduMessage.shareDataHeader.pduType2.value != data.PDUType2.PDUTYPE2_SYNCHRONIZE:
             #not a blocking error because in deactive reactive sequence 
             #input can be send too but ignored
@@ -220,6 +338,8 @@ class Client(PDULayer):
         """
         pdu = data.PDU()
         s.readType(pdu)
+        if pdu.shareControlHeader.pduType.value == data.PDUType.PDUTYPE_DATAPDU:
+            self.decompressDataPDU(pdu.pduMessage)
         if pdu.shareControlHeader.pduType.value != data.PDUType.PDUTYPE_DATAPDU or pdu.pduMessage.shareDataHeader.pduType2.value != data.PDUType2.PDUTYPE2_CONTROL or pdu.pduMessage.pduData.action.value != data.Action.CTRLACTION_COOPERATE:
             #not a blocking error because in deactive reactive sequence 
             #input can be send too but ignored
@@ -236,6 +356,8 @@ class Client(PDULayer):
         """
         pdu = data.PDU()
         s.readType(pdu)
+        if pdu.shareControlHeader.pduType.value == data.PDUType.PDUTYPE_DATAPDU:
+            self.decompressDataPDU(pdu.pduMessage)
         if pdu.shareControlHeader.pduType.value != data.PDUType.PDUTYPE_DATAPDU or pdu.pduMessage.shareDataHeader.pduType2.value != data.PDUType2.PDUTYPE2_CONTROL or pdu.pduMessage.pduData.action.value != data.Action.CTRLACTION_GRANTED_CONTROL:
             #not a blocking error because in deactive reactive sequence 
             #input can be send too but ignored
@@ -252,6 +374,8 @@ class Client(PDULayer):
         """
         pdu = data.PDU()
         s.readType(pdu)
+        if pdu.shareControlHeader.pduType.value == data.PDUType.PDUTYPE_DATAPDU:
+            self.decompressDataPDU(pdu.pduMessage)
         if pdu.shareControlHeader.pduType.value != data.PDUType.PDUTYPE_DATAPDU or pdu.pduMessage.shareDataHeader.pduType2.value != data.PDUType2.PDUTYPE2_FONTMAP:
             #not a blocking error because in deactive reactive sequence 
             #input can be send too but ignored
@@ -271,6 +395,7 @@ class Client(PDULayer):
         s.readType(pdus)
         for pdu in pdus:
             if pdu.shareControlHeader.pduType.value == data.PDUType.PDUTYPE_DATAPDU:
+                self.decompressDataPDU(pdu.pduMessage)
                 self.readDataPDU(pdu.pduMessage)
             elif pdu.shareControlHeader.pduType.value == data.PDUType.PDUTYPE_DEACTIVATEALLPDU:
                 #use in deactivation-reactivation sequence
@@ -288,8 +413,74 @@ class Client(PDULayer):
         updates = ArrayType(data.FastPathUpdatePDU)
         fastPathS.readType(updates)
         for update in updates:
-            if update.updateHeader.value == data.FastPathUpdateType.FASTPATH_UPDATETYPE_BITMAP:
-                self._listener.onUpdate(update.updateData.rectangles._array)
+            updateCode = update.getUpdateCode()
+            fragmentation = update.getFragmentation()
+            
+            if update.compressionFlags.value & data.CompressionOrder.PACKET_COMPRESSED:
+                s = self.decompress(update.compressionFlags.value, update.updateData.value)
+            else:
+                if update.compressionFlags.value & data.CompressionOrder.PACKET_FLUSHED:
+                    self.decompress(update.compressionFlags.value, "")
+                s = None
+            
+            if fragmentation != data.FastPathFragmentation.FASTPATH_FRAGMENT_SINGLE:
+                s = self.reassembleFastPathFragment(updateCode, fragmentation, update.updateData.value if s is None else s.getvalue())
+                if s is None:
+                    continue
+                
+            if s is None:
+                updateData = update.updateData
+            else:
+                updateData = data.createFastPathUpdateData(updateCode, CallableValue(s.dataLen()))
+                s.readType(updateData)
+                
+            if updateCode == data.FastPathUpdateType.FASTPATH_UPDATETYPE_BITMAP:
+                self._listener.onUpdate(updateData.rectangles._array)
+            elif updateCode == data.FastPathUpdateType.FASTPATH_UPDATETYPE_ORDERS:
+                self.readOrders(updateData.numberOrders.value, updateData.orderData.value)
+            elif updateCode == data.FastPathUpdateType.FASTPATH_UPDATETYPE_SURFCMDS:
+                self.readSurfaceCommands(updateData.surfaceCommands.value)
+            elif updateCode == data.FastPathUpdateType.FASTPATH_UPDATETYPE_PTR_NULL:
+                self._listener.onPointerUpdate(data.SystemPointerUpdate(data.SystemPointerType.SYSPTR_NULL))
+            elif updateCode == data.FastPathUpdateType.FASTPATH_UPDATETYPE_PTR_DEFAULT:
+                self._listener.onPointerUpdate(data.SystemPointerUpdate(data.SystemPointerType.SYSPTR_DEFAULT))
+            elif updateCode in [data.FastPathUpdateType.FASTPATH_UPDATETYPE_PTR_POSITION, data.FastPathUpdateType.FASTPATH_UPDATETYPE_COLOR, data.FastPathUpdateType.FASTPATH_UPDATETYPE_CACHED, data.FastPathUpdateType.FASTPATH_UPDATETYPE_POINTER]:
+                self._listener.onPointerUpdate(updateData)
+                
+    def reassembleFastPathFragment(self, updateCode, fragmentation, payload):
+        """
+        @summary: Append fragment into reassembly buffer
+        @param updateCode: {data.FastPathUpdateType} update code of fragment
+        @param fragmentation: {data.FastPathFragmentation} position of fragment
+        @param payload: {str} fragment payload (uncompressed)
+        @return: {Stream} of whole update data on last fragment else None
+                    stream read reassembly buffer in place, it must be read before next fragment
+        """
+        if fragmentation == data.FastPathFragmentation.FASTPATH_FRAGMENT_FIRST:
+            if self._fragmentLength != 0:
+                log.debug("Drop incomplete fast path update %s"%hex(self._fragmentUpdateCode))
+            self._fragmentLength = 0
+            self._fragmentUpdateCode = updateCode
+        elif self._fragmentUpdateCode != updateCode:
+            raise InvalidExpectedDataException("Unexpected fast path fragment %s"%hex(updateCode))
+        
+        end = self._fragmentLength + len(payload)
+        if end > self._FASTPATH_MAX_REQUEST_SIZE_:
+            raise InvalidExpectedDataException("Fast path update exceed max request size")
+        #grow buffer
+        if end > len(self._fragmentBuffer):
+            self._fragmentBuffer.extend(bytearray(max(end, 2 * len(self._fragmentBuffer)) - len(self._fragmentBuffer)))
+        self._fragmentBuffer[self._fragmentLength:end] = payload
+        self._fragmentLength = end
+        
+        if fragmentation != data.FastPathFragmentation.FASTPATH_FRAGMENT_LAST:
+            return None
+        
+        #read-only buffer avoid copy of whole update
+        s = Stream(buffer(self._fragmentBuffer, 0, self._fragmentLength))
+        self._fragmentLength = 0
+        self._fragmentUpdateCode = None
+        return s
         
     def readDataPDU(self, dataPDU):
         """
@@ -313,6 +504,8 @@ class Client(PDULayer):
             self._listener.onSessionReady()
         elif dataPDU.shareDataHeader.pduType2.value == data.PDUType2.PDUTYPE2_UPDATE:
             self.readUpdateDataPDU(dataPDU.pduData)
+        elif dataPDU.shareDataHeader.pduType2.value == data.PDUType2.PDUTYPE2_POINTER:
+            self._listener.onPointerUpdate(dataPDU.pduData.pointerData)
     
     def readUpdateDataPDU(self, updateDataPDU):
         """
@@ -322,6 +515,53 @@ class Client(PDULayer):
         """
         if updateDataPDU.updateType.value == data.UpdateType.UPDATETYPE_BITMAP:
             self._listener.onUpdate(updateDataPDU.updateData.rectangles._array)
+        elif updateDataPDU.updateType.value == data.UpdateType.UPDATETYPE_ORDERS:
+            self.readOrders(updateDataPDU.updateData.numberOrders.value, updateDataPDU.updateData.orderData.value)
+            
+    def readOrders(self, numberOrders, orderData):
+        """
+        @summary: Decode drawing orders and dispatch them
+        @param numberOrders: {integer} number of orders
+        @param orderData: {str} orders stream
+        """
+        try:
+            for drawingOrder in self._orderDecoder.readOrders(Stream(orderData), numberOrders):
+                if isinstance(drawingOrder, order.SecondaryDrawingOrder):
+                    self._listener.onSecondaryOrder(drawingOrder)
+                else:
+                    self._listener.onPrimaryOrder(drawingOrder)
+        except InvalidExpectedDataException as e:
+            #remaining orders can't be read
+            log.error("Unable to read drawing orders : %s"%e)
+        
+    def readSurfaceCommands(self, surfaceCommands):
+        """
+        @summary: Decode surface commands and dispatch them
+        @param surfaceCommands: {str} surface commands stream
+        """
+        commands = ArrayType(data.SurfaceCommand)
+        try:
+            Stream(surfaceCommands).readType(commands)
+        except InvalidExpectedDataException as e:
+            #commands don't have length, remaining commands can't be read
+            log.error("Unable to read surface commands : %s"%e)
+        for command in commands._array:
+            self._listener.onSurfaceCommand(command)
+            
+    def addBitmapCodec(self, codecGUID, codecID, codecProperties = ""):
+        """
+        @summary: Advertise a bitmap codec used by server in surface bits commands
+                    surface commands are advertised with first codec
+        @param codecGUID: {caps.CodecGUID}
+        @param codecID: {integer} identifier of codec in surface bits commands
+        @param codecProperties: {str} codec specific properties
+        """
+        if not self._clientCapabilities.has_key(caps.CapsType.CAPSETTYPE_BITMAP_CODECS):
+            surfaceCommandsCapability = caps.SurfaceCommandsCapability()
+            surfaceCommandsCapability.cmdFlags.value = caps.SurfaceCommandsFlag.SURFCMDS_SETSURFACEBITS | caps.SurfaceCommandsFlag.SURFCMDS_FRAMEMARKER | caps.SurfaceCommandsFlag.SURFCMDS_STREAMSURFACEBITS
+            self._clientCapabilities[caps.CapsType.CAPSETTYPE_SURFACE_COMMANDS] = caps.Capability(surfaceCommandsCapability)
+            self._clientCapabilities[caps.CapsType.CAPSETTYPE_BITMAP_CODECS] = caps.Capability(caps.BitmapCodecsCapability())
+        self._clientCapabilities[caps.CapsType.CAPSETTYPE_BITMAP_CODECS].capability.bitmapCodecArray._array.append(caps.BitmapCodec(codecGUID, codecID, codecProperties))
         
     def sendConfirmActivePDU(self):
         """
@@ -343,7 +583,13 @@ class Client(PDULayer):
          
         #init order capability
         orderCapability = self._clientCapabilities[caps.CapsType.CAPSTYPE_ORDER].capability
-        orderCapability.orderFlags.value |= caps.OrderFlag.ZEROBOUNDSDELTASSUPPORT
+        orderCapability.orderFlags.value |= caps.OrderFlag.ZEROBOUNDSDELTASSUPPORT | caps.OrderFlag.ORDERFLAGS_EXTRA_FLAGS
+        if self._drawingOrders:
+            orderCapability.orderSupportExFlags.value |= caps.OrderEx.ORDERFLAGS_EX_CACHE_BITMAP_REV3_SUPPORT
+            for c in [order.DstBltOrder, order.PatBltOrder, order.ScrBltOrder, order.OpaqueRectOrder, order.LineToOrder, order.MemBltOrder, order.GlyphIndexOrder, order.FastIndexOrder, order.FastGlyphOrder]:
+                orderCapability.orderSupport[c._NEGOTIATE_].value = 1
+        #new orders state for new activation
+        self._orderDecoder = order.OrderDecoder()
         
         #init input capability
         inputCapability = self._clientCapabilities[caps.CapsType.CAPSTYPE_INPUT].capability
@@ -354,6 +600,9 @@ class Client(PDULayer):
         inputCapability.keyboardrFunctionKey = self._gccCore.keyboardFnKeys
         inputCapability.imeFileName = self._gccCore.imeFileName
         
+        #init multi fragment update capability
+        self._clientCapabilities[caps.CapsType.CAPSETTYPE_MULTIFRAGMENTUPDATE].capability.MaxRequestSize.value = self._FASTPATH_MAX_REQUEST_SIZE_
+        
         #make active PDU packet
         confirmActivePDU = data.ConfirmActivePDU()
         confirmActivePDU.shareId.value = self._shareId
@@ -375,25 +624,92 @@ class Client(PDULayer):
         controlRequestPDU = data.ControlDataPDU(data.Action.CTRLACTION_REQUEST_CONTROL)
         self.sendDataPDU(controlRequestPDU)
         
-        #TODO persistent key list http://msdn.microsoft.com/en-us/library/cc240494.aspx
+        #persistent key list is only sent in first activation
+        if not self._persistentBitmapCache is None and self._persistentKeys is None:
+            self.sendPersistentKeyListPDU()
         
         #deprecated font list pdu
         fontListPDU = data.FontListDataPDU()
         self.sendDataPDU(fontListPDU)
         
+    def sendPersistentKeyListPDU(self):
+        """
+        @summary: send keys of bitmaps stored in persistent bitmap cache
+                    server will use them in place of sending bitmaps
+                    entry i of a cell is expected at index i of this cell
+                    bitmaps are copied in memory because cache may be shared with other
+                    connections that can evict sent keys before bitmap cache is filled
+        @see: http://msdn.microsoft.com/en-us/library/cc240494.aspx
+        """
+        bitsPerPixel = self._serverCapabilities[caps.CapsType.CAPSTYPE_BITMAP].capability.preferredBitsPerPixel.value
+        cellEntries = self._clientCapabilities[caps.CapsType.CAPSTYPE_BITMAPCACHE_REV2].capability.getCellEntries()
+        self._persistentKeys = []
+        self._persistentBitmaps = []
+        for cacheId in range(0, len(cellEntries)):
+            keys = []
+            bitmaps = []
+            for key1, key2 in self._persistentBitmapCache.getKeys(cacheId, bitsPerPixel, cellEntries[cacheId]):
+                bitmap = self._persistentBitmapCache.get(key1, key2)
+                if bitmap is None:
+                    continue
+                keys.append((key1, key2))
+                bitmaps.append(bitmap[2:])
+            self._persistentKeys.append(keys)
+            self._persistentBitmaps.append(bitmaps)
+        
+        entries = [(cacheId, key) for cacheId in range(0, len(self._persistentKeys)) for key in self._persistentKeys[cacheId]]
+        for first in range(0, len(entries), data.PersistentListPDU._MAX_ENTRIES_):
+            last = first + data.PersistentListPDU._MAX_ENTRIES_
+            persistentListPDU = data.PersistentListPDU()
+            for cacheId in range(0, len(self._persistentKeys)):
+                getattr(persistentListPDU, "numEntriesCache%d"%cacheId).value = len([entry for entry in entries[first:last] if entry[0] == cacheId])
+                getattr(persistentListPDU, "totalEntriesCache%d"%cacheId).value = len(self._persistentKeys[cacheId])
+            if first == 0:
+                persistentListPDU.bitMask.value |= data.PersistentKeyListFlag.PERSIST_FIRST_PDU
+            if last >= len(entries):
+                persistentListPDU.bitMask.value |= data.PersistentKeyListFlag.PERSIST_LAST_PDU
+            persistentListPDU.entries._array = [data.PersistentListEntry(key1, key2) for _, (key1, key2) in entries[first:last]]
+            self.sendDataPDU(persistentListPDU)
+        
     def sendInputEvents(self, pointerEvents):
         """
         @summary: send client input events
+                    use fast path if server support it
         @param pointerEvents: list of pointer events
         """
+        if not self._fastPathSender is None and self._serverCapabilities[caps.CapsType.CAPSTYPE_INPUT].capability.inputFlags.value & (caps.InputFlags.INPUT_FLAG_FASTPATH_INPUT | caps.InputFlags.INPUT_FLAG_FASTPATH_INPUT2):
+            self.sendFastPathInputEvents([data.createFastPathInputEvent(x) for x in pointerEvents])
+            return
+        
         pdu = data.ClientInputEventPDU()
         pdu.slowPathInputEvents._array = [data.SlowPathInputEvent(x) for x in pointerEvents]
         self.sendDataPDU(pdu)
         
+    def sendFastPathInputEvents(self, fastPathInputEvents):
+        """
+        @summary: send many input events in one fast path input PDU
+        @param fastPathInputEvents: {list(data.FastPathInputEvent)}
+        @see: http://msdn.microsoft.com/en-us/library/cc240589.aspx
+        """
+        #number of events is encoded on one byte
+        for i in range(0, len(fastPathInputEvents), 255):
+            events = ArrayType(data.FastPathInputEvent)
+            events._array = fastPathInputEvents[i:i + 255]
+            #number of events is in header if it fit on 4 bits
+            if len(events._array) < 16:
+                self._fastPathSender.sendFastPath(len(events._array) << 2, events)
+            else:
+                self._fastPathSender.sendFastPath(0, (UInt8(len(events._array)), events))
+        
 class Server(PDULayer):
     """
     @summary: Server Automata of PDU layer
     """
+    #max payload size of one fast path update fragment
+    _FASTPATH_FRAGMENT_SIZE_ = 0x3F80
+    #MCS send data (8), security header with signature (12), share control (6) and share data (12) headers
+    _SLOWPATH_HEADERS_SIZE_ = 38
+    
     def __init__(self, listener):
         """
         @param listener: PDUServerListener
@@ -402,6 +718,19 @@ class Server(PDULayer):
         self._listener = listener
         #fast path layer
         self._fastPathSender = None
+        #bulk compressor for fast path update
+        self._bulkCompressor = None
+        
+    def setCompression(self, compressionType = None, level = 1):
+        """
+        @summary: Compress fast path updates with MPPC
+        @param compressionType: {data.CompressionType} 8K or 64K, None to disable
+        @param level: {integer} 1 (fast) to 9 (best ratio) match search effort
+        """
+        if compressionType is None:
+            self._bulkCompressor = None
+        else:
+            self._bulkCompressor = bulk.Compressor(compressionType, level)
         
     def connect(self):
         """
@@ -445,6 +774,8 @@ class Server(PDULayer):
         """
         pdu = data.PDU()
         s.readType(pdu)
+        if pdu.shareControlHeader.pduType.value == data.PDUType.PDUTYPE_DATAPDU:
+            self.decompressDataPDU(pdu.pduMessage)
         if pdu.shareControlHeader.pduType.value != data.PDUType.PDUTYPE_DATAPDU or pdu.pduMessage.shareDataHeader.pduType2.value != data.PDUType2.PDUTYPE2_SYNCHRONIZE:
             #not a blocking error because in deactive reactive sequence 
             #input can be send too but ignored
@@ -460,6 +791,8 @@ class Server(PDULayer):
         """
         pdu = data.PDU()
         s.readType(pdu)
+        if pdu.shareControlHeader.pduType.value == data.PDUType.PDUTYPE_DATAPDU:
+            self.decompressDataPDU(pdu.pduMessage)
         if pdu.shareControlHeader.pduType.value != data.PDUType.PDUTYPE_DATAPDU or pdu.pduMessage.shareDataHeader.pduType2.value != data.PDUType2.PDUTYPE2_CONTROL or pdu.pduMessage.pduData.action.value != data.Action.CTRLACTION_COOPERATE:
             #not a blocking error because in deactive reactive sequence 
             #input can be send too but ignored
@@ -475,6 +808,8 @@ class Server(PDULayer):
         """
         pdu = data.PDU()
         s.readType(pdu)
+        if pdu.shareControlHeader.pduType.value == data.PDUType.PDUTYPE_DATAPDU:
+            self.decompressDataPDU(pdu.pduMessage)
         if pdu.shareControlHeader.pduType.value != data.PDUType.PDUTYPE_DATAPDU or pdu.pduMessage.shareDataHeader.pduType2.value != data.PDUType2.PDUTYPE2_CONTROL or pdu.pduMessage.pduData.action.value != data.Action.CTRLACTION_REQUEST_CONTROL:
             #not a blocking error because in deactive reactive sequence 
             #input can be send too but ignored
@@ -491,6 +826,8 @@ class Server(PDULayer):
         """
         pdu = data.PDU()
         s.readType(pdu)
+        if pdu.shareControlHeader.pduType.value == data.PDUType.PDUTYPE_DATAPDU:
+            self.decompressDataPDU(pdu.pduMessage)
         if pdu.shareControlHeader.pduType.value != data.PDUType.PDUTYPE_DATAPDU or pdu.pduMessage.shareDataHeader.pduType2.value != data.PDUType2.PDUTYPE2_FONTLIST:
             #not a blocking error because in deactive reactive sequence 
             #input can be send but ignored
@@ -511,6 +848,7 @@ class Server(PDULayer):
         pdu = data.PDU()
         s.readType(pdu)
         if pdu.shareControlHeader.pduType.value == data.PDUType.PDUTYPE_DATAPDU:
+            self.decompressDataPDU(pdu.pduMessage)
             self.readDataPDU(pdu.pduMessage)
             
     def readDataPDU(self, dataPDU):
@@ -531,13 +869,22 @@ class Server(PDULayer):
             log.debug("Receive Shutdown Request")
             self._transport.close()
             
-    def recvFastPath(self, fastPathS):
+    def recvFastPath(self, secFlag, fastPathS):
         """
         @summary: Implement IFastPathListener interface
-        Fast path is needed by RDP 8.0
-        @param fastPathS: Stream that contain fast path data
+        Fast path input events from client
+        @param secFlag: {SecFlags} with number of events in bits 2 to 5
+        @param fastPathS: {Stream} that contain fast path data
+        @see: http://msdn.microsoft.com/en-us/library/cc240589.aspx
         """
-        pass
+        numEvents = UInt8((secFlag & tpkt.SecFlags.FASTPATH_INPUT_NUM_EVENTS_MASK) >> 2)
+        #number of events doesn't fit in header
+        if numEvents.value == 0:
+            fastPathS.readType(numEvents)
+        
+        events = ArrayType(data.FastPathInputEvent, readLen = numEvents)
+        fastPathS.readType(events)
+        self._listener.onFastPathInput(events._array)
         
     def sendDemandActivePDU(self):
         """
@@ -550,7 +897,7 @@ class Server(PDULayer):
         generalCapability.extraFlags.value = caps.GeneralExtraFlag.LONG_CREDENTIALS_SUPPORTED | caps.GeneralExtraFlag.NO_BITMAP_COMPRESSION_HDR | caps.GeneralExtraFlag.FASTPATH_OUTPUT_SUPPORTED | caps.GeneralExtraFlag.ENC_SALTED_CHECKSUM
         
         inputCapability = self._serverCapabilities[caps.CapsType.CAPSTYPE_INPUT].capability
-        inputCapability.inputFlags.value = caps.InputFlags.INPUT_FLAG_SCANCODES | caps.InputFlags.INPUT_FLAG_MOUSEX
+        inputCapability.inputFlags.value = caps.InputFlags.INPUT_FLAG_SCANCODES | caps.InputFlags.INPUT_FLAG_MOUSEX | caps.InputFlags.INPUT_FLAG_FASTPATH_INPUT | caps.InputFlags.INPUT_FLAG_FASTPATH_INPUT2
         
         demandActivePDU = data.DemandActivePDU()
         demandActivePDU.shareId.value = self._shareId
@@ -589,6 +936,98 @@ class Server(PDULayer):
             self.sendDemandActivePDU()
             self.setNextState(self.recvConfirmActivePDU)
         
+    def getFastPathMaxRequestSize(self):
+        """
+        @return: {integer} max size of reassembled fast path update accepted by client
+        """
+        multiFragmentUpdate = self._clientCapabilities.get(caps.CapsType.CAPSETTYPE_MULTIFRAGMENTUPDATE)
+        if multiFragmentUpdate is None:
+            return self._FASTPATH_FRAGMENT_SIZE_
+        return max(multiFragmentUpdate.capability.MaxRequestSize.value, self._FASTPATH_FRAGMENT_SIZE_)
+    
+    def getSlowPathMaxUpdateSize(self):
+        """
+        @return: {integer} max size of slow path bitmap update
+                    negotiated MCS max PDU size without headers of lower layers
+        """
+        return self._transport.getMaxPduSize() - self._SLOWPATH_HEADERS_SIZE_
+    
+    def getBitmapCodec(self, codecGUID):
+        """
+        @summary: Codec usable in surface bits commands
+                    surface commands are only sent on fast path
+        @param codecGUID: {caps.CodecGUID}
+        @return: {caps.BitmapCodec} codec advertised by client or None
+        """
+        surfaceCommands = self._clientCapabilities.get(caps.CapsType.CAPSETTYPE_SURFACE_COMMANDS)
+        bitmapCodecs = self._clientCapabilities.get(caps.CapsType.CAPSETTYPE_BITMAP_CODECS)
+        if not self._clientFastPathSupported or self._fastPathSender is None or surfaceCommands is None or bitmapCodecs is None:
+            return None
+        if not surfaceCommands.capability.cmdFlags.value & caps.SurfaceCommandsFlag.SURFCMDS_SETSURFACEBITS:
+            return None
+        return bitmapCodecs.capability.getCodec(codecGUID)
+        
+    def sendFastPathUpdate(self, updateData):
+        """
+        @summary: Send fast path update splitted in fragments
+        each fragment is bulk compressed if compression is enabled
+        update is serialized element by element (each item of arrays)
+        and fragments are cut while data is produced
+        @param updateData: {data.FastPathXXXUpdateDataPDU}
+        """
+        updateCode = updateData.__class__._FASTPATH_UPDATE_TYPE_
+        
+        #client can't reassemble fragments
+        if self.getFastPathMaxRequestSize() <= self._FASTPATH_FRAGMENT_SIZE_:
+            s = Stream()
+            s.writeType(updateData)
+            self.sendFastPathFragment(updateCode, data.FastPathFragmentation.FASTPATH_FRAGMENT_SINGLE, s.getvalue())
+            return
+        
+        pending = bytearray()
+        isFirst = True
+        for element in self.iterUpdateElements(updateData):
+            s = Stream()
+            s.writeType(element)
+            pending.extend(s.getvalue())
+            #keep at least one byte to know which fragment is the last
+            while len(pending) > self._FASTPATH_FRAGMENT_SIZE_:
+                fragmentation = data.FastPathFragmentation.FASTPATH_FRAGMENT_FIRST if isFirst else data.FastPathFragmentation.FASTPATH_FRAGMENT_NEXT
+                self.sendFastPathFragment(updateCode, fragmentation, str(buffer(pending, 0, self._FASTPATH_FRAGMENT_SIZE_)))
+                del pending[:self._FASTPATH_FRAGMENT_SIZE_]
+                isFirst = False
+        
+        fragmentation = data.FastPathFragmentation.FASTPATH_FRAGMENT_SINGLE if isFirst else data.FastPathFragmentation.FASTPATH_FRAGMENT_LAST
+        self.sendFastPathFragment(updateCode, fragmentation, str(pending))
+        
+    def iterUpdateElements(self, updateData):
+        """
+        @summary: Iterate over top level elements of update, arrays are flattened
+        @param updateData: {CompositeType}
+        @return: {generator(Type)}
+        """
+        for name in updateData._typeName:
+            element = updateData.__dict__[name]
+            if isinstance(element, ArrayType):
+                if element._conditional():
+                    for item in element._array:
+                        yield item
+            else:
+                yield element
+    
+    def sendFastPathFragment(self, updateCode, fragmentation, fragment):
+        """
+        @summary: Compress and send one fast path update fragment
+        @param updateCode: {data.FastPathUpdateType}
+        @param fragmentation: {data.FastPathFragmentation}
+        @param fragment: {str} uncompressed payload
+        """
+        compressionFlags = None
+        if not self._bulkCompressor is None:
+            fragment, compressionFlags = self._bulkCompressor.compress(fragment)
+        self._fastPathSender.sendFastPath(0, data.FastPathUpdatePDU(String(fragment), updateCode, fragmentation, compressionFlags))
+        
+
     def sendBitmapUpdatePDU(self, bitmapDatas):
         """
         @summary: Send bitmap update data
@@ -602,11 +1041,52 @@ class Server(PDULayer):
         
         if self._clientFastPathSupported and not self._fastPathSender is None:
             #fast path case
-            fastPathUpdateDataPDU = data.FastPathBitmapUpdateDataPDU()
-            fastPathUpdateDataPDU.rectangles._array = bitmapDatas
-            self._fastPathSender.sendFastPath(0, data.FastPathUpdatePDU(fastPathUpdateDataPDU))
+            for rectangles in self.packBitmapDatas(bitmapDatas, self.getFastPathMaxRequestSize()):
+                fastPathUpdateDataPDU = data.FastPathBitmapUpdateDataPDU()
+                fastPathUpdateDataPDU.rectangles._array = rectangles
+                self.sendFastPathUpdate(fastPathUpdateDataPDU)
         else:
             #slow path case
-            updateDataPDU = data.BitmapUpdateDataPDU()
-            updateDataPDU.rectangles._array = bitmapDatas
-            self.sendDataPDU(data.UpdateDataPDU(updateDataPDU))
\ No newline at end of file
+            for rectangles in self.packBitmapDatas(bitmapDatas, self.getSlowPathMaxUpdateSize()):
+                updateDataPDU = data.BitmapUpdateDataPDU()
+                updateDataPDU.rectangles._array = rectangles
+                self.sendDataPDU(data.UpdateDataPDU(updateDataPDU))
+                
+    def sendSurfaceCommands(self, surfaceCommands):
+        """
+        @summary: Send surface commands packed in as few fast path updates as possible
+                    a command bigger than max request size is sent alone
+        @param surfaceCommands: {list(data.SurfaceCommand)}
+        """
+        maxUpdateSize = self.getFastPathMaxRequestSize()
+        updates = [""]
+        for surfaceCommand in surfaceCommands:
+            s = Stream()
+            s.writeType(surfaceCommand)
+            command = s.getvalue()
+            if len(updates[-1]) > 0 and len(updates[-1]) + len(command) > maxUpdateSize:
+                updates.append("")
+            updates[-1] += command
+        for update in updates:
+            self.sendFastPathUpdate(data.FastPathSurfaceCommandsUpdate(update))
+                
+    def packBitmapDatas(self, bitmapDatas, maxUpdateSize):
+        """
+        @summary: Split rectangles into as few updates as possible
+        A rectangle bigger than maxUpdateSize is sent alone
+        @param bitmapDatas: {list(data.BitmapData)}
+        @param maxUpdateSize: {integer} max size of one bitmap update
+        @return: {list(list(data.BitmapData))} rectangles of each update
+        """
+        #update type and number of rectangles
+        headerSize = 4
+        updates = [[]]
+        updateSize = headerSize
+        for bitmapData in bitmapDatas:
+            bitmapDataSize = sizeof(bitmapData)
+            if len(updates[-1]) > 0 and updateSize + bitmapDataSize > maxUpdateSize:
+                updates.append([])
+                updateSize = headerSize
+            updates[-1].append(bitmapData)
+            updateSize += bitmapDataSize
+        return updates
\ No newline at end of file
@@ -23,7 +23,8 @@ GDI order structure
 
 from rdpy.core import log
 from rdpy.core.error import InvalidExpectedDataException
-from rdpy.core.type import CompositeType, UInt8, String, FactoryType, SInt8, SInt16Le
+from rdpy.core.type import Type, CallableValue, CompositeType, UInt8, UInt16Le, UInt24Le, UInt32Le, String, SInt8, SInt16Le, ArrayType, FactoryType, Stream, sizeof
+import caps, data
 
 class ControlFlag(object):
     """
@@ -67,63 +68,903 @@ class OrderType(object):
     TS_ENC_ELLIPSE_CB_ORDER = 0x1A
     TS_ENC_INDEX_ORDER = 0x1B
     
-class CoordField(CompositeType):
+class SecondaryOrderType(object):
+    """
+    @summary: Secondary order type
+    @see: http://msdn.microsoft.com/en-us/library/cc241604.aspx
+    """
+    TS_CACHE_BITMAP_UNCOMPRESSED = 0x00
+    TS_CACHE_COLOR_TABLE = 0x01
+    TS_CACHE_BITMAP_COMPRESSED = 0x02
+    TS_CACHE_GLYPH = 0x03
+    TS_CACHE_BITMAP_UNCOMPRESSED_REV2 = 0x04
+    TS_CACHE_BITMAP_COMPRESSED_REV2 = 0x05
+    TS_CACHE_BRUSH = 0x07
+    TS_CACHE_BITMAP_COMPRESSED_REV3 = 0x08
+    
+class CacheBitmapFlag(object):
+    """
+    @summary: Flags of cache bitmap revision 2 and 3 (bits 7 to 15 of extra flags)
+    @see: http://msdn.microsoft.com/en-us/library/cc241608.aspx
+    """
+    CBR2_HEIGHT_SAME_AS_WIDTH = 0x01
+    CBR2_PERSISTENT_KEY_PRESENT = 0x02
+    CBR2_NO_BITMAP_COMPRESSION_HDR = 0x08
+    CBR2_DO_NOT_CACHE = 0x10
+    
+class BitsPerPixelId(object):
+    """
+    @summary: Color depth of cached bitmap (bits 3 to 6 of extra flags)
+    @see: http://msdn.microsoft.com/en-us/library/cc241608.aspx
+    """
+    CBR2_8BPP = 0x3
+    CBR2_16BPP = 0x4
+    CBR2_24BPP = 0x5
+    CBR2_32BPP = 0x6
+    
+class BitmapFormat(object):
+    """
+    @summary: Color depth of cached brush
+    @see: http://msdn.microsoft.com/en-us/library/cc241616.aspx
+    """
+    BMF_1BPP = 0x1
+    BMF_8BPP = 0x3
+    BMF_16BPP = 0x4
+    BMF_24BPP = 0x5
+    BMF_32BPP = 0x6
+    
+class CacheGlyphFlag(object):
+    """
+    @summary: Flags of cache glyph order (extra flags)
+    @see: http://msdn.microsoft.com/en-us/library/cc241620.aspx
+    """
+    CG_GLYPH_UNICODE_PRESENT = 0x0010
+    
+class TextAccelFlag(object):
+    """
+    @summary: Glyph placement of glyph orders (flAccel)
+    @see: http://msdn.microsoft.com/en-us/library/cc241594.aspx
+    """
+    SO_FLAG_DEFAULT_PLACEMENT = 0x01
+    SO_HORIZONTAL = 0x02
+    SO_VERTICAL = 0x04
+    SO_REVERSED = 0x08
+    SO_ZERO_BEARINGS = 0x10
+    SO_CHAR_INC_EQUAL_BM_BASE = 0x20
+    SO_MAXEXT_EQUAL_BM_SIDE = 0x40
+    
+class GlyphFragment(object):
+    """
+    @summary: Operation bytes of glyph fragments
+    @see: http://msdn.microsoft.com/en-us/library/cc241595.aspx
+    """
+    GLYPH_FRAGMENT_USE = 0xFE
+    GLYPH_FRAGMENT_ADD = 0xFF
+    
+class BoundsFlag(object):
+    """
+    @summary: Describe which bounds fields are present
+    @see: http://msdn.microsoft.com/en-us/library/cc241579.aspx
+    """
+    TS_BOUND_LEFT = 0x01
+    TS_BOUND_TOP = 0x02
+    TS_BOUND_RIGHT = 0x04
+    TS_BOUND_BOTTOM = 0x08
+    TS_BOUND_DELTA_LEFT = 0x10
+    TS_BOUND_DELTA_TOP = 0x20
+    TS_BOUND_DELTA_RIGHT = 0x40
+    TS_BOUND_DELTA_BOTTOM = 0x80
+    
+class BrushStyle(object):
+    """
+    @summary: Style of brush
+    @see: http://msdn.microsoft.com/en-us/library/cc241609.aspx
+    """
+    BS_SOLID = 0x00
+    BS_NULL = 0x01
+    BS_HATCHED = 0x02
+    BS_PATTERN = 0x03
+    #brush hatch is an index in brush cache
+    TS_CACHED_BRUSH = 0x80
+    
+class CoordField(Type, CallableValue):
     """
     @summary: used to describe a value in the range -32768 to 32767
+                in delta mode value is a signed byte added to last value
     @see: http://msdn.microsoft.com/en-us/library/cc241577.aspx
     """
-    def __init__(self, isDelta, conditional = lambda:True):
+    def __init__(self, isDelta, value = 0, conditional = lambda:True):
         """
         @param isDelta: callable object to know if coord field is in delta mode
+        @param value: initial value
         @param conditional: conditional read or write type
         """
+        Type.__init__(self, conditional = conditional)
+        CallableValue.__init__(self, value)
+        self._isDelta = isDelta
+        #last read delta
+        self._delta = 0
+        
+    def __read__(self, s):
+        """
+        @summary: read absolute or delta coordinate
+        @param s: Stream
+        """
+        if self._isDelta():
+            delta = SInt8()
+            s.readType(delta)
+            self._delta = delta.value
+            self.value += delta.value
+        else:
+            coordinate = SInt16Le()
+            s.readType(coordinate)
+            self.value = coordinate.value
+            
+    def __write__(self, s):
+        """
+        @summary: write absolute coordinate or last read delta
+        @param s: Stream
+        """
+        if self._isDelta():
+            s.writeType(SInt8(self._delta))
+        else:
+            s.writeType(SInt16Le(self.value))
+            
+    def __sizeof__(self):
+        """
+        @return: size of coordinate in current mode
+        """
+        return 1 if self._isDelta() else 2
+    
+class TwoByteUnsigned(Type, CallableValue):
+    """
+    @summary: unsigned value on 1 or 2 bytes (15 bits)
+    @see: http://msdn.microsoft.com/en-us/library/cc241622.aspx
+    """
+    def __init__(self, value = 0, conditional = lambda:True):
+        Type.__init__(self, conditional = conditional)
+        CallableValue.__init__(self, value)
+        
+    def __read__(self, s):
+        """
+        @param s: Stream
+        """
+        first = UInt8()
+        s.readType(first)
+        if first.value & 0x80:
+            second = UInt8()
+            s.readType(second)
+            self.value = ((first.value & 0x7f) << 8) | second.value
+        else:
+            self.value = first.value
+            
+    def __write__(self, s):
+        """
+        @param s: Stream
+        """
+        if self.value > 0x7f:
+            s.writeType((UInt8(0x80 | (self.value >> 8)), UInt8(self.value & 0xff)))
+        else:
+            s.writeType(UInt8(self.value))
+            
+    def __sizeof__(self):
+        """
+        @return: size of encoded value
+        """
+        return 2 if self.value > 0x7f else 1
+    
+class FourByteUnsigned(Type, CallableValue):
+    """
+    @summary: unsigned value on 1 to 4 bytes (30 bits)
+                two first bits contain number of following bytes
+    @see: http://msdn.microsoft.com/en-us/library/cc241624.aspx
+    """
+    def __init__(self, value = 0, conditional = lambda:True):
+        Type.__init__(self, conditional = conditional)
+        CallableValue.__init__(self, value)
+        
+    def __read__(self, s):
+        """
+        @param s: Stream
+        """
+        first = UInt8()
+        s.readType(first)
+        value = first.value & 0x3f
+        for _ in range(0, first.value >> 6):
+            following = UInt8()
+            s.readType(following)
+            value = (value << 8) | following.value
+        self.value = value
+        
+    def __write__(self, s):
+        """
+        @param s: Stream
+        """
+        count = self.__sizeof__() - 1
+        s.writeType(UInt8((count << 6) | (self.value >> (8 * count))))
+        for i in range(count - 1, -1, -1):
+            s.writeType(UInt8((self.value >> (8 * i)) & 0xff))
+        
+    def __sizeof__(self):
+        """
+        @return: size of encoded value
+        """
+        for i in range(0, 4):
+            if self.value < (0x40 << (8 * i)):
+                return i + 1
+        return 4
+    
+class TwoByteSigned(Type, CallableValue):
+    """
+    @summary: signed value on 1 or 2 bytes (14 bits and sign bit)
+    @see: http://msdn.microsoft.com/en-us/library/cc241621.aspx
+    """
+    def __init__(self, value = 0, conditional = lambda:True):
+        Type.__init__(self, conditional = conditional)
+        CallableValue.__init__(self, value)
+        
+    def __read__(self, s):
+        """
+        @param s: Stream
+        """
+        first = UInt8()
+        s.readType(first)
+        value = first.value & 0x3f
+        if first.value & 0x80:
+            second = UInt8()
+            s.readType(second)
+            value = (value << 8) | second.value
+        self.value = -value if first.value & 0x40 else value
+            
+    def __write__(self, s):
+        """
+        @param s: Stream
+        """
+        value = abs(self.value)
+        sign = 0x40 if self.value < 0 else 0
+        if value > 0x3f:
+            s.writeType((UInt8(0x80 | sign | (value >> 8)), UInt8(value & 0xff)))
+        else:
+            s.writeType(UInt8(sign | value))
+            
+    def __sizeof__(self):
+        """
+        @return: size of encoded value
+        """
+        return 2 if abs(self.value) > 0x3f else 1
+    
+class VariableBytes(CompositeType):
+    """
+    @summary: Field of glyph orders prefixed by its length
+    @see: http://msdn.microsoft.com/en-us/library/cc241594.aspx
+    """
+    def __init__(self, conditional = lambda:True):
         CompositeType.__init__(self, conditional = conditional)
-        self.delta = SInt8(conditional = isDelta)
-        self.coordinate = SInt16Le(conditional = isDelta)
+        self.cbData = UInt8(lambda:sizeof(self.data))
+        self.data = String(readLen = self.cbData)
+        
+class Bounds(CompositeType):
+    """
+    @summary: Inclusive clipping rectangle of primary order
+                Missing coordinates keep their last value
+    @see: http://msdn.microsoft.com/en-us/library/cc241579.aspx
+    """
+    def __init__(self):
+        CompositeType.__init__(self)
+        self.description = UInt8()
+        self.left = CoordField(lambda:self.description.value & BoundsFlag.TS_BOUND_DELTA_LEFT, conditional = lambda:self.description.value & (BoundsFlag.TS_BOUND_LEFT | BoundsFlag.TS_BOUND_DELTA_LEFT))
+        self.top = CoordField(lambda:self.description.value & BoundsFlag.TS_BOUND_DELTA_TOP, conditional = lambda:self.description.value & (BoundsFlag.TS_BOUND_TOP | BoundsFlag.TS_BOUND_DELTA_TOP))
+        self.right = CoordField(lambda:self.description.value & BoundsFlag.TS_BOUND_DELTA_RIGHT, conditional = lambda:self.description.value & (BoundsFlag.TS_BOUND_RIGHT | BoundsFlag.TS_BOUND_DELTA_RIGHT))
+        self.bottom = CoordField(lambda:self.description.value & BoundsFlag.TS_BOUND_DELTA_BOTTOM, conditional = lambda:self.description.value & (BoundsFlag.TS_BOUND_BOTTOM | BoundsFlag.TS_BOUND_DELTA_BOTTOM))
+        
+    def getRect(self):
+        """
+        @return: {tuple} (left, top, right, bottom)
+        """
+        return (self.left.value, self.top.value, self.right.value, self.bottom.value)
     
 class PrimaryDrawingOrder(CompositeType):
     """
     @summary: GDI Primary drawing order
+                A field is read only if its bit is set in field flags
+                else it keep value of last order of same type
     @see: http://msdn.microsoft.com/en-us/library/cc241586.aspx
     """
-    def __init__(self, order = None):
+    def __init__(self, controlFlags, fieldFlags):
+        """
+        @param controlFlags: {UInt8} control flags of current order
+        @param fieldFlags: {CallableValue} field flags of current order
+        """
         CompositeType.__init__(self)
-        self.controlFlags = UInt8()
-        self.orderType = UInt8()
+        self._controlFlags = controlFlags
+        self._fieldFlags = fieldFlags
+        #clipping rectangle of current order
+        self._bounds = None
         
-        def OrderFactory():
-            """
-            Closure for capability factory
-            """
-            for c in [DstBltOrder]:
-                if self.orderType.value == c._ORDER_TYPE_:
-                    return c(self.controlFlags)
-            log.debug("unknown Order type : %s"%hex(self.orderType.value))
-            #read entire packet
-            return String()
-        
-        if order is None:
-            order = FactoryType(OrderFactory)
-        elif not "_ORDER_TYPE_" in order.__class__.__dict__:
-            raise InvalidExpectedDataException("Try to send an invalid order block")
+    def isFieldPresent(self, index):
+        """
+        @param index: {integer} index of field
+        @return: {callable} conditional of field
+        """
+        return lambda:(self._fieldFlags.value & (1 << index)) != 0
+    
+    def isDeltaCoordinates(self):
+        """
+        @return: True if coordinates are encoded as delta
+        """
+        return (self._controlFlags.value & ControlFlag.TS_DELTA_COORDINATES) != 0
+    
+    def getBounds(self):
+        """
+        @return: {tuple} inclusive clipping rectangle (left, top, right, bottom) or None
+        """
+        if self._bounds is None:
+            return None
+        return self._bounds.getRect()
 
-class DstBltOrder(CompositeType):
+class DstBltOrder(PrimaryDrawingOrder):
     """
     @summary: The DstBlt Primary Drawing Order is used to paint 
                 a rectangle by using a destination-only raster operation.
     @see: http://msdn.microsoft.com/en-us/library/cc241587.aspx
     """
     #order type
-    _ORDER_TYPE_ = 0x00
+    _ORDER_TYPE_ = OrderType.TS_ENC_DSTBLT_ORDER
     #negotiation index
-    _NEGOTIATE_ = 0x00
+    _NEGOTIATE_ = caps.Order.TS_NEG_DSTBLT_INDEX
+    #number of field flags bytes
+    _FIELD_BYTES_ = 1
+    
+    def __init__(self, controlFlags, fieldFlags):
+        PrimaryDrawingOrder.__init__(self, controlFlags, fieldFlags)
+        self.nLeftRect = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(0))
+        self.nTopRect = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(1))
+        self.nWidth = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(2))
+        self.nHeight = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(3))
+        self.bRop = UInt8(conditional = self.isFieldPresent(4))
+        
+class PatBltOrder(PrimaryDrawingOrder):
+    """
+    @summary: The PatBlt Primary Drawing Order is used to paint 
+                a rectangle by using a specified brush and three-way raster operation.
+    @see: http://msdn.microsoft.com/en-us/library/cc241602.aspx
+    """
+    _ORDER_TYPE_ = OrderType.TS_ENC_PATBLT_ORDER
+    _NEGOTIATE_ = caps.Order.TS_NEG_PATBLT_INDEX
+    _FIELD_BYTES_ = 2
+    
+    def __init__(self, controlFlags, fieldFlags):
+        PrimaryDrawingOrder.__init__(self, controlFlags, fieldFlags)
+        self.nLeftRect = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(0))
+        self.nTopRect = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(1))
+        self.nWidth = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(2))
+        self.nHeight = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(3))
+        self.bRop = UInt8(conditional = self.isFieldPresent(4))
+        self.backColor = UInt24Le(conditional = self.isFieldPresent(5))
+        self.foreColor = UInt24Le(conditional = self.isFieldPresent(6))
+        self.brushOrgX = SInt8(conditional = self.isFieldPresent(7))
+        self.brushOrgY = SInt8(conditional = self.isFieldPresent(8))
+        self.brushStyle = UInt8(conditional = self.isFieldPresent(9))
+        self.brushHatch = UInt8(conditional = self.isFieldPresent(10))
+        self.brushExtra = String("\x00" * 7, readLen = CallableValue(7), conditional = self.isFieldPresent(11))
+        
+class ScrBltOrder(PrimaryDrawingOrder):
+    """
+    @summary: The ScrBlt Primary Drawing Order is used to perform 
+                a bit-block transfer from source to destination inside screen.
+    @see: http://msdn.microsoft.com/en-us/library/cc241606.aspx
+    """
+    _ORDER_TYPE_ = OrderType.TS_ENC_SCRBLT_ORDER
+    _NEGOTIATE_ = caps.Order.TS_NEG_SCRBLT_INDEX
+    _FIELD_BYTES_ = 1
+    
+    def __init__(self, controlFlags, fieldFlags):
+        PrimaryDrawingOrder.__init__(self, controlFlags, fieldFlags)
+        self.nLeftRect = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(0))
+        self.nTopRect = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(1))
+        self.nWidth = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(2))
+        self.nHeight = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(3))
+        self.bRop = UInt8(conditional = self.isFieldPresent(4))
+        self.nXSrc = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(5))
+        self.nYSrc = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(6))
+        
+class LineToOrder(PrimaryDrawingOrder):
+    """
+    @summary: The LineTo Primary Drawing Order is used to draw 
+                a single line with a one-pixel width
+    @see: http://msdn.microsoft.com/en-us/library/cc241589.aspx
+    """
+    _ORDER_TYPE_ = OrderType.TS_ENC_LINETO_ORDER
+    _NEGOTIATE_ = caps.Order.TS_NEG_LINETO_INDEX
+    _FIELD_BYTES_ = 2
+    
+    def __init__(self, controlFlags, fieldFlags):
+        PrimaryDrawingOrder.__init__(self, controlFlags, fieldFlags)
+        self.backMode = UInt16Le(conditional = self.isFieldPresent(0))
+        self.nXStart = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(1))
+        self.nYStart = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(2))
+        self.nXEnd = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(3))
+        self.nYEnd = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(4))
+        self.backColor = UInt24Le(conditional = self.isFieldPresent(5))
+        self.bRop2 = UInt8(conditional = self.isFieldPresent(6))
+        self.penStyle = UInt8(conditional = self.isFieldPresent(7))
+        self.penWidth = UInt8(conditional = self.isFieldPresent(8))
+        self.penColor = UInt24Le(conditional = self.isFieldPresent(9))
+        
+class OpaqueRectOrder(PrimaryDrawingOrder):
+    """
+    @summary: The OpaqueRect Primary Drawing Order is used to paint 
+                a rectangle by using an opaque brush
+                Negotiated with PatBlt order
+    @see: http://msdn.microsoft.com/en-us/library/cc241583.aspx
+    """
+    _ORDER_TYPE_ = OrderType.TS_ENC_OPAQUERECT_ORDER
+    _NEGOTIATE_ = caps.Order.TS_NEG_PATBLT_INDEX
+    _FIELD_BYTES_ = 1
+    
+    def __init__(self, controlFlags, fieldFlags):
+        PrimaryDrawingOrder.__init__(self, controlFlags, fieldFlags)
+        self.nLeftRect = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(0))
+        self.nTopRect = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(1))
+        self.nWidth = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(2))
+        self.nHeight = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(3))
+        self.redOrBlue = UInt8(conditional = self.isFieldPresent(4))
+        self.green = UInt8(conditional = self.isFieldPresent(5))
+        self.blue = UInt8(conditional = self.isFieldPresent(6))
+        
+    def getColor(self):
+        """
+        @return: {integer} color in session color depth
+        """
+        return self.redOrBlue.value | (self.green.value << 8) | (self.blue.value << 16)
+        
+class MemBltOrder(PrimaryDrawingOrder):
+    """
+    @summary: The MemBlt Primary Drawing Order is used to render 
+                a bitmap stored in bitmap cache
+    @see: http://msdn.microsoft.com/en-us/library/cc241600.aspx
+    """
+    _ORDER_TYPE_ = OrderType.TS_ENC_MEMBLT_ORDER
+    _NEGOTIATE_ = caps.Order.TS_NEG_MEMBLT_INDEX
+    _FIELD_BYTES_ = 2
     
-    def __init__(self, controlFlag):
+    def __init__(self, controlFlags, fieldFlags):
+        PrimaryDrawingOrder.__init__(self, controlFlags, fieldFlags)
+        self.cacheId = UInt16Le(conditional = self.isFieldPresent(0))
+        self.nLeftRect = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(1))
+        self.nTopRect = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(2))
+        self.nWidth = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(3))
+        self.nHeight = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(4))
+        self.bRop = UInt8(conditional = self.isFieldPresent(5))
+        self.nXSrc = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(6))
+        self.nYSrc = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(7))
+        self.cacheIndex = UInt16Le(conditional = self.isFieldPresent(8))
+        
+class GlyphIndexOrder(PrimaryDrawingOrder):
+    """
+    @summary: The GlyphIndex Primary Drawing Order is used to render 
+                a string of glyphs stored in glyph cache
+                BackColor is the color of text, ForeColor the color of opaque rectangle
+    @see: http://msdn.microsoft.com/en-us/library/cc241594.aspx
+    """
+    _ORDER_TYPE_ = OrderType.TS_ENC_INDEX_ORDER
+    _NEGOTIATE_ = caps.Order.TS_NEG_INDEX_INDEX
+    _FIELD_BYTES_ = 3
+    
+    def __init__(self, controlFlags, fieldFlags):
+        PrimaryDrawingOrder.__init__(self, controlFlags, fieldFlags)
+        self.cacheId = UInt8(conditional = self.isFieldPresent(0))
+        self.flAccel = UInt8(conditional = self.isFieldPresent(1))
+        self.ulCharInc = UInt8(conditional = self.isFieldPresent(2))
+        self.fOpRedundant = UInt8(conditional = self.isFieldPresent(3))
+        self.backColor = UInt24Le(conditional = self.isFieldPresent(4))
+        self.foreColor = UInt24Le(conditional = self.isFieldPresent(5))
+        self.bkLeft = SInt16Le(conditional = self.isFieldPresent(6))
+        self.bkTop = SInt16Le(conditional = self.isFieldPresent(7))
+        self.bkRight = SInt16Le(conditional = self.isFieldPresent(8))
+        self.bkBottom = SInt16Le(conditional = self.isFieldPresent(9))
+        self.opLeft = SInt16Le(conditional = self.isFieldPresent(10))
+        self.opTop = SInt16Le(conditional = self.isFieldPresent(11))
+        self.opRight = SInt16Le(conditional = self.isFieldPresent(12))
+        self.opBottom = SInt16Le(conditional = self.isFieldPresent(13))
+        self.brushOrgX = SInt8(conditional = self.isFieldPresent(14))
+        self.brushOrgY = SInt8(conditional = self.isFieldPresent(15))
+        self.brushStyle = UInt8(conditional = self.isFieldPresent(16))
+        self.brushHatch = UInt8(conditional = self.isFieldPresent(17))
+        self.brushExtra = String("\x00" * 7, readLen = CallableValue(7), conditional = self.isFieldPresent(18))
+        self.x = SInt16Le(conditional = self.isFieldPresent(19))
+        self.y = SInt16Le(conditional = self.isFieldPresent(20))
+        self.glyphData = VariableBytes(conditional = self.isFieldPresent(21))
+        
+    def getAccel(self):
+        """
+        @return: {TextAccelFlag}
+        """
+        return self.flAccel.value
+    
+    def getCharInc(self):
+        """
+        @return: {integer} fixed increment between glyphs (0 for variable increment)
+        """
+        return self.ulCharInc.value
+    
+    def getOrigin(self):
+        """
+        @return: {tuple} (x, y) position of first glyph
+        """
+        return (self.x.value, self.y.value)
+    
+    def getOpaqueRect(self):
+        """
+        @return: {tuple} exclusive opaque rectangle (left, top, right, bottom) or None
+        """
+        if self.opRight.value > self.opLeft.value and self.opBottom.value > self.opTop.value:
+            return (self.opLeft.value, self.opTop.value, self.opRight.value, self.opBottom.value)
+        if self.fOpRedundant.value:
+            return (self.bkLeft.value, self.bkTop.value, self.bkRight.value, self.bkBottom.value)
+        return None
+    
+class FastIndexOrder(PrimaryDrawingOrder):
+    """
+    @summary: The FastIndex Primary Drawing Order is used to render 
+                a string of glyphs stored in glyph cache with delta coordinates
+    @see: http://msdn.microsoft.com/en-us/library/cc241592.aspx
+    """
+    _ORDER_TYPE_ = OrderType.TS_ENC_FAST_INDEX_ORDER
+    _NEGOTIATE_ = caps.Order.TS_NEG_FAST_INDEX_INDEX
+    _FIELD_BYTES_ = 2
+    
+    def __init__(self, controlFlags, fieldFlags):
+        PrimaryDrawingOrder.__init__(self, controlFlags, fieldFlags)
+        self.cacheId = UInt8(conditional = self.isFieldPresent(0))
+        #flAccel in high byte, ulCharInc in low byte
+        self.fDrawing = UInt16Le(conditional = self.isFieldPresent(1))
+        self.backColor = UInt24Le(conditional = self.isFieldPresent(2))
+        self.foreColor = UInt24Le(conditional = self.isFieldPresent(3))
+        self.bkLeft = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(4))
+        self.bkTop = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(5))
+        self.bkRight = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(6))
+        self.bkBottom = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(7))
+        self.opLeft = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(8))
+        self.opTop = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(9))
+        self.opRight = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(10))
+        self.opBottom = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(11))
+        self.x = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(12))
+        self.y = CoordField(self.isDeltaCoordinates, conditional = self.isFieldPresent(13))
+        self.glyphData = VariableBytes(conditional = self.isFieldPresent(14))
+        
+    def getAccel(self):
+        """
+        @return: {TextAccelFlag}
+        """
+        return self.fDrawing.value >> 8
+    
+    def getCharInc(self):
+        """
+        @return: {integer} fixed increment between glyphs (0 for variable increment)
+        """
+        return self.fDrawing.value & 0xff
+    
+    def getOrigin(self):
+        """
+        @return: {tuple} (x, y) position of first glyph, -32768 means background rectangle origin
+        """
+        return (self.bkLeft.value if self.x.value == -32768 else self.x.value, self.bkTop.value if self.y.value == -32768 else self.y.value)
+    
+    def getOpaqueRect(self):
+        """
+        @summary: Missing coordinates of opaque rectangle are the background rectangle ones
+                    if opBottom is -32768, opTop is a mask of these coordinates
+        @return: {tuple} exclusive opaque rectangle (left, top, right, bottom) or None
+        """
+        left, top, right, bottom = self.opLeft.value, self.opTop.value, self.opRight.value, self.opBottom.value
+        if bottom == -32768:
+            bottom = self.bkBottom.value if top & 0x01 else 0
+            right = self.bkRight.value if top & 0x02 else right
+            left = self.bkLeft.value if top & 0x08 else left
+            top = self.bkTop.value if top & 0x04 else 0
+        if left == 0:
+            left = self.bkLeft.value
+        if right == 0:
+            right = self.bkRight.value
+        if right <= left or bottom <= top:
+            return None
+        return (left, top, right, bottom)
+    
+class FastGlyphOrder(FastIndexOrder):
+    """
+    @summary: The FastGlyph Primary Drawing Order is used to render 
+                one glyph, may contain glyph to store in glyph cache
+    @see: http://msdn.microsoft.com/en-us/library/cc241593.aspx
+    """
+    _ORDER_TYPE_ = OrderType.TS_ENC_FAST_GLYPH_ORDER
+    _NEGOTIATE_ = caps.Order.TS_NEG_FAST_GLYPH_INDEX
+    
+    def getGlyph(self):
+        """
+        @return: {FastGlyphData} glyph data of order
+        """
+        glyph = FastGlyphData(readLen = CallableValue(len(self.glyphData.data.value)))
+        Stream(self.glyphData.data.value).readType(glyph)
+        return glyph
+        
+class FastGlyphData(CompositeType):
+    """
+    @summary: Glyph index of FastGlyph order followed by glyph if it's not cached
+    @see: http://msdn.microsoft.com/en-us/library/cc241593.aspx
+    """
+    def __init__(self, readLen = None):
+        CompositeType.__init__(self, readLen = readLen)
+        self.cacheIndex = UInt8()
+        isGlyphPresent = lambda:readLen.value > 1
+        self.x = TwoByteSigned(conditional = isGlyphPresent)
+        self.y = TwoByteSigned(conditional = isGlyphPresent)
+        self.cx = TwoByteUnsigned(conditional = isGlyphPresent)
+        self.cy = TwoByteUnsigned(conditional = isGlyphPresent)
+        self.aj = String(readLen = CallableValue(lambda:(((self.cx.value + 7) / 8 * self.cy.value + 3) & ~3)), conditional = isGlyphPresent)
+        
+    def isGlyphPresent(self):
+        """
+        @return: True if glyph must be stored in cache
+        """
+        return self.cx._is_readed
+        
+class SecondaryDrawingOrder(CompositeType):
+    """
+    @summary: Secondary drawing order use to fill caches
+    @see: http://msdn.microsoft.com/en-us/library/cc241604.aspx
+    """
+    def __init__(self):
         CompositeType.__init__(self)
-        #only one field
-        self.fieldFlag = UInt8(conditional = lambda:(controlFlag.value & ControlFlag.TS_ZERO_FIELD_BYTE_BIT0 == 0 and controlFlag.value & ControlFlag.TS_ZERO_FIELD_BYTE_BIT1 == 0))
-        self.nLeftRect = CoordField(lambda:not controlFlag.value & ControlFlag.TS_DELTA_COORDINATES == 0)
-        self.nTopRect = CoordField(lambda:not controlFlag.value & ControlFlag.TS_DELTA_COORDINATES == 0)
-        self.nWidth = CoordField(lambda:not controlFlag.value & ControlFlag.TS_DELTA_COORDINATES == 0)
-        self.nHeight = CoordField(lambda:not controlFlag.value & ControlFlag.TS_DELTA_COORDINATES == 0)
-        self.bRop = CoordField(lambda:not controlFlag.value & ControlFlag.TS_DELTA_COORDINATES == 0)
\ No newline at end of file
+        #order length is 13 bytes less than real size (control flags included)
+        self.orderLength = SInt16Le()
+        self.extraFlags = UInt16Le()
+        self.orderType = UInt8()
+        
+        def SecondaryOrderFactory():
+            """
+            @summary: Create secondary order in accordance with order type
+            """
+            readLen = CallableValue(self.orderLength.value + 7)
+            if self.orderType.value in [SecondaryOrderType.TS_CACHE_BITMAP_UNCOMPRESSED_REV2, SecondaryOrderType.TS_CACHE_BITMAP_COMPRESSED_REV2]:
+                return CacheBitmapRev2Order(self.orderType, self.extraFlags, readLen = readLen)
+            for c in [CacheBitmapRev3Order, CacheColorTableOrder, CacheBrushOrder, CacheGlyphOrder]:
+                if self.orderType.value == c._ORDER_TYPE_:
+                    return c(self.extraFlags, readLen = readLen)
+            log.debug("unknown secondary order type : %s"%hex(self.orderType.value))
+            return String(readLen = readLen)
+        
+        self.order = FactoryType(SecondaryOrderFactory)
+        
+class CacheBitmapRev2Order(CompositeType):
+    """
+    @summary: Store a bitmap in bitmap cache (revision 2)
+                order type define if bitmap is compressed
+    @see: http://msdn.microsoft.com/en-us/library/cc241608.aspx
+    """
+    def __init__(self, orderType, extraFlags, readLen = None):
+        """
+        @param orderType: {UInt8} secondary order type
+        @param extraFlags: {UInt16Le} extra flags of secondary order header
+        @param readLen: {CallableValue} order length
+        """
+        CompositeType.__init__(self, readLen = readLen)
+        self._orderType = orderType
+        self._extraFlags = extraFlags
+        self.key1 = UInt32Le(conditional = lambda:(self.getFlags() & CacheBitmapFlag.CBR2_PERSISTENT_KEY_PRESENT))
+        self.key2 = UInt32Le(conditional = lambda:(self.getFlags() & CacheBitmapFlag.CBR2_PERSISTENT_KEY_PRESENT))
+        self.bitmapWidth = TwoByteUnsigned()
+        self.bitmapHeight = TwoByteUnsigned(conditional = lambda:not (self.getFlags() & CacheBitmapFlag.CBR2_HEIGHT_SAME_AS_WIDTH))
+        self.bitmapLength = FourByteUnsigned()
+        self.cacheIndex = TwoByteUnsigned()
+        self.bitmapComprHdr = data.BitmapCompressedDataHeader(conditional = lambda:(self.isCompressed() and not (self.getFlags() & CacheBitmapFlag.CBR2_NO_BITMAP_COMPRESSION_HDR)))
+        self.bitmapDataStream = String(readLen = CallableValue(lambda:(self.bitmapComprHdr.cbCompMainBodySize.value if self.bitmapComprHdr._is_readed else self.bitmapLength.value)))
+        
+    def getCacheId(self):
+        """
+        @return: {integer} id of bitmap cache cell
+        """
+        return self._extraFlags.value & 0x7
+    
+    def getBitsPerPixel(self):
+        """
+        @return: {integer} color depth of bitmap
+        """
+        return {BitsPerPixelId.CBR2_8BPP : 8, BitsPerPixelId.CBR2_16BPP : 16, BitsPerPixelId.CBR2_24BPP : 24, BitsPerPixelId.CBR2_32BPP : 32}.get((self._extraFlags.value >> 3) & 0xf, 0)
+    
+    def getFlags(self):
+        """
+        @return: {CacheBitmapFlag}
+        """
+        return self._extraFlags.value >> 7
+    
+    def getHeight(self):
+        """
+        @return: {integer} height of bitmap
+        """
+        if self.getFlags() & CacheBitmapFlag.CBR2_HEIGHT_SAME_AS_WIDTH:
+            return self.bitmapWidth.value
+        return self.bitmapHeight.value
+    
+    def isCompressed(self):
+        """
+        @return: True if bitmap is RLE compressed
+        """
+        return self._orderType.value == SecondaryOrderType.TS_CACHE_BITMAP_COMPRESSED_REV2
+    
+class CacheBitmapRev3Order(CompositeType):
+    """
+    @summary: Store a bitmap encoded with a bitmap codec in bitmap cache (revision 3)
+    @see: http://msdn.microsoft.com/en-us/library/cc241609.aspx
+    """
+    _ORDER_TYPE_ = SecondaryOrderType.TS_CACHE_BITMAP_COMPRESSED_REV3
+    
+    def __init__(self, extraFlags, readLen = None):
+        """
+        @param extraFlags: {UInt16Le} extra flags of secondary order header
+        @param readLen: {CallableValue} order length
+        """
+        CompositeType.__init__(self, readLen = readLen)
+        self._extraFlags = extraFlags
+        self.cacheIndex = UInt16Le()
+        self.key1 = UInt32Le()
+        self.key2 = UInt32Le()
+        self.bitmapData = data.BitmapDataEx()
+        
+    def getCacheId(self):
+        """
+        @return: {integer} id of bitmap cache cell
+        """
+        return self._extraFlags.value & 0x7
+    
+    def getFlags(self):
+        """
+        @return: {CacheBitmapFlag}
+        """
+        return self._extraFlags.value >> 7
+    
+class CacheColorTableOrder(CompositeType):
+    """
+    @summary: Store a palette in color table cache
+    @see: http://msdn.microsoft.com/en-us/library/cc241617.aspx
+    """
+    _ORDER_TYPE_ = SecondaryOrderType.TS_CACHE_COLOR_TABLE
+    
+    def __init__(self, extraFlags, readLen = None):
+        CompositeType.__init__(self, readLen = readLen)
+        self.cacheIndex = UInt8()
+        self.numberColors = UInt16Le(lambda:len(self.colorTable._array))
+        #TS_COLOR_QUAD (blue, green, red, pad)
+        self.colorTable = ArrayType(UInt32Le, readLen = self.numberColors)
+        
+class CacheBrushOrder(CompositeType):
+    """
+    @summary: Store a 8x8 brush in brush cache
+    @see: http://msdn.microsoft.com/en-us/library/cc241616.aspx
+    """
+    _ORDER_TYPE_ = SecondaryOrderType.TS_CACHE_BRUSH
+    
+    def __init__(self, extraFlags, readLen = None):
+        CompositeType.__init__(self, readLen = readLen)
+        self.cacheIndex = UInt8()
+        self.iBitmapFormat = UInt8()
+        self.cx = UInt8(8)
+        self.cy = UInt8(8)
+        self.style = UInt8()
+        self.iBytes = UInt8(lambda:sizeof(self.brushData))
+        self.brushData = String(readLen = self.iBytes)
+        
+class GlyphData(CompositeType):
+    """
+    @summary: Glyph of cache glyph order
+                aj is a monochrome bitmap, rows padded on a byte
+    @see: http://msdn.microsoft.com/en-us/library/cc241621.aspx
+    """
+    def __init__(self):
+        CompositeType.__init__(self)
+        self.cacheIndex = UInt16Le()
+        self.x = SInt16Le()
+        self.y = SInt16Le()
+        self.cx = UInt16Le()
+        self.cy = UInt16Le()
+        #padded on 4 bytes
+        self.aj = String(readLen = CallableValue(lambda:(((self.cx.value + 7) / 8 * self.cy.value + 3) & ~3)))
+        
+class CacheGlyphOrder(CompositeType):
+    """
+    @summary: Store glyphs in glyph cache (revision 1)
+    @see: http://msdn.microsoft.com/en-us/library/cc241620.aspx
+    """
+    _ORDER_TYPE_ = SecondaryOrderType.TS_CACHE_GLYPH
+    
+    def __init__(self, extraFlags, readLen = None):
+        CompositeType.__init__(self, readLen = readLen)
+        self.cacheId = UInt8()
+        self.cGlyphs = UInt8(lambda:len(self.glyphData._array))
+        self.glyphData = ArrayType(GlyphData, readLen = self.cGlyphs)
+        self.unicodeCharacters = String(readLen = CallableValue(lambda:(self.cGlyphs.value * 2)), conditional = lambda:(extraFlags.value & CacheGlyphFlag.CG_GLYPH_UNICODE_PRESENT))
+        
+class OrderDecoder(object):
+    """
+    @summary: Read drawing orders stream of order update
+                Keep state between orders (last order type, bounds and fields of each order type)
+                State is kept during whole session
+    @see: http://msdn.microsoft.com/en-us/library/cc241586.aspx
+    """
+    #supported primary drawing orders
+    _PRIMARY_ORDERS_ = [DstBltOrder, PatBltOrder, ScrBltOrder, LineToOrder, OpaqueRectOrder, MemBltOrder, GlyphIndexOrder, FastIndexOrder, FastGlyphOrder]
+    
+    def __init__(self):
+        self._controlFlags = UInt8()
+        self._fieldFlags = CallableValue(0)
+        #initial order type is PatBlt
+        self._orderType = OrderType.TS_ENC_PATBLT_ORDER
+        self._bounds = Bounds()
+        #last state of each primary order
+        self._primaryOrders = {}
+        for c in self._PRIMARY_ORDERS_:
+            self._primaryOrders[c._ORDER_TYPE_] = c(self._controlFlags, self._fieldFlags)
+            
+    def readOrders(self, s, numberOrders):
+        """
+        @summary: Read orders of an order update
+                    Each order object is reused by next order of same type
+                    So it must be handled before reading next one
+        @param s: {Stream} order data
+        @param numberOrders: {integer} number of orders in stream
+        @return: {generator} PrimaryDrawingOrder | SecondaryDrawingOrder
+        """
+        for _ in range(0, numberOrders):
+            s.readType(self._controlFlags)
+            if not self._controlFlags.value & ControlFlag.TS_STANDARD:
+                #alternate secondary order have no common length field
+                log.debug("alternate secondary order not supported, drop remaining orders")
+                return
+            
+            if self._controlFlags.value & ControlFlag.TS_SECONDARY:
+                secondaryOrder = SecondaryDrawingOrder()
+                s.readType(secondaryOrder)
+                yield secondaryOrder
+                continue
+            
+            yield self.readPrimaryOrder(s)
+            
+    def readPrimaryOrder(self, s):
+        """
+        @summary: Read primary order in accordance with last state
+        @param s: {Stream}
+        @return: {PrimaryDrawingOrder}
+        @raise InvalidExpectedDataException: for unsupported order type
+        """
+        if self._controlFlags.value & ControlFlag.TS_TYPE_CHANGE:
+            orderType = UInt8()
+            s.readType(orderType)
+            self._orderType = orderType.value
+            
+        if not self._orderType in self._primaryOrders:
+            raise InvalidExpectedDataException("unsupported primary order type : %s"%hex(self._orderType))
+        
+        order = self._primaryOrders[self._orderType]
+        
+        #field flags bytes may be omitted when they are zero
+        fieldBytes = order._FIELD_BYTES_
+        if self._controlFlags.value & ControlFlag.TS_ZERO_FIELD_BYTE_BIT0:
+            fieldBytes -= 1
+        if self._controlFlags.value & ControlFlag.TS_ZERO_FIELD_BYTE_BIT1:
+            fieldBytes = max(fieldBytes - 2, 0)
+        fieldFlags = 0
+        for i in range(0, fieldBytes):
+            fieldByte = UInt8()
+            s.readType(fieldByte)
+            fieldFlags |= fieldByte.value << (8 * i)
+        self._fieldFlags.value = fieldFlags
+        
+        if self._controlFlags.value & ControlFlag.TS_BOUNDS:
+            if not self._controlFlags.value & ControlFlag.TS_ZERO_BOUNDS_DELTAS:
+                s.readType(self._bounds)
+            order._bounds = self._bounds
+        else:
+            order._bounds = None
+            
+        s.readType(order)
+        return order
@@ -21,13 +21,15 @@
 Use to manage RDP stack in twisted
 """
 
-from rdpy.core import layer
+import struct
+from rdpy.core import layer, framebuffer
 from rdpy.core.error import CallPureVirtualFuntion, InvalidValue
 import pdu.layer
 import pdu.data
 import pdu.caps
+import pdu.order
 import rdpy.core.log as log
-import tpkt, x224, sec
+import tpkt, x224, sec, cache, rfx, nsc, drdynvc, rdpgfx, autodetect
 from t125 import mcs, gcc
 from nla import cssp, ntlm
 
@@ -39,7 +41,15 @@ class SecurityLevel(object):
     RDP_LEVEL_SSL = 1
     RDP_LEVEL_NLA = 2
 
-class RDPClientController(pdu.layer.PDUClientListener):
+class PointerType(object):
+    """
+    @summary: Kind of pointer notified to client observer
+    """
+    POINTER_HIDDEN = 0
+    POINTER_DEFAULT = 1
+    POINTER_SHAPE = 2
+
+class RDPClientController(pdu.layer.PDUClientListener, rdpgfx.GraphicsListener, autodetect.NetworkCharacteristicsListener):
     """
     Manage RDP stack as client
     """
@@ -61,6 +71,36 @@ class RDPClientController(pdu.layer.PDUClientListener):
         self._secLayer.initFastPath(self._tpktLayer)
         #is pdu layer is ready to send
         self._isReady = False
+        #input events waiting to be sent
+        self._pendingInputs = []
+        self._flushInputsCall = None
+        #max delay before pending inputs are sent, None send at once (see setInputBatching)
+        self._inputBatchDelay = None
+        #desktop surface use to render drawing orders and surface commands
+        #only kept if needed, observers decode bitmap updates
+        self._useFrameBuffer = False
+        self._frameBuffer = None
+        #caches filled by secondary orders
+        self._bitmapCache = None
+        self._brushCache = {}
+        self._colorTableCache = {}
+        self._glyphCache = None
+        self._persistentBitmapCache = None
+        self._pointerCache = None
+        #decode bitmaps of update on several threads
+        self._decodePool = None
+        #RemoteFX codec state of surface bits commands
+        self._rfxDecoder = rfx.Decoder()
+        #dynamic virtual channels manager, None if not enabled
+        self._dynamicChannels = None
+        #server doesn't send display updates (client is hidden or paused)
+        self._isOutputSuppressed = False
+        #area invalidated by refresh orders while output is suppressed
+        self._refreshArea = None
+        #auto-detect layer of message channel, None if not enabled
+        self._autoDetect = None
+        #last measured (bandwidth, rtt)
+        self._networkCharacteristics = None
         
     def getProtocol(self):
         """
@@ -69,6 +109,13 @@ class RDPClientController(pdu.layer.PDUClientListener):
         """
         return cssp.CSSP(self._tpktLayer, ntlm.NTLMv2(self._secLayer._info.domain.value, self._secLayer._info.userName.value, self._secLayer._info.password.value))
     
+    def getFrameBuffer(self):
+        """
+        @return: {framebuffer.FrameBuffer} desktop surface kept up to date with bitmap updates
+                    and drawing orders, None before stack is ready or if not enabled (see setFrameBuffer)
+        """
+        return self._frameBuffer
+    
     def getColorDepth(self):
         """
         @return: color depth set by the server (15, 16, 24)
@@ -87,6 +134,165 @@ class RDPClientController(pdu.layer.PDUClientListener):
         """
         self._secLayer._info.extendedInfo.performanceFlags.value = sec.PerfFlag.PERF_DISABLE_WALLPAPER | sec.PerfFlag.PERF_DISABLE_MENUANIMATIONS | sec.PerfFlag.PERF_DISABLE_CURSOR_SHADOW | sec.PerfFlag.PERF_DISABLE_THEMING | sec.PerfFlag.PERF_DISABLE_FULLWINDOWDRAG
         
+    def setCompression(self, compressionType = pdu.data.CompressionType.PACKET_COMPR_TYPE_64K):
+        """
+        @summary: Ask server to use bulk compression for updates
+        Server may choose any type lower or equal than compressionType
+        @param compressionType: {pdu.data.CompressionType} max supported compression type
+        @see: http://msdn.microsoft.com/en-us/library/cc240475.aspx
+        """
+        self._secLayer._info.flag.value &= ~sec.InfoFlag.INFO_CompressionTypeMask
+        self._secLayer._info.flag.value |= sec.InfoFlag.INFO_COMPRESSION | ((compressionType << 9) & sec.InfoFlag.INFO_CompressionTypeMask)
+        
+    def setBulkRecorder(self, recorder):
+        """
+        @summary: Record bulk compressed payloads received from server
+                    they can be replayed by rdpy-bulkbench
+        @param recorder: {rss.FileRecorder}
+        """
+        self._pduLayer._bulkRecorder = recorder
+        
+    def setAutoDetect(self, bandwidth = None, rtt = None):
+        """
+        @summary: Let server measure network characteristics at connection and during session
+                    settings sent at connection are chosen from previous measure if any
+        @param bandwidth: {integer} previous bandwidth in kilobits per second (see getNetworkCharacteristics)
+        @param rtt: {integer} previous round trip time in milliseconds
+        """
+        coreSettings = self._mcsLayer._clientSettings.getBlock(gcc.MessageType.CS_CORE)
+        coreSettings.earlyCapabilityFlags.value |= gcc.CapabilityFlags.RNS_UD_CS_SUPPORT_NETCHAR_AUTODETECT | gcc.CapabilityFlags.RNS_UD_CS_VALID_CONNECTION_TYPE
+        coreSettings.connectionType.value = gcc.ConnectionType.CONNECTION_TYPE_AUTODETECT
+        self._autoDetect = autodetect.Client(self, self._secLayer)
+        self._mcsLayer.setMessageChannel(self._autoDetect)
+        if not bandwidth is None:
+            self.setNetworkProfile(autodetect.getProfile(bandwidth, rtt))
+            
+    def setNetworkProfile(self, profile):
+        """
+        @summary: Configure session for a kind of link, must be called before connection
+                    connection type is kept if auto-detect is enabled
+                    color depth is only lowered, codecs may still ask for a 32 bpp session
+        @param profile: {autodetect.NetworkProfile}
+        """
+        coreSettings = self._mcsLayer._clientSettings.getBlock(gcc.MessageType.CS_CORE)
+        if coreSettings.connectionType.value != gcc.ConnectionType.CONNECTION_TYPE_AUTODETECT:
+            coreSettings.earlyCapabilityFlags.value |= gcc.CapabilityFlags.RNS_UD_CS_VALID_CONNECTION_TYPE
+            coreSettings.connectionType.value = profile.connectionType
+        if not profile.colorDepth is None and profile.colorDepth < coreSettings.highColorDepth.value:
+            coreSettings.highColorDepth.value = profile.colorDepth
+        
+        self._secLayer._info.extendedInfo.performanceFlags.value = profile.performanceFlags
+        self._secLayer._info.flag.value &= ~(sec.InfoFlag.INFO_COMPRESSION | sec.InfoFlag.INFO_CompressionTypeMask)
+        if not profile.compressionType is None:
+            self.setCompression(profile.compressionType)
+        
+        if not self._inputBatchDelay is None:
+            self.setInputBatching(profile.inputBatchDelay)
+            
+    def getNetworkCharacteristics(self):
+        """
+        @return: {tuple} last measured (bandwidth in kbps, rtt in ms or None), None if never measured
+                    may be given to setAutoDetect of next connection
+        """
+        return self._networkCharacteristics
+        
+    def setInputBatching(self, delay = 1.0 / 60):
+        """
+        @summary: Configure accumulation of input events (disabled by default)
+                    consecutive pointer moves are merged and pending events
+                    are sent in one input PDU
+        @param delay: {float} max delay in second before pending events are sent
+                        0 flush at next reactor tick, None disable batching
+        """
+        self.flushInputs()
+        self._inputBatchDelay = delay
+        
+    def setDecodePool(self, decodePool):
+        """
+        @summary: Decode rectangles of bitmap updates in parallel without blocking reactor
+                    rectangles are drawn in frame buffer and notified in update order
+        @param decodePool: {framebuffer.DecodePool} may be shared with observers
+        """
+        self._decodePool = decodePool
+        #tiles of RemoteFX messages are decoded in parallel
+        self._rfxDecoder.setDecodeMap(map if decodePool is None else decodePool.map)
+        
+    def getDecodePool(self):
+        """
+        @return: {framebuffer.DecodePool} decode pool or None if bitmaps are decoded in reactor thread
+        """
+        return self._decodePool
+        
+    def setFrameBuffer(self):
+        """
+        @summary: Keep desktop surface up to date (see getFrameBuffer)
+                    use by tools without graphic toolkit
+        """
+        self._useFrameBuffer = True
+        
+    def setDrawingOrders(self):
+        """
+        @summary: Advertise drawing orders, they are rendered in frame buffer
+                    and modified areas are notified to observers as raw bitmap
+        """
+        self.setFrameBuffer()
+        self._pduLayer._drawingOrders = True
+        
+    def setRemoteFX(self):
+        """
+        @summary: Advertise RemoteFX codec, server send surface bits commands
+                    in place of bitmap updates in a 32 bpp session
+        """
+        coreSettings = self._mcsLayer._clientSettings.getBlock(gcc.MessageType.CS_CORE)
+        #RemoteFX is only used in 32 bpp session on LAN
+        coreSettings.earlyCapabilityFlags.value |= gcc.CapabilityFlags.RNS_UD_CS_WANT_32BPP_SESSION | gcc.CapabilityFlags.RNS_UD_CS_VALID_CONNECTION_TYPE
+        coreSettings.connectionType.value = gcc.ConnectionType.CONNECTION_TYPE_LAN
+        #surface commands are rendered in frame buffer
+        self.setFrameBuffer()
+        self._pduLayer.addBitmapCodec(pdu.caps.CodecGUID.CODEC_GUID_REMOTEFX, rfx.CODEC_ID_REMOTEFX, rfx.clientCapsContainer())
+        self._pduLayer.addBitmapCodec(pdu.caps.CodecGUID.CODEC_GUID_IMAGE_REMOTEFX, rfx.CODEC_ID_IMAGE_REMOTEFX, rfx.clientCapsContainer())
+        
+    def setNSCodec(self):
+        """
+        @summary: Advertise NSCodec, server may send surface bits commands
+                    in place of bitmap updates in a 32 bpp session
+        """
+        coreSettings = self._mcsLayer._clientSettings.getBlock(gcc.MessageType.CS_CORE)
+        coreSettings.earlyCapabilityFlags.value |= gcc.CapabilityFlags.RNS_UD_CS_WANT_32BPP_SESSION
+        #surface commands are rendered in frame buffer
+        self.setFrameBuffer()
+        self._pduLayer.addBitmapCodec(pdu.caps.CodecGUID.CODEC_GUID_NSCODEC, nsc.CODEC_ID_NSCODEC, nsc.capabilitySet())
+        
+    def setGraphicsPipeline(self, cacheStore = None):
+        """
+        @summary: Open drdynvc static channel and accept graphics pipeline
+                    server draw desktop in surfaces of a 32 bpp session
+        @param cacheStore: {dict} persistent store of graphics pipeline cache
+                            cache key => (width, height, pixels), may be shared between clients
+        """
+        coreSettings = self._mcsLayer._clientSettings.getBlock(gcc.MessageType.CS_CORE)
+        coreSettings.earlyCapabilityFlags.value |= gcc.CapabilityFlags.RNS_UD_CS_WANT_32BPP_SESSION | gcc.CapabilityFlags.RNS_UD_CS_SUPPORT_DYNVC_GFX_PROTOCOL
+        self._dynamicChannels = drdynvc.Client()
+        self._dynamicChannels.addListener(rdpgfx.CHANNEL_NAME, lambda:rdpgfx.GraphicsClient(self, cacheStore))
+        channelLayer = sec.ChannelSecLayer(drdynvc.VirtualChannel(self._dynamicChannels), self._secLayer)
+        self._mcsLayer.addVirtualChannel(gcc.ChannelDef(drdynvc.CHANNEL_NAME, gcc.ChannelOptions.CHANNEL_OPTION_INITIALIZED | gcc.ChannelOptions.CHANNEL_OPTION_ENCRYPT_RDP), channelLayer)
+        
+    def setPersistentBitmapCache(self, persistentBitmapCache):
+        """
+        @summary: Keep cached bitmaps on disk across sessions
+                    keys of known bitmaps are sent at connection
+                    and server doesn't send them again
+        @param persistentBitmapCache: {cache.PersistentBitmapCache} may be shared between clients
+        """
+        #cached bitmaps are only drawn by orders
+        self.setDrawingOrders()
+        self._persistentBitmapCache = persistentBitmapCache
+        self._pduLayer._persistentBitmapCache = persistentBitmapCache
+        bitmapCacheCapability = self._pduLayer._clientCapabilities[pdu.caps.CapsType.CAPSTYPE_BITMAPCACHE_REV2].capability
+        bitmapCacheCapability.cacheFlags.value |= pdu.caps.BitmapCacheRev2Flag.PERSISTENT_KEYS_EXPECTED_FLAG
+        for cellInfo in bitmapCacheCapability.bitmapCacheCellInfo._array[:bitmapCacheCapability.numCellCaches.value]:
+            cellInfo.value |= pdu.caps.BitmapCacheRev2CellInfo.PERSISTENT
+        
     def setScreen(self, width, height):
         """
         @summary: Set screen dim of session
@@ -185,20 +391,519 @@ class RDPClientController(pdu.layer.PDUClientListener):
         @summary: Call when a bitmap data is received from update PDU
         @param rectangles: [pdu.BitmapData] struct
         """
-        for observer in self._clientObserver:
-            #for each rectangle in update PDU
+        #observers decode bitmaps
+        if self._frameBuffer is None:
+            for rectangle in rectangles:
+                self.notifyRectangle(rectangle)
+                
+        elif self._decodePool is None:
+            #all tiles in one native call
+            try:
+                self._frameBuffer.updateBitmaps([(rectangle.destLeft.value, rectangle.destTop.value, rectangle.destRight.value, rectangle.destBottom.value, rectangle.width.value, rectangle.height.value, rectangle.bitsPerPixel.value, rectangle.flags.value & pdu.data.BitmapFlag.BITMAP_COMPRESSION, rectangle.bitmapDataStream.value) for rectangle in rectangles])
+            except InvalidValue as e:
+                log.debug("Unable to update frame buffer : %s"%e)
             for rectangle in rectangles:
-                observer.onUpdate(rectangle.destLeft.value, rectangle.destTop.value, rectangle.destRight.value, rectangle.destBottom.value, rectangle.width.value, rectangle.height.value, rectangle.bitsPerPixel.value, rectangle.flags.value & pdu.data.BitmapFlag.BITMAP_COMPRESSION, rectangle.bitmapDataStream.value)
+                self.notifyRectangle(rectangle)
+                
+        else:
+            #decoded in threads, drawn and notified in update order
+            frameBuffer = self._frameBuffer
+            for rectangle in rectangles:
+                self._decodePool.submit(lambda rectangle = rectangle:self.decodeRectangle(frameBuffer, rectangle), lambda pixels, rectangle = rectangle:self.drawRectangle(frameBuffer, rectangle, pixels))
+                
+    def decodeRectangle(self, frameBuffer, rectangle):
+        """
+        @summary: Decode bitmap of update in frame buffer color depth
+                    may be called from decoding threads
+        @param frameBuffer: {framebuffer.FrameBuffer} destination surface
+        @param rectangle: {pdu.data.BitmapData}
+        @return: {str} top-down pixels or None if bitmap is invalid
+        """
+        try:
+            if rectangle.bitsPerPixel.value != frameBuffer.getBitsPerPixel():
+                raise InvalidValue("bitmap color depth %s doesn't match surface color depth"%rectangle.bitsPerPixel.value)
+            return frameBuffer.decodeBitmap(rectangle.width.value, rectangle.height.value, rectangle.flags.value & pdu.data.BitmapFlag.BITMAP_COMPRESSION, rectangle.bitmapDataStream.value)
+        except InvalidValue as e:
+            log.debug("Unable to update frame buffer : %s"%e)
+            return None
+        
+    def drawRectangle(self, frameBuffer, rectangle, pixels):
+        """
+        @summary: Write decoded bitmap of update in frame buffer then notify observers
+                    observers can read pixels from frame buffer instead of decoding again
+        @param frameBuffer: {framebuffer.FrameBuffer} surface use at decoding
+        @param rectangle: {pdu.data.BitmapData}
+        @param pixels: {str} top-down pixels or None if bitmap is invalid
+        """
+        #surface was reset meanwhile
+        if not frameBuffer is self._frameBuffer:
+            return
+        if not pixels is None:
+            frameBuffer.writeBitmap(rectangle.destLeft.value, rectangle.destTop.value, rectangle.destRight.value, rectangle.destBottom.value, rectangle.width.value, pixels)
+        self.notifyRectangle(rectangle)
+        
+    def notifyRectangle(self, rectangle):
+        """
+        @summary: Notify observers with bitmap of update as received
+        @param rectangle: {pdu.data.BitmapData}
+        """
+        for observer in self._clientObserver:
+            observer.onUpdate(rectangle.destLeft.value, rectangle.destTop.value, rectangle.destRight.value, rectangle.destBottom.value, rectangle.width.value, rectangle.height.value, rectangle.bitsPerPixel.value, rectangle.flags.value & pdu.data.BitmapFlag.BITMAP_COMPRESSION, rectangle.bitmapDataStream.value)
+            
+    def callInOrder(self, function):
+        """
+        @summary: Call function after bitmaps of previous updates are drawn
+        @param function: {callable()}
+        """
+        if self._decodePool is None:
+            function()
+        else:
+            self._decodePool.schedule(function)
+        
+    def onPrimaryOrder(self, primaryOrder):
+        """
+        @summary: Render primary drawing order into frame buffer
+                    and notify observers with modified area as raw bitmap
+        @param primaryOrder: {pdu.order.PrimaryDrawingOrder}
+        """
+        if self._frameBuffer is None:
+            return
+        
+        #order is reused by next one of same type so it can't wait pending updates
+        if not self._decodePool is None:
+            self._decodePool.flush()
+        try:
+            area = self.drawPrimaryOrder(primaryOrder)
+        except InvalidValue as e:
+            log.debug("Unable to render primary order : %s"%e)
+            return
+        if area is None:
+            return
+        
+        left, top, width, height = area
+        paddedWidth, data = self._frameBuffer.getBitmap(left, top, width, height)
+        for observer in self._clientObserver:
+            observer.onUpdate(left, top, left + width - 1, top + height - 1, paddedWidth, height, self._frameBuffer.getBitsPerPixel(), False, data)
+            
+    def onSurfaceCommand(self, surfaceCommand):
+        """
+        @summary: Render surface bits command into frame buffer
+                    and notify observers with modified areas as raw bitmap
+        @param surfaceCommand: {pdu.data.SurfaceCommand}
+        """
+        if self._frameBuffer is None or surfaceCommand.cmdType.value == pdu.data.SurfaceCommandType.CMDTYPE_FRAME_MARKER:
+            return
+        self.callInOrder(lambda:self.drawSurfaceCommand(surfaceCommand))
+        
+    def drawSurfaceCommand(self, surfaceCommand):
+        """
+        @summary: Render surface bits command into frame buffer
+                    and notify observers with modified areas as raw bitmap
+        @param surfaceCommand: {pdu.data.SurfaceCommand}
+        """
+        command = surfaceCommand.command
+        bitmapData = command.bitmapData
+        left, top = command.destLeft.value, command.destTop.value
+        width, height = bitmapData.width.value, bitmapData.height.value
+        try:
+            if bitmapData.codecID.value in [rfx.CODEC_ID_REMOTEFX, rfx.CODEC_ID_IMAGE_REMOTEFX]:
+                if self._frameBuffer.getBitsPerPixel() != 32:
+                    raise InvalidValue("RemoteFX need 32 bpp session")
+                rects, tiles = self._rfxDecoder.decode(bitmapData.bitmapData.value)
+                pixels = rfx.drawTiles(width, height, tiles)
+            else:
+                rects = [(0, 0, width, height)]
+                pixels = self.decodeSurfaceBitmap(bitmapData)
+        except InvalidValue as e:
+            log.debug("Unable to render surface command : %s"%e)
+            return
+        
+        for x, y, rectWidth, rectHeight in rects:
+            area = self._frameBuffer.blitRect(left + x, top + y, rectWidth, rectHeight, pixels, width, x, y)
+            if area is None:
+                continue
+            areaLeft, areaTop, areaWidth, areaHeight = area
+            paddedWidth, data = self._frameBuffer.getBitmap(areaLeft, areaTop, areaWidth, areaHeight)
+            for observer in self._clientObserver:
+                observer.onUpdate(areaLeft, areaTop, areaLeft + areaWidth - 1, areaTop + areaHeight - 1, paddedWidth, areaHeight, self._frameBuffer.getBitsPerPixel(), False, data)
+                
+    def decodeSurfaceBitmap(self, bitmapData):
+        """
+        @summary: Decode bitmap encoded with a negotiated codec
+        @param bitmapData: {pdu.data.BitmapDataEx}
+        @return: {str} top-down pixels in frame buffer color depth
+        @raise InvalidValue: if codec is not supported
+        """
+        codecID = bitmapData.codecID.value
+        width, height = bitmapData.width.value, bitmapData.height.value
+        if codecID in [rfx.CODEC_ID_REMOTEFX, rfx.CODEC_ID_IMAGE_REMOTEFX] and self._frameBuffer.getBitsPerPixel() == 32:
+            return rfx.drawTiles(width, height, self._rfxDecoder.decode(bitmapData.bitmapData.value)[1])
+        if codecID == nsc.CODEC_ID_NSCODEC and self._frameBuffer.getBitsPerPixel() == 32:
+            return nsc.decode(width, height, bitmapData.bitmapData.value)
+        #raw bitmap of surface command is top-down
+        if codecID == 0 and (bitmapData.bpp.value + 7) / 8 == (self._frameBuffer.getBitsPerPixel() + 7) / 8:
+            return bitmapData.bitmapData.value
+        raise InvalidValue("unsupported bitmap codec %s"%codecID)
+            
+    def drawPrimaryOrder(self, primaryOrder):
+        """
+        @summary: Render primary drawing order into frame buffer
+        @param primaryOrder: {pdu.order.PrimaryDrawingOrder}
+        @return: {tuple} modified area (left, top, width, height) or None
+        """
+        bounds = primaryOrder.getBounds()
+        if isinstance(primaryOrder, pdu.order.DstBltOrder):
+            return self._frameBuffer.fillRect(primaryOrder.nLeftRect.value, primaryOrder.nTopRect.value, primaryOrder.nWidth.value, primaryOrder.nHeight.value, 0, primaryOrder.bRop.value, bounds)
+        
+        elif isinstance(primaryOrder, pdu.order.PatBltOrder):
+            pattern = None
+            if primaryOrder.brushStyle.value & pdu.order.BrushStyle.TS_CACHED_BRUSH:
+                brush = self._brushCache.get(primaryOrder.brushHatch.value)
+                if brush is None:
+                    log.debug("Unable to render primary order : unknown brush %s"%primaryOrder.brushHatch.value)
+                    return None
+                if brush.isMonochrome():
+                    pattern = self.createMonochromePattern(brush.getRows(), primaryOrder.foreColor.value, primaryOrder.backColor.value)
+                else:
+                    pattern = brush.getRows()
+            elif primaryOrder.brushStyle.value == pdu.order.BrushStyle.BS_PATTERN:
+                pattern = self.createMonochromePattern([primaryOrder.brushHatch.value] + [ord(c) for c in primaryOrder.brushExtra.value], primaryOrder.foreColor.value, primaryOrder.backColor.value)
+            
+            if not pattern is None:
+                return self._frameBuffer.patternRect(primaryOrder.nLeftRect.value, primaryOrder.nTopRect.value, primaryOrder.nWidth.value, primaryOrder.nHeight.value, pattern, primaryOrder.brushOrgX.value, primaryOrder.brushOrgY.value, primaryOrder.bRop.value, bounds)
+            #hatched brush are rendered as solid brush
+            return self._frameBuffer.fillRect(primaryOrder.nLeftRect.value, primaryOrder.nTopRect.value, primaryOrder.nWidth.value, primaryOrder.nHeight.value, primaryOrder.foreColor.value, primaryOrder.bRop.value, bounds)
+        
+        elif isinstance(primaryOrder, pdu.order.OpaqueRectOrder):
+            return self._frameBuffer.fillRect(primaryOrder.nLeftRect.value, primaryOrder.nTopRect.value, primaryOrder.nWidth.value, primaryOrder.nHeight.value, primaryOrder.getColor(), framebuffer.Rop3.PATCOPY, bounds)
+        
+        elif isinstance(primaryOrder, pdu.order.ScrBltOrder):
+            return self._frameBuffer.copyRect(primaryOrder.nLeftRect.value, primaryOrder.nTopRect.value, primaryOrder.nWidth.value, primaryOrder.nHeight.value, primaryOrder.nXSrc.value, primaryOrder.nYSrc.value, primaryOrder.bRop.value, bounds)
+        
+        elif isinstance(primaryOrder, pdu.order.LineToOrder):
+            return self._frameBuffer.drawLine(primaryOrder.nXStart.value, primaryOrder.nYStart.value, primaryOrder.nXEnd.value, primaryOrder.nYEnd.value, primaryOrder.penColor.value, primaryOrder.bRop2.value, bounds)
+        
+        elif isinstance(primaryOrder, pdu.order.MemBltOrder):
+            #low byte is bitmap cache id, high byte is color table index
+            bitmap = self._bitmapCache.get(primaryOrder.cacheId.value & 0xff, primaryOrder.cacheIndex.value)
+            if bitmap is None:
+                log.debug("Unable to render primary order : bitmap %s of cache %s not found"%(primaryOrder.cacheIndex.value, primaryOrder.cacheId.value & 0xff))
+                return None
+            width, height, pixels = bitmap
+            return self._frameBuffer.blitRect(primaryOrder.nLeftRect.value, primaryOrder.nTopRect.value, primaryOrder.nWidth.value, primaryOrder.nHeight.value, pixels, width, primaryOrder.nXSrc.value, primaryOrder.nYSrc.value, primaryOrder.bRop.value, bounds)
+        
+        elif isinstance(primaryOrder, (pdu.order.GlyphIndexOrder, pdu.order.FastIndexOrder)):
+            return self.drawGlyphOrder(primaryOrder, bounds)
+        
+        log.debug("Unable to render primary order %s"%primaryOrder.__class__)
+        return None
+    
+    def drawGlyphOrder(self, glyphOrder, bounds):
+        """
+        @summary: Render opaque rectangle then glyphs of a glyph order
+        @param glyphOrder: {pdu.order.GlyphIndexOrder | pdu.order.FastIndexOrder | pdu.order.FastGlyphOrder}
+        @param bounds: {tuple} inclusive clipping rectangle
+        @return: {tuple} modified area (left, top, width, height) or None
+        """
+        areas = []
+        opaqueRect = glyphOrder.getOpaqueRect()
+        if not opaqueRect is None:
+            left, top, right, bottom = opaqueRect
+            areas.append(self._frameBuffer.fillRect(left, top, right - left, bottom - top, glyphOrder.foreColor.value, framebuffer.Rop3.PATCOPY, bounds))
+        
+        x, y = glyphOrder.getOrigin()
+        try:
+            if isinstance(glyphOrder, pdu.order.FastGlyphOrder):
+                glyphData = glyphOrder.getGlyph()
+                if glyphData.isGlyphPresent():
+                    self._glyphCache.putGlyph(glyphOrder.cacheId.value, glyphData.cacheIndex.value, cache.Glyph(glyphData.x.value, glyphData.y.value, glyphData.cx.value, glyphData.cy.value, glyphData.aj.value))
+                areas.append(self.drawGlyph(self._glyphCache.getGlyph(glyphOrder.cacheId.value, glyphData.cacheIndex.value), x, y, glyphOrder.backColor.value, bounds))
+            else:
+                self.drawGlyphFragments(glyphOrder, glyphOrder.glyphData.data.value, x, y, areas, bounds)
+        except (InvalidValue, IndexError) as e:
+            #keep already drawn area
+            log.debug("Unable to render glyphs : %s"%e)
+        
+        return framebuffer.union(areas)
+    
+    def drawGlyphFragments(self, glyphOrder, fragments, x, y, areas, bounds):
+        """
+        @summary: Render glyph fragments of glyph order
+                    each glyph is followed by its delta position
+                    unless glyphs have a fixed increment
+        @param glyphOrder: {pdu.order.GlyphIndexOrder | pdu.order.FastIndexOrder}
+        @param fragments: {str} glyph fragments bytes
+        @param x: {integer} x coordinate of current glyph origin
+        @param y: {integer} y coordinate of current glyph origin
+        @param areas: {list} modified areas
+        @param bounds: {tuple} inclusive clipping rectangle
+        @return: {tuple} (x, y) origin of next glyph
+        @see: http://msdn.microsoft.com/en-us/library/cc241595.aspx
+        """
+        accel = glyphOrder.getAccel()
+        charInc = glyphOrder.getCharInc()
+        #variable pitch text, each glyph or fragment use is followed by delta
+        hasDelta = charInc == 0 and not accel & pdu.order.TextAccelFlag.SO_CHAR_INC_EQUAL_BM_BASE
+        index = 0
+        while index < len(fragments):
+            operation = ord(fragments[index])
+            index += 1
+            if operation == pdu.order.GlyphFragment.GLYPH_FRAGMENT_USE:
+                x, y = self.drawGlyphFragments(glyphOrder, self._glyphCache.getFragment(ord(fragments[index])), x, y, areas, bounds)
+                index += 1
+                if hasDelta and index < len(fragments):
+                    delta, index = self.readGlyphDelta(fragments, index)
+                    x, y = self.moveGlyphOrigin(accel, x, y, delta)
+            
+            elif operation == pdu.order.GlyphFragment.GLYPH_FRAGMENT_ADD:
+                #fragment is made of previous bytes
+                size = ord(fragments[index + 1])
+                self._glyphCache.putFragment(ord(fragments[index]), fragments[max(index - 1 - size, 0):index - 1])
+                index += 2
+            
+            else:
+                if hasDelta:
+                    delta, index = self.readGlyphDelta(fragments, index)
+                    x, y = self.moveGlyphOrigin(accel, x, y, delta)
+                    
+                glyph = self._glyphCache.getGlyph(glyphOrder.cacheId.value, operation)
+                areas.append(self.drawGlyph(glyph, x, y, glyphOrder.backColor.value, bounds))
+                
+                if charInc != 0:
+                    x, y = self.moveGlyphOrigin(accel, x, y, charInc)
+                elif accel & pdu.order.TextAccelFlag.SO_CHAR_INC_EQUAL_BM_BASE:
+                    x, y = self.moveGlyphOrigin(accel, x, y, glyph.getWidth())
+        return (x, y)
+    
+    def readGlyphDelta(self, fragments, index):
+        """
+        @summary: Read delta position of variable pitch text
+                    0x80 is followed by 16 bits delta
+        @param fragments: {str} glyph fragments bytes
+        @param index: {integer} offset of delta
+        @return: {tuple} (delta, offset of next byte)
+        """
+        delta = struct.unpack("<b", fragments[index])[0]
+        index += 1
+        if delta == -128:
+            delta = struct.unpack("<h", fragments[index:index + 2])[0]
+            index += 2
+        return (delta, index)
+    
+    def moveGlyphOrigin(self, accel, x, y, delta):
+        """
+        @summary: Move origin of glyph in text direction
+        @param accel: {pdu.order.TextAccelFlag}
+        @param delta: {integer} distance to next glyph
+        @return: {tuple} (x, y) new origin
+        """
+        if accel & pdu.order.TextAccelFlag.SO_REVERSED:
+            delta = -delta
+        if accel & pdu.order.TextAccelFlag.SO_VERTICAL:
+            return (x, y + delta)
+        return (x + delta, y)
+    
+    def drawGlyph(self, glyph, x, y, color, bounds):
+        """
+        @summary: Render glyph mask with text color
+        @param glyph: {cache.Glyph}
+        @param x: {integer} x coordinate of glyph origin
+        @param y: {integer} y coordinate of glyph origin
+        @param color: {integer} text color in session color depth
+        @param bounds: {tuple} inclusive clipping rectangle
+        @return: {tuple} modified area
+        """
+        left, top, width, height = glyph.getRect(x, y)
+        return self._frameBuffer.fillMask(left, top, width, height, glyph.getMask(), color, bounds)
+    
+    def createMonochromePattern(self, rows, foreColor, backColor):
+        """
+        @summary: Build 8x8 pattern from monochrome brush, set bit use background color
+        @param rows: {list(integer)} 8 top-down rows
+        @param foreColor: {integer} foreground color in session color depth
+        @param backColor: {integer} background color in session color depth
+        @return: {list(str)} 8 rows of 8 raw pixels
+        """
+        backPixel = self._frameBuffer.colorToPixel(backColor)
+        forePixel = self._frameBuffer.colorToPixel(foreColor)
+        return ["".join([backPixel if row & (0x80 >> i) else forePixel for i in range(0, 8)]) for row in rows]
+    
+    def onSecondaryOrder(self, secondaryOrder):
+        """
+        @summary: Fill client caches with secondary drawing order
+        @param secondaryOrder: {pdu.order.SecondaryDrawingOrder}
+        """
+        if self._frameBuffer is None:
+            return
+        
+        orderType = secondaryOrder.orderType.value
+        cacheOrder = secondaryOrder.order
+        try:
+            if orderType in [pdu.order.SecondaryOrderType.TS_CACHE_BITMAP_UNCOMPRESSED_REV2, pdu.order.SecondaryOrderType.TS_CACHE_BITMAP_COMPRESSED_REV2]:
+                if (cacheOrder.getBitsPerPixel() + 7) / 8 != (self._frameBuffer.getBitsPerPixel() + 7) / 8:
+                    raise InvalidValue("cached bitmap color depth %s doesn't match session color depth"%cacheOrder.getBitsPerPixel())
+                if cacheOrder.getFlags() & pdu.order.CacheBitmapFlag.CBR2_DO_NOT_CACHE:
+                    return
+                width, height = cacheOrder.bitmapWidth.value, cacheOrder.getHeight()
+                pixels = self._frameBuffer.decodeBitmap(width, height, cacheOrder.isCompressed(), cacheOrder.bitmapDataStream.value)
+                self._bitmapCache.put(cacheOrder.getCacheId(), cacheOrder.cacheIndex.value, (width, height, pixels))
+                if not self._persistentBitmapCache is None and cacheOrder.getFlags() & pdu.order.CacheBitmapFlag.CBR2_PERSISTENT_KEY_PRESENT:
+                    self._persistentBitmapCache.put(cacheOrder.key1.value, cacheOrder.key2.value, cacheOrder.getCacheId(), self._frameBuffer.getBitsPerPixel(), width, height, pixels)
+            
+            elif orderType == pdu.order.SecondaryOrderType.TS_CACHE_BITMAP_COMPRESSED_REV3:
+                bitmapData = cacheOrder.bitmapData
+                if cacheOrder.getFlags() & pdu.order.CacheBitmapFlag.CBR2_DO_NOT_CACHE:
+                    return
+                width, height = bitmapData.width.value, bitmapData.height.value
+                #raw bitmap of cache order is bottom-up
+                if bitmapData.codecID.value == 0:
+                    pixels = self._frameBuffer.decodeBitmap(width, height, False, bitmapData.bitmapData.value)
+                else:
+                    pixels = self.decodeSurfaceBitmap(bitmapData)
+                self._bitmapCache.put(cacheOrder.getCacheId(), cacheOrder.cacheIndex.value, (width, height, pixels))
+            
+            elif orderType == pdu.order.SecondaryOrderType.TS_CACHE_COLOR_TABLE:
+                self._colorTableCache[cacheOrder.cacheIndex.value] = [c.value for c in cacheOrder.colorTable._array]
+            
+            elif orderType == pdu.order.SecondaryOrderType.TS_CACHE_GLYPH:
+                for glyphData in cacheOrder.glyphData._array:
+                    self._glyphCache.putGlyph(cacheOrder.cacheId.value, glyphData.cacheIndex.value, cache.Glyph(glyphData.x.value, glyphData.y.value, glyphData.cx.value, glyphData.cy.value, glyphData.aj.value))
+            
+            elif orderType == pdu.order.SecondaryOrderType.TS_CACHE_BRUSH:
+                self._brushCache[cacheOrder.cacheIndex.value] = cache.decodeBrush(cacheOrder.iBitmapFormat.value, cacheOrder.brushData.value)
+            
+            else:
+                log.debug("Ignore secondary order %s"%hex(orderType))
+        except InvalidValue as e:
+            log.debug("Unable to read secondary order : %s"%e)
+                
+    def onPointerUpdate(self, pointerUpdate):
+        """
+        @summary: Update pointer cache and notify observers of pointer changes
+        @param pointerUpdate: {pdu.data.SystemPointerUpdate | pdu.data.PointerPositionUpdate | pdu.data.ColorPointerUpdate | pdu.data.CachedPointerUpdate | pdu.data.NewPointerUpdate}
+        """
+        if self._pointerCache is None:
+            return
+        
+        #pointer update may be wrapped by a factory type
+        messageType = pointerUpdate._MESSAGE_TYPE_
+        try:
+            if messageType == pdu.data.PointerMessageType.TS_PTRMSGTYPE_POSITION:
+                for observer in self._clientObserver:
+                    observer.onPointerPosition(pointerUpdate.xPos.value, pointerUpdate.yPos.value)
+                return
+            
+            if messageType == pdu.data.PointerMessageType.TS_PTRMSGTYPE_SYSTEM:
+                pointerType = PointerType.POINTER_HIDDEN if pointerUpdate.systemPointerType.value == pdu.data.SystemPointerType.SYSPTR_NULL else PointerType.POINTER_DEFAULT
+                for observer in self._clientObserver:
+                    observer.onPointerUpdate(pointerType, 0, 0, 0, 0, "")
+                return
+            
+            if messageType == pdu.data.PointerMessageType.TS_PTRMSGTYPE_CACHED:
+                pointer = self._pointerCache.get(pointerUpdate.cacheIndex.value)
+            else:
+                xorBpp = pointerUpdate.getXorBpp()
+                if messageType == pdu.data.PointerMessageType.TS_PTRMSGTYPE_POINTER:
+                    pointerUpdate = pointerUpdate.colorPtrAttr
+                width, height = pointerUpdate.width.value, pointerUpdate.height.value
+                pointer = cache.Pointer(pointerUpdate.hotSpotX.value, pointerUpdate.hotSpotY.value, width, height, cache.decodePointer(xorBpp, width, height, pointerUpdate.xorMaskData.value, pointerUpdate.andMaskData.value))
+                self._pointerCache.put(pointerUpdate.cacheIndex.value, pointer)
+        except InvalidValue as e:
+            log.debug("Unable to read pointer update : %s"%e)
+            return
+        
+        hotSpotX, hotSpotY = pointer.getHotSpot()
+        width, height = pointer.getSize()
+        for observer in self._clientObserver:
+            observer.onPointerUpdate(PointerType.POINTER_SHAPE, hotSpotX, hotSpotY, width, height, pointer.getData())
                 
     def onReady(self):
         """
         @summary: Call when PDU layer is connected
         """
         self._isReady = True
+        if self._useFrameBuffer:
+            bitmapCapability = self._pduLayer._serverCapabilities[pdu.caps.CapsType.CAPSTYPE_BITMAP].capability
+            self._frameBuffer = framebuffer.FrameBuffer(bitmapCapability.desktopWidth.value, bitmapCapability.desktopHeight.value, self.getColorDepth())
+        self._bitmapCache = cache.BitmapCache(self._pduLayer._clientCapabilities[pdu.caps.CapsType.CAPSTYPE_BITMAPCACHE_REV2].capability.getCellEntries())
+        self._brushCache = {}
+        self._colorTableCache = {}
+        glyphCapability = self._pduLayer._clientCapabilities[pdu.caps.CapsType.CAPSTYPE_GLYPHCACHE].capability
+        self._glyphCache = cache.GlyphCache([entry.cacheEntries.value for entry in glyphCapability.glyphCache._array], glyphCapability.fragCache.value & 0xffff)
+        pointerCapability = self._pduLayer._clientCapabilities[pdu.caps.CapsType.CAPSTYPE_POINTER].capability
+        self._pointerCache = cache.PointerCache(max(pointerCapability.colorPointerCacheSize.value, pointerCapability.pointerCacheSize.value))
+        self.loadPersistentBitmaps()
+        #output may be suppressed before connection
+        if self._isOutputSuppressed:
+            self._isOutputSuppressed = self.isSuppressOutputSupported()
+            if self._isOutputSuppressed:
+                self.sendSuppressOutput(False)
         #signal all listener
         for observer in self._clientObserver:
             observer.onReady()
             
+    def loadPersistentBitmaps(self):
+        """
+        @summary: Fill bitmap cache with bitmaps of persistent key list
+                    in order of keys sent to server
+                    bitmaps were copied when keys were sent (see pdu.layer.Client.sendPersistentKeyListPDU)
+        """
+        if self._pduLayer._persistentBitmaps is None:
+            return
+        for cacheId in range(0, len(self._pduLayer._persistentBitmaps)):
+            for cacheIndex, bitmap in enumerate(self._pduLayer._persistentBitmaps[cacheId]):
+                self._bitmapCache.put(cacheId, cacheIndex, bitmap)
+        #keys are only sent at first activation
+        self._pduLayer._persistentBitmaps = None
+    
+    def onNetworkCharacteristics(self, bandwidth, rtt):
+        """
+        @summary: Call when auto-detect measure link
+                    settings of Client Info PDU are already sent,
+                    only input batching is adapted during session
+        @param bandwidth: {integer} bandwidth in kilobits per second
+        @param rtt: {integer} round trip time in milliseconds, None if unknown
+        @see: autodetect.NetworkCharacteristicsListener
+        """
+        self._networkCharacteristics = (bandwidth, rtt)
+        profile = autodetect.getProfile(bandwidth, rtt)
+        log.debug("network characteristics bandwidth %d kbps rtt %s ms connection type %d"%(bandwidth, rtt, profile.connectionType))
+        if not self._inputBatchDelay is None:
+            self.setInputBatching(profile.inputBatchDelay)
+        
+    def onResetGraphics(self, width, height):
+        """
+        @summary: Graphics pipeline output is reset, desktop is 32 bpp
+        @see: rdpgfx.GraphicsListener
+        """
+        def reset():
+            self._frameBuffer = framebuffer.FrameBuffer(width, height, 32)
+        self.callInOrder(reset)
+        
+    def onGraphicsUpdate(self, left, top, width, height, pixels):
+        """
+        @summary: Render output of graphics pipeline into frame buffer
+                    and notify observers with modified area as raw bitmap
+        @see: rdpgfx.GraphicsListener
+        """
+        self.callInOrder(lambda:self.drawGraphicsUpdate(left, top, width, height, pixels))
+        
+    def drawGraphicsUpdate(self, left, top, width, height, pixels):
+        """
+        @summary: Render output of graphics pipeline into frame buffer
+                    and notify observers with modified area as raw bitmap
+        @see: onGraphicsUpdate
+        """
+        if self._frameBuffer is None or self._frameBuffer.getBitsPerPixel() != 32:
+            return
+        area = self._frameBuffer.blitRect(left, top, width, height, pixels, width, 0, 0)
+        if area is None:
+            return
+        areaLeft, areaTop, areaWidth, areaHeight = area
+        paddedWidth, data = self._frameBuffer.getBitmap(areaLeft, areaTop, areaWidth, areaHeight)
+        for observer in self._clientObserver:
+            observer.onUpdate(areaLeft, areaTop, areaLeft + areaWidth - 1, areaTop + areaHeight - 1, paddedWidth, areaHeight, 32, False, data)
+            
     def onSessionReady(self):
         """
         @summary: Call when Windows session is ready (connected)
@@ -212,7 +917,10 @@ class RDPClientController(pdu.layer.PDUClientListener):
         """
         @summary: Event call when RDP stack is closed
         """
+        self.flushInputs()
         self._isReady = False
+        if not self._dynamicChannels is None:
+            self._dynamicChannels.closeChannels()
         for observer in self._clientObserver:
             observer.onClose()
     
@@ -257,7 +965,7 @@ class RDPClientController(pdu.layer.PDUClientListener):
             event.yPos.value = y
             
             # send proper event
-            self._pduLayer.sendInputEvents([event])
+            self.sendInputEvent(event)
             
         except InvalidValue:
             log.info("try send pointer event with incorrect position")
@@ -291,7 +999,7 @@ class RDPClientController(pdu.layer.PDUClientListener):
             event.yPos.value = y
             
             #send proper event
-            self._pduLayer.sendInputEvents([event])
+            self.sendInputEvent(event)
             
         except InvalidValue:
             log.info("try send wheel event with incorrect position")
@@ -316,7 +1024,7 @@ class RDPClientController(pdu.layer.PDUClientListener):
                 event.keyboardFlags.value |= pdu.data.KeyboardFlag.KBDFLAGS_EXTENDED
                 
             #send event
-            self._pduLayer.sendInputEvents([event])
+            self.sendInputEvent(event)
             
         except InvalidValue:
             log.info("try send bad key event")
@@ -337,19 +1045,67 @@ class RDPClientController(pdu.layer.PDUClientListener):
                 event.keyboardFlags.value |= pdu.data.KeyboardFlag.KBDFLAGS_RELEASE
             
             #send event
-            self._pduLayer.sendInputEvents([event])
+            self.sendInputEvent(event)
             
         except InvalidValue:
             log.info("try send bad key event")
             
+    def sendInputEvent(self, event):
+        """
+        @summary: Accumulate input event (see setInputBatching)
+                    pointer move replace previous pending pointer move
+                    order of other events is kept
+        @param event: {pdu.data.PointerEvent | pdu.data.PointerExEvent | pdu.data.ScancodeKeyEvent | pdu.data.UnicodeKeyEvent}
+        """
+        if self._inputBatchDelay is None:
+            self._pduLayer.sendInputEvents([event])
+            return
+        
+        if len(self._pendingInputs) > 0 and self.isPointerMove(event) and self.isPointerMove(self._pendingInputs[-1]):
+            self._pendingInputs[-1] = event
+        else:
+            self._pendingInputs.append(event)
+            
+        if self._flushInputsCall is None:
+            #reactor is imported at use to let tools install their own reactor (or fork) before
+            from twisted.internet import reactor
+            self._flushInputsCall = reactor.callLater(self._inputBatchDelay, self.flushInputs)
+            
+    def isPointerMove(self, event):
+        """
+        @param event: {pdu.data.PointerEvent | pdu.data.PointerExEvent | pdu.data.ScancodeKeyEvent | pdu.data.UnicodeKeyEvent}
+        @return: True if event is a pointer move without button or wheel
+        """
+        return isinstance(event, pdu.data.PointerEvent) and event.pointerFlags.value == pdu.data.PointerFlag.PTRFLAGS_MOVE
+    
+    def flushInputs(self):
+        """
+        @summary: send all pending input events in one input PDU
+        """
+        if not self._flushInputsCall is None:
+            if self._flushInputsCall.active():
+                self._flushInputsCall.cancel()
+            self._flushInputsCall = None
+            
+        pendingInputs = self._pendingInputs
+        self._pendingInputs = []
+        if len(pendingInputs) == 0 or not self._isReady:
+            return
+        self._pduLayer.sendInputEvents(pendingInputs)
+        
     def sendRefreshOrder(self, left, top, right, bottom):
         """
         @summary: Force server to resend a particular zone
+                    while output is suppressed zone is refreshed at resume
         @param left: left coordinate
         @param top: top coordinate
         @param right: right coordinate
         @param bottom: bottom coordinate
         """
+        if self._isOutputSuppressed:
+            self._refreshArea = framebuffer.union([self._refreshArea, (left, top, right - left + 1, bottom - top + 1)])
+            return
+        
         refreshPDU = pdu.data.RefreshRectPDU()
         rect = pdu.data.InclusiveRectangle()
         rect.left.value = left
@@ -359,10 +1115,85 @@ class RDPClientController(pdu.layer.PDUClientListener):
         refreshPDU.areasToRefresh._array.append(rect)
         self._pduLayer.sendDataPDU(refreshPDU)
             
+    def getDesktopSize(self):
+        """
+        @return: {tuple} (width, height) of desktop negotiated with server
+        """
+        bitmapCapability = self._pduLayer._serverCapabilities[pdu.caps.CapsType.CAPSTYPE_BITMAP].capability
+        return (bitmapCapability.desktopWidth.value, bitmapCapability.desktopHeight.value)
+    
+    def suppressOutput(self):
+        """
+        @summary: Ask server to stop sending display updates
+                    when client is hidden, minimized or paused
+                    Ignored if server doesn't support it
+        """
+        if self._isOutputSuppressed or (self._isReady and not self.isSuppressOutputSupported()):
+            return
+        self._isOutputSuppressed = True
+        self._refreshArea = None
+        if self._isReady:
+            self.sendSuppressOutput(False)
+        
+    def resumeOutput(self, area = None):
+        """
+        @summary: Allow display updates again and ask server to refresh
+                    area that client need to redraw
+        @param area: {tuple} (left, top, width, height) area to refresh
+                        default is area of refresh orders received while output was suppressed
+                        or whole desktop
+        """
+        if not self._isOutputSuppressed:
+            return
+        self._isOutputSuppressed = False
+        if not self._isReady:
+            return
+        self.sendSuppressOutput(True)
+        
+        width, height = self.getDesktopSize()
+        area = area or self._refreshArea or (0, 0, width, height)
+        self._refreshArea = None
+        left, top = max(area[0], 0), max(area[1], 0)
+        right, bottom = min(area[0] + area[2], width) - 1, min(area[1] + area[3], height) - 1
+        if right < left or bottom < top or not self._pduLayer._serverCapabilities[pdu.caps.CapsType.CAPSTYPE_GENERAL].capability.refreshRectSupport.value:
+            return
+        self.sendRefreshOrder(left, top, right, bottom)
+        
+    def isSuppressOutputSupported(self):
+        """
+        @return: {bool} True if server advertise suppress output support
+        """
+        return bool(self._pduLayer._serverCapabilities[pdu.caps.CapsType.CAPSTYPE_GENERAL].capability.suppressOutputSupport.value)
+        
+    def isOutputSuppressed(self):
+        """
+        @return: {bool} True if server is asked to not send display updates
+        """
+        return self._isOutputSuppressed
+        
+    def sendSuppressOutput(self, allowDisplayUpdates):
+        """
+        @summary: Send suppress output PDU
+        @param allowDisplayUpdates: {bool} False to suppress display updates
+                                    True to allow updates of whole desktop
+        """
+        suppressPDU = pdu.data.SupressOutputDataPDU()
+        if allowDisplayUpdates:
+            width, height = self.getDesktopSize()
+            suppressPDU.allowDisplayUpdates.value = pdu.data.Display.ALLOW_DISPLAY_UPDATES
+            suppressPDU.desktopRect.left.value = 0
+            suppressPDU.desktopRect.top.value = 0
+            suppressPDU.desktopRect.right.value = width - 1
+            suppressPDU.desktopRect.bottom.value = height - 1
+        else:
+            suppressPDU.allowDisplayUpdates.value = pdu.data.Display.SUPPRESS_DISPLAY_UPDATES
+        self._pduLayer.sendDataPDU(suppressPDU)
+            
     def close(self):
         """
         @summary: Close protocol stack
         """
+        self.flushInputs()
         self._pduLayer.close()
 
 class RDPServerController(pdu.layer.PDUServerListener):
@@ -394,11 +1225,21 @@ class RDPServerController(pdu.layer.PDUServerListener):
         self._secLayer.initFastPath(self._tpktLayer)
         #set color depth of session
         self.setColorDepth(colorDepth)
+        #bulk compression level (0 disable)
+        self._compressionLevel = 1
+        #pending updates accumulated by sendUpdate
+        self._pendingUpdates = []
+        self._pendingUpdatesSize = 0
+        self._flushUpdatesCall = None
+        #updates are sent at once unless batching is enabled
+        self._updateBatchDelay = None
+        self._updateBatchSize = 0x10000
         
     def close(self):
         """
         @summary: Close protocol stack
         """
+        self.flushUpdates()
         self._pduLayer.close()
         
     def getProtocol(self):
@@ -472,10 +1313,32 @@ class RDPServerController(pdu.layer.PDUServerListener):
         self._colorDepth = colorDepth
         self._pduLayer._serverCapabilities[pdu.caps.CapsType.CAPSTYPE_BITMAP].capability.preferredBitsPerPixel.value = colorDepth
         if self._isReady:
+            #send updates of old color depth
+            self.flushUpdates()
             #restart connection sequence
             self._isReady = False
             self._pduLayer.sendPDU(pdu.data.DeactiveAllPDU())
             
+    def setUpdateBatching(self, delay = 0.0, size = 0x10000):
+        """
+        @summary: Configure accumulation of sendUpdate calls (disabled by default)
+                    pending updates are sent in as few PDU as possible
+        @param delay: {float} max delay in second before pending updates are sent
+                        0 flush at next reactor tick, None disable batching
+        @param size: {integer} pending updates are sent as soon as their size reach this value
+        """
+        self.flushUpdates()
+        self._updateBatchDelay = delay
+        self._updateBatchSize = size
+        
+    def setCompressionLevel(self, level):
+        """
+        @summary: Set MPPC compression level of fast path updates
+                    compression is only used if client support it
+        @param level: {integer} 0 disable, 1 (fast) to 9 (best ratio)
+        """
+        self._compressionLevel = level
+        
     def setKeyEventUnicodeSupport(self):
         """
         @summary: Enable key event in unicode format
@@ -487,6 +1350,14 @@ class RDPServerController(pdu.layer.PDUServerListener):
         @summary: RDP stack is now ready
         """
         self._isReady = True
+        #client info flag contain max supported compression type
+        infoFlag = self._secLayer._info.flag.value
+        if self._compressionLevel > 0 and infoFlag & sec.InfoFlag.INFO_COMPRESSION:
+            compressionType = min((infoFlag & sec.InfoFlag.INFO_CompressionTypeMask) >> 9, pdu.data.CompressionType.PACKET_COMPR_TYPE_64K)
+            self._pduLayer.setCompression(compressionType, self._compressionLevel)
+        else:
+            self._pduLayer.setCompression(None)
+            
         for observer in self._serverObserver:
             observer.onReady()
             
@@ -495,6 +1366,7 @@ class RDPServerController(pdu.layer.PDUServerListener):
         @summary: Event call when RDP stack is closed
         """
         self._isReady = False
+        self.flushUpdates()
         for observer in self._serverObserver:
             observer.onClose()
             
@@ -512,29 +1384,63 @@ class RDPServerController(pdu.layer.PDUServerListener):
                 elif event.messageType.value == pdu.data.InputMessageType.INPUT_EVENT_UNICODE:
                     observer.onKeyEventUnicode(event.slowPathInputData.unicode.value, not (event.slowPathInputData.keyboardFlags.value & pdu.data.KeyboardFlag.KBDFLAGS_RELEASE))
                 #mouse events
-                elif event.messageType.value == pdu.data.InputMessageType.INPUT_EVENT_MOUSE:
-                    isPressed = event.slowPathInputData.pointerFlags.value & pdu.data.PointerFlag.PTRFLAGS_DOWN
-                    button = 0
-                    if event.slowPathInputData.pointerFlags.value & pdu.data.PointerFlag.PTRFLAGS_BUTTON1:
-                        button = 1
-                    elif event.slowPathInputData.pointerFlags.value & pdu.data.PointerFlag.PTRFLAGS_BUTTON2:
-                        button = 2
-                    elif event.slowPathInputData.pointerFlags.value & pdu.data.PointerFlag.PTRFLAGS_BUTTON3:
-                        button = 3
-                    observer.onPointerEvent(event.slowPathInputData.xPos.value, event.slowPathInputData.yPos.value, button, isPressed)
-                elif event.messageType.value == pdu.data.InputMessageType.INPUT_EVENT_MOUSEX:
-                    isPressed = event.slowPathInputData.pointerFlags.value & pdu.data.PointerExFlag.PTRXFLAGS_DOWN
-                    button = 0
-                    if event.slowPathInputData.pointerFlags.value & pdu.data.PointerExFlag.PTRXFLAGS_BUTTON1:
-                        button = 4
-                    elif event.slowPathInputData.pointerFlags.value & pdu.data.PointerExFlag.PTRXFLAGS_BUTTON2:
-                        button = 5
-                    observer.onPointerEvent(event.slowPathInputData.xPos.value, event.slowPathInputData.yPos.value, button, isPressed)
+                elif event.messageType.value in [pdu.data.InputMessageType.INPUT_EVENT_MOUSE, pdu.data.InputMessageType.INPUT_EVENT_MOUSEX]:
+                    self.dispatchPointerEvent(observer, event.slowPathInputData)
+                #toggle keys state
+                elif event.messageType.value == pdu.data.InputMessageType.INPUT_EVENT_SYNC:
+                    observer.onKeyboardSynchronize(event.slowPathInputData.toggleFlags.value)
+                    
+    def onFastPathInput(self, fastPathInputEvents):
+        """
+        @summary: Event call when fast path input are available
+        @param fastPathInputEvents: [data.FastPathInputEvent]
+        """
+        for observer in self._serverObserver:
+            for event in fastPathInputEvents:
+                eventCode = event.getEventCode()
+                eventFlags = event.getEventFlags()
+                #scan code
+                if eventCode == pdu.data.FastPathInputEventCode.FASTPATH_INPUT_EVENT_SCANCODE:
+                    observer.onKeyEventScancode(event.eventData.keyCode.value, not (eventFlags & pdu.data.FastPathKeyboardFlag.FASTPATH_INPUT_KBDFLAGS_RELEASE), bool(eventFlags & pdu.data.FastPathKeyboardFlag.FASTPATH_INPUT_KBDFLAGS_EXTENDED))
+                #unicode
+                elif eventCode == pdu.data.FastPathInputEventCode.FASTPATH_INPUT_EVENT_UNICODE:
+                    observer.onKeyEventUnicode(event.eventData.unicode.value, not (eventFlags & pdu.data.FastPathKeyboardFlag.FASTPATH_INPUT_KBDFLAGS_RELEASE))
+                #mouse events have same layout as slow path
+                elif eventCode in [pdu.data.FastPathInputEventCode.FASTPATH_INPUT_EVENT_MOUSE, pdu.data.FastPathInputEventCode.FASTPATH_INPUT_EVENT_MOUSEX]:
+                    self.dispatchPointerEvent(observer, event.eventData)
+                #toggle flags are event flags, same values as slow path
+                elif eventCode == pdu.data.FastPathInputEventCode.FASTPATH_INPUT_EVENT_SYNC:
+                    observer.onKeyboardSynchronize(eventFlags)
+                    
+    def dispatchPointerEvent(self, observer, pointerEvent):
+        """
+        @summary: Call onPointerEvent of observer
+        @param observer: {RDPServerObserver}
+        @param pointerEvent: {data.PointerEvent | data.PointerExEvent}
+        """
+        if isinstance(pointerEvent, pdu.data.PointerEvent):
+            isPressed = pointerEvent.pointerFlags.value & pdu.data.PointerFlag.PTRFLAGS_DOWN
+            button = 0
+            if pointerEvent.pointerFlags.value & pdu.data.PointerFlag.PTRFLAGS_BUTTON1:
+                button = 1
+            elif pointerEvent.pointerFlags.value & pdu.data.PointerFlag.PTRFLAGS_BUTTON2:
+                button = 2
+            elif pointerEvent.pointerFlags.value & pdu.data.PointerFlag.PTRFLAGS_BUTTON3:
+                button = 3
+        else:
+            isPressed = pointerEvent.pointerFlags.value & pdu.data.PointerExFlag.PTRXFLAGS_DOWN
+            button = 0
+            if pointerEvent.pointerFlags.value & pdu.data.PointerExFlag.PTRXFLAGS_BUTTON1:
+                button = 4
+            elif pointerEvent.pointerFlags.value & pdu.data.PointerExFlag.PTRXFLAGS_BUTTON2:
+                button = 5
+        observer.onPointerEvent(pointerEvent.xPos.value, pointerEvent.yPos.value, button, isPressed)
 
     
     def sendUpdate(self, destLeft, destTop, destRight, destBottom, width, height, bitsPerPixel, isCompress, data):
         """
         @summary: send bitmap update
+                    if batching is enabled update is accumulated and sent with next ones (see setUpdateBatching)
         @param destLeft: xmin position
         @param destTop: ymin position
         @param destRight: xmax position because RDP can send bitmap with padding
@@ -547,11 +1453,89 @@ class RDPServerController(pdu.layer.PDUServerListener):
         """
         if not self._isReady:
             return
+        bitmapData = self.createBitmapData(destLeft, destTop, destRight, destBottom, width, height, bitsPerPixel, isCompress, data)
+        
+        if self._updateBatchDelay is None:
+            self._pduLayer.sendBitmapUpdatePDU([bitmapData])
+            return
+        
+        self._pendingUpdates.append(bitmapData)
+        self._pendingUpdatesSize += len(data)
+        if self._pendingUpdatesSize >= self._updateBatchSize:
+            self.flushUpdates()
+        elif self._flushUpdatesCall is None:
+            from twisted.internet import reactor
+            self._flushUpdatesCall = reactor.callLater(self._updateBatchDelay, self.flushUpdates)
+            
+    def sendBitmap(self, left, top, width, height, pixels):
+        """
+        @summary: compress raw pixels and send them as bitmap updates
+                    NSCodec surface bits commands are used if client advertise it in 32 bpp session
+        @param pixels: {str} top-down pixels in session color depth
+        @see: framebuffer.compressBitmap
+        """
+        if not self._isReady:
+            return
+        codec = self._pduLayer.getBitmapCodec(pdu.caps.CodecGUID.CODEC_GUID_NSCODEC) if self._colorDepth == 32 else None
+        if codec is None:
+            self.sendUpdates(framebuffer.compressBitmap(left, top, width, height, self._colorDepth, pixels))
+            return
+        
+        try:
+            allowSubsampling, colorLossLevel = nsc.readCapabilitySet(codec.codecProperties.value)
+        except InvalidValue:
+            allowSubsampling, colorLossLevel = False, 1
+        #keep order with pending updates
+        self.flushUpdates()
+        #each band fit in one fast path update, encoded band is never bigger than raw pixels of padded width
+        rowSize = width * 4
+        bandHeight = max(1, min(height, (self._pduLayer.getFastPathMaxRequestSize() - 64) / ((width + 8) * 4)))
+        surfaceCommands = []
+        for bandTop in range(0, height, bandHeight):
+            bandBottom = min(bandTop + bandHeight, height)
+            data = nsc.encode(width, bandBottom - bandTop, pixels[bandTop * rowSize:bandBottom * rowSize], min(colorLossLevel, nsc.COLOR_LOSS_LEVEL), allowSubsampling)
+            bitmapData = pdu.data.BitmapDataEx(32, codec.codecID.value, width, bandBottom - bandTop, data)
+            surfaceCommands.append(pdu.data.SurfaceCommand(pdu.data.SurfaceBitsCommand(left, top + bandTop, left + width, top + bandBottom, bitmapData)))
+        self._pduLayer.sendSurfaceCommands(surfaceCommands)
+        
+    def sendUpdates(self, updates):
+        """
+        @summary: send many bitmap updates packed in as few PDU as possible
+        @param updates: {list(tuple)} list of sendUpdate parameters tuple
+                        (destLeft, destTop, destRight, destBottom, width, height, bitsPerPixel, isCompress, data)
+        """
+        if not self._isReady:
+            return
+        #keep order with pending updates
+        self._pendingUpdates += [self.createBitmapData(*update) for update in updates]
+        self.flushUpdates()
+        
+    def flushUpdates(self):
+        """
+        @summary: send all pending updates
+        """
+        if not self._flushUpdatesCall is None:
+            if self._flushUpdatesCall.active():
+                self._flushUpdatesCall.cancel()
+            self._flushUpdatesCall = None
+            
+        pendingUpdates = self._pendingUpdates
+        self._pendingUpdates = []
+        self._pendingUpdatesSize = 0
+        if len(pendingUpdates) == 0 or not self._isReady:
+            return
+        self._pduLayer.sendBitmapUpdatePDU(pendingUpdates)
+        
+    def createBitmapData(self, destLeft, destTop, destRight, destBottom, width, height, bitsPerPixel, isCompress, data):
+        """
+        @summary: build bitmap data of update
+        @see: sendUpdate
+        @return: {pdu.data.BitmapData}
+        """
         bitmapData = pdu.data.BitmapData(destLeft, destTop, destRight, destBottom, width, height, bitsPerPixel, data)
         if isCompress:
             bitmapData.flags.value = pdu.data.BitmapFlag.BITMAP_COMPRESSION
-        
-        self._pduLayer.sendBitmapUpdatePDU([bitmapData])
+        return bitmapData
 
 class ClientFactory(layer.RawLayerClientFactory):
     """
@@ -672,6 +1656,26 @@ class RDPClientObserver(object):
         """
         raise CallPureVirtualFuntion("%s:%s defined by interface %s"%(self.__class__, "onUpdate", "RDPClientObserver"))
     
+    def onPointerUpdate(self, pointerType, hotSpotX, hotSpotY, width, height, data):
+        """
+        @summary: Notify pointer shape change, by default pointer is ignored
+        @param pointerType: {PointerType}
+        @param hotSpotX: x coordinate of hot spot
+        @param hotSpotY: y coordinate of hot spot
+        @param width: width of pointer (0 if not POINTER_SHAPE)
+        @param height: height of pointer (0 if not POINTER_SHAPE)
+        @param data: {str} top-down BGRA pixels (32 bits ARGB image)
+        """
+        pass
+    
+    def onPointerPosition(self, x, y):
+        """
+        @summary: Notify pointer moved by server, by default ignored
+        @param x: x position in desktop
+        @param y: y position in desktop
+        """
+        pass
+    
 class RDPServerObserver(object):
     """
     @summary: Class use to inform all RDP event handle by RDPY
@@ -721,4 +1725,11 @@ class RDPServerObserver(object):
         @param button: 1, 2, 3, 4 or 5 button
         @param isPressed: True if mouse button is pressed
         """
-        raise CallPureVirtualFuntion("%s:%s defined by interface %s"%(self.__class__, "onPointerEvent", "RDPServerObserver"))
\ No newline at end of file
+        raise CallPureVirtualFuntion("%s:%s defined by interface %s"%(self.__class__, "onPointerEvent", "RDPServerObserver"))
+    
+    def onKeyboardSynchronize(self, toggleFlags):
+        """
+        @summary: Event call when client synchronize state of toggle keys, by default ignored
+        @param toggleFlags: {pdu.data.ToogleFlag} scroll, num, caps and kana lock state
+        """
+        pass
\ No newline at end of file
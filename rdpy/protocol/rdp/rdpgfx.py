@@ -0,0 +1,437 @@
+#
+# Copyright (c) 2014-2015 Sylvain Peyrefitte
+#
+# This file is part of rdpy.
+#
+# rdpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Graphics pipeline extension (RDPGFX) client
+Server draws in offscreen surfaces mapped to output, surfaces are
+32 bpp frame buffers of rdpy and bitmaps are decoded by native extensions
+@see: http://msdn.microsoft.com/en-us/library/jj712081.aspx
+"""
+
+import struct
+from rdpy.core import framebuffer, log
+from rdpy.core.error import CallPureVirtualFuntion, InvalidValue, InvalidExpectedDataException
+import drdynvc, rfx
+import bulk, rle
+
+#name of dynamic virtual channel
+CHANNEL_NAME = "Microsoft::Windows::RDS::Graphics"
+
+#max number of entries of cache import offer
+MAX_CACHE_IMPORT_ENTRIES = 5462
+
+class CmdId(object):
+    """
+    @summary: RDPGFX PDU type
+    @see: http://msdn.microsoft.com/en-us/library/jj712040.aspx
+    """
+    RDPGFX_CMDID_WIRETOSURFACE_1 = 0x0001
+    RDPGFX_CMDID_WIRETOSURFACE_2 = 0x0002
+    RDPGFX_CMDID_DELETEENCODINGCONTEXT = 0x0003
+    RDPGFX_CMDID_SOLIDFILL = 0x0004
+    RDPGFX_CMDID_SURFACETOSURFACE = 0x0005
+    RDPGFX_CMDID_SURFACETOCACHE = 0x0006
+    RDPGFX_CMDID_CACHETOSURFACE = 0x0007
+    RDPGFX_CMDID_EVICTCACHEENTRY = 0x0008
+    RDPGFX_CMDID_CREATESURFACE = 0x0009
+    RDPGFX_CMDID_DELETESURFACE = 0x000A
+    RDPGFX_CMDID_STARTFRAME = 0x000B
+    RDPGFX_CMDID_ENDFRAME = 0x000C
+    RDPGFX_CMDID_FRAMEACKNOWLEDGE = 0x000D
+    RDPGFX_CMDID_RESETGRAPHICS = 0x000E
+    RDPGFX_CMDID_MAPSURFACETOOUTPUT = 0x000F
+    RDPGFX_CMDID_CACHEIMPORTOFFER = 0x0010
+    RDPGFX_CMDID_CACHEIMPORTREPLY = 0x0011
+    RDPGFX_CMDID_CAPSADVERTISE = 0x0012
+    RDPGFX_CMDID_CAPSCONFIRM = 0x0013
+
+class CapsVersion(object):
+    """
+    @summary: Version of capability set
+    @see: http://msdn.microsoft.com/en-us/library/dn366923.aspx
+    """
+    RDPGFX_CAPVERSION_8 = 0x00080004
+    RDPGFX_CAPVERSION_81 = 0x00080105
+
+class CapsFlag(object):
+    """
+    @summary: Flags of capability set
+    """
+    RDPGFX_CAPS_FLAG_THINCLIENT = 0x00000001
+    RDPGFX_CAPS_FLAG_SMALL_CACHE = 0x00000002
+    RDPGFX_CAPS_FLAG_AVC420_ENABLED = 0x00000010
+
+class CodecId(object):
+    """
+    @summary: Codec of wire to surface PDU
+    @see: http://msdn.microsoft.com/en-us/library/jj712079.aspx
+    """
+    RDPGFX_CODECID_UNCOMPRESSED = 0x0000
+    RDPGFX_CODECID_CAVIDEO = 0x0003
+    RDPGFX_CODECID_CLEARCODEC = 0x0008
+    RDPGFX_CODECID_PLANAR = 0x000A
+    RDPGFX_CODECID_AVC420 = 0x000B
+    RDPGFX_CODECID_ALPHA = 0x000C
+
+class PixelFormat(object):
+    """
+    @summary: Pixel format of surface
+    """
+    GFX_PIXEL_FORMAT_XRGB_8888 = 0x20
+    GFX_PIXEL_FORMAT_ARGB_8888 = 0x21
+
+class GraphicsListener(object):
+    """
+    @summary: Receive output of graphics pipeline
+    """
+    def onResetGraphics(self, width, height):
+        """
+        @summary: Size of output changed, all surfaces are deleted
+        @param width: {integer} width of desktop
+        @param height: {integer} height of desktop
+        """
+        raise CallPureVirtualFuntion("%s:%s defined by interface %s"%(self.__class__, "onResetGraphics", "GraphicsListener"))
+
+    def onGraphicsUpdate(self, left, top, width, height, pixels):
+        """
+        @summary: Area of output modified during a frame
+        @param pixels: {str} top-down 32 bits pixels
+        """
+        raise CallPureVirtualFuntion("%s:%s defined by interface %s"%(self.__class__, "onGraphicsUpdate", "GraphicsListener"))
+
+def readRect16(data, offset):
+    """
+    @param data: {str} PDU
+    @param offset: {integer} offset of RDPGFX_RECT16
+    @return: {tuple} (left, top, width, height)
+    """
+    left, top, right, bottom = struct.unpack_from("<HHHH", data, offset)
+    if right < left or bottom < top:
+        raise InvalidExpectedDataException("invalid RDPGFX rectangle")
+    return (left, top, right - left, bottom - top)
+
+class GraphicsClient(drdynvc.DynamicChannelListener):
+    """
+    @summary: Client of graphics pipeline dynamic channel
+                Keep surfaces and bitmap cache, output is flushed at end of frame
+    """
+    def __init__(self, listener, cacheStore = None):
+        """
+        @param listener: {GraphicsListener}
+        @param cacheStore: {dict} optional persistent store of cached bitmaps
+                            cache key => (width, height, pixels), offered to server at connection
+        """
+        self._listener = listener
+        self._cacheStore = cacheStore
+        self._channel = None
+        #all server PDU are RDP 8.0 segmented data
+        self._decompressor = bulk.RDP8Decompressor()
+        #surface id => framebuffer.FrameBuffer
+        self._surfaces = {}
+        #surface id => (x, y) origin in output
+        self._outputs = {}
+        #cache slot => (width, height, pixels)
+        self._cache = {}
+        #cache keys offered in cache import offer
+        self._offeredKeys = []
+        self._capsVersion = None
+        self._frameId = None
+        self._totalFramesDecoded = 0
+        #codec contexts
+        self._rfxDecoder = rfx.Decoder()
+        self._clearDecoder = rle.ClearDecoder()
+        self._handlers = {
+            CmdId.RDPGFX_CMDID_WIRETOSURFACE_1 : self.recvWireToSurface1,
+            CmdId.RDPGFX_CMDID_SOLIDFILL : self.recvSolidFill,
+            CmdId.RDPGFX_CMDID_SURFACETOSURFACE : self.recvSurfaceToSurface,
+            CmdId.RDPGFX_CMDID_SURFACETOCACHE : self.recvSurfaceToCache,
+            CmdId.RDPGFX_CMDID_CACHETOSURFACE : self.recvCacheToSurface,
+            CmdId.RDPGFX_CMDID_EVICTCACHEENTRY : self.recvEvictCacheEntry,
+            CmdId.RDPGFX_CMDID_CREATESURFACE : self.recvCreateSurface,
+            CmdId.RDPGFX_CMDID_DELETESURFACE : self.recvDeleteSurface,
+            CmdId.RDPGFX_CMDID_STARTFRAME : self.recvStartFrame,
+            CmdId.RDPGFX_CMDID_ENDFRAME : self.recvEndFrame,
+            CmdId.RDPGFX_CMDID_RESETGRAPHICS : self.recvResetGraphics,
+            CmdId.RDPGFX_CMDID_MAPSURFACETOOUTPUT : self.recvMapSurfaceToOutput,
+            CmdId.RDPGFX_CMDID_CACHEIMPORTREPLY : self.recvCacheImportReply,
+            CmdId.RDPGFX_CMDID_CAPSCONFIRM : self.recvCapsConfirm,
+        }
+
+    def getSurface(self, surfaceId):
+        """
+        @param surfaceId: {integer}
+        @return: {framebuffer.FrameBuffer}
+        @raise InvalidExpectedDataException: if surface doesn't exist
+        """
+        if not surfaceId in self._surfaces:
+            raise InvalidExpectedDataException("unknown RDPGFX surface %s"%surfaceId)
+        return self._surfaces[surfaceId]
+
+    def getCapsVersion(self):
+        """
+        @return: {integer} version confirmed by server or None
+        """
+        return self._capsVersion
+
+    def onOpen(self, channel):
+        """
+        @summary: Advertise capabilities and offer persistent cache entries
+        @param channel: {drdynvc.DynamicChannel}
+        """
+        self._channel = channel
+        self._decompressor.reset()
+        capsSets = [struct.pack("<III", version, 4, 0) for version in [CapsVersion.RDPGFX_CAPVERSION_8, CapsVersion.RDPGFX_CAPVERSION_81]]
+        self.sendPDU(CmdId.RDPGFX_CMDID_CAPSADVERTISE, struct.pack("<H", len(capsSets)) + "".join(capsSets))
+        self.sendCacheImportOffer()
+
+    def onClose(self):
+        """
+        @summary: Channel is closed, drop surfaces
+        """
+        self._channel = None
+        self._surfaces = {}
+        self._outputs = {}
+
+    def sendPDU(self, cmdId, body):
+        """
+        @summary: Client PDU are not compressed
+        @param cmdId: {CmdId}
+        @param body: {str}
+        """
+        self._channel.send(struct.pack("<HHI", cmdId, 0, 8 + len(body)) + body)
+
+    def sendCacheImportOffer(self):
+        """
+        @summary: Offer keys of persistent store, server answer with their cache slots
+        """
+        if self._cacheStore is None:
+            return
+        self._offeredKeys = list(self._cacheStore.keys())[:MAX_CACHE_IMPORT_ENTRIES]
+        entries = []
+        for key in self._offeredKeys:
+            width, height, _ = self._cacheStore[key]
+            entries.append(struct.pack("<QI", key, width * height * 4))
+        self.sendPDU(CmdId.RDPGFX_CMDID_CACHEIMPORTOFFER, struct.pack("<H", len(entries)) + "".join(entries))
+
+    def recv(self, data):
+        """
+        @summary: Decompress and dispatch all PDU of message
+        @param data: {str} RDP_SEGMENTED_DATA
+        """
+        try:
+            data = self._decompressor.decompress(data)
+        except ValueError as e:
+            raise InvalidExpectedDataException("unable to decompress RDPGFX data : %s"%e)
+
+        offset = 0
+        while offset + 8 <= len(data):
+            cmdId, _, pduLength = struct.unpack_from("<HHI", data, offset)
+            if pduLength < 8 or offset + pduLength > len(data):
+                raise InvalidExpectedDataException("invalid RDPGFX PDU length")
+            if cmdId in self._handlers:
+                try:
+                    self._handlers[cmdId](data[offset + 8:offset + pduLength])
+                except (InvalidValue, InvalidExpectedDataException, struct.error) as e:
+                    log.debug("unable to process RDPGFX PDU %s : %s"%(cmdId, e))
+            else:
+                log.debug("ignore RDPGFX PDU %s"%cmdId)
+            offset += pduLength
+
+    def decodeBitmap(self, codecId, surface, left, top, width, height, bitmap):
+        """
+        @summary: Decode bitmap of wire to surface PDU
+        @param surface: {framebuffer.FrameBuffer} destination, ClearCodec draw over it
+        @return: {list} rects (x, y, width, height) relative to destination and top-down pixels
+        @raise InvalidValue: if codec is not supported or bitmap is invalid
+        """
+        if codecId == CodecId.RDPGFX_CODECID_UNCOMPRESSED:
+            if len(bitmap) != width * height * 4:
+                raise InvalidValue("invalid size of uncompressed bitmap")
+            return [(0, 0, width, height)], bitmap
+        if codecId == CodecId.RDPGFX_CODECID_PLANAR:
+            buf = bytearray(width * height * 4)
+            try:
+                rle.bitmap_decompress(buf, width, height, bitmap, 4)
+            except ValueError as e:
+                raise InvalidValue("invalid planar bitmap : %s"%e)
+            return [(0, 0, width, height)], str(buf)
+        if codecId == CodecId.RDPGFX_CODECID_CLEARCODEC:
+            try:
+                return [(0, 0, width, height)], self._clearDecoder.decompress(width, height, bitmap, surface.readRect(left, top, width, height))
+            except ValueError as e:
+                raise InvalidValue("invalid ClearCodec bitmap : %s"%e)
+        if codecId == CodecId.RDPGFX_CODECID_CAVIDEO:
+            rects, tiles = self._rfxDecoder.decode(bitmap)
+            return rects, rfx.drawTiles(width, height, tiles)
+        raise InvalidValue("unsupported RDPGFX codec %s"%codecId)
+
+    def recvWireToSurface1(self, data):
+        """
+        @summary: Bitmap encoded with a codec
+        @param data: {str} RDPGFX_WIRE_TO_SURFACE_PDU_1 body
+        """
+        surfaceId, codecId, _ = struct.unpack_from("<HHB", data)
+        left, top, width, height = readRect16(data, 5)
+        bitmapLength = struct.unpack_from("<I", data, 13)[0]
+        surface = self.getSurface(surfaceId)
+        if surface.clip(left, top, width, height) != (left, top, width, height):
+            raise InvalidValue("wire to surface rectangle is outside surface")
+        rects, pixels = self.decodeBitmap(codecId, surface, left, top, width, height, data[17:17 + bitmapLength])
+        for x, y, rectWidth, rectHeight in rects:
+            surface.blitRect(left + x, top + y, min(rectWidth, width - x), min(rectHeight, height - y), pixels, width, x, y)
+
+    def recvSolidFill(self, data):
+        """
+        @summary: Fill rectangles of surface with a color
+        @param data: {str} RDPGFX_SOLIDFILL_PDU body
+        """
+        surfaceId, blue, green, red, _, count = struct.unpack_from("<HBBBBH", data)
+        #surfaces are opaque
+        color = blue | (green << 8) | (red << 16) | (0xff << 24)
+        surface = self.getSurface(surfaceId)
+        for i in range(0, count):
+            left, top, width, height = readRect16(data, 8 + i * 8)
+            surface.fillRect(left, top, width, height, color)
+
+    def recvSurfaceToSurface(self, data):
+        """
+        @summary: Copy an area of surface to points of another one (may be the same)
+        @param data: {str} RDPGFX_SURFACE_TO_SURFACE_PDU body
+        """
+        srcId, dstId = struct.unpack_from("<HH", data)
+        left, top, width, height = readRect16(data, 4)
+        count = struct.unpack_from("<H", data, 12)[0]
+        src, dst = self.getSurface(srcId), self.getSurface(dstId)
+        if src.clip(left, top, width, height) != (left, top, width, height):
+            raise InvalidValue("surface to surface source is outside surface")
+        pixels = src.readRect(left, top, width, height)
+        for i in range(0, count):
+            x, y = struct.unpack_from("<hh", data, 14 + i * 4)
+            dst.blitRect(x, y, width, height, pixels, width, 0, 0)
+
+    def recvSurfaceToCache(self, data):
+        """
+        @summary: Store an area of surface in cache slot
+        @param data: {str} RDPGFX_SURFACE_TO_CACHE_PDU body
+        """
+        surfaceId, cacheKey, cacheSlot = struct.unpack_from("<HQH", data)
+        left, top, width, height = readRect16(data, 12)
+        surface = self.getSurface(surfaceId)
+        if surface.clip(left, top, width, height) != (left, top, width, height):
+            raise InvalidValue("surface to cache source is outside surface")
+        entry = (width, height, surface.readRect(left, top, width, height))
+        self._cache[cacheSlot] = entry
+        if not self._cacheStore is None:
+            self._cacheStore[cacheKey] = entry
+
+    def recvCacheToSurface(self, data):
+        """
+        @summary: Draw cached bitmap at points of surface
+        @param data: {str} RDPGFX_CACHE_TO_SURFACE_PDU body
+        """
+        cacheSlot, surfaceId, count = struct.unpack_from("<HHH", data)
+        if not cacheSlot in self._cache:
+            raise InvalidValue("empty RDPGFX cache slot %s"%cacheSlot)
+        width, height, pixels = self._cache[cacheSlot]
+        surface = self.getSurface(surfaceId)
+        for i in range(0, count):
+            x, y = struct.unpack_from("<hh", data, 6 + i * 4)
+            surface.blitRect(x, y, width, height, pixels, width, 0, 0)
+
+    def recvEvictCacheEntry(self, data):
+        """
+        @param data: {str} RDPGFX_EVICT_CACHE_ENTRY_PDU body
+        """
+        self._cache.pop(struct.unpack_from("<H", data)[0], None)
+
+    def recvCreateSurface(self, data):
+        """
+        @param data: {str} RDPGFX_CREATE_SURFACE_PDU body
+        """
+        surfaceId, width, height, _ = struct.unpack_from("<HHHB", data)
+        self._surfaces[surfaceId] = framebuffer.FrameBuffer(width, height, 32)
+        self._outputs.pop(surfaceId, None)
+
+    def recvDeleteSurface(self, data):
+        """
+        @param data: {str} RDPGFX_DELETE_SURFACE_PDU body
+        """
+        surfaceId = struct.unpack_from("<H", data)[0]
+        self._surfaces.pop(surfaceId, None)
+        self._outputs.pop(surfaceId, None)
+
+    def recvStartFrame(self, data):
+        """
+        @param data: {str} RDPGFX_START_FRAME_PDU body
+        """
+        _, self._frameId = struct.unpack_from("<II", data)
+
+    def recvEndFrame(self, data):
+        """
+        @summary: Flush modified areas of mapped surfaces and acknowledge frame
+        @param data: {str} RDPGFX_END_FRAME_PDU body
+        """
+        frameId = struct.unpack_from("<I", data)[0]
+        self._totalFramesDecoded += 1
+        for surfaceId, (x, y) in self._outputs.iteritems():
+            surface = self._surfaces[surfaceId]
+            area = surface.popDirtyArea()
+            if area is None:
+                continue
+            left, top, width, height = area
+            self._listener.onGraphicsUpdate(x + left, y + top, width, height, surface.readRect(left, top, width, height))
+        #queue depth is unavailable
+        self.sendPDU(CmdId.RDPGFX_CMDID_FRAMEACKNOWLEDGE, struct.pack("<III", 0, frameId, self._totalFramesDecoded))
+
+    def recvResetGraphics(self, data):
+        """
+        @param data: {str} RDPGFX_RESET_GRAPHICS_PDU body
+        """
+        width, height = struct.unpack_from("<II", data)
+        self._surfaces = {}
+        self._outputs = {}
+        self._listener.onResetGraphics(width, height)
+
+    def recvMapSurfaceToOutput(self, data):
+        """
+        @param data: {str} RDPGFX_MAP_SURFACE_TO_OUTPUT_PDU body
+        """
+        surfaceId, _, x, y = struct.unpack_from("<HHII", data)
+        surface = self.getSurface(surfaceId)
+        self._outputs[surfaceId] = (x, y)
+        #whole surface is shown at next end of frame
+        surface.markDirty(0, 0, surface.getWidth(), surface.getHeight())
+
+    def recvCacheImportReply(self, data):
+        """
+        @summary: Load offered bitmaps in cache slots chosen by server
+        @param data: {str} RDPGFX_CACHE_IMPORT_REPLY_PDU body
+        """
+        count = struct.unpack_from("<H", data)[0]
+        slots = struct.unpack_from("<%dH"%count, data, 2)
+        for key, cacheSlot in zip(self._offeredKeys, slots):
+            if cacheSlot != 0 and key in self._cacheStore:
+                self._cache[cacheSlot] = self._cacheStore[key]
+        self._offeredKeys = []
+
+    def recvCapsConfirm(self, data):
+        """
+        @param data: {str} RDPGFX_CAPS_CONFIRM_PDU body
+        """
+        self._capsVersion = struct.unpack_from("<I", data)[0]
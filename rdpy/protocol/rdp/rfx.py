@@ -0,0 +1,198 @@
+#
+# Copyright (c) 2014-2015 Sylvain Peyrefitte
+#
+# This file is part of rdpy.
+#
+# rdpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+RemoteFX codec messages use in surface bits commands
+Tiles are decoded by rle extension (RLGR, inverse DWT and color conversion in C)
+@see: http://msdn.microsoft.com/en-us/library/ff635423.aspx
+"""
+
+import struct
+from rdpy.core.error import InvalidValue
+import rle
+
+class BlockType(object):
+    """
+    @summary: Type of RemoteFX message block
+    @see: http://msdn.microsoft.com/en-us/library/ff635233.aspx
+    """
+    WBT_SYNC = 0xCCC0
+    WBT_CODEC_VERSIONS = 0xCCC1
+    WBT_CHANNELS = 0xCCC2
+    WBT_CONTEXT = 0xCCC3
+    WBT_FRAME_BEGIN = 0xCCC4
+    WBT_FRAME_END = 0xCCC5
+    WBT_REGION = 0xCCC6
+    WBT_EXTENSION = 0xCCC7
+    CBT_REGION = 0xCAC1
+    CBT_TILESET = 0xCAC2
+    CBT_TILE = 0xCAC3
+    CBY_CAPS = 0xCBC0
+    CBY_CAPSET = 0xCBC1
+    CLY_CAPSET = 0xCFC0
+
+class Entropy(object):
+    """
+    @summary: Entropy algorithm of tiles
+    @see: http://msdn.microsoft.com/en-us/library/ff635423.aspx
+    """
+    CLW_ENTROPY_RLGR1 = 0x01
+    CLW_ENTROPY_RLGR3 = 0x04
+
+class CaptureFlag(object):
+    """
+    @summary: Use in client capabilities container
+    @see: http://msdn.microsoft.com/en-us/library/ff635408.aspx
+    """
+    CARDP_CAPS_CAPTURE_NON_CAC = 0x00000001
+
+#codec ids of surface bits command chosen by client in bitmap codecs capability
+CODEC_ID_REMOTEFX = 3
+CODEC_ID_IMAGE_REMOTEFX = 4
+
+TILE_SIZE = rle.RFX_TILE_SIZE
+
+def clientCapsContainer():
+    """
+    @summary: Properties of RemoteFX codec in client bitmap codecs capability
+                advertise RLGR1 and RLGR3 entropy
+    @return: {str} TS_RFX_CLNT_CAPS_CONTAINER
+    @see: http://msdn.microsoft.com/en-us/library/ff635408.aspx
+    """
+    icaps = "".join([struct.pack("<HHBBBB", 0x0100, TILE_SIZE, 0, 1, 1, entropy) for entropy in [Entropy.CLW_ENTROPY_RLGR1, Entropy.CLW_ENTROPY_RLGR3]])
+    capset = struct.pack("<HIBHHH", BlockType.CBY_CAPSET, 13 + len(icaps), 1, BlockType.CLY_CAPSET, 2, 8) + icaps
+    rfxCaps = struct.pack("<HIH", BlockType.CBY_CAPS, 8, 1) + capset
+    return struct.pack("<III", 12 + len(rfxCaps), CaptureFlag.CARDP_CAPS_CAPTURE_NON_CAC, len(rfxCaps)) + rfxCaps
+
+class Tile(object):
+    """
+    @summary: Encoded 64x64 tile of tile set
+    """
+    def __init__(self, x, y, yData, cbData, crData, quantY, quantCb, quantCr, rlgr3):
+        """
+        @param x: {integer} x position relative to destination of surface command
+        @param y: {integer} y position relative to destination of surface command
+        @param yData, cbData, crData: {str} entropy encoded components
+        @param quantY, quantCb, quantCr: {str} 5 bytes quantization values of components
+        @param rlgr3: {bool} RLGR3 entropy in place of RLGR1
+        """
+        self.x = x
+        self.y = y
+        self._components = (yData, cbData, crData, quantY, quantCb, quantCr, rlgr3)
+
+    def decode(self):
+        """
+        @summary: Decode tile, GIL is released during decoding
+        @return: {str} top-down 32 bits pixels of 64x64 tile
+        """
+        return rle.rfx_decode_tile(*self._components)
+
+class Decoder(object):
+    """
+    @summary: Decode RemoteFX messages of surface bits commands
+                codec context is kept between messages
+    """
+    def __init__(self):
+        self._entropy = Entropy.CLW_ENTROPY_RLGR1
+        #function use to decode tiles (map or framebuffer.DecodePool.map)
+        self._decodeMap = map
+
+    def setDecodeMap(self, decodeMap):
+        """
+        @summary: Decode tiles of a message in parallel
+        @param decodeMap: {callable(function, items)} map like function
+        """
+        self._decodeMap = decodeMap
+
+    def decode(self, data):
+        """
+        @summary: Read all blocks of message and decode its tiles
+        @param data: {str} bitmap data of surface bits command
+        @return: {tuple} (rects, tiles) where rects is list of (x, y, width, height) to update
+                    and tiles list of (x, y, pixels), positions are relative to destination
+        @raise InvalidValue: if message is invalid
+        """
+        rects = []
+        tiles = []
+        offset = 0
+        while offset + 6 <= len(data):
+            blockType, blockLen = struct.unpack_from("<HI", data, offset)
+            if blockLen < 6 or offset + blockLen > len(data):
+                raise InvalidValue("invalid RemoteFX block length %s"%blockLen)
+            block = data[offset:offset + blockLen]
+            offset += blockLen
+            try:
+                if blockType == BlockType.WBT_CONTEXT:
+                    #codec id and channel id follow header of codec channel blocks
+                    properties = struct.unpack_from("<H", block, 11)[0]
+                    self._entropy = (properties >> 9) & 0xf
+                elif blockType == BlockType.WBT_REGION:
+                    numRects = struct.unpack_from("<H", block, 9)[0]
+                    rects += [struct.unpack_from("<HHHH", block, 11 + 8 * i) for i in range(0, numRects)]
+                elif blockType == BlockType.WBT_EXTENSION:
+                    tiles += self.readTileSet(block)
+            except struct.error:
+                raise InvalidValue("truncated RemoteFX block %s"%hex(blockType))
+
+        return rects, [(tile.x, tile.y, pixels) for tile, pixels in zip(tiles, self._decodeMap(Tile.decode, tiles))]
+
+    def readTileSet(self, block):
+        """
+        @summary: Read tiles of tile set block
+        @param block: {str} TS_RFX_TILESET block
+        @return: {list(Tile)}
+        @see: http://msdn.microsoft.com/en-us/library/ff635575.aspx
+        """
+        subtype, _, properties, numQuant, _, numTiles, _ = struct.unpack_from("<HHHBBHI", block, 8)
+        if subtype != BlockType.CBT_TILESET:
+            raise InvalidValue("unknown RemoteFX extension %s"%hex(subtype))
+        #entropy of context is used if tile set doesn't specify it
+        rlgr3 = (((properties >> 10) & 0xf) or self._entropy) == Entropy.CLW_ENTROPY_RLGR3
+        quantVals = [block[22 + 5 * i:27 + 5 * i] for i in range(0, numQuant)]
+
+        tiles = []
+        offset = 22 + 5 * numQuant
+        for i in range(0, numTiles):
+            blockType, blockLen, quantIdxY, quantIdxCb, quantIdxCr, xIdx, yIdx, yLen, cbLen, crLen = struct.unpack_from("<HIBBBHHHHH", block, offset)
+            if blockType != BlockType.CBT_TILE or blockLen < 19 + yLen + cbLen + crLen:
+                raise InvalidValue("invalid RemoteFX tile")
+            if max(quantIdxY, quantIdxCb, quantIdxCr) >= numQuant:
+                raise InvalidValue("invalid RemoteFX quantization index")
+            start = offset + 19
+            tiles.append(Tile(xIdx * TILE_SIZE, yIdx * TILE_SIZE, block[start:start + yLen], block[start + yLen:start + yLen + cbLen], block[start + yLen + cbLen:start + yLen + cbLen + crLen], quantVals[quantIdxY], quantVals[quantIdxCb], quantVals[quantIdxCr], rlgr3))
+            offset += blockLen
+        return tiles
+
+def drawTiles(width, height, tiles):
+    """
+    @summary: Assemble decoded tiles in one bitmap
+    @param width: {integer} width of bitmap
+    @param height: {integer} height of bitmap
+    @param tiles: {list} (x, y, pixels) decoded tiles
+    @return: {str} top-down 32 bits pixels, area without tile is black
+    """
+    bitmap = bytearray(width * height * 4)
+    for x, y, pixels in tiles:
+        rowSize = (min(x + TILE_SIZE, width) - x) * 4
+        if rowSize <= 0:
+            continue
+        for row in range(0, min(TILE_SIZE, height - y)):
+            offset = ((y + row) * width + x) * 4
+            bitmap[offset:offset + rowSize] = pixels[row * TILE_SIZE * 4:row * TILE_SIZE * 4 + rowSize]
+    return str(bitmap)
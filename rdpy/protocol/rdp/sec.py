@@ -551,6 +551,13 @@ class SecLayer(LayerAutomata, IStreamSender, tpkt.IFastPathListener, tpkt.IFastP
         """
         return self._transport.getChannelId()
         
+    def getMaxPduSize(self):
+        """
+        @return: {integer} max size of MCS PDU negotiated in connect initial and response
+        @see: mcs.IGCCConfig
+        """
+        return self._transport.getMaxPduSize()
+    
     def getGCCClientSettings(self):
         """
         @return: {gcc.Settings} mcs layer gcc client settings
@@ -565,6 +572,53 @@ class SecLayer(LayerAutomata, IStreamSender, tpkt.IFastPathListener, tpkt.IFastP
         """
         return self._transport.getGCCServerSettings()
     
+class ChannelSecLayer(LayerAutomata, IStreamSender):
+    """
+    @summary: Standard RDP security layer of a static virtual channel
+                Keys and counters are shared with security layer of global channel
+    """
+    def __init__(self, presentation, secLayer):
+        """
+        @param presentation: {Layer} channel layer
+        @param secLayer: {SecLayer} security layer of global channel
+        """
+        LayerAutomata.__init__(self, presentation)
+        self._secLayer = secLayer
+        
+    def recv(self, data):
+        """
+        @summary: decrypt channel data if basic RDP security layer is activate
+        @param data: {Stream} input Stream
+        """
+        if not self._secLayer._enableEncryption:
+            self._presentation.recv(data)
+            return
+        
+        securityFlag = UInt16Le()
+        securityFlagHi = UInt16Le()
+        data.readType((securityFlag, securityFlagHi))
+        
+        if securityFlag.value & SecurityFlag.SEC_ENCRYPT:
+            data = self._secLayer.readEncryptedPayload(data, securityFlag.value & SecurityFlag.SEC_SECURE_CHECKSUM)
+            
+        self._presentation.recv(data)
+        
+    def send(self, data):
+        """
+        @summary: encrypt channel data if basic RDP security layer is activate
+        @param data: {Type | Tuple}
+        """
+        if not self._secLayer._enableEncryption:
+            self._transport.send(data)
+            return
+        
+        flag = SecurityFlag.SEC_ENCRYPT
+        
+        if self._secLayer._enableSecureCheckSum:
+            flag |= SecurityFlag.SEC_SECURE_CHECKSUM
+        
+        self._transport.send((UInt16Le(flag), UInt16Le(), self._secLayer.writeEncryptedPayload(data, flag & SecurityFlag.SEC_SECURE_CHECKSUM)))
+    
 class Client(SecLayer):
     """
     @summary: Client side of security layer
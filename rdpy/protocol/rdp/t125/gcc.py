@@ -45,12 +45,14 @@ class MessageType(object):
     SC_CORE = 0x0C01
     SC_SECURITY = 0x0C02
     SC_NET = 0x0C03
+    SC_MCS_MSGCHANNEL = 0x0C04
     #client -> server
     CS_CORE = 0xC001
     CS_SECURITY = 0xC002
     CS_NET = 0xC003
     CS_CLUSTER = 0xC004
     CS_MONITOR = 0xC005
+    CS_MCS_MSGCHANNEL = 0xC006
     
 
 class ColorDepth(object):
@@ -222,7 +224,7 @@ class DataBlock(CompositeType):
             """
             @summary: build settings in accordance of type self.type.value
             """
-            for c in [ClientCoreData, ClientSecurityData, ClientNetworkData, ServerCoreData, ServerNetworkData, ServerSecurityData]:
+            for c in [ClientCoreData, ClientSecurityData, ClientNetworkData, ClientMessageChannelData, ServerCoreData, ServerNetworkData, ServerSecurityData, ServerMessageChannelData]:
                 if self.type.value == c._TYPE_:
                     return c(readLen = self.length - 4)
             log.debug("unknown GCC block type : %s"%hex(self.type.value))
@@ -459,8 +461,8 @@ class ChannelDef(CompositeType):
         CompositeType.__init__(self)
         #name of channel
         self.name = String(name[0:8] + "\x00" * (8 - len(name)), readLen = CallableValue(8))
-        #unknown
-        self.options = UInt32Le()
+        #channel options
+        self.options = UInt32Le(options)
         
 class ClientNetworkData(CompositeType):
     """
@@ -490,6 +492,30 @@ class ServerNetworkData(CompositeType):
         self.channelIdArray = ArrayType(UInt16Le, readLen = self.channelCount)
         self.pad = UInt16Le(conditional = lambda:((self.channelCount.value % 2) == 1))
         
+class ClientMessageChannelData(CompositeType):
+    """
+    @summary: GCC client message channel block
+    Ask server for an MCS message channel (use by auto-detect)
+    @see: http://msdn.microsoft.com/en-us/library/jj217627.aspx
+    """
+    _TYPE_ = MessageType.CS_MCS_MSGCHANNEL
+    
+    def __init__(self, readLen = None):
+        CompositeType.__init__(self, readLen = readLen)
+        self.flags = UInt32Le()
+        
+class ServerMessageChannelData(CompositeType):
+    """
+    @summary: GCC server message channel block
+    Channel id of MCS message channel
+    @see: http://msdn.microsoft.com/en-us/library/jj217637.aspx
+    """
+    _TYPE_ = MessageType.SC_MCS_MSGCHANNEL
+    
+    def __init__(self, readLen = None):
+        CompositeType.__init__(self, readLen = readLen)
+        self.MCSChannelId = UInt16Le()
+        
 class Settings(CompositeType):
     """
     @summary: Class which group all clients settings supported by RDPY
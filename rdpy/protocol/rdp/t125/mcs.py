@@ -78,6 +78,13 @@ class IGCCConfig(object):
         """
         raise CallPureVirtualFuntion("%s:%s defined by interface %s"%(self.__class__, "getChannelId", "IGCCConfig")) 
         
+    def getMaxPduSize(self):
+        """
+        @return: {integer} max size of MCS PDU negotiated in connect initial and response
+        @see: mcs.IGCCConfig
+        """
+        raise CallPureVirtualFuntion("%s:%s defined by interface %s"%(self.__class__, "getMaxPduSize", "IGCCConfig")) 
+    
     def getGCCClientSettings(self):
         """
         @return: {gcc.Settings} mcs layer gcc client settings
@@ -140,6 +147,13 @@ class MCSLayer(LayerAutomata):
             @see: mcs.IGCCConfig
             """
             return self._channelId
+        
+        def getMaxPduSize(self):
+            """
+            @return: {integer} max size of MCS PDU negotiated in connect initial and response
+            @see: mcs.IGCCConfig
+            """
+            return self._mcs._maxPduSize
             
         def getGCCClientSettings(self):
             """
@@ -176,6 +190,17 @@ class MCSLayer(LayerAutomata):
         self._sendOpcode = sendOpcode
         #receive opcode
         self._receiveOpcode = receiveOpcode
+        #max size of MCS PDU, negotiated at connection
+        self._maxPduSize = 0xffff
+        
+    def addVirtualChannel(self, channelDef, layer):
+        """
+        @summary: Add a static virtual channel, must be called before connection
+        @param channelDef: {gcc.ChannelDef} name and options of channel
+        @param layer: {Layer} presentation layer of channel
+        """
+        #don't modify list given in constructor (may be default argument)
+        self._virtualChannels = self._virtualChannels + [(channelDef, layer)]
         
     def close(self):
         """
@@ -309,6 +334,29 @@ class Client(MCSLayer):
         self._isUserChannelRequested = False
         #nb channel requested
         self._nbChannelRequested = 0
+        #layer of MCS message channel (auto-detect)
+        self._messageChannel = None
+        self._isMessageChannelRequested = False
+        
+    def setMessageChannel(self, layer):
+        """
+        @summary: Ask server for an MCS message channel, must be called before connection
+        @param layer: {Layer} presentation layer of message channel
+        """
+        self._messageChannel = layer
+        if self._clientSettings.getBlock(gcc.MessageType.CS_MCS_MSGCHANNEL) is None:
+            self._clientSettings.settings._array.append(gcc.DataBlock(gcc.ClientMessageChannelData()))
+            
+    def getMessageChannelId(self):
+        """
+        @return: {integer} id of MCS message channel given by server or None
+        """
+        if self._messageChannel is None:
+            return None
+        serverMessageChannel = self._serverSettings.getBlock(gcc.MessageType.SC_MCS_MSGCHANNEL)
+        if serverMessageChannel is None:
+            return None
+        return serverMessageChannel.MCSChannelId.value
     
     def connect(self):
         """
@@ -345,11 +393,17 @@ class Client(MCSLayer):
         
         #static virtual channel
         if self._nbChannelRequested < self._serverSettings.getBlock(gcc.MessageType.SC_NET).channelCount.value:
-            channelId = self._serverSettings.getBlock(gcc.MessageType.SC_NET).channelIdArray[self._nbChannelRequested]
+            channelId = self._serverSettings.getBlock(gcc.MessageType.SC_NET).channelIdArray[self._nbChannelRequested].value
             self._nbChannelRequested += 1
             self.sendChannelJoinRequest(channelId)
             return
         
+        #message channel
+        if not self._isMessageChannelRequested and not self.getMessageChannelId() is None:
+            self.sendChannelJoinRequest(self.getMessageChannelId())
+            self._isMessageChannelRequested = True
+            return
+        
         self.allChannelConnected()
         
     def recvConnectResponse(self, data):
@@ -363,7 +417,7 @@ class Client(MCSLayer):
         ber.readApplicationTag(data, UInt8(Message.MCS_TYPE_CONNECT_RESPONSE))
         ber.readEnumerated(data)
         ber.readInteger(data)
-        self.readDomainParams(data)
+        domainParams = self.readDomainParams(data)
         if not ber.readUniversalTag(data, ber.Tag.BER_TAG_OCTET_STRING, False):
             raise InvalidExpectedDataException("invalid expected BER tag")
         gccRequestLength = ber.readLength(data)
@@ -371,6 +425,8 @@ class Client(MCSLayer):
             raise InvalidSize("bad size of GCC request")
         self._serverSettings = gcc.readConferenceCreateResponse(data)
         
+        self._maxPduSize = domainParams[3]
+        
         #send domain request
         self.sendErectDomainRequest()
         #send attach user request
@@ -425,6 +481,8 @@ class Client(MCSLayer):
             for i in range(0, serverNet.channelCount.value):
                 if channelId == serverNet.channelIdArray[i].value:
                     self._channels[channelId] = self._virtualChannels[i][1] 
+            if channelId == self.getMessageChannelId():
+                self._channels[channelId] = self._messageChannel
         
         self.connectNextChannel()
         
@@ -480,6 +538,8 @@ class Server(MCSLayer):
         MCSLayer.__init__(self, presentation, DomainMCSPDU.SEND_DATA_REQUEST, DomainMCSPDU.SEND_DATA_INDICATION, virtualChannels)
         #nb channel requested
         self._nbChannelConfirmed = 0
+        #max PDU size accepted by server, lowered to client target in connect initial
+        self._maxPduSize = 0xfff8
         
     def connect(self):
         """
@@ -511,9 +571,10 @@ class Server(MCSLayer):
         if not ber.readBoolean(data):
             raise InvalidExpectedDataException("invalid expected BER boolean tag")
         
+        targetParams = self.readDomainParams(data)
         self.readDomainParams(data)
         self.readDomainParams(data)
-        self.readDomainParams(data)
+        self._maxPduSize = min(self._maxPduSize, targetParams[3])
         self._clientSettings = gcc.readConferenceCreateRequest(Stream(ber.readOctetString(data)))
         
         if not self._clientSettings.CS_NET is None:
@@ -595,7 +656,7 @@ class Server(MCSLayer):
         ccReqStream = Stream()
         ccReqStream.writeType(ccReq)
         
-        tmp = (ber.writeEnumerated(0), ber.writeInteger(0), self.writeDomainParams(22, 3, 0, 0xfff8), 
+        tmp = (ber.writeEnumerated(0), ber.writeInteger(0), self.writeDomainParams(22, 3, 0, self._maxPduSize), 
                ber.writeOctetstring(ccReqStream.getvalue()))
         self._transport.send((ber.writeApplicationTag(Message.MCS_TYPE_CONNECT_RESPONSE, sizeof(tmp)), tmp))
         
@@ -41,6 +41,8 @@ class SecFlags(object):
     #hihi 'secure' checksum but private key is public !!!
     FASTPATH_OUTPUT_SECURE_CHECKSUM = 0x1
     FASTPATH_OUTPUT_ENCRYPTED = 0x2
+    #bits 2 to 5 of header (number of fast path input events)
+    FASTPATH_INPUT_NUM_EVENTS_MASK = 0x3C
 
 class IFastPathListener(object):
     """
@@ -147,7 +149,7 @@ class TPKT(RawLayer, IFastPathSender):
             self.expect(2, self.readExtendedHeader)
         else:
             #is fast path packet
-            self._secFlag = ((version.value >> 6) & 0x3)
+            self._secFlag = ((version.value >> 6) & 0x3) | (version.value & SecFlags.FASTPATH_INPUT_NUM_EVENTS_MASK)
             data.readType(self._lastShortLength)
             if self._lastShortLength.value & 0x80:
                 #size is 1 byte more
@@ -205,9 +207,15 @@ class TPKT(RawLayer, IFastPathSender):
     def sendFastPath(self, secFlag, fastPathS):
         """
         @param fastPathS: {Type | Tuple} type transform to stream and send as fastpath
-        @param secFlag: {integer} Security flag for fastpath packet
+        @param secFlag: {integer} Security flag for fastpath packet (with number of input events in bits 2 to 5)
         """
-        RawLayer.send(self, (UInt8(Action.FASTPATH_ACTION_FASTPATH | ((secFlag & 0x3) << 6)), UInt16Be((sizeof(fastPathS) + 3) | 0x8000), fastPathS))
+        header = UInt8(Action.FASTPATH_ACTION_FASTPATH | ((secFlag & 0x3) << 6) | (secFlag & SecFlags.FASTPATH_INPUT_NUM_EVENTS_MASK))
+        size = sizeof(fastPathS)
+        #length is on one byte for small packet (input)
+        if size + 2 < 0x80:
+            RawLayer.send(self, (header, UInt8(size + 2), fastPathS))
+        else:
+            RawLayer.send(self, (header, UInt16Be((size + 3) | 0x8000), fastPathS))
     
     def startTLS(self, sslContext):
         """
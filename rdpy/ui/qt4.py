@@ -25,8 +25,8 @@ QRemoteDesktop is a widget use for render in rdpy
 
 from PyQt4 import QtGui, QtCore
 from rdpy.protocol.rfb.rfb import RFBClientObserver
-from rdpy.protocol.rdp.rdp import RDPClientObserver
-from rdpy.core.error import CallPureVirtualFuntion
+from rdpy.protocol.rdp.rdp import RDPClientObserver, PointerType
+from rdpy.core.error import CallPureVirtualFuntion, InvalidValue
 import sys
 
 import rdpy.core.log as log
@@ -67,6 +67,13 @@ class QAdaptor(object):
         """ 
         raise CallPureVirtualFuntion("%s:%s defined by interface %s"%(self.__class__, "closeEvent", "QAdaptor"))
     
+    def visibilityEvent(self, isVisible):
+        """
+        @summary: Call when widget is shown, hidden or minimized
+        @param isVisible: {bool} widget can be seen by user
+        """
+        raise CallPureVirtualFuntion("%s:%s defined by interface %s"%(self.__class__, "visibilityEvent", "QAdaptor"))
+    
 def qtImageFormatFromRFBPixelFormat(pixelFormat):
     """
     @summary: convert RFB pixel format to QtGui.QImage format
@@ -172,6 +179,13 @@ class RFBClientQt(RFBClientObserver, QAdaptor):
         """ 
         self._controller.close()
         
+    def visibilityEvent(self, isVisible):
+        """
+        @summary: Framebuffer update requests are driven by updates, nothing to do
+        @param isVisible: {bool} widget can be seen by user
+        """
+        pass
+        
     def onClose(self):
         """
         @summary: Call when stack is close
@@ -188,44 +202,14 @@ def RDPBitmapToQtImage(width, height, bitsPerPixel, isCompress, data):
     @param isCompress: use RLE compression
     @param data: bitmap data
     """
-    image = None
-    #allocate
-    
-    if bitsPerPixel == 15:
-        if isCompress:
-            buf = bytearray(width * height * 2)
-            rle.bitmap_decompress(buf, width, height, data, 2)
-            image = QtGui.QImage(buf, width, height, QtGui.QImage.Format_RGB555)
-        else:
-            image = QtGui.QImage(data, width, height, QtGui.QImage.Format_RGB555).transformed(QtGui.QMatrix(1.0, 0.0, 0.0, -1.0, 0.0, 0.0))
-    
-    elif bitsPerPixel == 16:
-        if isCompress:
-            buf = bytearray(width * height * 2)
-            rle.bitmap_decompress(buf, width, height, data, 2)
-            image = QtGui.QImage(buf, width, height, QtGui.QImage.Format_RGB16)
-        else:
-            image = QtGui.QImage(data, width, height, QtGui.QImage.Format_RGB16).transformed(QtGui.QMatrix(1.0, 0.0, 0.0, -1.0, 0.0, 0.0))
-    
-    elif bitsPerPixel == 24:
-        if isCompress:
-            buf = bytearray(width * height * 3)
-            rle.bitmap_decompress(buf, width, height, data, 3)
-            image = QtGui.QImage(buf, width, height, QtGui.QImage.Format_RGB888)
-        else:
-            image = QtGui.QImage(data, width, height, QtGui.QImage.Format_RGB888).transformed(QtGui.QMatrix(1.0, 0.0, 0.0, -1.0, 0.0, 0.0))
-            
-    elif bitsPerPixel == 32:
-        if isCompress:
-            buf = bytearray(width * height * 4)
-            rle.bitmap_decompress(buf, width, height, data, 4)
-            image = QtGui.QImage(buf, width, height, QtGui.QImage.Format_RGB32)
-        else:
-            image = QtGui.QImage(data, width, height, QtGui.QImage.Format_RGB32).transformed(QtGui.QMatrix(1.0, 0.0, 0.0, -1.0, 0.0, 0.0))
-    else:
+    if not bitsPerPixel in [15, 16, 24, 32]:
         log.error("Receive image in bad format")
-        image = QtGui.QImage(width, height, QtGui.QImage.Format_RGB32)
-    return image
+        return QtGui.QImage(width, height, QtGui.QImage.Format_RGB32)
+    
+    #decode, flip and convert in one pass, buffer is shared with image
+    buf = bytearray(width * height * 4)
+    rle.bitmap_to_xrgb(buf, width, height, data, bitsPerPixel, int(bool(isCompress)))
+    return QtGui.QImage(buf, width, height, QtGui.QImage.Format_RGB32)
   
 class RDPClientQt(RDPClientObserver, QAdaptor):
     """
@@ -241,6 +225,8 @@ class RDPClientQt(RDPClientObserver, QAdaptor):
         self._widget = QRemoteDesktop(width, height, self)
         #set widget screen to RDP stack
         controller.setScreen(width, height)
+        #inputs of a display frame are sent together
+        controller.setInputBatching()
         
     def getWidget(self):
         """
@@ -289,6 +275,17 @@ class RDPClientQt(RDPClientObserver, QAdaptor):
         @param e: QCloseEvent
         """
         self._controller.close()
+        
+    def visibilityEvent(self, isVisible):
+        """
+        @summary: Server stop sending updates while widget is hidden or minimized
+                    at resume widget area is refreshed
+        @param isVisible: {bool} widget can be seen by user
+        """
+        if isVisible:
+            self._controller.resumeOutput((0, 0, self._widget.width(), self._widget.height()))
+        else:
+            self._controller.suppressOutput()
     
     def onUpdate(self, destLeft, destTop, destRight, destBottom, width, height, bitsPerPixel, isCompress, data):
         """
@@ -303,10 +300,43 @@ class RDPClientQt(RDPClientObserver, QAdaptor):
         @param isCompress: {bool} use RLE compression
         @param data: {str} bitmap data
         """
-        image = RDPBitmapToQtImage(width, height, bitsPerPixel, isCompress, data)
         #if image need to be cut
         #For bit alignement server may send more than image pixel
-        self._widget.notifyImage(destLeft, destTop, image, destRight - destLeft + 1, destBottom - destTop + 1)
+        notify = lambda image:self._widget.notifyImage(destLeft, destTop, image, destRight - destLeft + 1, destBottom - destTop + 1)
+        #bitmap is already drawn in controller frame buffer
+        frameBuffer = self._controller.getFrameBuffer()
+        if not frameBuffer is None:
+            area = frameBuffer.clip(destLeft, destTop, destRight - destLeft + 1, destBottom - destTop + 1)
+            if area is None:
+                return
+            left, top, areaWidth, areaHeight = area
+            try:
+                buf = frameBuffer.toXRGB(left, top, areaWidth, areaHeight)
+                self._widget.notifyImage(left, top, QtGui.QImage(buf, areaWidth, areaHeight, QtGui.QImage.Format_RGB32), areaWidth, areaHeight)
+                return
+            except InvalidValue as e:
+                log.debug("Unable to read frame buffer : %s"%e)
+        
+        decodePool = self._controller.getDecodePool()
+        if decodePool is None:
+            notify(RDPBitmapToQtImage(width, height, bitsPerPixel, isCompress, data))
+        else:
+            #QImage can be built outside GUI thread, images are painted in update order
+            decodePool.submit(lambda:RDPBitmapToQtImage(width, height, bitsPerPixel, isCompress, data), notify)
+        
+    def onPointerUpdate(self, pointerType, hotSpotX, hotSpotY, width, height, data):
+        """
+        @summary: Render pointer of remote session as local cursor
+        @see: rdp.RDPClientObserver.onPointerUpdate
+        """
+        if pointerType == PointerType.POINTER_HIDDEN:
+            self._widget.setCursor(QtCore.Qt.BlankCursor)
+        elif pointerType == PointerType.POINTER_DEFAULT:
+            self._widget.unsetCursor()
+        else:
+            #pixmap copy image data
+            pixmap = QtGui.QPixmap.fromImage(QtGui.QImage(data, width, height, QtGui.QImage.Format_ARGB32))
+            self._widget.setCursor(QtGui.QCursor(pixmap, hotSpotX, hotSpotY))
     
     def onReady(self):
         """
@@ -428,4 +458,27 @@ class QRemoteDesktop(QtGui.QWidget):
         @summary: Call when widget is closed
         @param event: QCloseEvent
         """
-        self._adaptor.closeEvent(event)
\ No newline at end of file
+        self._adaptor.closeEvent(event)
+        
+    def showEvent(self, event):
+        """
+        @summary: Call when widget is shown
+        @param event: QShowEvent
+        """
+        self._adaptor.visibilityEvent(not self.isMinimized())
+        
+    def hideEvent(self, event):
+        """
+        @summary: Call when widget is hidden
+        @param event: QHideEvent
+        """
+        self._adaptor.visibilityEvent(False)
+        
+    def changeEvent(self, event):
+        """
+        @summary: Minimized window is not visible
+        @param event: QEvent
+        """
+        if event.type() == QtCore.QEvent.WindowStateChange:
+            self._adaptor.visibilityEvent(self.isVisible() and not self.isMinimized())
+        QtGui.QWidget.changeEvent(self, event)
\ No newline at end of file
@@ -26,8 +26,9 @@ setup(name='rdpy',
 			'rdpy.protocol.rfb', 
 			'rdpy.ui'
 		],
-	ext_modules=[Extension('rle', ['ext/rle.c'])],
+	ext_modules=[Extension('rle', ['ext/rle.c', 'ext/planar.c', 'ext/rfx.c', 'ext/nsc.c', 'ext/clear.c'], depends = ['ext/planar.h', 'ext/rfx.h', 'ext/nsc.h', 'ext/clear.h']), Extension('bulk', ['ext/bulk.c'])],
 	scripts = [
+			'bin/rdpy-bulkbench.py',
 			'bin/rdpy-rdpclient.py',
 			'bin/rdpy-rdphoneypot.py',
 			'bin/rdpy-rdpmitm.py',
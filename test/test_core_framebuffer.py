@@ -0,0 +1,255 @@
+#
+# Copyright (c) 2014 Sylvain Peyrefitte
+#
+# This file is part of rdpy.
+#
+# rdpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+unit test for rdpy.core.framebuffer module
+"""
+
+import os, sys
+# Change path so we find rdpy
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+
+import unittest
+import rdpy.core.framebuffer as framebuffer
+from rdpy.core.error import InvalidValue
+
+class FrameBufferTest(unittest.TestCase):
+    """
+    @summary: test case for frame buffer
+    """
+    
+    def test_rop3(self):
+        """
+        @summary: generic raster operation
+        """
+        self.assertEqual(framebuffer.rop3(framebuffer.Rop3.PATINVERT, "\x0f\xff", pat = "\xff\x0f"), "\xf0\xf0", "invalid PATINVERT")
+        self.assertEqual(framebuffer.rop3(framebuffer.Rop3.DSTINVERT, "\x0f\x00"), "\xf0\xff", "invalid DSTINVERT")
+        self.assertEqual(framebuffer.rop3(framebuffer.Rop3.SRCAND, "\x0f\xff", src = "\xff\x0f"), "\x0f\x0f", "invalid SRCAND")
+        
+    def test_rop2(self):
+        """
+        @summary: binary raster operation conversion
+        """
+        self.assertEqual(framebuffer.rop2ToRop3(13), framebuffer.Rop3.PATCOPY, "R2_COPYPEN must be PATCOPY")
+        self.assertEqual(framebuffer.rop2ToRop3(6), framebuffer.Rop3.DSTINVERT, "R2_NOT must be DSTINVERT")
+        
+    def test_fill_clip(self):
+        """
+        @summary: fill is clipped by bounds and surface
+        """
+        fb = framebuffer.FrameBuffer(4, 4, 8)
+        self.assertEqual(fb.fillRect(-2, 1, 10, 2, 7, bounds = (0, 0, 2, 3)), (0, 1, 3, 2), "invalid clipped area")
+        self.assertEqual(fb.readRect(0, 0, 4, 4), "\x00" * 4 + "\x07\x07\x07\x00" * 2 + "\x00" * 4, "invalid fill")
+        
+    def test_copy_overlap(self):
+        """
+        @summary: screen to screen copy with overlapping area
+        """
+        fb = framebuffer.FrameBuffer(4, 1, 16)
+        fb.writeRect(0, 0, 4, 1, "\x01\x00\x02\x00\x03\x00\x04\x00")
+        fb.copyRect(1, 0, 3, 1, 0, 0)
+        self.assertEqual(fb.readRect(0, 0, 4, 1), "\x01\x00\x01\x00\x02\x00\x03\x00", "invalid overlapped copy")
+        
+    def test_update_bitmap(self):
+        """
+        @summary: raw bitmap is bottom-up and may be padded
+        """
+        fb = framebuffer.FrameBuffer(4, 2, 8)
+        fb.updateBitmap(1, 0, 2, 1, 4, 2, 8, False, "\x03\x04\x00\x00\x01\x02\x00\x00")
+        self.assertEqual(fb.readRect(0, 0, 4, 2), "\x00\x01\x02\x00\x00\x03\x04\x00", "invalid bitmap update")
+        self.assertEqual(fb.getBitmap(1, 0, 2, 2), (4, "\x03\x04\x00\x00\x01\x02\x00\x00"), "invalid exported bitmap")
+        
+    def test_draw_line(self):
+        """
+        @summary: last point of line is not drawn
+        """
+        fb = framebuffer.FrameBuffer(4, 4, 8)
+        self.assertEqual(fb.drawLine(0, 0, 3, 3, 1), (0, 0, 3, 3), "invalid line area")
+        self.assertEqual(fb.readRect(0, 0, 4, 4), "\x01\x00\x00\x00\x00\x01\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00", "invalid line")
+        
+    def test_fill_mask(self):
+        """
+        @summary: only set bits of mask are filled, mask is clipped
+        """
+        frameBuffer = framebuffer.FrameBuffer(10, 2, 8)
+        self.assertEqual(frameBuffer.fillMask(-1, 0, 10, 2, "\xb1\x80" + "\x00\x40", 5, (0, 0, 8, 1)), (0, 0, 9, 2), "invalid modified area")
+        self.assertEqual(frameBuffer.readRect(0, 0, 10, 2), "\x00\x05\x05\x00\x00\x00\x05\x05\x00\x00" + "\x00" * 8 + "\x05\x00", "invalid mask rendering")
+        self.assertEqual(framebuffer.union([None, (1, 1, 2, 2), (0, 2, 2, 3)]), (0, 1, 3, 4), "invalid union")
+        
+    def test_pixels_to_rgb(self):
+        """
+        @summary: color conversion give same result with and without NumPy
+        """
+        cases = [(15, "\x1f\x7c", "\xff\x00\xff"), (16, "\xe0\x07", "\x00\xff\x00"), (24, "\x01\x02\x03", "\x03\x02\x01"), (32, "\x01\x02\x03\x00", "\x03\x02\x01")]
+        numpy = framebuffer.numpy
+        try:
+            for module in [numpy, None]:
+                framebuffer.numpy = module
+                for bitsPerPixel, pixels, rgb in cases:
+                    self.assertEqual(framebuffer.pixelsToRGB(pixels * 2, bitsPerPixel), rgb * 2, "invalid %s bpp conversion"%bitsPerPixel)
+                self.assertEqual(framebuffer.pixelsToRGB("\x01", 8, [(0, 0, 0), (1, 2, 3)] + [(0, 0, 0)] * 254), "\x01\x02\x03", "invalid palette conversion")
+        finally:
+            framebuffer.numpy = numpy
+            
+    def test_dirty_area(self):
+        """
+        @summary: dirty area is the bounding area of drawing since last pop
+        """
+        fb = framebuffer.FrameBuffer(8, 8, 8)
+        fb.fillRect(1, 1, 2, 2, 1)
+        fb.updateBitmap(4, 5, 5, 5, 2, 1, 8, False, "\x01\x02")
+        self.assertEqual(fb.popDirtyArea(), (1, 1, 5, 5), "invalid dirty area")
+        self.assertEqual(fb.popDirtyArea(), None, "dirty area must be reset")
+        
+    def test_png(self):
+        """
+        @summary: surface is exported in PNG format
+        """
+        import zlib, struct
+        fb = framebuffer.FrameBuffer(2, 1, 16)
+        fb.writeRect(0, 0, 2, 1, "\x00\xf8\x1f\x00")
+        png = fb.toPNG()
+        self.assertEqual(png[:8], "\x89PNG\r\n\x1a\n", "invalid PNG signature")
+        self.assertEqual(struct.unpack(">II", png[16:24]), (2, 1), "invalid PNG size")
+        idatLength = struct.unpack(">I", png[33:37])[0]
+        self.assertEqual(zlib.decompress(png[41:41 + idatLength]), "\x00\xff\x00\x00\x00\x00\xff", "invalid PNG pixels")
+        
+    def test_rle_bitmap(self):
+        """
+        @summary: compressed bitmap is decoded, output buffer is checked
+        """
+        import rle
+        fb = framebuffer.FrameBuffer(4, 1, 8)
+        #color image of 4 pixels
+        self.assertEqual(fb.decodeBitmap(4, 1, True, "\x84abcd"), "abcd", "invalid rle bitmap")
+        self.assertRaises(ValueError, rle.bitmap_decompress, bytearray(2), 4, 1, "\x84abcd", 1)
+        
+    def test_decode_pool(self):
+        """
+        @summary: decode pool results are returned in submission order
+        """
+        pool = framebuffer.DecodePool(4)
+        try:
+            self.assertEqual(pool.map(lambda x:x * 2, range(0, 20)), [x * 2 for x in range(0, 20)], "invalid map results order")
+            self.assertRaises(ZeroDivisionError, pool.map, lambda x:1 / x, [1, 0, 2])
+        finally:
+            pool.close()
+        
+        delivered = []
+        pool.deliver(1, delivered.append, ("b", None))
+        self.assertEqual(delivered, [], "result must wait previous one")
+        pool.deliver(0, delivered.append, ("a", None))
+        self.assertEqual(delivered, ["a", "b"], "invalid delivery order")
+        
+    def test_decode_pool_schedule(self):
+        """
+        @summary: scheduled callbacks wait pending decoding, flush wait decoding threads
+        """
+        import threading
+        pool = framebuffer.DecodePool(2)
+        try:
+            decoding = threading.Event()
+            def decode():
+                decoding.wait()
+                return "a"
+            delivered = []
+            pool.submit(decode, delivered.append)
+            pool.schedule(lambda:delivered.append("b"))
+            self.assertEqual(delivered, [], "callback must wait pending decoding")
+            decoding.set()
+            pool.flush()
+            self.assertEqual(delivered, ["a", "b"], "invalid delivery order")
+            pool.schedule(lambda:delivered.append("c"))
+            self.assertEqual(delivered, ["a", "b", "c"], "callback must be called at once if nothing is pending")
+        finally:
+            pool.close()
+        
+    def test_update_bitmaps(self):
+        """
+        @summary: batch update give same surface than bitmap by bitmap update
+        """
+        bitmaps = [(-1, 2, 2, 3, 4, 2, 8, False, "abcdefgh"),
+                   (2, 0, 5, 0, 4, 1, 8, True, "\x84ijkl"),
+                   (4, 4, 7, 7, 4, 1, 8, True, "\x84mnop"),
+                   (1, 1, 3, 1, 4, 1, 16, False, "\x00" * 8)]
+        expected = framebuffer.FrameBuffer(6, 5, 8)
+        for bitmap in bitmaps[:3]:
+            expected.updateBitmap(*bitmap)
+        fb = framebuffer.FrameBuffer(6, 5, 8)
+        self.assertRaises(InvalidValue, fb.updateBitmaps, bitmaps)
+        self.assertEqual(fb.readRect(0, 0, 6, 5), expected.readRect(0, 0, 6, 5), "invalid batch update")
+        self.assertEqual(fb.updateBitmaps(bitmaps[:3]), [(0, 2, 3, 2), (2, 0, 4, 1), (4, 4, 2, 1)], "invalid modified areas")
+        self.assertEqual(fb.popDirtyArea(), (0, 0, 6, 5), "invalid dirty area")
+        
+    def test_to_xrgb(self):
+        """
+        @summary: pixels are converted in native 32 bits, raw bitmap is flipped
+        """
+        import rle, array
+        fb = framebuffer.FrameBuffer(2, 1, 16)
+        fb.writeRect(0, 0, 2, 1, "\x00\xf8\xe0\x07")
+        self.assertEqual(list(array.array("I", str(fb.toXRGB()))), [0xffff0000, 0xff00ff00], "invalid 16 bpp conversion")
+        
+        fb = framebuffer.FrameBuffer(1, 1, 8)
+        self.assertRaises(InvalidValue, fb.toXRGB)
+        fb.setPalette([(1, 2, 3)] * 256)
+        self.assertEqual(list(array.array("I", str(fb.toXRGB()))), [0xff010203], "invalid 8 bpp conversion")
+        
+        buf = bytearray(8)
+        rle.bitmap_to_xrgb(buf, 1, 2, "\x01\x02\x03\x04\x05\x06", 24, 0)
+        self.assertEqual(list(array.array("I", str(buf))), [0xff060504, 0xff030201], "raw bitmap must be flipped")
+        self.assertRaises(ValueError, rle.bitmap_to_xrgb, bytearray(4), 1, 2, "\x01\x02\x03\x04\x05\x06", 24, 0)
+        
+    def test_compress_bitmap(self):
+        """
+        @summary: compressed tiles are decoded in original pixels
+        """
+        import random
+        random.seed(0)
+        for bitsPerPixel in [8, 16, 24, 32]:
+            bytesPerPixel = (bitsPerPixel + 7) / 8
+            #noise on flat background
+            pixels = "".join([chr(random.randint(0, 255)) if random.random() < 0.1 else "\x00" for _ in range(0, 70 * 66 * bytesPerPixel)])
+            tiles = framebuffer.compressBitmap(3, 2, 70, 66, bitsPerPixel, pixels)
+            self.assertEqual([tile[:6] for tile in tiles], [(3, 2, 66, 65, 64, 64), (67, 2, 72, 65, 8, 64), (3, 66, 66, 67, 64, 2), (67, 66, 72, 67, 8, 2)], "invalid tiles")
+            self.assertTrue(sum([len(tile[8]) for tile in tiles]) < len(pixels), "bitmap must be compressed")
+            fb = framebuffer.FrameBuffer(73, 68, bitsPerPixel)
+            fb.updateBitmaps(tiles)
+            self.assertEqual(fb.readRect(3, 2, 70, 66), pixels, "invalid round trip for %d bpp"%bitsPerPixel)
+        
+    def test_planar_codec(self):
+        """
+        @summary: planar codec variants decoded by 32 bpp bitmap path
+        """
+        import rle, random
+        random.seed(1)
+        fb = framebuffer.FrameBuffer(5, 3, 32)
+        pixels = "".join([chr(random.choice([0, 7, 255, random.randint(0, 255)])) for _ in range(0, 5 * 3 * 4)])
+        for flags in [rle.PLANAR_RLE, 0]:
+            self.assertEqual(fb.decodeBitmap(5, 3, True, rle.planar_compress(pixels, 5, 3, flags)), pixels, "invalid lossless planar bitmap")
+        self.assertEqual(fb.decodeBitmap(5, 3, True, rle.planar_compress(pixels, 5, 3, rle.PLANAR_RLE | rle.PLANAR_NA)), "".join([pixels[i:i + 3] + "\xff" for i in range(0, len(pixels), 4)]), "alpha must be opaque without alpha plane")
+        #color loss level 2 on YCoCg
+        decoded = fb.decodeBitmap(5, 3, True, rle.planar_compress(pixels, 5, 3, rle.PLANAR_RLE | 2))
+        self.assertTrue(max([abs(ord(a) - ord(b)) for i, (a, b) in enumerate(zip(decoded, pixels)) if i % 4 != 3]) <= 4, "invalid color loss reduction")
+        #chroma subsampling on 2x2 blocks of same color
+        pixels = "".join([chr(x / 2 * 40) + chr(y / 2 * 90) + chr(x * 20) + "\xff" for y in range(0, 4) for x in range(0, 6)])
+        decoded = framebuffer.FrameBuffer(6, 4, 32).decodeBitmap(6, 4, True, rle.planar_compress(pixels, 6, 4, rle.PLANAR_RLE | rle.PLANAR_CS | 1))
+        self.assertTrue(max([abs(ord(a) - ord(b)) for a, b in zip(decoded, pixels)]) <= 16, "invalid chroma subsampling")
+        self.assertRaises(InvalidValue, fb.decodeBitmap, 5, 3, True, rle.planar_compress(pixels, 5, 3)[:-1])
+        self.assertRaises(InvalidValue, fb.decodeBitmap, 5, 3, True, "\x18")
@@ -388,4 +388,15 @@ class TypeTest(unittest.TestCase):
     def test_stream_read_string(self):
         """
         @summary: read stream as string buffer
-        """
\ No newline at end of file
+        """        
+    def test_stream_read_buffer(self):
+        """
+        @summary: stream built on a buffer read it in place
+        """
+        data = bytearray("\x01\x02\x03\x04\x05")
+        s = rdpy.core.type.Stream(buffer(data, 1, 3))
+        self.assertEqual(s.dataLen(), 3, "invalid stream length")
+        t = rdpy.core.type.UInt16Le()
+        s.readType(t)
+        self.assertEqual(t.value, 0x0302, "invalid read from buffer")
+        self.assertEqual(s.getvalue(), "\x02\x03\x04", "invalid stream content")
@@ -0,0 +1,58 @@
+#
+# Copyright (c) 2014 Sylvain Peyrefitte
+#
+# This file is part of rdpy.
+#
+# rdpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+unit test for rdpy.core.worker module
+"""
+
+import os, sys
+# Change path so we find rdpy
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+
+import unittest
+import rdpy.core.worker as worker
+
+class WorkerTest(unittest.TestCase):
+    """
+    @summary: test case for worker processes
+    """
+    
+    def test_supervisor(self):
+        """
+        @summary: lines written by workers are collected with their exit code
+        """
+        def run(index, output):
+            output.write("a%s\nb%s"%(index, index))
+            if index == 1:
+                raise Exception("worker failure")
+        
+        supervisor = worker.Supervisor(2)
+        supervisor.start(run)
+        lines = []
+        supervisor.collect(lambda index, line:lines.append((index, line)))
+        self.assertEqual(sorted(lines), [(0, "a0"), (0, "b0"), (1, "a1"), (1, "b1")], "invalid collected lines")
+        self.assertEqual(supervisor.wait(), [0, 1], "invalid exit codes")
+        
+    def tearDown(self):
+        """
+        @summary: supervisor install signal handlers
+        """
+        import signal
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
@@ -0,0 +1,123 @@
+#
+# Copyright (c) 2014-2015 Sylvain Peyrefitte
+#
+# This file is part of rdpy.
+#
+# rdpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""
+unit test for rdpy.protocol.rdp.autodetect module
+"""
+
+import os, sys
+# Change path so we find rdpy
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+
+import unittest
+import struct
+import rdpy.protocol.rdp.autodetect as autodetect
+from rdpy.protocol.rdp.t125.gcc import ConnectionType
+from rdpy.protocol.rdp.sec import SecurityFlag
+from rdpy.core.type import Stream
+
+class Transport(object):
+    """
+    @summary: keep sent messages as string
+    """
+    def __init__(self):
+        self.sent = []
+    def send(self, data):
+        s = Stream()
+        s.writeType(data)
+        self.sent.append(s.getvalue())
+
+class SecLayer(object):
+    """
+    @summary: security layer without encryption
+    """
+    _enableEncryption = False
+    _enableSecureCheckSum = False
+
+class Listener(autodetect.NetworkCharacteristicsListener):
+    """
+    @summary: keep notified measures
+    """
+    def __init__(self):
+        self.measures = []
+    def onNetworkCharacteristics(self, bandwidth, rtt):
+        self.measures.append((bandwidth, rtt))
+
+def request(sequenceNumber, requestType, data = "", headerLength = None):
+    """
+    @return: {Stream} auto-detect request PDU with its security header
+    """
+    if headerLength is None:
+        headerLength = 6 + len(data)
+    return Stream(struct.pack("<HHBBHH", SecurityFlag.SEC_AUTODETECT_REQ, 0, headerLength, autodetect.HeaderType.TYPE_ID_AUTODETECT_REQUEST, sequenceNumber, requestType) + data)
+
+class AutoDetectTest(unittest.TestCase):
+    """
+    @summary: test case for client side of auto-detect
+    """
+    def setUp(self):
+        self._time = 0.0
+        self._transport = Transport()
+        self._listener = Listener()
+        self._client = autodetect.Client(self._listener, SecLayer(), lambda:self._time)
+        self._client._transport = self._transport
+        
+    def test_rtt(self):
+        """
+        @summary: client answer RTT request with same sequence number
+        """
+        self._client.recv(request(7, autodetect.RequestType.RDP_RTT_REQUEST_TYPE_CONNECTTIME))
+        self.assertEqual(self._transport.sent, [struct.pack("<HHBBHH", SecurityFlag.SEC_AUTODETECT_RSP, 0, 6, autodetect.HeaderType.TYPE_ID_AUTODETECT_RESPONSE, 7, autodetect.ResponseType.RDP_RTT_RESPONSE_TYPE)], "invalid RTT response")
+        
+    def test_bandwidth(self):
+        """
+        @summary: client measure bytes received between start and stop
+        """
+        self._client.recv(request(1, autodetect.RequestType.RDP_BW_START_REQUEST_TYPE_CONNECTTIME))
+        self._time = 0.5
+        self._client.recv(request(2, autodetect.RequestType.RDP_BW_PAYLOAD_REQUEST_TYPE, struct.pack("<H", 40000) + "\x00" * 40000, 8))
+        self._time = 1.0
+        self._client.recv(request(3, autodetect.RequestType.RDP_BW_STOP_REQUEST_TYPE_CONNECTTIME, struct.pack("<H", 10000) + "\x00" * 10000, 8))
+        self.assertEqual(self._transport.sent, [struct.pack("<HHBBHHII", SecurityFlag.SEC_AUTODETECT_RSP, 0, 14, autodetect.HeaderType.TYPE_ID_AUTODETECT_RESPONSE, 3, autodetect.ResponseType.RDP_BW_RESULTS_RESPONSE_TYPE_CONNECTTIME, 1000, 50000)], "invalid bandwidth results")
+        self.assertEqual(self._listener.measures, [(400, None)], "invalid client side measure")
+        self.assertEqual(self._client.getBandwidth(), 400, "invalid bandwidth")
+        
+    def test_network_characteristics(self):
+        """
+        @summary: server measures are notified
+        """
+        self._client.recv(request(1, autodetect.RequestType.RDP_NETCHAR_RESULTS_BASERTT_AVERAGERTT, struct.pack("<II", 20, 30)))
+        self.assertEqual(self._listener.measures, [], "bandwidth is unknown")
+        self._client.recv(request(2, autodetect.RequestType.RDP_NETCHAR_RESULTS_BASERTT_BANDWIDTH_AVERAGERTT, struct.pack("<III", 20, 1500, 40)))
+        self._client.recv(request(3, autodetect.RequestType.RDP_NETCHAR_RESULTS_BANDWIDTH_AVERAGERTT, struct.pack("<II", 50000, 5)))
+        self.assertEqual(self._listener.measures, [(1500, 40), (50000, 5)], "invalid network characteristics")
+        self.assertEqual(self._transport.sent, [], "network characteristics results have no response")
+        
+    def test_profile(self):
+        """
+        @summary: link is classified from its bandwidth and rtt
+        """
+        self.assertEqual(autodetect.getConnectionType(56, 200), ConnectionType.CONNECTION_TYPE_MODEM, "invalid connection type")
+        self.assertEqual(autodetect.getConnectionType(1500, None), ConnectionType.CONNECTION_TYPE_BROADBAND_LOW, "invalid connection type")
+        self.assertEqual(autodetect.getConnectionType(5000, 600), ConnectionType.CONNECTION_TYPE_SATELLITE, "invalid connection type")
+        self.assertEqual(autodetect.getConnectionType(5000, 50), ConnectionType.CONNECTION_TYPE_BROADBAND_HIGH, "invalid connection type")
+        self.assertEqual(autodetect.getConnectionType(50000, 80), ConnectionType.CONNECTION_TYPE_WAN, "invalid connection type")
+        self.assertEqual(autodetect.getConnectionType(100000, 1), ConnectionType.CONNECTION_TYPE_LAN, "invalid connection type")
+        self.assertIsNone(autodetect.getProfile(100000, 1).compressionType, "LAN must not be compressed")
@@ -0,0 +1,169 @@
+#
+# Copyright (c) 2014 Sylvain Peyrefitte
+#
+# This file is part of rdpy.
+#
+# rdpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+unit test for bulk compression extension (RDP)
+"""
+
+import os, sys
+# Change path so we find rdpy
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+
+import unittest
+import struct
+import random
+import bulk
+from rdpy.protocol.rdp.pdu.data import CompressionOrder, CompressionType
+
+class BulkTest(unittest.TestCase):
+    """
+    @summary: test case for bulk decompression (MPPC and RDP 6.1)
+    """
+
+    def test_mppc_64k_literal_and_match(self):
+        """
+        @summary: literals followed by a copy tuple (offset 3, length 3)
+        """
+        d = bulk.Decompressor(CompressionType.PACKET_COMPR_TYPE_64K)
+        self.assertEqual(d.decompress("abc\xf8\x60", CompressionOrder.PACKET_COMPRESSED | CompressionType.PACKET_COMPR_TYPE_64K), "abcabc", "invalid MPPC 64K decompression")
+
+    def test_mppc_8k_literal_and_match(self):
+        """
+        @summary: RDP 4.0 use shorter offset encoding
+        """
+        d = bulk.Decompressor(CompressionType.PACKET_COMPR_TYPE_8K)
+        self.assertEqual(d.decompress("abc\xf0\xc0", CompressionOrder.PACKET_COMPRESSED | CompressionType.PACKET_COMPR_TYPE_8K), "abcabc", "invalid MPPC 8K decompression")
+
+    def test_mppc_high_literal(self):
+        """
+        @summary: literal greater than 0x7f is encoded on 9 bits
+        """
+        d = bulk.Decompressor(CompressionType.PACKET_COMPR_TYPE_64K)
+        self.assertEqual(d.decompress("\xbf\x80", CompressionOrder.PACKET_COMPRESSED), "\xff", "invalid high literal")
+
+    def test_mppc_overlapped_match(self):
+        """
+        @summary: copy tuple which overlap its own output (offset 1, length 4)
+        """
+        d = bulk.Decompressor(CompressionType.PACKET_COMPR_TYPE_64K)
+        self.assertEqual(d.decompress("a\xf8\x30", CompressionOrder.PACKET_COMPRESSED), "aaaaa", "invalid overlapped match")
+
+    def test_mppc_history(self):
+        """
+        @summary: history is kept between packets and cleared by flush flag
+        """
+        d = bulk.Decompressor(CompressionType.PACKET_COMPR_TYPE_64K)
+        d.decompress("abc", CompressionOrder.PACKET_COMPRESSED)
+        self.assertEqual(d.decompress("\xf8\x60", CompressionOrder.PACKET_COMPRESSED), "abc", "history not kept")
+        self.assertRaises(ValueError, d.decompress, "\xf8\x60", CompressionOrder.PACKET_COMPRESSED | CompressionOrder.PACKET_FLUSHED)
+
+    def test_mppc_uncompressed(self):
+        """
+        @summary: uncompressed packet is returned as is
+        """
+        d = bulk.Decompressor(CompressionType.PACKET_COMPR_TYPE_64K)
+        self.assertEqual(d.decompress("\xf8\x60", 0), "\xf8\x60", "uncompressed data must not be altered")
+
+    def test_rdp61_level1_match(self):
+        """
+        @summary: level 1 match copy data from level 1 history
+        """
+        d = bulk.Decompressor(CompressionType.PACKET_COMPR_TYPE_RDP61)
+        payload = "\x01\x00" + struct.pack("<HHHI", 1, 3, 3, 0) + "abc"
+        self.assertEqual(d.decompress(payload, CompressionOrder.PACKET_COMPRESSED | CompressionType.PACKET_COMPR_TYPE_RDP61), "abcabc", "invalid RDP 6.1 level 1 decompression")
+
+    def test_rdp61_level2(self):
+        """
+        @summary: level 2 is MPPC 64K
+        """
+        d = bulk.Decompressor(CompressionType.PACKET_COMPR_TYPE_RDP61)
+        payload = "\x02\x21" + "abc\xf8\x60"
+        self.assertEqual(d.decompress(payload, CompressionOrder.PACKET_COMPRESSED | CompressionType.PACKET_COMPR_TYPE_RDP61), "abcabc", "invalid RDP 6.1 level 2 decompression")
+
+    def test_unsupported_type(self):
+        """
+        @summary: RDP 6.0 is not supported
+        """
+        self.assertRaises(ValueError, bulk.Decompressor, CompressionType.PACKET_COMPR_TYPE_RDP6)
+
+    def test_mppc_compressor_round_trip(self):
+        """
+        @summary: compressed stream is readable by decompressor
+        """
+        for compressionType in [CompressionType.PACKET_COMPR_TYPE_8K, CompressionType.PACKET_COMPR_TYPE_64K]:
+            c = bulk.Compressor(compressionType)
+            d = bulk.Decompressor(compressionType)
+            for data in ["\x00" * 4000, "rdpy" * 1000, "".join([chr(i & 0xff) for i in range(6000)]), "\xff\x80abc" * 1000]:
+                payload, flags = c.compress(data)
+                self.assertTrue(flags & CompressionOrder.PACKET_COMPRESSED, "data must be compressed")
+                self.assertTrue(len(payload) < len(data), "compression must reduce size")
+                self.assertEqual(d.decompress(payload, flags), data, "invalid round trip")
+
+    def test_mppc_compressor_never_expand(self):
+        """
+        @summary: incompressible data is sent as is with flushed flag
+        """
+        c = bulk.Compressor(CompressionType.PACKET_COMPR_TYPE_64K)
+        d = bulk.Decompressor(CompressionType.PACKET_COMPR_TYPE_64K)
+        r = random.Random(0)
+        data = "".join([chr(r.randint(0, 255)) for _ in range(64)])
+        payload, flags = c.compress(data)
+        self.assertEqual(flags, CompressionOrder.PACKET_FLUSHED, "incompressible data must be flushed")
+        self.assertEqual(payload, data, "incompressible data must be sent as is")
+        self.assertEqual(d.decompress(payload, flags), data, "invalid round trip")
+        payload, flags = c.compress("rdpy" * 100)
+        self.assertEqual(d.decompress(payload, flags), "rdpy" * 100, "invalid round trip after flush")
+
+    def test_mppc_compressor_level(self):
+        """
+        @summary: level must be between 1 and 9
+        """
+        self.assertRaises(ValueError, bulk.Compressor, CompressionType.PACKET_COMPR_TYPE_64K, 0)
+        self.assertRaises(ValueError, bulk.Compressor, CompressionType.PACKET_COMPR_TYPE_RDP61)
+
+    def test_rdp8_raw_segments(self):
+        """
+        @summary: uncompressed single and multipart segmented data
+        """
+        d = bulk.RDP8Decompressor()
+        self.assertEqual(d.decompress("\xe0\x04rdpy"), "rdpy", "invalid single segment")
+        multipart = "\xe1" + struct.pack("<HI", 2, 8) + struct.pack("<I", 5) + "\x04rdpy" + struct.pack("<I", 5) + "\x04RDPY"
+        self.assertEqual(d.decompress(multipart), "rdpyRDPY", "invalid multipart segments")
+
+    def test_rdp8_literal_and_match(self):
+        """
+        @summary: literal followed by a match of distance 1 and count 3
+        """
+        #literal 'a', match prefix 10001 distance 1, count 3, 4 padding bits
+        bits = "0" + "01100001" + "10001" + "00001" + "0" + "0000"
+        payload = "".join([chr(int(bits[i:i + 8], 2)) for i in range(0, len(bits), 8)]) + "\x04"
+        d = bulk.RDP8Decompressor()
+        self.assertEqual(d.decompress("\xe0\x24" + payload), "aaaa", "invalid RDP 8.0 decompression")
+        #history is kept between segments
+        bits = "10001" + "00100" + "0" + "00000"
+        payload = "".join([chr(int(bits[i:i + 8], 2)) for i in range(0, len(bits), 8)]) + "\x05"
+        self.assertEqual(d.decompress("\xe0\x24" + payload), "aaa", "invalid RDP 8.0 history")
+
+    def test_rdp8_invalid(self):
+        """
+        @summary: invalid descriptor or size raise ValueError
+        """
+        d = bulk.RDP8Decompressor()
+        self.assertRaises(ValueError, d.decompress, "\xe2\x04rdpy")
+        self.assertRaises(ValueError, d.decompress, "\xe1" + struct.pack("<HI", 1, 8) + struct.pack("<I", 5) + "\x04rdpy")
@@ -0,0 +1,144 @@
+#
+# Copyright (c) 2014-2015 Sylvain Peyrefitte
+#
+# This file is part of rdpy.
+#
+# rdpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+unit test for rdpy.protocol.rdp.cache module
+"""
+
+import os, sys
+# Change path so we find rdpy
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+
+import unittest
+import tempfile, shutil
+import rdpy.protocol.rdp.cache as cache
+import rdpy.protocol.rdp.pdu.order as order
+from rdpy.core.error import InvalidValue
+
+class CacheTest(unittest.TestCase):
+    """
+    @summary: test case for client side caches
+    """
+    
+    def test_bitmap_cache_index(self):
+        """
+        @summary: explicit index is kept, out of cell index is refused
+        """
+        bitmapCache = cache.BitmapCache([2, 4])
+        bitmapCache.put(1, 3, "a")
+        self.assertEqual(bitmapCache.get(1, 3), "a", "invalid cached bitmap")
+        self.assertEqual(bitmapCache.get(0, 3), None, "cell must be empty")
+        self.assertRaises(InvalidValue, bitmapCache.put, 0, 2, "b")
+        self.assertRaises(InvalidValue, bitmapCache.get, 2, 0)
+        
+    def test_bitmap_cache_waiting_list(self):
+        """
+        @summary: waiting list index use free entry then least recently used one
+        """
+        bitmapCache = cache.BitmapCache([2])
+        self.assertEqual(bitmapCache.put(0, cache.BitmapCache.WAITING_LIST_INDEX, "a"), 0, "first free entry must be used")
+        self.assertEqual(bitmapCache.put(0, cache.BitmapCache.WAITING_LIST_INDEX, "b"), 1, "first free entry must be used")
+        bitmapCache.get(0, 0)
+        self.assertEqual(bitmapCache.put(0, cache.BitmapCache.WAITING_LIST_INDEX, "c"), 1, "least recently used entry must be replaced")
+        self.assertEqual((bitmapCache.get(0, 0), bitmapCache.get(0, 1)), ("a", "c"), "invalid cached bitmaps")
+        
+    def test_decode_monochrome_brush(self):
+        """
+        @summary: monochrome brush rows are sent bottom-up
+        """
+        brush = cache.decodeBrush(order.BitmapFormat.BMF_1BPP, "".join([chr(i) for i in range(8)]))
+        self.assertTrue(brush.isMonochrome(), "brush must be monochrome")
+        self.assertEqual(brush.getRows(), range(7, -1, -1), "invalid brush rows")
+        
+    def test_decode_compressed_brush(self):
+        """
+        @summary: compressed color brush use 2 bits palette index
+        """
+        #first row (sent last) use index 0 to 3 twice
+        brushData = "\x00\x00" * 7 + "\x1b\x1b" + "\x0a\x0b\x0c\x0d"
+        brush = cache.decodeBrush(order.BitmapFormat.BMF_8BPP, brushData)
+        self.assertFalse(brush.isMonochrome(), "brush must be colored")
+        self.assertEqual(brush.getRows()[0], "\x0a\x0b\x0c\x0d" * 2, "invalid first row")
+        self.assertEqual(brush.getRows()[1], "\x0a" * 8, "invalid second row")
+        
+    def test_persistent_bitmap_cache(self):
+        """
+        @summary: bitmaps are kept in file between two sessions
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "bitmap.cache")
+            persistentCache = cache.PersistentBitmapCache(path, 4)
+            self.assertTrue(persistentCache.put(1, 2, 2, 16, 2, 1, "abcd"), "bitmap must be stored")
+            self.assertTrue(persistentCache.put(3, 4, 2, 16, 1, 1, "ef"), "bitmap must be stored")
+            self.assertTrue(persistentCache.put(5, 6, 1, 16, 1, 1, "gh"), "bitmap must be stored")
+            self.assertFalse(persistentCache.put(7, 8, 2, 32, 64, 65, "\x00" * 64 * 65 * 4), "bitmap is too large")
+            persistentCache.close()
+            
+            persistentCache = cache.PersistentBitmapCache(path, 4)
+            self.assertEqual(persistentCache.get(1, 2), (2, 16, 2, 1, "abcd"), "invalid bitmap after reopen")
+            self.assertEqual(persistentCache.getKeys(2, 16, 10), [(1, 2), (3, 4)], "keys must be sorted by most recently used")
+            self.assertEqual(persistentCache.getKeys(2, 16, 1), [(1, 2)], "keys must be limited by cell entries")
+            self.assertEqual(persistentCache.getKeys(2, 24, 10), [], "keys of another color depth")
+            persistentCache.close()
+            
+            #cache is reset if size change
+            persistentCache = cache.PersistentBitmapCache(path, 8)
+            self.assertEqual(persistentCache.get(1, 2), None, "cache must be reset")
+            persistentCache.close()
+        finally:
+            shutil.rmtree(directory)
+            
+    def test_persistent_bitmap_cache_eviction(self):
+        """
+        @summary: least recently used bitmap is replaced when file is full
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            persistentCache = cache.PersistentBitmapCache(os.path.join(directory, "bitmap.cache"), 2)
+            persistentCache.put(1, 0, 0, 8, 1, 1, "a")
+            persistentCache.put(2, 0, 0, 8, 1, 1, "b")
+            persistentCache.get(1, 0)
+            persistentCache.put(3, 0, 0, 8, 1, 1, "c")
+            self.assertEqual((persistentCache.get(1, 0), persistentCache.get(2, 0), persistentCache.get(3, 0)), ((0, 8, 1, 1, "a"), None, (0, 8, 1, 1, "c")), "least recently used bitmap must be evicted")
+            persistentCache.close()
+        finally:
+            shutil.rmtree(directory)
+            
+    def test_decode_pointer(self):
+        """
+        @summary: pointer masks are bottom-up, and bit makes black pixel transparent
+        """
+        #2x2 pointer 24 bpp, and mask rows padded on 2 bytes
+        xorMask = "\x00\x00\x00" + "\xff\xff\xff" + "\x01\x02\x03" + "\x00\x00\x00"
+        andMask = "\xc0\x00" + "\x00\x00"
+        self.assertEqual(cache.decodePointer(24, 2, 2, xorMask, andMask), "\x01\x02\x03\xff" + "\x00\x00\x00\xff" + "\x00\x00\x00\x00" + "\x00\x00\x00\xff", "invalid pointer pixels")
+        self.assertEqual(cache.decodePointer(32, 1, 1, "\x01\x02\x03\x80", ""), "\x01\x02\x03\x80", "32 bpp pointer use its alpha channel")
+        self.assertRaises(InvalidValue, cache.decodePointer, 8, 1, 1, "\x00\x00", "\x00\x00")
+        
+    def test_pointer_cache(self):
+        """
+        @summary: pointer cache has negotiated size
+        """
+        pointerCache = cache.PointerCache(2)
+        pointer = cache.Pointer(1, 2, 1, 1, "\x00\x00\x00\x00")
+        pointerCache.put(1, pointer)
+        self.assertIs(pointerCache.get(1), pointer, "invalid cached pointer")
+        self.assertRaises(InvalidValue, pointerCache.get, 0)
+        self.assertRaises(InvalidValue, pointerCache.put, 2, pointer)
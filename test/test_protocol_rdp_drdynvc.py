@@ -0,0 +1,149 @@
+#
+# Copyright (c) 2014-2015 Sylvain Peyrefitte
+#
+# This file is part of rdpy.
+#
+# rdpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+unit test for rdpy.protocol.rdp.drdynvc module
+"""
+
+import os, sys
+# Change path so we find rdpy
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+
+import unittest
+import struct
+import rdpy.protocol.rdp.drdynvc as drdynvc
+from rdpy.core.type import Stream, String
+from rdpy.core.error import InvalidExpectedDataException
+
+class Transport(object):
+    """
+    @summary: keep sent messages as string
+    """
+    def __init__(self):
+        self.sent = []
+    def send(self, data):
+        s = Stream()
+        s.writeType(data)
+        self.sent.append(s.getvalue())
+
+class Listener(drdynvc.DynamicChannelListener):
+    """
+    @summary: keep received messages
+    """
+    def __init__(self):
+        self.channel = None
+        self.received = []
+        self.closed = False
+    def onOpen(self, channel):
+        self.channel = channel
+    def recv(self, data):
+        self.received.append(data)
+    def onClose(self):
+        self.closed = True
+
+class DynamicChannelTest(unittest.TestCase):
+    """
+    @summary: test case for dynamic virtual channel manager
+    """
+    def setUp(self):
+        self._transport = Transport()
+        self._listener = Listener()
+        self._manager = drdynvc.Client()
+        self._manager._transport = self._transport
+        self._manager.addListener("rdpy", lambda:self._listener)
+
+    def recv(self, data):
+        self._manager.recv(Stream(data))
+
+    def test_capabilities(self):
+        """
+        @summary: client answer with lowest version
+        """
+        self.recv("\x50\x00\x02\x00")
+        self.assertEqual(self._transport.sent, ["\x50\x00\x02\x00"], "invalid capabilities response")
+        self.recv("\x50\x00\x03\x00" + "\x00" * 8)
+        self.assertEqual(self._manager.getVersion(), 3, "invalid version")
+
+    def test_create(self):
+        """
+        @summary: known channel is accepted, other are refused
+        """
+        self.recv("\x10\x07rdpy\x00")
+        self.assertEqual(self._transport.sent[-1], "\x10\x07" + struct.pack("<I", drdynvc.CreationStatus.OK), "invalid create response")
+        self.assertEqual(self._listener.channel.getChannelId(), 7, "invalid channel id")
+        self.assertEqual(self._listener.channel.getName(), "rdpy", "invalid channel name")
+        self.recv("\x11\x08\x01unknown\x00")
+        self.assertEqual(self._transport.sent[-1], "\x11\x08\x01" + struct.pack("<I", drdynvc.CreationStatus.NO_LISTENER), "unknown channel must be refused")
+
+    def test_data(self):
+        """
+        @summary: fragmented and compressed data are reassembled
+        """
+        self.recv("\x10\x07rdpy\x00")
+        self.recv("\x30\x07hello")
+        self.recv("\x24\x07\x08\x00rdpy")
+        self.recv("\x30\x07RDPY")
+        self.recv("\x70\x07\xe0\x04lite")
+        self.recv("\x30\x09lost")
+        self.assertEqual(self._listener.received, ["hello", "rdpyRDPY", "lite"], "invalid received data")
+        self.assertRaises(InvalidExpectedDataException, self.recv, "\x70\x07\xe2\x04lite")
+
+    def test_send_fragmented(self):
+        """
+        @summary: message bigger than a chunk is sent in data first and data PDU
+        """
+        self.recv("\x10\x07rdpy\x00")
+        data = "".join([chr(i & 0xff) for i in range(0, 4000)])
+        self._listener.channel.send(data)
+        sent = self._transport.sent[1:]
+        self.assertTrue(all([len(pdu) <= drdynvc.CHANNEL_CHUNK_LENGTH for pdu in sent]), "PDU must fit in a chunk")
+        self.assertEqual(sent[0][:4], "\x24\x07" + struct.pack("<H", 4000), "invalid data first header")
+        self.assertEqual(sent[0][4:] + "".join([pdu[2:] for pdu in sent[1:]]), data, "invalid fragmentation")
+        self.assertTrue(all([pdu[:2] == "\x30\x07" for pdu in sent[1:]]), "invalid data header")
+
+    def test_close(self):
+        """
+        @summary: client answer to close and notify listener
+        """
+        self.recv("\x10\x07rdpy\x00")
+        self.recv("\x40\x07")
+        self.assertEqual(self._transport.sent[-1], "\x40\x07", "invalid close response")
+        self.assertTrue(self._listener.closed, "listener must be notified")
+
+class VirtualChannelTest(unittest.TestCase):
+    """
+    @summary: test case for static virtual channel chunks
+    """
+    def test_chunks(self):
+        """
+        @summary: message is split in chunks and reassembled
+        """
+        listener = Listener()
+        class Presentation(object):
+            def recv(self, s):
+                listener.recv(s.read())
+        transport = Transport()
+        channel = drdynvc.VirtualChannel(None, 4)
+        channel._presentation = Presentation()
+        channel._transport = transport
+        channel.send(String("0123456789"))
+        self.assertEqual([struct.unpack_from("<II", chunk) for chunk in transport.sent], [(10, 1), (10, 0), (10, 2)], "invalid chunk header")
+        for chunk in transport.sent:
+            channel.recv(Stream(chunk))
+        self.assertEqual(listener.received, ["0123456789"], "invalid reassembly")
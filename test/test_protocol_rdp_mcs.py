@@ -26,6 +26,19 @@ import os, sys
 sys.path.insert(1, os.path.join(sys.path[0], '..'))
 
 import unittest
+import rdpy.protocol.rdp.t125.mcs as mcs
+from rdpy.core.type import Stream
+
+class Transport(object):
+    """
+    @summary: keep sent messages as string
+    """
+    def __init__(self):
+        self.sent = []
+    def send(self, data):
+        s = Stream()
+        s.writeType(data)
+        self.sent.append(s.getvalue())
 
 class MCSTest(unittest.TestCase):
     """
@@ -33,4 +46,20 @@ class MCSTest(unittest.TestCase):
     """
     
     def test_per_readLength(self):
-        pass
\ No newline at end of file
+        pass
+    
+    def test_max_pdu_size(self):
+        """
+        @summary: max PDU size is negotiated in connect initial and connect response
+        """
+        client = mcs.Client(None)
+        client._transport = Transport()
+        server = mcs.Server(None)
+        server._transport = Transport()
+        
+        client.sendConnectInitial()
+        server.recvConnectInitial(Stream(client._transport.sent[0]))
+        self.assertEqual(server._maxPduSize, 0xfff8, "server must keep its max PDU size")
+        client.recvConnectResponse(Stream(server._transport.sent[0]))
+        self.assertEqual(client._maxPduSize, 0xfff8, "client must use max PDU size of server")
+        self.assertEqual(mcs.MCSLayer.MCSProxySender(None, client, 1003).getMaxPduSize(), 0xfff8, "invalid max PDU size of channel")
\ No newline at end of file
@@ -0,0 +1,146 @@
+#
+# Copyright (c) 2014-2015 Sylvain Peyrefitte
+#
+# This file is part of rdpy.
+#
+# rdpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+unit test for rdpy.protocol.rdp.nsc module
+"""
+
+import os, sys
+# Change path so we find rdpy
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+
+import unittest
+import struct, random
+import rdpy.protocol.rdp.nsc as nsc
+import rdpy.protocol.rdp.rdp as rdp
+import rdpy.protocol.rdp.pdu.layer as layer
+import rdpy.protocol.rdp.pdu.data as data
+import rdpy.protocol.rdp.pdu.caps as caps
+import rdpy.core.type as type
+from rdpy.core.error import InvalidValue
+
+def maxError(a, b):
+    """
+    @return: {integer} max difference between bytes of a and b
+    """
+    return max([abs(ord(x) - ord(y)) for x, y in zip(a, b)])
+
+class NSCodecTest(unittest.TestCase):
+    """
+    @summary: test case for NSCodec
+    """
+    
+    def test_round_trip(self):
+        """
+        @summary: color loss is bounded by color loss level, alpha is lossless
+        """
+        random.seed(7)
+        for width, height in [(1, 1), (7, 5), (33, 17)]:
+            pixels = "".join([chr(random.randint(0, 255)) for _ in range(0, width * height * 4)])
+            for colorLossLevel in range(1, 8):
+                decoded = nsc.decode(width, height, nsc.encode(width, height, pixels, colorLossLevel, False))
+                self.assertTrue(maxError(pixels, decoded) <= 1 << colorLossLevel, "color loss exceed color loss level %s"%colorLossLevel)
+                self.assertEqual(decoded[3::4], pixels[3::4], "alpha must be lossless")
+            
+            #subsampled chroma of smooth image
+            pixels = "".join([chr(x * 4) + chr(y * 8) + chr(x * 2 + y) + "\xff" for y in range(0, height) for x in range(0, width)])
+            decoded = nsc.decode(width, height, nsc.encode(width, height, pixels, 1, True))
+            self.assertTrue(maxError(pixels, decoded) <= 16, "invalid chroma subsampling")
+    
+    def test_gray(self):
+        """
+        @summary: gray pixels have no chroma and are lossless
+        """
+        pixels = "".join([chr(i) * 3 + chr(255 - i) for i in range(0, 256)]) * 3
+        for colorLossLevel in [1, 3, 7]:
+            self.assertEqual(nsc.decode(256, 3, nsc.encode(256, 3, pixels, colorLossLevel)), pixels, "invalid gray pixels")
+    
+    def test_rle(self):
+        """
+        @summary: constant planes are RLE encoded
+        """
+        pixels = "\x10\x20\x30\xff" * (640 * 480)
+        encoded = nsc.encode(640, 480, pixels)
+        self.assertTrue(len(encoded) <= 64, "constant planes must be RLE encoded")
+        self.assertTrue(maxError(pixels, nsc.decode(640, 480, encoded)) <= 8, "invalid RLE decoding")
+    
+    def test_raw_planes(self):
+        """
+        @summary: hand made stream of 1x1 bitmap with raw planes and empty alpha plane
+        """
+        stream = struct.pack("<IIIIBBH", 1, 1, 1, 0, 1, 0, 0) + "\x40\x10\xf8"
+        self.assertEqual(nsc.decode(1, 1, stream), "\x38\x38\x58\xff", "invalid raw planes")
+    
+    def test_invalid_stream(self):
+        """
+        @summary: truncated or invalid stream raise InvalidValue
+        """
+        encoded = nsc.encode(16, 16, "".join([chr(i) for i in range(0, 256)]) * 4)
+        self.assertRaises(InvalidValue, nsc.decode, 16, 16, encoded[:-1])
+        self.assertRaises(InvalidValue, nsc.decode, 16, 16, encoded[:16])
+        self.assertRaises(InvalidValue, nsc.decode, 16, 16, encoded[:16] + "\x00" + encoded[17:])
+        self.assertRaises(InvalidValue, nsc.encode, 16, 16, "\x00" * 16)
+    
+    def test_server_surface_bits(self):
+        """
+        @summary: server send bitmap in NSCodec surface bits commands when client advertise it
+        """
+        class FastPathSender(object):
+            def __init__(self):
+                self._packets = []
+            def sendFastPath(self, secFlag, fastPathS):
+                s = type.Stream()
+                s.writeType(fastPathS)
+                self._packets.append(s.getvalue())
+        
+        class ClientListener(object):
+            def __init__(self):
+                self._commands = []
+            def onSurfaceCommand(self, surfaceCommand):
+                self._commands.append(surfaceCommand)
+        
+        controller = rdp.RDPServerController(32)
+        controller._isReady = True
+        server = controller._pduLayer
+        server._fastPathSender = FastPathSender()
+        server._clientFastPathSupported = True
+        server._clientCapabilities[caps.CapsType.CAPSETTYPE_MULTIFRAGMENTUPDATE].capability.MaxRequestSize.value = 0x10000
+        #advertise NSCodec as a client does
+        client = layer.Client(ClientListener())
+        client.addBitmapCodec(caps.CodecGUID.CODEC_GUID_NSCODEC, nsc.CODEC_ID_NSCODEC, nsc.capabilitySet(colorLossLevel = 2))
+        server._clientCapabilities.update(client._clientCapabilities)
+        
+        width, height = 300, 100
+        pixels = "".join([chr(x * 255 / width) + chr(y * 2) + chr((x + y) * 255 / (width + height)) + "\xff" for y in range(0, height) for x in range(0, width)])
+        controller.sendBitmap(10, 20, width, height, pixels)
+        
+        for packet in server._fastPathSender._packets:
+            client.recvFastPath(0, type.Stream(packet))
+        commands = [c.command for c in client._listener._commands]
+        self.assertTrue(len(commands) > 1, "bitmap must be splitted in bands")
+        self.assertEqual((commands[0].destLeft.value, commands[0].destTop.value, commands[-1].destRight.value, commands[-1].destBottom.value), (10, 20, 310, 120), "invalid bands position")
+        decoded = "".join([nsc.decode(c.bitmapData.width.value, c.bitmapData.height.value, c.bitmapData.bitmapData.value) for c in commands])
+        self.assertEqual(set([c.bitmapData.codecID.value for c in commands]), set([nsc.CODEC_ID_NSCODEC]), "invalid codec id")
+        self.assertTrue(maxError(pixels, decoded) <= 16, "invalid encoded bitmap")
+        
+        #not advertised codec fallback on bitmap updates
+        del server._clientCapabilities[caps.CapsType.CAPSETTYPE_BITMAP_CODECS]
+        server._fastPathSender._packets = []
+        controller.sendBitmap(0, 0, 4, 4, "\x00" * 64)
+        self.assertEqual(ord(server._fastPathSender._packets[0][0]) >> 2 & 0xf, 0, "invalid fallback")
@@ -0,0 +1,123 @@
+#
+# Copyright (c) 2014 Sylvain Peyrefitte
+#
+# This file is part of rdpy.
+#
+# rdpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+unit test for rdpy.protocol.rdp.pdu.order module
+"""
+
+import os, sys
+# Change path so we find rdpy
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+
+import unittest
+import struct
+import rdpy.protocol.rdp.pdu.order as order
+import rdpy.core.type as type
+
+class OrderTest(unittest.TestCase):
+    """
+    @summary: test case for drawing orders decoding
+    """
+    
+    def test_primary_order_type_change(self):
+        """
+        @summary: order type is kept between orders
+        """
+        decoder = order.OrderDecoder()
+        #OpaqueRect all fields
+        s = "\x09\x0a\x7f" + struct.pack("<hhhh", 10, 20, 30, 40) + "\x01\x02\x03"
+        #OpaqueRect only width
+        s += "\x01\x04" + struct.pack("<h", 50)
+        orders = [(o.__class__, o.nLeftRect.value, o.nTopRect.value, o.nWidth.value, o.nHeight.value, o.getColor()) for o in decoder.readOrders(type.Stream(s), 2)]
+        self.assertEqual(orders, [(order.OpaqueRectOrder, 10, 20, 30, 40, 0x030201), (order.OpaqueRectOrder, 10, 20, 50, 40, 0x030201)], "invalid opaque rect orders")
+        
+    def test_primary_order_delta(self):
+        """
+        @summary: coordinates in delta mode are added to last value
+        """
+        decoder = order.OrderDecoder()
+        s = "\x09\x02\x7f" + struct.pack("<hhhhB", 100, 100, 10, 10, 0xcc) + struct.pack("<hh", 5, 6)
+        s += "\x11\x03" + struct.pack("<bb", -5, 3)
+        orders = [(o.nLeftRect.value, o.nTopRect.value, o.nWidth.value, o.nXSrc.value, o.nYSrc.value) for o in decoder.readOrders(type.Stream(s), 2)]
+        self.assertEqual(orders, [(100, 100, 10, 5, 6), (95, 103, 10, 5, 6)], "invalid delta coordinates")
+        
+    def test_primary_order_bounds(self):
+        """
+        @summary: bounds are kept between orders
+        """
+        decoder = order.OrderDecoder()
+        s = "\x0d\x00\x00\x0f" + struct.pack("<hhhh", 1, 2, 3, 4)
+        #zero bounds deltas
+        s += "\x25\x00"
+        #delta on right bound, no bounds
+        s += "\x05\x00\x40\x02" + "\x01\x00"
+        bounds = [o.getBounds() for o in decoder.readOrders(type.Stream(s), 4)]
+        self.assertEqual(bounds, [(1, 2, 3, 4), (1, 2, 3, 4), (1, 2, 5, 4), None], "invalid bounds")
+        
+    def test_zero_field_byte(self):
+        """
+        @summary: field flags byte may be omitted
+        """
+        decoder = order.OrderDecoder()
+        s = "\x09\x01\x01\x00" + struct.pack("<h", 7)
+        s += "\x81"
+        orders = [(o.__class__, o.nLeftRect.value) for o in decoder.readOrders(type.Stream(s), 2)]
+        self.assertEqual(orders, [(order.PatBltOrder, 7), (order.PatBltOrder, 7)], "invalid zero field byte")
+        
+    def test_skip_secondary_order(self):
+        """
+        @summary: unknown secondary order is skipped with its length
+        """
+        decoder = order.OrderDecoder()
+        s = "\x03" + struct.pack("<hHB", 4 - 7, 0, 0x06) + "abcd"
+        s += "\x09\x0a\x01" + struct.pack("<h", 3)
+        orders = list(decoder.readOrders(type.Stream(s), 2))
+        self.assertIsInstance(orders[0], order.SecondaryDrawingOrder, "invalid secondary order")
+        self.assertEqual(orders[0].order.value, "abcd", "unknown secondary order must be skipped with its length")
+        self.assertEqual((orders[1].__class__, orders[1].nLeftRect.value), (order.OpaqueRectOrder, 3), "invalid primary order after secondary order")
+        
+    def test_cache_bitmap_rev2_order(self):
+        """
+        @summary: cache bitmap revision 2 with variable length fields
+        """
+        decoder = order.OrderDecoder()
+        extraFlags = 1 | (order.BitsPerPixelId.CBR2_8BPP << 3) | (order.CacheBitmapFlag.CBR2_HEIGHT_SAME_AS_WIDTH << 7)
+        #width 2, length 4, index 0x105
+        body = "\x02\x04\x81\x05" + "abcd"
+        s = "\x03" + struct.pack("<hHB", len(body) - 7, extraFlags, order.SecondaryOrderType.TS_CACHE_BITMAP_UNCOMPRESSED_REV2) + body
+        cacheOrder = list(decoder.readOrders(type.Stream(s), 1))[0].order
+        self.assertEqual((cacheOrder.getCacheId(), cacheOrder.getBitsPerPixel(), cacheOrder.bitmapWidth.value, cacheOrder.getHeight(), cacheOrder.cacheIndex.value, cacheOrder.isCompressed()), (1, 8, 2, 2, 0x105, False), "invalid cache bitmap order")
+        self.assertEqual(cacheOrder.bitmapDataStream.value, "abcd", "invalid bitmap data")
+        
+    def test_fast_glyph_order(self):
+        """
+        @summary: fast glyph order may contain glyph with variable length fields
+        """
+        decoder = order.OrderDecoder()
+        #cache index 3, x = -2, y = 300, 8x2 glyph
+        glyph = "\x03" + "\x42" + "\x81\x2c" + "\x08\x02" + "\xff\x81\x00\x00"
+        s = "\x09\x18" + struct.pack("<H", 1 | (1 << 14)) + "\x01" + chr(len(glyph)) + glyph
+        fastGlyph = list(decoder.readOrders(type.Stream(s), 1))[0]
+        self.assertIsInstance(fastGlyph, order.FastGlyphOrder, "invalid order type")
+        glyphData = fastGlyph.getGlyph()
+        self.assertTrue(glyphData.isGlyphPresent(), "glyph must be present")
+        self.assertEqual((glyphData.cacheIndex.value, glyphData.x.value, glyphData.y.value, glyphData.cx.value, glyphData.cy.value, glyphData.aj.value), (3, -2, 300, 8, 2, "\xff\x81\x00\x00"), "invalid glyph")
+        
+        s = "\x01" + struct.pack("<H", 1 << 14) + "\x01\x04"
+        self.assertFalse(list(decoder.readOrders(type.Stream(s), 1))[0].getGlyph().isGlyphPresent(), "glyph must be cached")
@@ -0,0 +1,332 @@
+#
+# Copyright (c) 2014 Sylvain Peyrefitte
+#
+# This file is part of rdpy.
+#
+# rdpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+unit test for rdpy.protocol.rdp.pdu.layer module
+"""
+
+import os, sys
+# Change path so we find rdpy
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+
+import unittest
+import rdpy.protocol.rdp.pdu.layer as layer
+import rdpy.protocol.rdp.pdu.data as data
+import rdpy.protocol.rdp.pdu.caps as caps
+import rdpy.core.type as type
+
+class PDUTest(unittest.TestCase):
+    """
+    @summary: test case for PDU layer
+    """
+
+    class FastPathSender(object):
+        """
+        @summary: keep each fast path packet as string
+        """
+        def __init__(self):
+            self._packets = []
+        def sendFastPath(self, secFlag, fastPathS):
+            s = type.Stream()
+            s.writeType(fastPathS)
+            self._packets.append(s.getvalue())
+
+    class ClientListener(object):
+        """
+        @summary: keep each bitmap update
+        """
+        def __init__(self):
+            self._updates = []
+        def onUpdate(self, rectangles):
+            self._updates.append(rectangles)
+
+    def buildServer(self, maxRequestSize):
+        """
+        @summary: build a server PDU layer which send fast path update
+        @param maxRequestSize: {integer} client multi fragment update capability
+        """
+        server = layer.Server(None)
+        server._fastPathSender = PDUTest.FastPathSender()
+        server._clientFastPathSupported = True
+        server._clientCapabilities[caps.CapsType.CAPSETTYPE_MULTIFRAGMENTUPDATE].capability.MaxRequestSize.value = maxRequestSize
+        return server
+
+    def sendToClient(self, server):
+        """
+        @summary: forward each fast path packet of server to a client PDU layer
+        @return: list of bitmap updates received by client
+        """
+        client = layer.Client(PDUTest.ClientListener())
+        for packet in server._fastPathSender._packets:
+            client.recvFastPath(0, type.Stream(packet))
+        return client._listener._updates
+
+    def test_fast_path_fragmentation(self):
+        """
+        @summary: large update is sent in fragments and reassembled by client
+        """
+        server = self.buildServer(0x100000)
+        rectangles = [data.BitmapData(0, 0, 63, 63, 64, 64, 32, chr(i) * 40000) for i in range(2)]
+        server.sendBitmapUpdatePDU(rectangles)
+        self.assertTrue(len(server._fastPathSender._packets) > 1, "update must be fragmented")
+        for packet in server._fastPathSender._packets:
+            self.assertTrue(len(packet) < 0x7fff, "fragment exceed fast path packet size")
+
+        updates = self.sendToClient(server)
+        self.assertEqual(len(updates), 1, "fragments must be reassembled in one update")
+        self.assertEqual([r.bitmapDataStream.value for r in updates[0]], [r.bitmapDataStream.value for r in rectangles], "invalid reassembled update")
+
+    def test_fast_path_fragment_boundary(self):
+        """
+        @summary: update of exactly two fragments is not followed by an empty fragment
+        """
+        server = self.buildServer(0x100000)
+        #fast path bitmap update header (4) + bitmap data header (18)
+        rectangles = [data.BitmapData(0, 0, 63, 63, 64, 64, 32, "\x01" * (2 * layer.Server._FASTPATH_FRAGMENT_SIZE_ - 22))]
+        server.sendBitmapUpdatePDU(rectangles)
+        packets = server._fastPathSender._packets
+        self.assertEqual([(ord(p[0]) >> 4) & 0x3 for p in packets], [data.FastPathFragmentation.FASTPATH_FRAGMENT_FIRST, data.FastPathFragmentation.FASTPATH_FRAGMENT_LAST], "invalid fragmentation")
+        updates = self.sendToClient(server)
+        self.assertEqual(updates[0][0].bitmapDataStream.value, rectangles[0].bitmapDataStream.value, "invalid reassembled update")
+        
+    def test_fast_path_max_request_size(self):
+        """
+        @summary: rectangles are splitted in many updates to respect client max request size
+        """
+        server = self.buildServer(50000)
+        rectangles = [data.BitmapData(0, 0, 63, 63, 64, 64, 32, chr(i) * 30000) for i in range(3)]
+        server.sendBitmapUpdatePDU(rectangles)
+        updates = self.sendToClient(server)
+        self.assertEqual([len(u) for u in updates], [1, 1, 1], "each update must respect max request size")
+
+    def test_fast_path_fragmentation_compressed(self):
+        """
+        @summary: each fragment is bulk compressed
+        """
+        server = self.buildServer(0x100000)
+        server.setCompression(data.CompressionType.PACKET_COMPR_TYPE_64K)
+        rectangles = [data.BitmapData(0, 0, 63, 63, 64, 64, 32, "rdpy" * 15000)]
+        server.sendBitmapUpdatePDU(rectangles)
+        updates = self.sendToClient(server)
+        self.assertEqual(updates[0][0].bitmapDataStream.value, rectangles[0].bitmapDataStream.value, "invalid compressed fragments")
+
+    def test_slow_path_packing(self):
+        """
+        @summary: small rectangles are packed in one slow path update
+                    update size is limited by negotiated MCS max PDU size
+        """
+        class Transport(object):
+            def getMaxPduSize(self):
+                return 0x4000
+        server = layer.Server(None)
+        server._transport = Transport()
+        server._clientFastPathSupported = False
+        sent = []
+        server.sendDataPDU = lambda pduData:sent.append(pduData)
+        server.sendBitmapUpdatePDU([data.BitmapData(0, 0, 15, 15, 16, 16, 16, "\x00" * 512) for _ in range(20)])
+        self.assertEqual(len(sent), 1, "small rectangles must be packed in one update")
+        self.assertEqual(len(sent[0].updateData.rectangles._array), 20, "invalid number of rectangles")
+
+        sent = []
+        server.sendBitmapUpdatePDU([data.BitmapData(0, 0, 63, 63, 64, 64, 16, "\x00" * 8192) for _ in range(4)])
+        self.assertEqual([len(u.updateData.rectangles._array) for u in sent], [1, 1, 1, 1], "update exceed slow path max size")
+        
+        Transport.getMaxPduSize = lambda self:0xfff8
+        sent = []
+        server.sendBitmapUpdatePDU([data.BitmapData(0, 0, 63, 63, 64, 64, 16, "\x00" * 8192) for _ in range(10)])
+        self.assertEqual([len(u.updateData.rectangles._array) for u in sent], [7, 3], "update must use negotiated max PDU size")
+        
+    def test_pack_bitmap_datas(self):
+        """
+        @summary: rectangles are split when update exceed max size, big rectangle is sent alone
+        """
+        server = layer.Server(None)
+        rectangles = [data.BitmapData(0, 0, 0, 0, 1, 1, 8, "\x00" * size) for size in [100, 100, 1000, 50, 50]]
+        #update header (4) + bitmap data header (18) + data
+        updates = server.packBitmapDatas(rectangles, 4 + 2 * 118)
+        self.assertEqual([[len(r.bitmapDataStream.value) for r in u] for u in updates], [[100, 100], [1000], [50, 50]], "invalid packing")
+
+    def test_fast_path_input(self):
+        """
+        @summary: client send input events in one fast path input PDU when server support it
+        """
+        client = layer.Client(None)
+        client._fastPathSender = PDUTest.FastPathSender()
+        sent = []
+        client._fastPathSender.sendFastPath = lambda secFlag, fastPathS:sent.append((secFlag, fastPathS))
+        client._serverCapabilities[caps.CapsType.CAPSTYPE_INPUT].capability.inputFlags.value = caps.InputFlags.INPUT_FLAG_FASTPATH_INPUT
+
+        key = data.ScancodeKeyEvent()
+        key.keyCode.value = 0x1e
+        key.keyboardFlags.value = data.KeyboardFlag.KBDFLAGS_RELEASE | data.KeyboardFlag.KBDFLAGS_EXTENDED
+        pointer = data.PointerEvent()
+        pointer.pointerFlags.value = data.PointerFlag.PTRFLAGS_MOVE
+        pointer.xPos.value = 10
+        pointer.yPos.value = 20
+        client.sendInputEvents([key, pointer])
+
+        self.assertEqual(len(sent), 1, "events must be sent in one PDU")
+        secFlag, fastPathS = sent[0]
+        self.assertEqual(secFlag >> 2, 2, "number of events must be in header")
+        s = type.Stream()
+        s.writeType(fastPathS)
+        self.assertEqual(s.getvalue(), "\x03\x1e\x20\x00\x08\x0a\x00\x14\x00", "invalid fast path input events")
+    
+    def test_fast_path_input_server(self):
+        """
+        @summary: server decode fast path input events sent by client
+        """
+        received = []
+        class ServerListener(object):
+            def onFastPathInput(self, fastPathInputEvents):
+                received.extend(fastPathInputEvents)
+        server = layer.Server(ServerListener())
+        
+        events = []
+        for i in range(20):
+            key = data.UnicodeKeyEvent()
+            key.unicode.value = ord('a') + i
+            events.append(data.createFastPathInputEvent(key))
+        
+        #less than 16 events in header
+        server.recvFastPath(2 << 2, type.Stream("\x03\x1e\x20\x00\x08\x0a\x00\x14\x00"))
+        self.assertEqual([e.getEventCode() for e in received], [data.FastPathInputEventCode.FASTPATH_INPUT_EVENT_SCANCODE, data.FastPathInputEventCode.FASTPATH_INPUT_EVENT_MOUSE], "invalid events code")
+        self.assertEqual(received[0].eventData.keyCode.value, 0x1e, "invalid scancode")
+        self.assertEqual(received[1].eventData.yPos.value, 20, "invalid pointer position")
+        
+        #number of events in first byte
+        received = []
+        s = type.Stream()
+        s.writeType((type.UInt8(len(events)), events))
+        server.recvFastPath(0, type.Stream(s.getvalue()))
+        self.assertEqual([e.eventData.unicode.value for e in received], [ord('a') + i for i in range(20)], "invalid unicode events")
+
+    def test_persistent_key_list(self):
+        """
+        @summary: persistent keys are sent by cell in PDUs of at most 169 entries
+                    keys of bitmaps that can't be loaded are not sent
+        """
+        class PersistentBitmapCache(object):
+            def getKeys(self, cacheId, bitsPerPixel, maxKeys):
+                return [(cacheId, i) for i in range(0, min(maxKeys, [10, 0, 200][cacheId]))]
+            def get(self, key1, key2):
+                if (key1, key2) == (0, 3):
+                    return None
+                return (key1, 16, 1, 1, "\x00\x00")
+
+        client = layer.Client(None)
+        client._persistentBitmapCache = PersistentBitmapCache()
+        sent = []
+        client.sendDataPDU = lambda pduData:sent.append(pduData)
+        client.sendPersistentKeyListPDU()
+        self.assertEqual(client._persistentKeys[0], [(0, i) for i in range(0, 10) if i != 3], "invalid keys of first cell")
+        self.assertEqual(len(client._persistentBitmaps[2]), 200, "bitmaps must be kept in memory")
+        self.assertEqual([(p.numEntriesCache0.value, p.numEntriesCache1.value, p.numEntriesCache2.value) for p in sent], [(9, 0, 160), (0, 0, 40)], "invalid number of entries")
+        self.assertEqual([(p.totalEntriesCache0.value, p.totalEntriesCache2.value) for p in sent], [(9, 200)] * 2, "invalid total number of entries")
+        self.assertEqual([p.bitMask.value for p in sent], [data.PersistentKeyListFlag.PERSIST_FIRST_PDU, data.PersistentKeyListFlag.PERSIST_LAST_PDU], "invalid first and last flags")
+        self.assertEqual((sent[1].entries._array[0].key1.value, sent[1].entries._array[0].key2.value), (2, 160), "invalid key")
+        
+        s = type.Stream()
+        s.writeType(sent[0])
+        pdu = data.PersistentListPDU()
+        type.Stream(s.getvalue()).readType(pdu)
+        self.assertEqual(len(pdu.entries._array), 169, "invalid entries read")
+        
+    def test_fast_path_pointer_update(self):
+        """
+        @summary: fast path pointer updates are notified to client listener
+        """
+        class ClientListener(object):
+            def __init__(self):
+                self._pointers = []
+            def onPointerUpdate(self, pointerUpdate):
+                self._pointers.append(pointerUpdate)
+        
+        pointer = data.NewPointerUpdate()
+        pointer.xorBpp.value = 32
+        pointer.colorPtrAttr.cacheIndex.value = 3
+        pointer.colorPtrAttr.width.value = 1
+        pointer.colorPtrAttr.height.value = 1
+        pointer.colorPtrAttr.xorMaskData.value = "\x01\x02\x03\x04"
+        pointer.colorPtrAttr.andMaskData.value = "\x00\x00"
+        
+        s = type.Stream()
+        s.writeType((data.FastPathUpdatePDU(data.FastPathPointerHiddenUpdate()), data.FastPathUpdatePDU(pointer)))
+        client = layer.Client(ClientListener())
+        client.recvFastPath(0, type.Stream(s.getvalue()))
+        
+        pointers = client._listener._pointers
+        self.assertEqual(pointers[0].systemPointerType.value, data.SystemPointerType.SYSPTR_NULL, "invalid hidden pointer")
+        self.assertEqual((pointers[1].xorBpp.value, pointers[1].colorPtrAttr.cacheIndex.value, pointers[1].colorPtrAttr.xorMaskData.value), (32, 3, "\x01\x02\x03\x04"), "invalid new pointer")
+        
+    def test_slow_path_pointer_update(self):
+        """
+        @summary: slow path pointer PDU is read in accordance with message type
+        """
+        position = data.PointerPositionUpdate()
+        position.xPos.value = 10
+        position.yPos.value = 20
+        s = type.Stream()
+        s.writeType(data.PointerDataPDU(position))
+        
+        pdu = data.createPDUData(data.PDUType2.PDUTYPE2_POINTER, type.CallableValue(len(s.getvalue())))
+        type.Stream(s.getvalue()).readType(pdu)
+        self.assertEqual(pdu.pointerData._MESSAGE_TYPE_, data.PointerMessageType.TS_PTRMSGTYPE_POSITION, "invalid pointer message type")
+        self.assertEqual((pdu.pointerData.xPos.value, pdu.pointerData.yPos.value), (10, 20), "invalid pointer position")
+        
+    def test_surface_commands(self):
+        """
+        @summary: surface commands of fast path update are notified to client listener
+        """
+        class ClientListener(object):
+            def __init__(self):
+                self._commands = []
+            def onSurfaceCommand(self, surfaceCommand):
+                self._commands.append(surfaceCommand)
+        
+        commands = type.Stream()
+        commands.writeType((data.SurfaceCommand(data.FrameMarkerCommand(data.FrameAction.SURFACECMD_FRAMEACTION_BEGIN, 7)),
+                            data.SurfaceCommand(data.SurfaceBitsCommand(10, 20, 12, 21, data.BitmapDataEx(32, 3, 2, 1, "rfx")), data.SurfaceCommandType.CMDTYPE_STREAM_SURFACE_BITS),
+                            data.SurfaceCommand(data.FrameMarkerCommand(data.FrameAction.SURFACECMD_FRAMEACTION_END, 7))))
+        s = type.Stream()
+        s.writeType(data.FastPathUpdatePDU(data.FastPathSurfaceCommandsUpdate(commands.getvalue())))
+        client = layer.Client(ClientListener())
+        client.recvFastPath(0, type.Stream(s.getvalue()))
+        
+        received = client._listener._commands
+        self.assertEqual([c.cmdType.value for c in received], [data.SurfaceCommandType.CMDTYPE_FRAME_MARKER, data.SurfaceCommandType.CMDTYPE_STREAM_SURFACE_BITS, data.SurfaceCommandType.CMDTYPE_FRAME_MARKER], "invalid surface commands")
+        self.assertEqual((received[0].command.frameId.value, received[2].command.frameAction.value), (7, data.FrameAction.SURFACECMD_FRAMEACTION_END), "invalid frame marker")
+        bits = received[1].command
+        self.assertEqual((bits.destLeft.value, bits.destBottom.value, bits.bitmapData.codecID.value, bits.bitmapData.width.value, bits.bitmapData.bitmapData.value), (10, 21, 3, 2, "rfx"), "invalid surface bits")
+        
+    def test_bitmap_codecs_capability(self):
+        """
+        @summary: bitmap codecs are advertised with surface commands and read back
+        """
+        client = layer.Client(None)
+        client.addBitmapCodec(caps.CodecGUID.CODEC_GUID_REMOTEFX, 3, "properties")
+        self.assertTrue(client._clientCapabilities[caps.CapsType.CAPSETTYPE_SURFACE_COMMANDS].capability.cmdFlags.value & caps.SurfaceCommandsFlag.SURFCMDS_SETSURFACEBITS, "surface commands must be advertised")
+        
+        s = type.Stream()
+        s.writeType(client._clientCapabilities[caps.CapsType.CAPSETTYPE_BITMAP_CODECS])
+        capability = caps.Capability()
+        type.Stream(s.getvalue()).readType(capability)
+        codec = capability.capability.bitmapCodecArray[0]
+        self.assertEqual((codec.codecGUID.value, codec.codecID.value, codec.codecProperties.value), (caps.CodecGUID.CODEC_GUID_REMOTEFX, 3, "properties"), "invalid bitmap codec")
+        self.assertEqual(capability.capability.getCodecID(caps.CodecGUID.CODEC_GUID_REMOTEFX), 3, "invalid codec id")
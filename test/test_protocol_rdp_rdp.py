@@ -0,0 +1,491 @@
+#
+# Copyright (c) 2014 Sylvain Peyrefitte
+#
+# This file is part of rdpy.
+#
+# rdpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+unit test for rdpy.protocol.rdp.rdp module
+"""
+
+import os, sys
+# Change path so we find rdpy
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+
+import unittest
+import rdpy.protocol.rdp.rdp as rdp
+import rdpy.protocol.rdp.pdu.data as data
+
+class RDPTest(unittest.TestCase):
+    """
+    @summary: test case for RDP controllers
+    """
+    
+    def buildClient(self):
+        """
+        @summary: build a ready client controller which keep each input PDU
+        """
+        controller = rdp.RDPClientController()
+        controller._isReady = True
+        controller._sent = []
+        controller._pduLayer.sendInputEvents = lambda events:controller._sent.append(events)
+        return controller
+    
+    def test_input_coalescing(self):
+        """
+        @summary: consecutive pointer moves are merged, other events keep their order
+        """
+        controller = self.buildClient()
+        controller.setInputBatching()
+        for i in range(10):
+            controller.sendPointerEvent(i, i, 0, False)
+        controller.sendPointerEvent(10, 10, 1, True)
+        controller.sendKeyEventScancode(0x1e, True)
+        for i in range(10):
+            controller.sendPointerEvent(20 + i, 20, 0, False)
+        controller.sendPointerEvent(30, 20, 1, False)
+        self.assertEqual(controller._sent, [], "events must be pending")
+        
+        controller.flushInputs()
+        self.assertEqual(len(controller._sent), 1, "pending events must be sent in one PDU")
+        events = controller._sent[0]
+        self.assertEqual([e.__class__ for e in events], [data.PointerEvent, data.PointerEvent, data.ScancodeKeyEvent, data.PointerEvent, data.PointerEvent], "invalid events order")
+        self.assertEqual([(e.xPos.value, e.yPos.value) for e in events if isinstance(e, data.PointerEvent)], [(9, 9), (10, 10), (29, 20), (30, 20)], "last pointer move must be kept")
+        
+    def test_input_batching_disabled(self):
+        """
+        @summary: batching is disabled by default, each event is sent immediately
+        """
+        controller = self.buildClient()
+        controller.sendPointerEvent(1, 1, 0, False)
+        controller.sendPointerEvent(2, 2, 0, False)
+        self.assertEqual(len(controller._sent), 2, "events must be sent immediately")
+        
+    def test_primary_order_rendering(self):
+        """
+        @summary: drawing orders are rendered in frame buffer and notified as raw bitmap
+        """
+        import struct
+        import rdpy.core.framebuffer as framebuffer
+        import rdpy.core.type as type
+        
+        updates = []
+        class Observer(object):
+            def onUpdate(self, destLeft, destTop, destRight, destBottom, width, height, bitsPerPixel, isCompress, data):
+                updates.append((destLeft, destTop, destRight, destBottom, width, height, bitsPerPixel, isCompress, data))
+                
+        controller = self.buildClient()
+        controller._frameBuffer = framebuffer.FrameBuffer(8, 2, 8)
+        controller.addClientObserver(Observer())
+        #OpaqueRect then ScrBlt
+        s = "\x09\x0a\x7f" + struct.pack("<hhhh", 0, 0, 2, 2) + "\x05\x00\x00"
+        s += "\x09\x02\x7f" + struct.pack("<hhhhBhh", 4, 0, 3, 2, 0xcc, 1, 0)
+        controller._pduLayer.readOrders(2, s)
+        self.assertEqual(updates[0], (0, 0, 1, 1, 4, 2, 8, False, "\x05\x05\x00\x00" * 2), "invalid opaque rect update")
+        self.assertEqual(updates[1], (4, 0, 6, 1, 4, 2, 8, False, "\x05\x00\x00\x00" * 2), "invalid screen blt update")
+        
+    def test_decode_pool_update_order(self):
+        """
+        @summary: bitmaps decoded in threads are drawn and notified before next drawing order
+        """
+        import struct
+        import rdpy.core.framebuffer as framebuffer
+        
+        controller = self.buildClient()
+        controller._frameBuffer = framebuffer.FrameBuffer(8, 2, 8)
+        updates = []
+        class Observer(object):
+            def onUpdate(self, destLeft, destTop, destRight, destBottom, width, height, bitsPerPixel, isCompress, data):
+                #decoded pixels are shared by frame buffer
+                updates.append((destLeft, controller.getFrameBuffer().readRect(0, 0, 4, 1)))
+        controller.addClientObserver(Observer())
+        pool = framebuffer.DecodePool(2)
+        controller.setDecodePool(pool)
+        try:
+            controller.onUpdate([data.BitmapData(0, 0, 3, 0, 4, 1, 8, "abcd")])
+            self.assertEqual(updates, [], "bitmap must be decoded in decoding threads")
+            #OpaqueRect
+            controller._pduLayer.readOrders(1, "\x09\x0a\x7f" + struct.pack("<hhhh", 4, 0, 2, 2) + "\x05\x00\x00")
+            self.assertEqual(updates, [(0, "abcd"), (4, "abcd")], "bitmap must be drawn before order")
+        finally:
+            pool.close()
+        
+    def test_surface_bits_rendering(self):
+        """
+        @summary: RemoteFX surface bits are rendered in region rects and notified as raw bitmap
+        """
+        import struct
+        import rdpy.core.framebuffer as framebuffer
+        import rdpy.protocol.rdp.rfx as rfx
+        
+        updates = []
+        class Observer(object):
+            def onUpdate(self, destLeft, destTop, destRight, destBottom, width, height, bitsPerPixel, isCompress, data):
+                updates.append((destLeft, destTop, destRight, destBottom, width, height, bitsPerPixel, isCompress, data))
+        
+        controller = self.buildClient()
+        controller._frameBuffer = framebuffer.FrameBuffer(80, 8, 32)
+        controller.addClientObserver(Observer())
+        #region of 2x2 pixels, one empty tile
+        tile = struct.pack("<HIBBBHHHHH", rfx.BlockType.CBT_TILE, 19, 0, 0, 0, 0, 0, 0, 0, 0)
+        tileSet = struct.pack("<BBHHHBBHI", 1, 0, rfx.BlockType.CBT_TILESET, 0, rfx.Entropy.CLW_ENTROPY_RLGR1 << 10, 1, 64, 1, len(tile)) + "\x66" * 5 + tile
+        region = struct.pack("<BBBHHHHHHH", 1, 0, 1, 1, 1, 1, 2, 2, rfx.BlockType.CBT_REGION, 1)
+        message = struct.pack("<HI", rfx.BlockType.WBT_REGION, 6 + len(region)) + region + struct.pack("<HI", rfx.BlockType.WBT_EXTENSION, 6 + len(tileSet)) + tileSet
+        controller.onSurfaceCommand(data.SurfaceCommand(data.SurfaceBitsCommand(70, 2, 80, 8, data.BitmapDataEx(32, rfx.CODEC_ID_REMOTEFX, 10, 6, message))))
+        
+        self.assertEqual(controller._frameBuffer.readRect(70, 2, 4, 1), "\x00" * 16, "pixels outside region must not be drawn")
+        self.assertEqual(controller._frameBuffer.readRect(71, 3, 3, 1), "\x80\x80\x80\xff" * 2 + "\x00" * 4, "invalid region pixels")
+        self.assertEqual(updates[0][:4], (71, 3, 72, 4), "invalid update area")
+        
+        #raw surface bits are top-down
+        controller.onSurfaceCommand(data.SurfaceCommand(data.SurfaceBitsCommand(0, 0, 1, 2, data.BitmapDataEx(32, 0, 1, 2, "\x01\x02\x03\x04\x05\x06\x07\x08"))))
+        self.assertEqual(controller._frameBuffer.readRect(0, 0, 1, 2), "\x01\x02\x03\x04\x05\x06\x07\x08", "invalid raw surface bits")
+        
+        #NSCodec surface bits
+        import rdpy.protocol.rdp.nsc as nsc
+        controller.onSurfaceCommand(data.SurfaceCommand(data.SurfaceBitsCommand(2, 0, 4, 1, data.BitmapDataEx(32, nsc.CODEC_ID_NSCODEC, 2, 1, nsc.encode(2, 1, "\x40\x40\x40\xff" * 2)))))
+        self.assertEqual(controller._frameBuffer.readRect(2, 0, 2, 1), "\x40\x40\x40\xff" * 2, "invalid NSCodec surface bits")
+        
+    def test_mem_blt_rendering(self):
+        """
+        @summary: cache bitmap order fill bitmap cache used by MemBlt
+        """
+        import struct
+        import rdpy.core.framebuffer as framebuffer
+        import rdpy.protocol.rdp.cache as cache
+        import rdpy.protocol.rdp.pdu.order as order
+        
+        updates = []
+        class Observer(object):
+            def onUpdate(self, destLeft, destTop, destRight, destBottom, width, height, bitsPerPixel, isCompress, data):
+                updates.append((destLeft, destTop, destRight, destBottom, width, height, bitsPerPixel, isCompress, data))
+                
+        controller = self.buildClient()
+        controller._frameBuffer = framebuffer.FrameBuffer(8, 2, 8)
+        controller._bitmapCache = cache.BitmapCache([10, 10])
+        controller.addClientObserver(Observer())
+        #2x2 raw bottom-up bitmap in cell 1 index 3
+        extraFlags = 1 | (order.BitsPerPixelId.CBR2_8BPP << 3) | (order.CacheBitmapFlag.CBR2_HEIGHT_SAME_AS_WIDTH << 7)
+        body = "\x02\x04\x03" + "\x03\x04\x01\x02"
+        s = "\x03" + struct.pack("<hHB", len(body) - 7, extraFlags, order.SecondaryOrderType.TS_CACHE_BITMAP_UNCOMPRESSED_REV2) + body
+        #MemBlt all fields
+        s += "\x09\x0d\xff\x01" + struct.pack("<HhhhhBhhH", 1, 4, 0, 2, 2, 0xcc, 0, 0, 3)
+        controller._pduLayer.readOrders(2, s)
+        self.assertEqual(controller._bitmapCache.get(1, 3), (2, 2, "\x01\x02\x03\x04"), "bitmap must be cached top-down")
+        self.assertEqual(updates, [(4, 0, 5, 1, 4, 2, 8, False, "\x03\x04\x00\x00\x01\x02\x00\x00")], "invalid mem blt update")
+        
+    def test_persistent_bitmaps_pinned(self):
+        """
+        @summary: bitmaps of sent keys are loaded even if shared cache evict them meanwhile
+        """
+        import os, shutil, tempfile
+        import rdpy.protocol.rdp.cache as cache
+        import rdpy.protocol.rdp.pdu.caps as caps
+        
+        directory = tempfile.mkdtemp()
+        try:
+            persistentCache = cache.PersistentBitmapCache(os.path.join(directory, "bitmap.cache"), 1)
+            persistentCache.put(1, 2, 0, 8, 1, 1, "a")
+            controller = self.buildClient()
+            controller.setPersistentBitmapCache(persistentCache)
+            controller._pduLayer._serverCapabilities[caps.CapsType.CAPSTYPE_BITMAP].capability.preferredBitsPerPixel.value = 8
+            controller._pduLayer.sendDataPDU = lambda pduData:None
+            controller._pduLayer.sendPersistentKeyListPDU()
+            
+            #another connection evict sent key
+            persistentCache.put(3, 4, 0, 8, 1, 1, "b")
+            controller._bitmapCache = cache.BitmapCache(controller._pduLayer._clientCapabilities[caps.CapsType.CAPSTYPE_BITMAPCACHE_REV2].capability.getCellEntries())
+            controller.loadPersistentBitmaps()
+            self.assertEqual(controller._bitmapCache.get(0, 0), (1, 1, "a"), "bitmap of sent key must be loaded")
+            persistentCache.close()
+        finally:
+            shutil.rmtree(directory)
+        
+    def test_glyph_rendering(self):
+        """
+        @summary: glyphs of glyph cache are rendered with fragments
+        """
+        import struct
+        import rdpy.core.framebuffer as framebuffer
+        import rdpy.protocol.rdp.cache as cache
+        import rdpy.protocol.rdp.pdu.order as order
+        
+        updates = []
+        class Observer(object):
+            def onUpdate(self, destLeft, destTop, destRight, destBottom, width, height, bitsPerPixel, isCompress, data):
+                updates.append((destLeft, destTop, destRight, destBottom))
+                
+        controller = self.buildClient()
+        controller._frameBuffer = framebuffer.FrameBuffer(16, 4, 8)
+        controller._glyphCache = cache.GlyphCache([10], 256)
+        controller.addClientObserver(Observer())
+        #2x2 glyph at index 5 of cell 0
+        body = "\x00\x01" + struct.pack("<HhhHH", 5, 0, 0, 2, 2) + "\xc0\x40\x00\x00"
+        s = "\x03" + struct.pack("<hHB", len(body) - 7, 0, order.SecondaryOrderType.TS_CACHE_GLYPH) + body
+        #glyph 5 twice, add them as fragment 0 then use fragment 0
+        glyphs = "\x05\x00\x05\x04" + "\xff\x00\x04" + "\xfe\x00"
+        fieldFlags = sum([1 << i for i in [0, 1, 2, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 19, 20, 21]])
+        s += "\x09\x1b" + struct.pack("<I", fieldFlags)[:3] + struct.pack("<BBB", 0, order.TextAccelFlag.SO_HORIZONTAL, 0) + "\x07\x00\x00" + "\x01\x00\x00"
+        s += struct.pack("<hhhhhhhhhhB", 0, 0, 16, 4, 0, 0, 8, 2, 1, 1, len(glyphs)) + glyphs
+        controller._pduLayer.readOrders(2, s)
+        
+        self.assertEqual(updates, [(0, 0, 10, 2)], "invalid glyph index update")
+        self.assertEqual(controller._frameBuffer.readRect(0, 0, 11, 3), "\x01" * 8 + "\x00" * 3 + "\x01\x07\x07\x01\x01\x07\x07\x01\x00\x07\x07" + "\x00\x00\x07\x00\x00\x00\x07\x00\x00\x00\x07", "invalid glyphs rendering")
+        
+    def test_glyph_fragment_delta(self):
+        """
+        @summary: fragment use of variable pitch text is followed by a delta
+        """
+        import struct
+        import rdpy.core.framebuffer as framebuffer
+        import rdpy.protocol.rdp.cache as cache
+        import rdpy.protocol.rdp.pdu.order as order
+        
+        controller = self.buildClient()
+        controller._frameBuffer = framebuffer.FrameBuffer(16, 4, 8)
+        controller._glyphCache = cache.GlyphCache([10], 256)
+        #2x2 glyph at index 5 of cell 0
+        body = "\x00\x01" + struct.pack("<HhhHH", 5, 0, 0, 2, 2) + "\xc0\x40\x00\x00"
+        s = "\x03" + struct.pack("<hHB", len(body) - 7, 0, order.SecondaryOrderType.TS_CACHE_GLYPH) + body
+        #glyph 5 added as fragment 0, fragment 0 used with delta 6, then glyph 5 with delta 3
+        glyphs = "\x05\x00" + "\xff\x00\x02" + "\xfe\x00\x06" + "\x05\x03"
+        fieldFlags = sum([1 << i for i in [0, 1, 2, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 19, 20, 21]])
+        s += "\x09\x1b" + struct.pack("<I", fieldFlags)[:3] + struct.pack("<BBB", 0, order.TextAccelFlag.SO_HORIZONTAL, 0) + "\x07\x00\x00" + "\x01\x00\x00"
+        s += struct.pack("<hhhhhhhhhhB", 0, 0, 16, 4, 0, 0, 8, 2, 1, 1, len(glyphs)) + glyphs
+        controller._pduLayer.readOrders(2, s)
+        
+        self.assertEqual(controller._frameBuffer.readRect(0, 1, 16, 1), "\x01\x07\x07\x01\x01\x01\x01\x01" + "\x00\x00\x07\x07\x00\x00\x00\x00", "glyph after fragment must be moved by delta")
+        
+    def test_pointer_update(self):
+        """
+        @summary: color pointer is cached and notified to observers
+        """
+        import rdpy.protocol.rdp.cache as cache
+        import rdpy.protocol.rdp.pdu.data as data
+        from rdpy.protocol.rdp.rdp import PointerType
+        
+        pointers = []
+        class Observer(object):
+            def onPointerUpdate(self, pointerType, hotSpotX, hotSpotY, width, height, data):
+                pointers.append((pointerType, hotSpotX, hotSpotY, width, height, data))
+            def onPointerPosition(self, x, y):
+                pointers.append((x, y))
+                
+        controller = self.buildClient()
+        controller._pointerCache = cache.PointerCache(2)
+        controller.addClientObserver(Observer())
+        
+        pointer = data.ColorPointerUpdate()
+        pointer.cacheIndex.value = 1
+        pointer.hotSpotX.value = 1
+        pointer.width.value = 1
+        pointer.height.value = 1
+        pointer.xorMaskData.value = "\x01\x02\x03\x00"
+        pointer.andMaskData.value = "\x00\x00"
+        cached = data.CachedPointerUpdate()
+        cached.cacheIndex.value = 1
+        position = data.PointerPositionUpdate()
+        position.xPos.value = 4
+        
+        for pointerUpdate in [pointer, data.SystemPointerUpdate(data.SystemPointerType.SYSPTR_NULL), cached, position]:
+            controller.onPointerUpdate(pointerUpdate)
+        self.assertEqual(pointers, [(PointerType.POINTER_SHAPE, 1, 0, 1, 1, "\x01\x02\x03\xff"), (PointerType.POINTER_HIDDEN, 0, 0, 0, 0, ""), (PointerType.POINTER_SHAPE, 1, 0, 1, 1, "\x01\x02\x03\xff"), (4, 0)], "invalid pointer notifications")
+        
+    def test_frame_buffer_opt_in(self):
+        """
+        @summary: frame buffer is only kept if drawing orders or headless output are asked
+        """
+        import rdpy.protocol.rdp.pdu.caps as caps
+        
+        controller = self.buildClient()
+        bitmapCapability = controller._pduLayer._serverCapabilities[caps.CapsType.CAPSTYPE_BITMAP].capability
+        bitmapCapability.desktopWidth.value = 64
+        bitmapCapability.desktopHeight.value = 32
+        controller.onReady()
+        self.assertIsNone(controller.getFrameBuffer(), "observers decode bitmap updates")
+        self.assertFalse(controller._pduLayer._drawingOrders, "drawing orders must not be advertised")
+        
+        controller = self.buildClient()
+        controller._pduLayer._serverCapabilities[caps.CapsType.CAPSTYPE_BITMAP].capability = bitmapCapability
+        controller.setDrawingOrders()
+        controller.onReady()
+        self.assertIsNotNone(controller.getFrameBuffer(), "drawing orders are rendered in frame buffer")
+        self.assertTrue(controller._pduLayer._drawingOrders, "drawing orders must be advertised")
+        
+    def test_suppress_output(self):
+        """
+        @summary: suppress output is sent once, resume refresh area invalidated while suppressed
+        """
+        import rdpy.protocol.rdp.pdu.caps as caps
+        
+        controller = self.buildClient()
+        sent = []
+        controller._pduLayer.sendDataPDU = lambda pduData:sent.append(pduData)
+        generalCapability = controller._pduLayer._serverCapabilities[caps.CapsType.CAPSTYPE_GENERAL].capability
+        generalCapability.refreshRectSupport.value = 1
+        generalCapability.suppressOutputSupport.value = 1
+        bitmapCapability = controller._pduLayer._serverCapabilities[caps.CapsType.CAPSTYPE_BITMAP].capability
+        bitmapCapability.desktopWidth.value = 800
+        bitmapCapability.desktopHeight.value = 600
+        
+        controller.suppressOutput()
+        controller.suppressOutput()
+        self.assertTrue(controller.isOutputSuppressed(), "output must be suppressed")
+        self.assertEqual([(p.__class__, p.allowDisplayUpdates.value) for p in sent], [(data.SupressOutputDataPDU, data.Display.SUPPRESS_DISPLAY_UPDATES)], "suppress output must be sent once")
+        
+        controller.sendRefreshOrder(10, 10, 19, 19)
+        controller.sendRefreshOrder(30, 5, 39, 14)
+        self.assertEqual(len(sent), 1, "refresh must wait resume")
+        controller.resumeOutput()
+        self.assertEqual(sent[1].allowDisplayUpdates.value, data.Display.ALLOW_DISPLAY_UPDATES, "display updates must be allowed")
+        self.assertEqual((sent[1].desktopRect.right.value, sent[1].desktopRect.bottom.value), (799, 599), "invalid desktop rect")
+        rects = sent[2].areasToRefresh._array
+        self.assertEqual([(r.left.value, r.top.value, r.right.value, r.bottom.value) for r in rects], [(10, 5, 39, 19)], "refresh must be limited to invalidated area")
+        
+        controller.suppressOutput()
+        controller.resumeOutput((700, 500, 200, 200))
+        rects = sent[-1].areasToRefresh._array
+        self.assertEqual([(r.left.value, r.top.value, r.right.value, r.bottom.value) for r in rects], [(700, 500, 799, 599)], "refresh area must be clipped to desktop")
+        
+        generalCapability.suppressOutputSupport.value = 0
+        controller.suppressOutput()
+        controller.resumeOutput()
+        self.assertFalse(controller.isOutputSuppressed(), "suppress output is not supported by server")
+        self.assertEqual(len(sent), 6, "suppress output is not supported by server")
+        
+    def test_auto_detect(self):
+        """
+        @summary: previous measure configure connection, new measure adapt input batching
+        """
+        import rdpy.protocol.rdp.sec as sec
+        import rdpy.protocol.rdp.t125.gcc as gcc
+        
+        controller = self.buildClient()
+        controller.setInputBatching()
+        controller.setAutoDetect(100, 400)
+        coreSettings = controller._mcsLayer._clientSettings.getBlock(gcc.MessageType.CS_CORE)
+        self.assertEqual(coreSettings.connectionType.value, gcc.ConnectionType.CONNECTION_TYPE_AUTODETECT, "server must measure network")
+        self.assertTrue(coreSettings.earlyCapabilityFlags.value & gcc.CapabilityFlags.RNS_UD_CS_SUPPORT_NETCHAR_AUTODETECT, "auto-detect must be advertised")
+        self.assertIsNotNone(controller._mcsLayer._clientSettings.getBlock(gcc.MessageType.CS_MCS_MSGCHANNEL), "message channel must be requested")
+        self.assertEqual(coreSettings.highColorDepth.value, gcc.HighColor.HIGH_COLOR_16BPP, "color depth must be lowered on modem")
+        self.assertTrue(controller._secLayer._info.extendedInfo.performanceFlags.value & sec.PerfFlag.PERF_DISABLE_WALLPAPER, "wallpaper must be disabled on modem")
+        self.assertEqual(controller._secLayer._info.flag.value & sec.InfoFlag.INFO_CompressionTypeMask, data.CompressionType.PACKET_COMPR_TYPE_RDP61 << 9, "invalid compression type")
+        self.assertEqual(controller._inputBatchDelay, 1.0 / 10, "invalid input batching")
+        
+        controller.onNetworkCharacteristics(100000, 1)
+        self.assertEqual(controller.getNetworkCharacteristics(), (100000, 1), "measure must be kept for next connection")
+        self.assertEqual(controller._inputBatchDelay, 1.0 / 60, "input batching must follow link")
+        
+    def test_compression(self):
+        """
+        @summary: any compression type can be advertised, compressed payloads can be recorded
+        """
+        import bulk
+        import rdpy.protocol.rdp.sec as sec
+        
+        controller = self.buildClient()
+        controller.setCompression(data.CompressionType.PACKET_COMPR_TYPE_RDP61)
+        self.assertTrue(controller._secLayer._info.flag.value & sec.InfoFlag.INFO_COMPRESSION, "compression must be asked")
+        self.assertEqual(controller._secLayer._info.flag.value & sec.InfoFlag.INFO_CompressionTypeMask, data.CompressionType.PACKET_COMPR_TYPE_RDP61 << 9, "invalid compression type")
+        controller.setCompression(data.CompressionType.PACKET_COMPR_TYPE_8K)
+        self.assertEqual(controller._secLayer._info.flag.value & sec.InfoFlag.INFO_CompressionTypeMask, data.CompressionType.PACKET_COMPR_TYPE_8K << 9, "compression type must be replaced")
+        
+        recorded = []
+        class Recorder(object):
+            def bulk(self, compressionFlags, data):
+                recorded.append((compressionFlags, data))
+        controller.setBulkRecorder(Recorder())
+        payload, flags = bulk.Compressor(data.CompressionType.PACKET_COMPR_TYPE_8K).compress("abcabcabc")
+        self.assertEqual(controller._pduLayer.decompress(flags, payload).getvalue(), "abcabcabc", "invalid decompressed payload")
+        self.assertEqual(recorded, [(flags, payload)], "compressed payload must be recorded")
+        
+    def buildServer(self):
+        """
+        @summary: build a ready server controller which keep each bitmap update PDU
+        """
+        controller = rdp.RDPServerController(16)
+        controller._isReady = True
+        controller._sent = []
+        controller._pduLayer.sendBitmapUpdatePDU = lambda bitmapDatas:controller._sent.append([b.bitmapDataStream.value for b in bitmapDatas])
+        return controller
+    
+    def test_update_batching(self):
+        """
+        @summary: updates are accumulated until flush, timer is cancelled by flush
+        """
+        controller = self.buildServer()
+        controller.setUpdateBatching(0.5, 0x10000)
+        controller.sendUpdate(0, 0, 0, 0, 1, 1, 16, False, "a")
+        controller.sendUpdate(0, 0, 0, 0, 1, 1, 16, False, "b")
+        self.assertEqual(controller._sent, [], "updates must be pending")
+        flushCall = controller._flushUpdatesCall
+        self.assertTrue(flushCall.active(), "flush must be scheduled")
+        
+        controller.flushUpdates()
+        self.assertEqual(controller._sent, [["a", "b"]], "pending updates must be sent in one PDU")
+        self.assertFalse(flushCall.active(), "scheduled flush must be cancelled")
+        self.assertIsNone(controller._flushUpdatesCall, "no flush must be scheduled")
+        controller.flushUpdates()
+        self.assertEqual(len(controller._sent), 1, "nothing to flush")
+        
+    def test_update_batching_size(self):
+        """
+        @summary: pending updates are sent as soon as they reach batch size
+        """
+        controller = self.buildServer()
+        controller.setUpdateBatching(0.5, 4)
+        controller.sendUpdate(0, 0, 0, 0, 1, 1, 16, False, "ab")
+        self.assertEqual(controller._sent, [], "update must be pending")
+        controller.sendUpdate(0, 0, 0, 0, 1, 1, 16, False, "cd")
+        self.assertEqual(controller._sent, [["ab", "cd"]], "updates must be flushed on size")
+        self.assertIsNone(controller._flushUpdatesCall, "scheduled flush must be cancelled")
+        
+    def test_update_batching_disabled(self):
+        """
+        @summary: batching is disabled by default, sendUpdates keep order with pending updates
+        """
+        controller = self.buildServer()
+        controller.sendUpdate(0, 0, 0, 0, 1, 1, 16, False, "a")
+        controller.sendUpdate(0, 0, 0, 0, 1, 1, 16, False, "b")
+        self.assertEqual(controller._sent, [["a"], ["b"]], "updates must be sent at once")
+        
+        controller = self.buildServer()
+        controller.setUpdateBatching(0.5)
+        controller.sendUpdate(0, 0, 0, 0, 1, 1, 16, False, "a")
+        controller.sendUpdates([(0, 0, 0, 0, 1, 1, 16, False, "b"), (0, 0, 0, 0, 1, 1, 16, True, "c")])
+        self.assertEqual(controller._sent, [["a", "b", "c"]], "sendUpdates must flush pending updates in order")
+        
+        controller.setUpdateBatching(0.5)
+        controller.sendUpdate(0, 0, 0, 0, 1, 1, 16, False, "d")
+        controller.setUpdateBatching(None)
+        self.assertEqual(controller._sent[-1], ["d"], "pending updates must be sent when batching change")
+        
+    def test_keyboard_synchronize(self):
+        """
+        @summary: slow path and fast path synchronize events are dispatched to observers
+        """
+        received = []
+        class Observer(rdp.RDPServerObserver):
+            def onKeyboardSynchronize(self, toggleFlags):
+                received.append(toggleFlags)
+                
+        controller = self.buildServer()
+        Observer(controller)
+        event = data.SynchronizeEvent()
+        event.toggleFlags.value = data.ToogleFlag.TS_SYNC_NUM_LOCK | data.ToogleFlag.TS_SYNC_CAPS_LOCK
+        controller.onSlowPathInput([data.SlowPathInputEvent(event)])
+        controller.onFastPathInput([data.createFastPathInputEvent(event)])
+        self.assertEqual(received, [data.ToogleFlag.TS_SYNC_NUM_LOCK | data.ToogleFlag.TS_SYNC_CAPS_LOCK] * 2, "invalid toggle flags")
@@ -0,0 +1,221 @@
+#
+# Copyright (c) 2014-2015 Sylvain Peyrefitte
+#
+# This file is part of rdpy.
+#
+# rdpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+unit test for rdpy.protocol.rdp.rdpgfx module and ClearCodec decoder
+"""
+
+import os, sys
+# Change path so we find rdpy
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+
+import unittest
+import struct
+import rle
+import rdpy.protocol.rdp.rdpgfx as rdpgfx
+from rdpy.protocol.rdp.rdpgfx import CmdId, CodecId
+
+RED = "\x00\x00\xff\xff"
+GREEN = "\x00\xff\x00\xff"
+BLUE = "\xff\x00\x00\xff"
+
+def clearCodec(residual = "", bands = "", subcodecs = "", flags = 0, glyphIndex = None):
+    """
+    @summary: build ClearCodec bitmap stream
+    """
+    header = struct.pack("<BB", flags, 0)
+    if not glyphIndex is None:
+        header += struct.pack("<H", glyphIndex)
+    return header + struct.pack("<III", len(residual), len(bands), len(subcodecs)) + residual + bands + subcodecs
+
+def pdu(cmdId, body):
+    """
+    @summary: build RDPGFX PDU
+    """
+    return struct.pack("<HHI", cmdId, 0, 8 + len(body)) + body
+
+def segmented(*pdus):
+    """
+    @summary: uncompressed RDP 8.0 single segment
+    """
+    return "\xe0\x04" + "".join(pdus)
+
+class ClearCodecTest(unittest.TestCase):
+    """
+    @summary: test case for ClearCodec decoder of rle extension
+    """
+    def test_residual(self):
+        """
+        @summary: runs of BGR pixels cover whole bitmap
+        """
+        decoder = rle.ClearDecoder()
+        pixels = decoder.decompress(2, 2, clearCodec(residual = "\x00\x00\xff\x03\x00\xff\x00\x01"), "\x00" * 16)
+        self.assertEqual(pixels, RED * 3 + GREEN, "invalid residual layer")
+        self.assertRaises(ValueError, decoder.decompress, 2, 2, clearCodec(residual = "\x00\x00\xff\x03"), "\x00" * 16)
+
+    def test_bands(self):
+        """
+        @summary: short vertical bar in background, second column is vertical bar cache hit
+        """
+        decoder = rle.ClearDecoder()
+        band = struct.pack("<HHHH", 0, 1, 0, 1) + "\xff\x00\x00" + struct.pack("<H", 0x0100) + "\x00\x00\xff" + struct.pack("<H", 0x8000)
+        pixels = decoder.decompress(2, 2, clearCodec(bands = band), GREEN * 4)
+        self.assertEqual(pixels, RED * 2 + BLUE * 2, "invalid bands layer")
+
+    def test_subcodec_rlex(self):
+        """
+        @summary: run of first palette color followed by suite of indexes
+        """
+        decoder = rle.ClearDecoder()
+        rlex = "\x02" + "\x00\x00\xff" + "\x00\xff\x00" + "\x03\x02"
+        subcodec = struct.pack("<HHHHIB", 0, 0, 4, 1, len(rlex), 2) + rlex
+        pixels = decoder.decompress(4, 1, clearCodec(subcodecs = subcodec), "\x00" * 16)
+        self.assertEqual(pixels, RED * 3 + GREEN, "invalid RLEX subcodec")
+
+    def test_subcodec_draw_over_destination(self):
+        """
+        @summary: raw subcodec only modify its rectangle
+        """
+        decoder = rle.ClearDecoder()
+        subcodec = struct.pack("<HHHHIB", 1, 0, 1, 1, 3, 0) + "\x00\x00\xff"
+        pixels = decoder.decompress(2, 1, clearCodec(subcodecs = subcodec), BLUE * 2)
+        self.assertEqual(pixels, BLUE + RED, "invalid uncompressed subcodec")
+
+    def test_glyph_cache(self):
+        """
+        @summary: bitmap stored with glyph index is reused on glyph hit
+        """
+        decoder = rle.ClearDecoder()
+        pixels = decoder.decompress(2, 1, clearCodec(residual = "\x00\xff\x00\x02", flags = 1, glyphIndex = 5), "\x00" * 8)
+        self.assertEqual(decoder.decompress(2, 1, struct.pack("<BBH", 3, 1, 5), "\x00" * 8), pixels, "invalid glyph hit")
+        self.assertRaises(ValueError, decoder.decompress, 2, 1, struct.pack("<BBH", 3, 1, 6), "\x00" * 8)
+
+class Channel(object):
+    """
+    @summary: keep PDU sent by client
+    """
+    def __init__(self):
+        self.sent = []
+    def send(self, data):
+        self.sent.append(data)
+
+class Listener(rdpgfx.GraphicsListener):
+    """
+    @summary: keep output of graphics pipeline
+    """
+    def __init__(self):
+        self.reset = None
+        self.updates = []
+    def onResetGraphics(self, width, height):
+        self.reset = (width, height)
+    def onGraphicsUpdate(self, left, top, width, height, pixels):
+        self.updates.append((left, top, width, height, pixels))
+
+class GraphicsClientTest(unittest.TestCase):
+    """
+    @summary: test case for graphics pipeline client
+    """
+    def setUp(self):
+        self._listener = Listener()
+        self._channel = Channel()
+        self._client = rdpgfx.GraphicsClient(self._listener)
+        self._client.onOpen(self._channel)
+
+    def createSurface(self, surfaceId, width, height, x = 0, y = 0):
+        self._client.recv(segmented(pdu(CmdId.RDPGFX_CMDID_CREATESURFACE, struct.pack("<HHHB", surfaceId, width, height, rdpgfx.PixelFormat.GFX_PIXEL_FORMAT_XRGB_8888)),
+                                    pdu(CmdId.RDPGFX_CMDID_MAPSURFACETOOUTPUT, struct.pack("<HHII", surfaceId, 0, x, y))))
+
+    def test_caps_advertise(self):
+        """
+        @summary: client advertise version 8 and 8.1
+        """
+        cmdId, _, length, count = struct.unpack_from("<HHIH", self._channel.sent[0])
+        self.assertEqual((cmdId, length, count), (CmdId.RDPGFX_CMDID_CAPSADVERTISE, len(self._channel.sent[0]), 2), "invalid caps advertise")
+        self._client.recv(segmented(pdu(CmdId.RDPGFX_CMDID_CAPSCONFIRM, struct.pack("<III", rdpgfx.CapsVersion.RDPGFX_CAPVERSION_81, 4, 0))))
+        self.assertEqual(self._client.getCapsVersion(), rdpgfx.CapsVersion.RDPGFX_CAPVERSION_81, "invalid confirmed version")
+
+    def test_frame(self):
+        """
+        @summary: modified area of mapped surface is flushed at end of frame and acknowledged
+        """
+        self.createSurface(1, 4, 4, 10, 20)
+        self._client.recv(segmented(pdu(CmdId.RDPGFX_CMDID_STARTFRAME, struct.pack("<II", 0, 7)),
+                                    pdu(CmdId.RDPGFX_CMDID_SOLIDFILL, struct.pack("<HBBBBHHHHH", 1, 0, 0, 0xff, 0, 1, 0, 0, 4, 4)),
+                                    pdu(CmdId.RDPGFX_CMDID_ENDFRAME, struct.pack("<I", 7))))
+        self.assertEqual(self._listener.updates, [(10, 20, 4, 4, RED * 16)], "invalid output")
+        self.assertEqual(self._channel.sent[-1], pdu(CmdId.RDPGFX_CMDID_FRAMEACKNOWLEDGE, struct.pack("<III", 0, 7, 1)), "invalid frame acknowledge")
+
+        self._client.recv(segmented(pdu(CmdId.RDPGFX_CMDID_SOLIDFILL, struct.pack("<HBBBBHHHHH", 1, 0, 0xff, 0, 0, 1, 1, 1, 2, 3)),
+                                    pdu(CmdId.RDPGFX_CMDID_ENDFRAME, struct.pack("<I", 8))))
+        self.assertEqual(self._listener.updates[-1], (11, 21, 1, 2, GREEN * 2), "only modified area must be flushed")
+
+    def test_wire_to_surface(self):
+        """
+        @summary: uncompressed and ClearCodec bitmaps
+        """
+        self.createSurface(1, 2, 2)
+        self._client.recv(segmented(pdu(CmdId.RDPGFX_CMDID_WIRETOSURFACE_1, struct.pack("<HHBHHHHI", 1, CodecId.RDPGFX_CODECID_UNCOMPRESSED, 0x20, 0, 0, 2, 2, 16) + BLUE * 4)))
+        clear = clearCodec(subcodecs = struct.pack("<HHHHIB", 1, 0, 1, 1, 3, 0) + "\x00\x00\xff")
+        self._client.recv(segmented(pdu(CmdId.RDPGFX_CMDID_WIRETOSURFACE_1, struct.pack("<HHBHHHHI", 1, CodecId.RDPGFX_CODECID_CLEARCODEC, 0x20, 0, 1, 2, 2, len(clear)) + clear)))
+        self.assertEqual(self._client.getSurface(1).readRect(0, 0, 2, 2), BLUE * 3 + RED, "invalid surface")
+
+    def test_surface_to_surface(self):
+        """
+        @summary: area is copied to each destination point
+        """
+        self.createSurface(1, 4, 1)
+        self.createSurface(2, 4, 1)
+        self._client.recv(segmented(pdu(CmdId.RDPGFX_CMDID_SOLIDFILL, struct.pack("<HBBBBHHHHH", 1, 0, 0, 0xff, 0, 1, 0, 0, 1, 1)),
+                                    pdu(CmdId.RDPGFX_CMDID_SURFACETOSURFACE, struct.pack("<HHHHHHHhhhh", 1, 2, 0, 0, 1, 1, 2, 1, 0, 3, 0))))
+        self.assertEqual(self._client.getSurface(2).readRect(0, 0, 4, 1), "\x00" * 4 + RED + "\x00" * 4 + RED, "invalid surface to surface")
+
+    def test_cache(self):
+        """
+        @summary: surface to cache, cache to surface and eviction
+        """
+        self.createSurface(1, 4, 1)
+        self._client.recv(segmented(pdu(CmdId.RDPGFX_CMDID_SOLIDFILL, struct.pack("<HBBBBHHHHH", 1, 0, 0, 0xff, 0, 1, 0, 0, 2, 1)),
+                                    pdu(CmdId.RDPGFX_CMDID_SURFACETOCACHE, struct.pack("<HQHHHHH", 1, 0x1234, 3, 0, 0, 2, 1)),
+                                    pdu(CmdId.RDPGFX_CMDID_CACHETOSURFACE, struct.pack("<HHHhh", 3, 1, 1, 2, 0))))
+        self.assertEqual(self._client.getSurface(1).readRect(0, 0, 4, 1), RED * 4, "invalid cache to surface")
+        self._client.recv(segmented(pdu(CmdId.RDPGFX_CMDID_EVICTCACHEENTRY, struct.pack("<H", 3))))
+        self.assertFalse(3 in self._client._cache, "cache entry must be evicted")
+
+    def test_cache_import(self):
+        """
+        @summary: persistent entries are offered and loaded in slots chosen by server
+        """
+        store = {0x1234 : (1, 1, GREEN)}
+        client = rdpgfx.GraphicsClient(self._listener, store)
+        channel = Channel()
+        client.onOpen(channel)
+        self.assertEqual(channel.sent[-1], pdu(CmdId.RDPGFX_CMDID_CACHEIMPORTOFFER, struct.pack("<HQI", 1, 0x1234, 4)), "invalid cache import offer")
+        client.recv(segmented(pdu(CmdId.RDPGFX_CMDID_CACHEIMPORTREPLY, struct.pack("<HH", 1, 9)),
+                              pdu(CmdId.RDPGFX_CMDID_CREATESURFACE, struct.pack("<HHHB", 1, 2, 1, 0x20)),
+                              pdu(CmdId.RDPGFX_CMDID_CACHETOSURFACE, struct.pack("<HHHhh", 9, 1, 1, 1, 0))))
+        self.assertEqual(client.getSurface(1).readRect(0, 0, 2, 1), "\x00" * 4 + GREEN, "invalid imported cache entry")
+
+    def test_reset_graphics(self):
+        """
+        @summary: reset graphics delete surfaces
+        """
+        self.createSurface(1, 4, 4)
+        self._client.recv(segmented(pdu(CmdId.RDPGFX_CMDID_RESETGRAPHICS, struct.pack("<III", 800, 600, 0))))
+        self.assertEqual(self._listener.reset, (800, 600), "listener must be notified")
+        self.assertFalse(1 in self._client._surfaces, "surfaces must be deleted")
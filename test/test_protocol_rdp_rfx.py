@@ -0,0 +1,199 @@
+#
+# Copyright (c) 2014-2015 Sylvain Peyrefitte
+#
+# This file is part of rdpy.
+#
+# rdpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+unit test for rdpy.protocol.rdp.rfx module
+"""
+
+import os, sys
+# Change path so we find rdpy
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+
+import unittest
+import struct, random
+import rle
+import rdpy.protocol.rdp.rfx as rfx
+import rdpy.core.framebuffer as framebuffer
+from rdpy.core.error import InvalidValue
+
+def rlgrEncode(values, rlgr3 = False):
+    """
+    @summary: RLGR encoder of [MS-RDPRFX] 3.1.8.1.7.3
+    @param values: {list(integer)} coefficients of component
+    @return: {str} encoded component
+    """
+    bits = []
+    state = {"kp" : 8, "krp" : 8}
+    def put(value, count):
+        bits.extend([(value >> i) & 1 for i in range(count - 1, -1, -1)])
+    def update(name, delta):
+        state[name] = min(max(state[name] + delta, 0), 80)
+    def codeGR(value):
+        kr = state["krp"] >> 3
+        vk = value >> kr
+        put(((1 << vk) - 1) << 1, vk + 1)
+        put(value & ((1 << kr) - 1), kr)
+        if vk == 0:
+            update("krp", -2)
+        elif vk > 1:
+            update("krp", vk)
+    def twoMagSign(value):
+        return 2 * value if value >= 0 else -2 * value - 1
+
+    i = 0
+    while i < len(values):
+        k = state["kp"] >> 3
+        if k:
+            zeros = 0
+            while i < len(values) and values[i] == 0:
+                zeros += 1
+                i += 1
+            while zeros >= (1 << k):
+                put(0, 1)
+                zeros -= 1 << k
+                update("kp", 4)
+                k = state["kp"] >> 3
+            put(1, 1)
+            put(zeros, k)
+            if i == len(values):
+                break
+            put(1 if values[i] < 0 else 0, 1)
+            codeGR(abs(values[i]) - 1)
+            i += 1
+            update("kp", -6)
+        elif rlgr3:
+            val1, val2 = twoMagSign(values[i]), twoMagSign(values[i + 1])
+            i += 2
+            codeGR(val1 + val2)
+            put(val1, len(bin(val1 + val2)) - 2 if val1 + val2 else 0)
+            if val1 and val2:
+                update("kp", -6)
+            elif not val1 and not val2:
+                update("kp", 6)
+        else:
+            value = twoMagSign(values[i])
+            i += 1
+            codeGR(value)
+            update("kp", 3 if value == 0 else -3)
+
+    bits += [0] * (-len(bits) % 8)
+    return "".join([chr(int("".join([str(b) for b in bits[j:j + 8]]), 2)) for j in range(0, len(bits), 8)])
+
+def dcComponent(value):
+    """
+    @summary: coefficients of a constant component (only first value of LL3 band)
+    """
+    coefficients = [0] * 4096
+    coefficients[4032] = value
+    return coefficients
+
+def tileSet(tiles, quant = "\x66" * 5, entropy = rfx.Entropy.CLW_ENTROPY_RLGR1):
+    """
+    @summary: build TS_RFX_TILESET block
+    @param tiles: {list} (xIdx, yIdx, yData, cbData, crData)
+    """
+    tileBlocks = "".join([struct.pack("<HIBBBHHHHH", rfx.BlockType.CBT_TILE, 19 + len(y) + len(cb) + len(cr), 0, 0, 0, x, yIdx, len(y), len(cb), len(cr)) + y + cb + cr for x, yIdx, y, cb, cr in tiles])
+    body = struct.pack("<BBHHHBBHI", 1, 0, rfx.BlockType.CBT_TILESET, 0, entropy << 10, 1, 64, len(tiles), len(tileBlocks)) + quant + tileBlocks
+    return struct.pack("<HI", rfx.BlockType.WBT_EXTENSION, 6 + len(body)) + body
+
+def region(rects):
+    """
+    @summary: build TS_RFX_REGION block
+    """
+    body = struct.pack("<BBBH", 1, 0, 1, len(rects)) + "".join([struct.pack("<HHHH", *r) for r in rects]) + struct.pack("<HH", rfx.BlockType.CBT_REGION, 1)
+    return struct.pack("<HI", rfx.BlockType.WBT_REGION, 6 + len(body)) + body
+
+class RFXTest(unittest.TestCase):
+    """
+    @summary: test case for RemoteFX decoder
+    """
+
+    def test_empty_tile(self):
+        """
+        @summary: tile without coefficients is middle gray
+        """
+        tile = rle.rfx_decode_tile("", "", "", "\x66" * 5, "\x66" * 5, "\x66" * 5)
+        self.assertEqual(tile, "\x80\x80\x80\xff" * 4096, "invalid empty tile")
+
+    def test_constant_tile(self):
+        """
+        @summary: LL3 value is dequantized and spread over whole tile by inverse DWT
+        """
+        for rlgr3 in [False, True]:
+            tile = rle.rfx_decode_tile(rlgrEncode(dcComponent(8), rlgr3), "", "", "\x66" * 5, "\x66" * 5, "\x66" * 5, rlgr3)
+            self.assertEqual(tile, "\x88\x88\x88\xff" * 4096, "invalid luma of constant tile")
+
+        #red chroma
+        tile = rle.rfx_decode_tile("", "", rlgrEncode(dcComponent(10)), "\x66" * 5, "\x66" * 5, "\x66" * 5)
+        self.assertEqual(tile[:4], "\x80\x78\x8e\xff", "invalid chroma of constant tile")
+
+    def test_rlgr_modes(self):
+        """
+        @summary: RLGR1 and RLGR3 encoding of same coefficients give same tile
+        """
+        random.seed(3)
+        coefficients = [random.randint(-20, 20) if random.random() < 0.7 else 0 for _ in range(0, 4032)] + [random.randint(-2, 2) for _ in range(0, 64)]
+        rlgr1 = rle.rfx_decode_tile(rlgrEncode(coefficients), "", "", "\x11" * 5, "\x66" * 5, "\x66" * 5)
+        rlgr3 = rle.rfx_decode_tile(rlgrEncode(coefficients, True), "", "", "\x11" * 5, "\x66" * 5, "\x66" * 5, True)
+        self.assertEqual(rlgr1, rlgr3, "RLGR1 and RLGR3 decoding mismatch")
+        self.assertNotEqual(rlgr1, rle.rfx_decode_tile("", "", "", "\x11" * 5, "\x66" * 5, "\x66" * 5), "coefficients are ignored")
+
+    def test_decode_message(self):
+        """
+        @summary: tiles are placed in accordance with their index and message rects are returned
+        """
+        message = region([(0, 0, 100, 64)]) + tileSet([(0, 0, rlgrEncode(dcComponent(8)), "", ""), (1, 0, "", "", "")])
+        rects, tiles = rfx.Decoder().decode(message)
+        self.assertEqual(rects, [(0, 0, 100, 64)], "invalid rects")
+        self.assertEqual([(x, y) for x, y, _ in tiles], [(0, 0), (64, 0)], "invalid tiles position")
+        self.assertEqual(tiles[0][2][:4], "\x88\x88\x88\xff", "invalid first tile")
+
+        bitmap = rfx.drawTiles(100, 64, tiles)
+        self.assertEqual(len(bitmap), 100 * 64 * 4, "invalid bitmap size")
+        self.assertEqual(bitmap[63 * 4:65 * 4], "\x88\x88\x88\xff\x80\x80\x80\xff", "invalid tiles assembly")
+
+    def test_decode_pool(self):
+        """
+        @summary: tiles decoded in parallel give same result
+        """
+        message = tileSet([(i, 0, rlgrEncode(dcComponent(i)), "", "") for i in range(0, 8)])
+        decoder = rfx.Decoder()
+        pool = framebuffer.DecodePool(4)
+        decoder.setDecodeMap(pool.map)
+        try:
+            self.assertEqual(decoder.decode(message), rfx.Decoder().decode(message), "invalid parallel decoding")
+        finally:
+            pool.close()
+
+    def test_invalid_message(self):
+        """
+        @summary: invalid blocks raise InvalidValue
+        """
+        message = tileSet([(0, 0, "", "", "")])
+        self.assertRaises(InvalidValue, rfx.Decoder().decode, message[:-4])
+        self.assertRaises(InvalidValue, rfx.Decoder().decode, message.replace("\xc3\xca", "\xc4\xca"))
+
+    def test_client_caps_container(self):
+        """
+        @summary: client capabilities container advertise both entropy
+        """
+        container = rfx.clientCapsContainer()
+        self.assertEqual(struct.unpack_from("<I", container)[0], len(container), "invalid container length")
+        self.assertEqual(len(container), 49, "invalid container size")
+        self.assertEqual([ord(container[i]) for i in [40, 48]], [rfx.Entropy.CLW_ENTROPY_RLGR1, rfx.Entropy.CLW_ENTROPY_RLGR3], "invalid entropy")
@@ -113,3 +113,18 @@ class TPKTTest(unittest.TestCase):
         layer.initFastPath(FastPathLayer())
         layer.connect()
         self.assertRaises(TPKTTest.TPKT_PASS, layer.dataReceived, s.getvalue())
+        
+    def test_tpkt_layer_send_fastpath_short_length(self):
+        """
+        @summary: small fast path packet use one byte length and keep number of events
+        """
+        class Transport(object):
+            def __init__(self):
+                self._data = ""
+            def write(self, data):
+                self._data += data
+            
+        layer = tpkt.TPKT(None)
+        layer.transport = Transport()
+        layer.sendFastPath(tpkt.SecFlags.FASTPATH_OUTPUT_ENCRYPTED | (3 << 2), type.String("abc"))
+        self.assertEqual(layer.transport._data, "\x8c\x05abc", "invalid fast path header")